@@ -0,0 +1,91 @@
+"""
+Запись объявления.
+
+Ad — компактный объект с __slots__ вместо словаря на каждую строку выборки:
+без __dict__ он занимает втрое меньше памяти, а кэш объявлений (cache.py)
+хранит и раздаёт сами объекты Ad, не собирая их заново при каждом чтении.
+Все выборки объявлений идут по колонкам COLUMNS, и строка превращается в Ad
+одним вызовом Ad(*row).
+
+Для кода, написанного под словари, Ad поддерживает ad['title'], ad.get(...),
+`in` и сравнение со словарём. Записи общие для всех читателей кэша, поэтому
+поля Ad не изменяют (запрет присваивания в __setattr__ вчетверо замедлил бы
+создание записи); изменённая копия — replace(). Единственное изменяемое
+поле — card: готовая карточка объявления, которую один раз рисует
+rendering.ad_card.
+"""
+
+import operator
+
+# Поля объявления; photo — колонка photo_id
+FIELDS = ('id', 'title', 'description', 'price', 'category', 'district', 'photo',
+          'username', 'age_group', 'gender', 'condition', 'user_id')
+
+# Колонки ads в порядке FIELDS
+COLUMNS = ", ".join('photo_id' if field == 'photo' else field for field in FIELDS)
+
+# ad['поле'] — через attrgetter: вдвое быстрее getattr() с проверкой имени
+_GETTERS = {field: operator.attrgetter(field) for field in FIELDS}
+
+
+class Ad:
+    """Объявление из таблицы ads (поля FIELDS, доступ как к атрибутам или ключам словаря)."""
+
+    __slots__ = FIELDS + ('card',)
+
+    def __init__(self, id, title, description, price, category, district, photo,
+                 username, age_group, gender, condition, user_id):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.price = price
+        self.category = category
+        self.district = district
+        self.photo = photo
+        self.username = username
+        self.age_group = age_group
+        self.gender = gender
+        self.condition = condition
+        self.user_id = user_id
+        self.card = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Объявление из словаря с ключами FIELDS; недостающие поля — None."""
+        return cls(**{field: data.get(field) for field in FIELDS})
+
+    def __getitem__(self, key):
+        try:
+            getter = _GETTERS[key]
+        except KeyError:
+            raise KeyError(key) from None
+        return getter(self)
+
+    def get(self, key, default=None):
+        getter = _GETTERS.get(key)
+        return default if getter is None else getter(self)
+
+    def __contains__(self, key):
+        return key in FIELDS
+
+    def keys(self):
+        return FIELDS
+
+    def replace(self, **changes):
+        """Копия объявления с изменёнными полями."""
+        return Ad(**{**self.as_dict(), **changes})
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __eq__(self, other):
+        if isinstance(other, Ad):
+            return all(getattr(self, field) == getattr(other, field) for field in FIELDS)
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Ad(id={self.id!r}, title={self.title!r}, category={self.category!r})"
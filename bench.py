@@ -0,0 +1,1108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки производительности бота.
+
+Запуск: python bench.py <сценарий>   (без аргумента — список сценариев)
+Все сценарии работают на временной БД и не обращаются к Telegram
+(sender отправляет сообщения в локальный fake_telegram.FakeTelegramAPI,
+moderation обращается к локальному fake_deepseek.FakeDeepSeek).
+"""
+
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from aiogram import types
+
+import bot
+import database
+import migrations
+import moderation
+import openai
+import outbox
+import prefilter
+import scheduler
+import search
+import sender
+from fake_deepseek import FakeDeepSeek
+from fake_telegram import FakeTelegramAPI
+
+# bot.py включает подробное логирование; для замеров оно только мешает
+logging.getLogger().setLevel(logging.WARNING)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Регистрирует сценарий бенчмарка под указанным именем."""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+@contextmanager
+def temp_db():
+    """Временная БД со схемой бота; bot.DB_PATH указывает на неё на время блока."""
+    path = tempfile.mktemp(suffix='.db')
+    original_path = bot.DB_PATH
+    bot.DB_PATH = path
+    try:
+        bot.init_db()
+        yield path
+    finally:
+        bot.DB_PATH = original_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+WORDS = ["коляска", "автокресло", "комбинезон", "кроватка", "конструктор", "книга", "бутылочка",
+         "ванночка", "сандалии", "рюкзак", "пазл", "куртка", "шапка", "манеж", "стульчик"]
+ADJECTIVES = ["новая", "удобная", "тёплая", "яркая", "лёгкая", "прочная", "детская", "большая"]
+
+
+def seed_ads(path, count, users=200, seed=1):
+    """Быстро заполняет БД синтетическими объявлениями."""
+    rnd = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        word = rnd.choice(WORDS)
+        title = f"{rnd.choice(ADJECTIVES).capitalize()} {word}"
+        description = " ".join(rnd.choice(ADJECTIVES + WORDS) for _ in range(12))
+        rows.append((
+            title, description, rnd.randint(100, 30000), rnd.choice(bot.CATEGORIES),
+            rnd.choice(bot.YAKUTSK_DISTRICTS), f"photo_{rnd.randint(1, 10**6)}" if rnd.random() < 0.6 else None,
+            rnd.randint(1, users), f"user{rnd.randint(1, users)}",
+        ))
+    with sqlite3.connect(path) as conn:
+        conn.executemany("""
+            INSERT INTO ads (title, description, price, category, district, photo_id, user_id, username)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    return rows
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def timed(func, *args, **kwargs):
+    """Время одного вызова func, секунд."""
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+class LoopLagMonitor:
+    """Замеряет, насколько цикл событий опаздывает с пробуждением фоновой задачи."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(loop.time() - start - self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+# --- Сценарий: пул соединений и awaitable-обёртки ---
+
+def legacy_get_ads_by_category(category):
+    """Исходная реализация: новое соединение на каждый вызов."""
+    with sqlite3.connect(bot.DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, title, description, price, category, district, photo_id, username, age_group, gender, condition FROM ads WHERE category = ? ORDER BY id DESC", (category,))
+        return [dict(zip(('id', 'title', 'description', 'price', 'category', 'district', 'photo', 'username', 'age_group', 'gender', 'condition'), row)) for row in cursor.fetchall()]
+
+
+def legacy_is_favorite(user_id, ad_id):
+    with sqlite3.connect(bot.DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM favorites WHERE user_id = ? AND ad_id = ?", (user_id, ad_id))
+        return cursor.fetchone() is not None
+
+
+def legacy_is_subscribed(user_id, category):
+    with sqlite3.connect(bot.DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM subscriptions WHERE user_id = ? AND category = ?", (user_id, category))
+        return cursor.fetchone() is not None
+
+
+async def simulate_users(heavy_update, light_update, heavy_users, light_users, updates_per_user):
+    """Запускает одновременно «тяжёлых» (просмотр категорий) и «лёгких» пользователей."""
+    light_latencies = []
+
+    async def heavy_user(user_id):
+        for i in range(updates_per_user):
+            await heavy_update(user_id, bot.CATEGORIES[(user_id + i) % len(bot.CATEGORIES)])
+            await asyncio.sleep(0)  # имитация отправки ответа
+
+    async def light_user(user_id):
+        loop = asyncio.get_running_loop()
+        for i in range(updates_per_user):
+            # Обновление «приходит» через 2 мс; задержка считается от момента прихода
+            arrival = loop.time() + 0.002
+            await asyncio.sleep(0.002)
+            await light_update(user_id, bot.CATEGORIES[i % len(bot.CATEGORIES)])
+            light_latencies.append(loop.time() - arrival)
+
+    with LoopLagMonitor() as monitor:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(heavy_user(u) for u in range(heavy_users)),
+            *(light_user(1000 + u) for u in range(light_users)),
+        )
+        elapsed = time.perf_counter() - start
+    total = (heavy_users + light_users) * updates_per_user
+    return total / elapsed, light_latencies, monitor.lags
+
+
+@benchmark('db')
+def bench_db(ads_count=3000, heavy_users=10, light_users=40, updates_per_user=15):
+    """Обновления/с и задержки цикла событий: соединение на вызов vs пул + пул потоков."""
+
+    async def legacy_heavy(user_id, category):
+        ads = legacy_get_ads_by_category(category)
+        for ad in ads[:10]:
+            legacy_is_favorite(user_id, ad['id'])
+
+    async def legacy_light(user_id, category):
+        legacy_is_subscribed(user_id, category)
+
+    async def pooled_heavy(user_id, category):
+        ads = await bot.get_ads_by_category_async(category)
+        for ad in ads[:10]:
+            await database.run(bot.is_favorite, user_id, ad['id'])
+
+    async def pooled_light(user_id, category):
+        await bot.is_subscribed_async(user_id, category)
+
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        print(f"{ads_count} объявлений, {heavy_users} пользователей листают категории, "
+              f"{light_users} шлют лёгкие запросы, по {updates_per_user} обновлений")
+        for name, heavy, light in (("до (connect на вызов)", legacy_heavy, legacy_light),
+                                   ("после (пул + потоки)", pooled_heavy, pooled_light)):
+            rate, latencies, lags = asyncio.run(simulate_users(heavy, light, heavy_users, light_users, updates_per_user))
+            print(f"  {name:24} {rate:8.0f} обновлений/с | лёгкие p95 {percentile(latencies, 95) * 1000:6.1f} мс"
+                  f" | задержка цикла max {max(lags) * 1000:6.1f} мс, среднее {statistics.mean(lags) * 1000:5.2f} мс")
+
+
+# --- Сценарий: WAL и единый писатель ---
+
+def measure_reads_during_sweep(ads_count, readers, sweep_size, inserts):
+    """Задержки чтения без записи и во время удаления просроченных + вставок новых объявлений."""
+
+    def read_loop(stop, latencies):
+        rnd = random.Random()
+        while not stop.is_set():
+            start = time.perf_counter()
+            bot.get_ad_by_id(rnd.randint(1, ads_count))
+            latencies.append(time.perf_counter() - start)
+
+    def run_readers(background=None):
+        stop = threading.Event()
+        latencies = []
+        threads = [threading.Thread(target=read_loop, args=(stop, latencies)) for _ in range(readers)]
+        for t in threads:
+            t.start()
+        errors = 0
+        if background:
+            errors = background()
+        else:
+            time.sleep(1.0)
+        stop.set()
+        for t in threads:
+            t.join()
+        return latencies, errors
+
+    def sweep():
+        errors = 0
+
+        def delete_expired():
+            nonlocal errors
+            for ad_id in range(1, sweep_size + 1):
+                try:
+                    bot.delete_ad_by_id(ad_id)
+                except sqlite3.OperationalError:
+                    errors += 1
+
+        def add_new():
+            nonlocal errors
+            for i in range(inserts):
+                try:
+                    bot.add_ad_to_db("Коляска", "Описание", 1000, bot.CATEGORIES[0], bot.YAKUTSK_DISTRICTS[0], None, i % 200 + 1, "user")
+                except sqlite3.OperationalError:
+                    errors += 1
+
+        workers = [threading.Thread(target=delete_expired), threading.Thread(target=add_new)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return errors
+
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        idle, _ = run_readers()
+        start = time.perf_counter()
+        busy, errors = run_readers(sweep)
+        sweep_time = time.perf_counter() - start
+    return idle, busy, errors, sweep_time
+
+
+@benchmark('wal')
+def bench_wal(ads_count=20000, readers=3, sweep_size=2000, inserts=500):
+    """Задержка чтения во время фонового удаления: журнал отката vs WAL + единый писатель."""
+    print(f"{ads_count} объявлений, {readers} читателя, удаление {sweep_size} + вставка {inserts} объявлений")
+    original_mode = database.STORAGE_MODE
+    try:
+        for mode in ('rollback', 'wal'):
+            database.STORAGE_MODE = mode
+            idle, busy, errors, sweep_time = measure_reads_during_sweep(ads_count, readers, sweep_size, inserts)
+            print(f"  {mode:9} чтение без записи p50 {percentile(idle, 50) * 1000:6.2f} мс p99 {percentile(idle, 99) * 1000:6.2f} мс"
+                  f" | во время удаления p50 {percentile(busy, 50) * 1000:6.2f} мс p99 {percentile(busy, 99) * 1000:7.2f} мс"
+                  f" | запись {sweep_time:5.2f} с, ошибок «database is locked»: {errors}")
+    finally:
+        database.STORAGE_MODE = original_mode
+
+
+# --- Сценарий: статус избранного для страницы объявлений ---
+
+def count_queries(func, *args):
+    """Выполняет функцию и возвращает (результат, число SQL-запросов к читающим соединениям)."""
+    statements = []
+    database.set_trace_callback(statements.append)
+    try:
+        result = func(*args)
+    finally:
+        database.set_trace_callback(None)
+    return result, len(statements)
+
+
+def render_listing_per_ad(user_id, limit):
+    """Исходная схема: клавиатура каждого объявления сама запрашивает is_favorite."""
+    ads = bot.get_all_ads(limit=limit)
+    return [bot.get_favorite_keyboard(user_id, ad['id']) for ad in ads]
+
+
+def render_listing_batched(user_id, limit):
+    """Статус избранного для всей выдачи одним запросом get_favorite_ids."""
+    ads = bot.get_all_ads(limit=limit)
+    favorite_ids = bot.get_favorite_ids(user_id, [ad['id'] for ad in ads])
+    return [bot.get_favorite_keyboard(user_id, ad['id'], ad['id'] in favorite_ids) for ad in ads]
+
+
+@benchmark('favorites')
+def bench_favorites(ads_count=5000, favorites=300, repeats=50):
+    """Запросов и времени на выдачу: is_favorite на объявление (N+1) vs один запрос на страницу."""
+    user_id = 42
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        rnd = random.Random(2)
+        with sqlite3.connect(path) as conn:
+            conn.executemany("INSERT INTO favorites (user_id, ad_id) VALUES (?, ?)",
+                             [(user_id, ad_id) for ad_id in rnd.sample(range(1, ads_count + 1), favorites)])
+        print(f"{ads_count} объявлений, у пользователя {favorites} в избранном")
+        for limit, label in ((bot.PAGE_SIZE, f"страница {bot.PAGE_SIZE}"), (1000, "выдача 1000")):
+            for name, render in (("до (N+1)", render_listing_per_ad), ("после (пакетом)", render_listing_batched)):
+                keyboards, queries = count_queries(render, user_id, limit)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    render(user_id, limit)
+                elapsed = (time.perf_counter() - start) / repeats
+                print(f"  {label:14} {name:16} запросов: {queries:5} | {elapsed * 1000:7.2f} мс на выдачу")
+
+
+# --- Сценарий: полнотекстовый поиск ---
+
+def legacy_search_ads(keyword, limit=None):
+    """Исходный поиск: LIKE по названию и описанию, полный просмотр таблицы."""
+    pattern = f"%{keyword}%"
+    sql = f"SELECT {bot.AD_COLUMNS} FROM ads WHERE title LIKE ? OR description LIKE ? ORDER BY id DESC"
+    params = [pattern, pattern]
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    with database.connect(bot.DB_PATH) as conn:
+        return [bot.row_to_ad(row) for row in conn.execute(sql, params)]
+
+
+def seed_search_corpus(path, count, vocabulary=5000, seed=3):
+    """
+    Объявления с правдоподобной частотой слов для замеров поиска.
+
+    Название — товар из WORDS с прилагательным, описание — слова из словаря
+    с распределением Ципфа: немного частых слов и длинный хвост редких.
+    """
+    rnd = random.Random(seed)
+    syllables = ["ка", "ло", "ми", "ре", "ту", "да", "ни", "со", "пе", "ра", "ви", "ко", "за", "лу"]
+    words = ADJECTIVES + WORDS + ["".join(rnd.choice(syllables) for _ in range(rnd.randint(2, 4))) for _ in range(vocabulary)]
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    rows = []
+    for _ in range(count):
+        title = f"{rnd.choice(ADJECTIVES).capitalize()} {rnd.choice(WORDS)}"
+        description = " ".join(rnd.choices(words, weights, k=15))
+        rows.append((title, description, rnd.randint(100, 30000), rnd.choice(bot.CATEGORIES),
+                     rnd.choice(bot.YAKUTSK_DISTRICTS), None, rnd.randint(1, 200), "user"))
+    with sqlite3.connect(path) as conn:
+        conn.executemany("""
+            INSERT INTO ads (title, description, price, category, district, photo_id, user_id, username)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+
+@benchmark('search')
+def bench_search(ads_count=100000, repeats=20):
+    """Задержка поиска на 100k объявлений: LIKE '%слово%' vs FTS5 (bm25, префиксы)."""
+    queries = ("коляска", "Коляска", "тёплая куртка", "велобалансир", "шапк",
+               "колясок", "каляска", "велобалансиры", "веллобалансир")
+    with temp_db() as path:
+        seed_search_corpus(path, ads_count)
+        with sqlite3.connect(path) as conn:
+            conn.executemany("UPDATE ads SET description = description || ' велобалансир' WHERE id = ?",
+                             [(ad_id,) for ad_id in range(1, ads_count, ads_count // 20)])
+        # Объявления загружены в обход бота — строим поисковый индекс целиком
+        start = time.perf_counter()
+        database.write(path, search.rebuild)
+        print(f"Индекс по {ads_count} объявлениям построен за {time.perf_counter() - start:.1f} с")
+        start = time.perf_counter()
+        for i in range(200):
+            bot.add_ad_to_db(f"Коляска {i}", "Прогулочная коляска, тёплый конверт в комплекте", 1000,
+                             bot.CATEGORIES[0], bot.YAKUTSK_DISTRICTS[0], None, 1, "user")
+        print(f"Добавление объявления с обновлением индекса: {(time.perf_counter() - start) / 200 * 1000:.2f} мс")
+        print(f"{ads_count} объявлений, первая страница ({bot.PAGE_SIZE}) и полная выдача, медиана из {repeats} запусков")
+        for query in queries:
+            for name, func in (("LIKE", legacy_search_ads), ("FTS5", bot.search_ads)):
+                timings = {}
+                for label, limit, runs in (("page", bot.PAGE_SIZE + 1, repeats), ("all", None, max(3, repeats // 4))):
+                    timings[label] = []
+                    for _ in range(runs):
+                        start = time.perf_counter()
+                        found = func(query, limit=limit)
+                        timings[label].append(time.perf_counter() - start)
+                print(f"  «{query}»{'':{max(0, 14 - len(query))}} {name:5} страница {statistics.median(timings['page']) * 1000:8.2f} мс"
+                      f" | вся выдача {statistics.median(timings['all']) * 1000:8.2f} мс, найдено {len(found)}")
+
+
+# --- Сценарий: фильтры по нескольким фасетам ---
+
+def legacy_filter_ads(filters):
+    """До find_ads: выборка по одному фильтру (категории) и остальное — в Python."""
+    ads = bot.get_ads_by_category(filters['category'])
+    return [ad for ad in ads
+            if ad['district'] == filters.get('district', ad['district'])
+            and filters.get('price_min', 0) <= ad['price'] <= filters.get('price_max', ad['price'])
+            and ad['condition'] == filters.get('condition', ad['condition'])]
+
+
+@benchmark('filters')
+def bench_filters(ads_count=100000, repeats=20):
+    """Фильтр по категории, району, цене и состоянию: выборка по категории + Python vs find_ads + count_facets."""
+    cases = (
+        ("без фильтров", {}),
+        ("категория + район + цена", {'category': bot.CATEGORIES[1], 'district': bot.YAKUTSK_DISTRICTS[5], 'price_max': 5000}),
+        ("категория + состояние", {'category': bot.CATEGORIES[0], 'condition': bot.CONDITIONS[2]}),
+        ("пол + район", {'gender': bot.GENDERS[0], 'district': bot.YAKUTSK_DISTRICTS[5]}),
+        ("слово + район", {'keyword': "коляска", 'district': bot.YAKUTSK_DISTRICTS[5]}),
+    )
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        rnd = random.Random(4)
+        with sqlite3.connect(path) as conn:
+            conn.executemany("UPDATE ads SET age_group = ?, gender = ?, condition = ? WHERE id = ?", [
+                (rnd.choice(bot.AGE_GROUPS), rnd.choice(bot.GENDERS), rnd.choice(bot.CONDITIONS), ad_id)
+                for ad_id in range(1, ads_count + 1)
+            ])
+        database.write(path, search.rebuild)
+        database.write(path, lambda conn: conn.execute("ANALYZE"))
+        print(f"{ads_count} объявлений, первая страница ({bot.PAGE_SIZE}), медиана из {repeats} запусков")
+
+        def measure(func, *args):
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                result = func(*args)
+                timings.append(time.perf_counter() - start)
+            return statistics.median(timings) * 1000, result
+
+        for label, filters in cases:
+            if 'category' in filters:
+                elapsed, found = measure(legacy_filter_ads, filters)
+                print(f"  {label:26} до (Python)     {elapsed:8.2f} мс, найдено {len(found)}")
+            elapsed, page = measure(bot.find_ads, filters, None, bot.PAGE_SIZE + 1)
+            counted, counts = measure(bot.count_facets, filters)
+            print(f"  {label:26} после (SQL)     {elapsed:8.2f} мс на страницу, "
+                  f"фасеты {counted:6.2f} мс, всего {counts['total']}")
+
+
+# --- Сценарий: рассылка с учётом лимитов Telegram ---
+
+async def broadcast_to_subscribers(subscribers, replies, throttled):
+    """Рассылка subscribers пользователям и replies ответов другим пользователям во время неё."""
+    api = FakeTelegramAPI()
+    await api.start()
+    tg = api.make_bot()
+    queue = sender.SendQueue()
+    if throttled:
+        tg.session.middleware(sender.ThrottlingMiddleware(queue))
+    loop = asyncio.get_running_loop()
+    reply_latencies = []
+
+    async def reply(user_id):
+        start = loop.time()
+        try:
+            await tg.send_message(user_id, "Ответ")
+            reply_latencies.append(loop.time() - start)
+        except Exception:
+            pass
+
+    async def interactive():
+        for i in range(replies):
+            await asyncio.sleep(0.5)
+            await reply(100000 + i)
+
+    start = time.perf_counter()
+    with sender.broadcast():
+        mailing = asyncio.gather(*(tg.send_message(user_id, "Новое объявление") for user_id in range(1, subscribers + 1)),
+                                 return_exceptions=True)
+    results, _ = await asyncio.gather(mailing, interactive())
+    elapsed = time.perf_counter() - start
+    lost = sum(isinstance(result, Exception) for result in results)
+    await queue.close()
+    await tg.session.close()
+    await api.stop()
+    return elapsed, lost, api.rejected, reply_latencies
+
+
+async def sequential_broadcast(subscribers):
+    """Исходная рассылка: по одному сообщению, каждое ждёт ответа API."""
+    api = FakeTelegramAPI()
+    await api.start()
+    tg = api.make_bot()
+    lost = 0
+    start = time.perf_counter()
+    for user_id in range(1, subscribers + 1):
+        try:
+            await tg.send_message(user_id, "Новое объявление")
+        except Exception:
+            lost += 1
+    elapsed = time.perf_counter() - start
+    await tg.session.close()
+    await api.stop()
+    return elapsed, lost, api.rejected
+
+
+@benchmark('sender')
+def bench_sender(subscribers=300, replies=10):
+    """Рассылка подписчикам при лимите 30 сообщений/с: по одному vs gather без очереди vs SendQueue."""
+    print(f"{subscribers} подписчиков, поддельный API: {FakeTelegramAPI().rate} запросов/с, задержка ответа 30 мс; "
+          f"во время рассылки {replies} ответов пользователям раз в 0.5 с")
+    elapsed, lost, rejected = asyncio.run(sequential_broadcast(subscribers))
+    print(f"  {'до (по одному)':22} {elapsed:6.1f} с, {subscribers / elapsed:5.1f} сообщений/с, потеряно {lost}, 429: {rejected}")
+    for name, throttled in (("gather без очереди", False), ("после (SendQueue)", True)):
+        elapsed, lost, rejected, latencies = asyncio.run(broadcast_to_subscribers(subscribers, replies, throttled))
+        delivered = subscribers - lost
+        answered = f"ответы p95 {percentile(latencies, 95) * 1000:6.0f} мс ({len(latencies)}/{replies})" if latencies else "ответы потеряны"
+        print(f"  {name:22} {elapsed:6.1f} с, {delivered / elapsed:5.1f} сообщений/с, потеряно {lost}, 429: {rejected}, {answered}")
+
+
+# --- Сценарий: модерация, не блокирующая цикл событий ---
+
+@contextmanager
+def fake_deepseek_in_thread(**kwargs):
+    """Поддельный API модерации в отдельном потоке: синхронный клиент не может заблокировать его цикл."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    api = FakeDeepSeek(**kwargs)
+    asyncio.run_coroutine_threadsafe(api.start(), loop).result()
+    try:
+        yield api
+    finally:
+        asyncio.run_coroutine_threadsafe(api.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def legacy_moderator(base_url):
+    """Исходная модерация: синхронный openai-клиент внутри async def."""
+    client = openai.OpenAI(api_key="bench", base_url=base_url)
+
+    async def moderate(text):
+        response = client.chat.completions.create(
+            model=moderation.MODEL,
+            messages=[{"role": "system", "content": moderation.SYSTEM_PROMPT}, {"role": "user", "content": text}],
+            temperature=0.1,
+            max_tokens=20
+        )
+        return moderation.parse_verdict(response.choices[0].message.content)
+    return moderate
+
+
+async def submit_during_clicks(moderate, submitters, clickers, clicks):
+    """submitters объявлений на модерацию одновременно с clickers пользователей, нажимающих кнопки."""
+    loop = asyncio.get_running_loop()
+    click_latencies = []
+
+    start = loop.time()
+
+    async def click_user(offset):
+        for i in range(clicks):
+            # Нажатия приходят по расписанию каждые 50 мс, обработчик мгновенный:
+            # задержка — это ожидание цикла событий
+            arrival = start + offset + i * 0.05
+            await asyncio.sleep(max(0.0, arrival - loop.time()))
+            click_latencies.append(loop.time() - arrival)
+
+    async def submit(i):
+        await moderate(f"Коляска прогулочная {i}, 5000 руб.")
+
+    async def submissions():
+        await asyncio.gather(*(submit(i) for i in range(submitters)))
+        return loop.time() - start
+
+    with LoopLagMonitor() as monitor:
+        clicking = [asyncio.create_task(click_user(0.05 * u / clickers)) for u in range(clickers)]
+        elapsed = await submissions()
+        await asyncio.gather(*clicking)
+    return elapsed, click_latencies, monitor.lags
+
+
+@benchmark('moderation')
+def bench_moderation(latency=0.5, submitters=10, clickers=20, clicks=30):
+    """
+    Модерация 10 объявлений при задержке API 0.5 с: синхронный openai vs ModerationClient,
+    и повторная подача тех же объявлений с кэшем вердиктов.
+    """
+    print(f"{submitters} объявлений на модерацию одновременно, задержка API {latency * 1000:.0f} мс, "
+          f"{clickers} пользователей нажимают кнопки ({clicks} раз)")
+    with fake_deepseek_in_thread(latency=latency) as api, temp_db() as path:
+        async def run_async_client(cache=None):
+            client = moderation.ModerationClient("bench", base_url=api.base_url, concurrency=submitters, cache=cache)
+            try:
+                return await submit_during_clicks(client.moderate, submitters, clickers, clicks)
+            finally:
+                await client.close()
+
+        def run_cached():
+            # Вердикты первой подачи уже в таблице; новый кэш (как после перезапуска) читает их из БД
+            return run_async_client(moderation.VerdictCache(lambda: path))
+
+        asyncio.run(run_async_client(moderation.VerdictCache(lambda: path)))
+        for name, run in (("до (синхронный openai)", lambda: submit_during_clicks(legacy_moderator(api.base_url), submitters, clickers, clicks)),
+                          ("после (AsyncOpenAI)", run_async_client),
+                          ("повтор (кэш вердиктов)", run_cached)):
+            api.connections.clear()
+            requests = api.requests
+            elapsed, latencies, lags = asyncio.run(run())
+            print(f"  {name:24} модерация всех {elapsed:5.2f} с | нажатия p95 {percentile(latencies, 95) * 1000:7.1f} мс,"
+                  f" max {max(latencies) * 1000:7.1f} мс | задержка цикла max {max(lags) * 1000:7.1f} мс"
+                  f" | запросов к API {api.requests - requests}")
+
+
+@benchmark('batching')
+def bench_batching(submissions=40, latency=0.5):
+    """Пик подачи объявлений: каждый текст отдельным запросом vs пачки по BATCH_SIZE."""
+    print(f"{submissions} текстов одновременно, задержка API {latency * 1000:.0f} мс, "
+          f"{moderation.CONCURRENCY} запросов к API одновременно")
+    with fake_deepseek_in_thread(latency=latency) as api:
+        async def run(batch_window):
+            client = moderation.ModerationClient("bench", base_url=api.base_url, batch_window=batch_window)
+            start = time.perf_counter()
+            try:
+                results = await asyncio.gather(*(client.moderate(f"Коляска прогулочная {i}, 5000 руб.") for i in range(submissions)))
+            finally:
+                await client.close()
+            return time.perf_counter() - start, results
+
+        for name, window in (("до (по одному)", 0), (f"после (пачки до {moderation.BATCH_SIZE})", moderation.BATCH_WINDOW)):
+            requests = api.requests
+            elapsed, results = asyncio.run(run(window))
+            print(f"  {name:24} {elapsed:5.2f} с, {submissions / elapsed:5.1f} текстов/с, запросов к API {api.requests - requests},"
+                  f" одобрено {results.count(True)}")
+
+
+# --- Сценарий: фоновая модерация новых объявлений ---
+
+async def submit_ads(mode, base_url, submissions):
+    """submissions пользователей одновременно подают объявления через add_photo в режиме mode."""
+    loop = asyncio.get_running_loop()
+    client = moderation.ModerationClient("bench", base_url=base_url)
+    answered = []
+
+    async def submit(i):
+        message = MagicMock()
+        message.from_user = MagicMock(id=i, username=f"user{i}")
+        message.photo = None
+        arrival = loop.time()
+        message.answer = AsyncMock(side_effect=lambda *args, **kwargs: answered.append(loop.time() - arrival))
+        state = AsyncMock()
+        state.get_data.return_value = {'title': f"Коляска {i}", 'description': "Прогулочная", 'price': 5000,
+                                       'category': bot.CATEGORIES[1], 'district': bot.YAKUTSK_DISTRICTS[0]}
+        await bot.add_photo(message, state)
+
+    with patch.object(bot, 'moderator', client), patch.object(bot, 'MODERATION_MODE', mode), \
+            patch.object(bot, 'pending_moderation', asyncio.Queue()), patch('bot.bot', MagicMock(send_message=AsyncMock())):
+        await bot.start_moderation_workers()
+        start = loop.time()
+        await asyncio.gather(*(submit(i) for i in range(submissions)))
+        await bot.pending_moderation.join()
+        published = loop.time() - start
+        for task in list(bot.moderation_tasks):
+            task.cancel()
+        await asyncio.gather(*bot.moderation_tasks, *bot.broadcast_tasks, return_exceptions=True)
+    await client.close()
+    return answered, published
+
+
+@benchmark('pipeline')
+def bench_pipeline(submissions=20, latency=0.5):
+    """Ответ на подачу объявления: модерация до публикации (sync) vs фоновая модерация (async)."""
+    print(f"{submissions} объявлений подаются одновременно, задержка API {latency * 1000:.0f} мс, "
+          f"{moderation.CONCURRENCY} запросов к API одновременно")
+    with fake_deepseek_in_thread(latency=latency) as api:
+        for name, mode in (("до (sync)", 'sync'), ("после (async)", 'async')):
+            with temp_db():
+                answered, published = asyncio.run(submit_ads(mode, api.base_url, submissions))
+                ads = len(bot.get_all_ads())
+            print(f"  {name:14} ответ пользователю p50 {percentile(answered, 50) * 1000:7.1f} мс,"
+                  f" max {max(answered) * 1000:7.1f} мс | опубликовано {ads} за {published:5.2f} с")
+
+
+# --- Сценарий: локальная предмодерация ---
+
+CLEAN_DETAILS = ["Всё работает, без дефектов", "Самовывоз из центра", "Торг уместен", "Носили один сезон",
+                 "Отдам вместе с чехлом", "Состояние отличное, из дома без животных", "Размер подойдёт на 2–3 года"]
+SPAM_TEMPLATES = ["Пассивный доход от 5000 в день без вложений! Пиши", "Казино Вулкан: бонус новичкам",
+                  "Быстрые деньги: микрозайм без отказа", "Обучение криптовалюте, первые шаги",
+                  "Сука, купите уже эту {word}", "Продам {word}, xyйня но работает", "Накрутка подписчиков недорого"]
+AMBIGUOUS_TEMPLATES = ["Продам {word}, только предоплата на карту", "{word}, подробности в WhatsApp",
+                       "{word} — фото на www.avito.ru", "Срочно!!!!!! {word} почти даром", "Пишите @mama_shop, {word}",
+                       "Требуются мамы для подработки, {word} в подарок"]
+
+
+def moderation_corpus(count, seed=7):
+    """Синтетические тексты объявлений: (текст, ожидание) — True чистое, False нарушение, None неоднозначное."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        word = rng.choice(WORDS)
+        roll = rng.random()
+        if roll < 0.8:
+            details = ", ".join(rng.sample(CLEAN_DETAILS, rng.randint(1, 3)))
+            if rng.random() < 0.3:
+                details += f", звоните 8 914 {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}"
+            text, expected = f"{word.capitalize()} {rng.choice(ADJECTIVES)}\n{details}", True
+        elif roll < 0.88:
+            text, expected = rng.choice(SPAM_TEMPLATES).format(word=word), False
+        else:
+            text, expected = rng.choice(AMBIGUOUS_TEMPLATES).format(word=word).capitalize(), None
+        corpus.append((f"{text}\nЦена: {rng.randint(1, 200) * 100}", expected))
+    return corpus
+
+
+@benchmark('prefilter')
+def bench_prefilter(texts=10000, latency=0.5):
+    """Доля объявлений, решённых локальным фильтром без запроса к DeepSeek."""
+    corpus = moderation_corpus(texts)
+    local = prefilter.PreFilter()
+    start = time.perf_counter()
+    decisions = [local.check(text).verdict for text, _ in corpus]
+    elapsed = time.perf_counter() - start
+    wrong_approvals = sum(1 for d, (_, e) in zip(decisions, corpus) if d is True and e is not True)
+    wrong_rejections = sum(1 for d, (_, e) in zip(decisions, corpus) if d is False and e is not False)
+    stats = local.stats
+    print(f"{texts} текстов (80% чистых, 8% явных нарушений, 12% неоднозначных)")
+    print(f"  одобрено {stats['approved']}, отклонено {stats['rejected']}, передано модели {stats['escalated']}"
+          f" — без запроса к API {local.avoided_rate:.1%}")
+    print(f"  ошибочно одобрено {wrong_approvals}, ошибочно отклонено {wrong_rejections}")
+    print(f"  {elapsed / texts * 1e6:.1f} мкс на текст; при задержке API {latency * 1000:.0f} мс сэкономлено"
+          f" {(stats['approved'] + stats['rejected']) * latency / 60:.0f} мин ожидания")
+
+
+# --- Сценарий: сроки объявлений ---
+
+def legacy_get_ads_needing_notifications():
+    """Исходная проверка сроков: пять запросов при каждом проходе раз в 10 минут."""
+    now = datetime.now()
+    ads = []
+    with database.connect(bot.DB_PATH) as conn:
+        for notif_type, offset in bot.EXPIRY_STAGES[:-1]:
+            field = f"notif_{notif_type}"
+            ads += conn.execute(f"SELECT id, title, user_id, username, created_at FROM ads WHERE created_at <= ? AND {field} = 0",
+                                (now - offset,)).fetchall()
+        ads += conn.execute("SELECT id, title, user_id, username, created_at FROM ads WHERE created_at <= ?",
+                            (now - bot.AD_LIFETIME,)).fetchall()
+    return ads
+
+
+def due_expiry_events():
+    """Созревшие события после простоя: по записи на объявление, тип самого срочного — в 'type'."""
+    now = datetime.now()
+    return [dict(ad, type=event) for ad in bot.get_expiring_ads() if (event := bot.expiry_event(ad, now))]
+
+
+async def scheduler_lateness(events, spread):
+    """Насколько позже срока Scheduler.run() отдаёт events событий, разбросанных на spread секунд."""
+    fired = asyncio.Event()
+    lateness = []
+    schedule = scheduler.Scheduler()
+
+    async def handler(keys):
+        now = time.time()
+        lateness.extend(now - due for due in keys)
+        if len(lateness) == events:
+            fired.set()
+
+    task = asyncio.create_task(schedule.run(handler))
+    start = time.time() + 0.05
+    for i in range(events):
+        due = start + spread * i / events
+        schedule.schedule(due, due)
+    await fired.wait()
+    task.cancel()
+    return lateness
+
+
+@benchmark('expiry')
+def bench_expiry(ads_count=100000, repeats=5):
+    """Сроки объявлений: опрос раз в 10 минут vs планировщик с окном загрузки."""
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        with sqlite3.connect(path) as conn:
+            # Объявления равномерно по возрасту от 0 до 7 дней
+            conn.execute("UPDATE ads SET created_at = datetime('now', 'localtime', '-' || (abs(random()) % 604800) || ' seconds')")
+        sweep = min(timed(legacy_get_ads_needing_notifications) for _ in range(repeats))
+        due = min(timed(due_expiry_events) for _ in range(repeats))
+        legacy_rows = legacy_get_ads_needing_notifications()
+        due_ads = due_expiry_events()
+        window = min(timed(bot.get_expiring_ads, horizon=bot.EXPIRY_HORIZON) for _ in range(repeats))
+        ids = [random.randint(1, ads_count) for _ in range(1000)]
+        lookup = timed(lambda: [bot.get_expiring_ads([ad_id]) for ad_id in ids]) / len(ids)
+        loaded = len(bot.get_expiring_ads(horizon=bot.EXPIRY_HORIZON))
+        # Событий в сутки: у каждого объявления 4 напоминания и удаление за 7 дней
+        events_per_day = ads_count / 7 * len(bot.EXPIRY_STAGES)
+        print(f"{ads_count} объявлений возрастом до 7 дней")
+        print(f"  до (опрос раз в 10 мин)  проход {sweep * 1000:7.1f} мс, за сутки {144 * sweep:6.2f} с чтения,"
+              f" опоздание уведомлений в среднем 5 мин, до 10 мин")
+        print(f"  созревшие события после простоя: до {len(legacy_rows)} записей на {len({row[0] for row in legacy_rows})}"
+              f" объявлений (5 запросов, {sweep * 1000:.1f} мс), после {len(due_ads)} записей"
+              f" (1 запрос по индексу, {due * 1000:.1f} мс)")
+        lateness = asyncio.run(scheduler_lateness(2000, 1.0))
+        print(f"  после (планировщик)      окно сроков {loaded} объявлений за {window * 1000:6.1f} мс,"
+              f" событие {lookup * 1e6:5.0f} мкс; за сутки {2 * window + events_per_day * lookup:6.2f} с чтения,"
+              f" опоздание p99 {percentile(lateness, 99) * 1000:5.1f} мс")
+
+
+# --- Сценарий: сводки напоминаний ---
+
+def legacy_queue_notice(ad):
+    """Прежняя постановка напоминания: транзакция и сообщение на каждое объявление."""
+    def queue(conn):
+        conn.execute("UPDATE ads SET next_notice_stage = 1 WHERE id = ? AND next_notice_stage = 0", (ad['id'],))
+        outbox.enqueue(conn, f"expiry:{ad['id']}:1d", 'message',
+                       {'chat_id': ad['user_id'], 'text': bot.expiry_notice_text(ad['title'], '1d')})
+    database.write(bot.DB_PATH, queue)
+
+
+@benchmark('digest')
+def bench_digest(users=200, ads_per_user=15):
+    """Напоминания за сутки: сообщение и транзакция на объявление vs одна сводка на автора."""
+    print(f"{users} авторов по {ads_per_user} объявлений, у всех созрело напоминание за сутки")
+    for name, digest in (("до (по объявлению)", False), ("после (сводка на автора)", True)):
+        with temp_db() as path:
+            with sqlite3.connect(path) as conn:
+                conn.executemany("""
+                    INSERT INTO ads (title, description, price, category, user_id, created_at)
+                    VALUES (?, '', 100, ?, ?, datetime('now', 'localtime', '-6 days', '-1 hours'))
+                """, [(f"Объявление {i}", bot.CATEGORIES[0], i % users) for i in range(users * ads_per_user)])
+            events = [dict(ad, type='1d') for ad in bot.get_expiring_ads()]
+            if digest:
+                elapsed = timed(bot.queue_expiry_digests, events)
+            else:
+                elapsed = timed(lambda: [legacy_queue_notice(ad) for ad in events])
+            with database.connect(path) as conn:
+                messages = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            print(f"  {name:26} {elapsed * 1000:7.1f} мс, транзакций {1 if digest else len(events):5},"
+                  f" сообщений {messages:5}")
+
+
+# --- Сценарий: удаление просроченных объявлений ---
+
+def legacy_delete_expired(ad_id):
+    """Прежнее удаление: транзакция на объявление, пост из чата — отдельным deleteMessage."""
+    def delete(conn):
+        row = conn.execute("DELETE FROM ads WHERE id = ? RETURNING title, user_id", (ad_id,)).fetchone()
+        outbox.enqueue(conn, f"expired:{ad_id}", 'message', {'chat_id': row[1], 'text': row[0]})
+    database.write(bot.DB_PATH, delete)
+
+
+@benchmark('expired')
+def bench_expired(ads_count=20000, expired=2000):
+    """Удаление просроченных объявлений: транзакция на объявление vs одна транзакция и deleteMessages."""
+    print(f"{ads_count} объявлений, просрочено {expired}, у каждого пост в общем чате")
+    for name, bulk in (("до (по одному)", False), ("после (одной пачкой)", True)):
+        with temp_db() as path, patch.object(bot, 'CHAT_ID', '-100500'):
+            seed_ads(path, ads_count)
+            with sqlite3.connect(path) as conn:
+                conn.execute("UPDATE ads SET public_chat_message_id = id")
+                conn.execute("UPDATE ads SET created_at = datetime('now', 'localtime', '-8 days') WHERE id <= ?", (expired,))
+            ids = list(range(1, expired + 1))
+            if bulk:
+                elapsed = timed(bot.delete_expired_ads, ids)
+                with database.connect(path) as conn:
+                    calls = conn.execute("SELECT COUNT(*) FROM outbox WHERE kind = 'chat_cleanup'").fetchone()[0]
+            else:
+                elapsed = timed(lambda: [legacy_delete_expired(ad_id) for ad_id in ids])
+                calls = expired
+            print(f"  {name:22} {elapsed * 1000:8.1f} мс, транзакций {1 if bulk else expired:5},"
+                  f" запросов удаления постов {calls:5} (при лимите группы 20/мин — {calls / 20:.1f} мин)")
+
+
+# --- Сценарий: запись объявления ---
+
+def legacy_row_to_ad(row):
+    """Прежнее отображение: словарь из 11 ключей на строку."""
+    return {
+        'id': row[0], 'title': row[1], 'description': row[2], 'price': row[3], 'category': row[4],
+        'district': row[5], 'photo': row[6], 'username': row[7], 'age_group': row[8],
+        'gender': row[9], 'condition': row[10],
+    }
+
+
+def legacy_format_ad_text(ad):
+    """Прежний format_ad_text: поля словаря по ключам."""
+    text = f"<b>{ad['title']}</b> [{ad['category']}]\n{ad['description']}\n💰 {ad['price']} руб.\n👤 @{ad['username']}"
+    if ad.get('district'):
+        text += f"\n📍 Район: {ad['district']}"
+    if ad.get('age_group'):
+        text += f"\n👶 Возраст: {ad['age_group']}"
+    if ad.get('gender'):
+        text += f"\n🚻 Пол: {ad['gender']}"
+    if ad.get('condition'):
+        text += f"\n📦 Состояние: {ad['condition']}"
+    return text
+
+
+def allocated(build):
+    """(результат build(), байт памяти, выделенных под него)."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark('records')
+def bench_records(ads_count=10000, repeats=20):
+    """Память и время создания записей: словарь на строку vs adrecord.Ad со __slots__."""
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        with database.connect(path) as conn:
+            rows = conn.execute(f"SELECT {bot.AD_COLUMNS} FROM ads").fetchall()
+        print(f"{ads_count} объявлений; строки выборки уже в памяти, считаются только записи")
+        for name, to_ad, format_text in (("до (dict)", legacy_row_to_ad, legacy_format_ad_text),
+                                         ("после (Ad)", bot.row_to_ad, bot.format_ad_text)):
+            ads, size = allocated(lambda: [to_ad(row) for row in rows])
+            start = time.perf_counter()
+            for _ in range(repeats):
+                [to_ad(row) for row in rows]
+            elapsed = (time.perf_counter() - start) / repeats
+            text_time = timed(lambda: [format_text(ad) for ad in ads])
+            print(f"  {name:12} {size / 1024:8.0f} КБ ({size / ads_count:5.0f} байт на запись, без значений полей)"
+                  f" | создание {elapsed * 1000:6.2f} мс | format_ad_text {text_time * 1000:6.2f} мс")
+
+
+# --- Сценарий: готовые карточки объявлений ---
+
+@benchmark('cards')
+def bench_cards(ads_count=10000, views=5):
+    """Карточки ленты: сборка строки при каждом показе vs один раз на запись объявления."""
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        with database.connect(path) as conn:
+            rows = conn.execute(f"SELECT {bot.AD_COLUMNS} FROM ads").fetchall()
+        legacy_ads = [legacy_row_to_ad(row) for row in rows]
+        ads = [bot.row_to_ad(row) for row in rows]
+        print(f"{ads_count} объявлений, каждое показано {views} раз")
+        legacy = timed(lambda: [legacy_format_ad_text(ad) for _ in range(views) for ad in legacy_ads])
+        first = timed(lambda: [bot.format_ad_text(ad) for ad in ads])
+        repeated = timed(lambda: [bot.format_ad_text(ad) for _ in range(views - 1) for ad in ads])
+        print(f"  до (строка на показ)      {legacy * 1000:7.2f} мс, без экранирования и лимита подписи")
+        print(f"  после: первый показ       {first * 1000:7.2f} мс (экранирование, лимит подписи)")
+        print(f"  после: ещё {views - 1} показа       {repeated * 1000:7.2f} мс"
+              f" | всего {(first + repeated) * 1000:7.2f} мс")
+
+
+# --- Сценарий: альбомы в выдаче ---
+
+async def browse_pages(mode, pages, user_id=42):
+    """Пользователь листает pages страниц фото-объявлений; (секунд, запросов к API, 429)."""
+    # Темп личного чата задаёт ограничитель sender (пачка, затем CHAT_RATE в секунду),
+    # поддельный API проверяет только общий лимит
+    api = FakeTelegramAPI(chat_interval=0.01)
+    await api.start()
+    tg = api.make_bot()
+    queue = sender.SendQueue()
+    tg.session.middleware(sender.ThrottlingMiddleware(queue))
+    message = types.Message(message_id=1, date=datetime.now(), chat=types.Chat(id=user_id, type='private')).as_(tg)
+    cursor = None
+    start = time.perf_counter()
+    try:
+        with patch.object(bot, 'LISTING_MODE', mode):
+            for _ in range(pages):
+                ads = bot.get_all_ads(before_id=cursor, limit=bot.PAGE_SIZE + 1)
+                await bot.send_ads_page(message, user_id, ads, "more_all_")
+                cursor = ads[bot.PAGE_SIZE - 1].id
+        elapsed = time.perf_counter() - start
+    finally:
+        await queue.close()
+        await tg.session.close()
+        await api.stop()
+    return elapsed, len(api.delivered), api.rejected
+
+
+@benchmark('album')
+def bench_album(pages=3):
+    """Страницы фото-объявлений: сообщение на объявление vs альбом и одна клавиатура."""
+    with temp_db() as path:
+        seed_ads(path, 200)
+        with sqlite3.connect(path) as conn:
+            conn.execute("UPDATE ads SET photo_id = 'photo_' || id")
+        print(f"{pages} страницы по {bot.PAGE_SIZE} объявлений с фото; в личный чат — пачка до "
+              f"{sender.CHAT_BURST} сообщений, дальше {sender.CHAT_RATE:.0f} в секунду")
+        for name, mode in (("до (сообщения)", 'messages'), ("после (альбомы)", 'album')):
+            elapsed, requests, rejected = asyncio.run(browse_pages(mode, pages))
+            print(f"  {name:18} запросов к API {requests:3} | {elapsed:6.1f} с до последней страницы | 429: {rejected}")
+
+
+# --- Сценарий: кэш объявлений ---
+
+def callback_reads(rnd, ads_count, count):
+    """Чтения, как от кнопок: карточка объявления и первая страница категории."""
+    reads = []
+    for _ in range(count):
+        if rnd.random() < 0.7:
+            # Чаще открывают свежие объявления
+            reads.append((bot.get_ad_by_id, (ads_count - int(rnd.expovariate(1 / 200)) % ads_count,)))
+        else:
+            reads.append((bot.get_ads_by_category, (rnd.choice(bot.CATEGORIES), None, bot.PAGE_SIZE)))
+    return reads
+
+
+@benchmark('cache')
+def bench_cache(ads_count=20000, reads=5000, writes_every=50):
+    """Карточки и страницы категорий: каждый раз из БД vs через кэш со сбросом при записи."""
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        print(f"{ads_count} объявлений, {reads} чтений, каждое {writes_every}-е — после правки объявления")
+        for name, ad_cache in (("до (без кэша)", bot.cache.AdCache(lambda: bot.DB_PATH, 0, 0)),
+                               ("после (кэш)", bot.cache.AdCache(lambda: bot.DB_PATH))):
+            rnd = random.Random(5)
+            with patch.object(bot, 'ad_cache', ad_cache):
+                workload = callback_reads(rnd, ads_count, reads)
+                statements = []
+                database.set_trace_callback(statements.append)
+                start = time.perf_counter()
+                try:
+                    for i, (read, args) in enumerate(workload, 1):
+                        read(*args)
+                        if i % writes_every == 0:
+                            bot.update_ad_field(rnd.randint(1, ads_count), 'price', i)
+                finally:
+                    database.set_trace_callback(None)
+                elapsed = time.perf_counter() - start
+            print(f"  {name:16} {elapsed * 1000:8.1f} мс | запросов чтения {len(statements):5}"
+                  f" | попаданий {ad_cache.hit_rate:.0%}")
+
+
+# --- Сценарий: запуск на актуальной БД ---
+
+LEGACY_ADS_COLUMNS = (
+    "district TEXT", "age_group TEXT", "gender TEXT", "condition TEXT",
+    "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP", "notif_1d INTEGER DEFAULT 0",
+    "notif_12h INTEGER DEFAULT 0", "notif_6h INTEGER DEFAULT 0", "notif_1h INTEGER DEFAULT 0",
+    "public_chat_message_id INTEGER",
+)
+
+
+def legacy_init_db(path):
+    """Исходный init_db(): ALTER TABLE в try/except и UPDATE всей таблицы при каждом запуске."""
+    with sqlite3.connect(path) as conn:
+        for column in LEGACY_ADS_COLUMNS:
+            try:
+                conn.execute(f"ALTER TABLE ads ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        conn.execute("PRAGMA table_info(ads)").fetchall()
+        conn.execute("UPDATE ads SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+        for table in ("favorites", "subscriptions", "complaints"):
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY)")
+        for ddl in migrations.SCHEMA_INDEXES.values():
+            conn.execute(ddl.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS"))
+
+
+@benchmark('startup')
+def bench_startup(ads_count=100000, null_share=0.3, runs=5):
+    """Время инициализации схемы при запуске: try/except ALTER + UPDATE vs версионные миграции."""
+    with temp_db() as path:
+        seed_ads(path, ads_count)
+        # Объявления без created_at — как в БД, где колонка когда-то добавилась без значения
+        with sqlite3.connect(path) as conn:
+            conn.execute("UPDATE ads SET created_at = NULL WHERE id % ? = 0", (round(1 / null_share),))
+        database.close_all()
+        print(f"{ads_count} объявлений, схема уже актуальна, {runs} запусков")
+        for name, init in (("до (try/except + UPDATE)", legacy_init_db), ("после (schema_version)", migrations.migrate)):
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                init(path)
+                timings.append(time.perf_counter() - start)
+                database.close_all()  # каждый запуск — с новыми соединениями, как при старте процесса
+            print(f"  {name:26} первый запуск {timings[0] * 1000:8.1f} мс | "
+                  f"последующие медиана {statistics.median(timings[1:]) * 1000:7.2f} мс")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Использование: python bench.py <сценарий>")
+        for name, func in BENCHMARKS.items():
+            print(f"  {name:12} {func.__doc__}")
+        return
+    BENCHMARKS[sys.argv[1]]()
+
+
+if __name__ == '__main__':
+    main()
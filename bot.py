@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import os
+import re
 import sqlite3
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types
@@ -8,9 +9,19 @@ from aiogram.filters import Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-import openai
+import adrecord
+import cache
+import database
+import migrations
+import moderation
+import outbox
+import prefilter
+import rendering
+import scheduler
+import search
+import sender
 from aiohttp_socks import ProxyConnector
 import aiohttp
 try:
@@ -31,12 +42,8 @@ if not API_TOKEN:
     logging.warning('BOT_TOKEN не задан — запускаем в тестовом/локальном режиме')
 
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
-if DEEPSEEK_API_KEY:
-    openai.api_key = DEEPSEEK_API_KEY
-    openai.base_url = "https://api.deepseek.com/v1/"
-else:
+if not DEEPSEEK_API_KEY:
     logging.warning('DEEPSEEK_API_KEY не задан — OpenAI/DeepSeek функции отключены')
-    openai.api_key = None
 
 ADMIN_ID = os.getenv('ADMIN_ID')
 if not ADMIN_ID:
@@ -59,8 +66,22 @@ if SUPPORT_CHAT_ID:
 else:
     logging.warning('SUPPORT_CHAT_ID не задан — используется старая логика поддержки')
 
+# 'sync' — объявление публикуется после ответа модерации; 'async' — сохраняется как
+# ожидающее (pending_ads), пользователь сразу получает ответ, модерация идёт в фоне
+MODERATION_MODE = os.getenv('MODERATION_MODE', 'sync')
+if MODERATION_MODE == 'async' and not DEEPSEEK_API_KEY:
+    # Без ключа вердикта не будет никогда: ожидающие объявления повторялись бы бесконечно
+    logging.warning('DEEPSEEK_API_KEY не задан — фоновая модерация невозможна, используем MODERATION_MODE=sync')
+    MODERATION_MODE = 'sync'
+
+# 'album' — фото-объявления страницы уходят одним альбомом с общей нумерованной
+# клавиатурой; 'messages' — каждое объявление отдельным сообщением со своими кнопками
+LISTING_MODE = os.getenv('LISTING_MODE', 'album')
+
 # Создаём объект бота только если указан токен (в тестах обычно не нужен)
 bot = Bot(token=API_TOKEN) if API_TOKEN else None
+# Все сообщения в чаты проходят через очередь с ограничением частоты (подключается в main)
+send_queue = sender.SendQueue()
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
@@ -99,495 +120,643 @@ YAKUTSK_DISTRICTS = [
     "📍 Другой район"
 ]
 
+# --- Характеристики товара (выбираются при добавлении и в фильтрах) ---
+AGE_GROUPS = ["0–3 мес", "3–12 мес", "1–3 года", "3–7 лет", "7–12 лет"]
+GENDERS = ["👧 Девочка", "👦 Мальчик", "👪 Унисекс"]
+CONDITIONS = ["🆕 Новое", "✨ Как новое", "🔄 Б/у", "🔧 Требует ремонта"]
+
 # --- Работа с базой данных SQLite ---
-DB_PATH = "/app/data/ads.db"
+DB_PATH = database.DEFAULT_DB_PATH
 
 def init_db():
-    """Создаёт все необходимые таблицы, если их нет. НЕ удаляет существующие данные."""
+    """Приводит схему БД к актуальной версии (см. migrations.py). НЕ удаляет существующие данные."""
     # Создаем директорию для базы данных, если её нет
-    os.makedirs("/app/data", exist_ok=True)
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        # Таблица объявлений
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS ads (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT NOT NULL,
-                price INTEGER NOT NULL,
-                category TEXT NOT NULL,
-                district TEXT,
-                photo_id TEXT,
-                user_id INTEGER NOT NULL,
-                username TEXT
-            )
-        """)
-        # Проверяем существование колонки district и добавляем её, если её нет
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN district TEXT")
-        except sqlite3.OperationalError:
-            pass  # колонка уже существует
-        
-        # Добавляем новые поля для детских объявлений
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN age_group TEXT")
-        except sqlite3.OperationalError:
-            pass  # поле уже существует
-        
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN gender TEXT")
-        except sqlite3.OperationalError:
-            pass  # поле уже существует
-        
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN condition TEXT")
-        except sqlite3.OperationalError:
-            pass  # поле уже существует
-        
-        # Добавляем поля для автоматического удаления, если их нет
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN notif_1d INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN notif_12h INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN notif_6h INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN notif_1h INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass
-        # Добавляем поле для хранения ID сообщения в общем чате
-        try:
-            cursor.execute("ALTER TABLE ads ADD COLUMN public_chat_message_id INTEGER")
-        except sqlite3.OperationalError:
-            pass
-
-        # Проверяем наличие колонки created_at
-        cursor.execute("PRAGMA table_info(ads)")
-        columns = [col[1] for col in cursor.fetchall()]
-        if 'created_at' not in columns:
-            cursor.execute("ALTER TABLE ads ADD COLUMN created_at TIMESTAMP")
-            logging.info("Колонка created_at добавлена")
-        # Теперь обновляем значения, если они NULL
-        cursor.execute("UPDATE ads SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
-        # Таблица избранного
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS favorites (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                ad_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (ad_id) REFERENCES ads(id) ON DELETE CASCADE,
-                UNIQUE(user_id, ad_id)
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_favorites_user ON favorites(user_id)")
-        # Таблица подписок на категории
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                category TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, category)
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions(user_id)")
-        # Таблица жалоб
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS complaints (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ad_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                reason TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'new',
-                FOREIGN KEY (ad_id) REFERENCES ads(id) ON DELETE CASCADE
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_complaints_status ON complaints(status)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_complaints_ad_id ON complaints(ad_id)")
-        conn.commit()
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+    migrations.migrate(DB_PATH)
+    ad_cache.clear()
+
+def _insert_ad(conn, title, description, price, category, district, photo_id, user_id, username, age_group=None, gender=None, condition=None):
+    cursor = conn.execute("""
+        INSERT INTO ads (title, description, price, category, district, photo_id, user_id, username, age_group, gender, condition, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, (title, description, price, category, district, photo_id, user_id, username, age_group, gender, condition))
+    # Поисковый индекс обновляется в той же транзакции
+    search.index_ad(conn, cursor.lastrowid)
+    # expires_at заполняет триггер (см. migrations.migration_expiry_stage)
+    expires_at = conn.execute("SELECT expires_at FROM ads WHERE id = ?", (cursor.lastrowid,)).fetchone()[0]
+    schedule_expiry({'id': cursor.lastrowid, 'expires_at': expires_at, 'next_notice_stage': 0})
+    return cursor.lastrowid
 
 def add_ad_to_db(title, description, price, category, district, photo_id, user_id, username, age_group=None, gender=None, condition=None):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO ads (title, description, price, category, district, photo_id, user_id, username, age_group, gender, condition)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (title, description, price, category, district, photo_id, user_id, username, age_group, gender, condition))
-        conn.commit()
-        return cursor.lastrowid
+    ad_id = database.write(DB_PATH, _insert_ad, title, description, price, category, district, photo_id,
+                           user_id, username, age_group, gender, condition)
+    ad_cache.invalidate(groups=ad_groups(category, district, user_id))
+    return ad_id
+
+def publish_ad(title, description, price, category, district, photo_id, user_id, username, age_group=None, gender=None, condition=None):
+    """
+    Сохраняет объявление вместе с рассылкой подписчикам и постом в общий чат (в outbox).
+
+    Всё записывается одной транзакцией: опубликованное объявление не останется
+    без уведомлений, даже если бот перезапустится до их отправки.
+    Возвращает (id объявления, рассылка) — рассылку запускает start_broadcast().
+    """
+    result = database.write(DB_PATH, _publish_ad, title, description, price, category, district, photo_id,
+                            user_id, username, age_group, gender, condition)
+    ad_cache.invalidate(groups=ad_groups(category, district, user_id))
+    return result
+
+def _publish_ad(conn, title, description, price, category, district, photo_id, user_id, username, age_group=None, gender=None, condition=None):
+    ad_id = _insert_ad(conn, title, description, price, category, district, photo_id,
+                       user_id, username, age_group, gender, condition)
+    text = rendering.subscriber_notice(category, title, description, price, username, photo_id)
+    broadcast = _create_broadcast(conn, category, text, photo_id, user_id)
+    if CHAT_ID:
+        text = rendering.public_post(title, description, price, username, district, age_group, gender, condition,
+                                     photo_id)
+        outbox.enqueue(conn, f"public_post:{ad_id}", 'public_post', {'ad_id': ad_id, 'text': text, 'photo_id': photo_id})
+    return ad_id, broadcast
+
+# --- Объявления, ожидающие фоновой модерации (MODERATION_MODE='async') ---
+PENDING_AD_FIELDS = ('id', 'title', 'description', 'price', 'category', 'district', 'photo_id',
+                     'user_id', 'username', 'age_group', 'gender', 'condition')
+
+def submit_pending_ad(title, description, price, category, district, photo_id, user_id, username, age_group=None, gender=None, condition=None):
+    """Сохраняет объявление до решения модерации; возвращает его номер в pending_ads."""
+    result = database.execute_write(DB_PATH, """
+        INSERT INTO pending_ads (title, description, price, category, district, photo_id, user_id, username, age_group, gender, condition)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (title, description, price, category, district, photo_id, user_id, username, age_group, gender, condition))
+    return result.lastrowid
+
+def _get_pending_ad(conn, pending_id):
+    row = conn.execute(f"SELECT {', '.join(PENDING_AD_FIELDS)} FROM pending_ads WHERE id = ?", (pending_id,)).fetchone()
+    return dict(zip(PENDING_AD_FIELDS, row)) if row else None
+
+def get_pending_ad(pending_id):
+    with database.connect(DB_PATH) as conn:
+        return _get_pending_ad(conn, pending_id)
+
+def get_pending_ad_ids():
+    """Номера объявлений, ожидающих модерации, в порядке подачи."""
+    with database.connect(DB_PATH) as conn:
+        return [row[0] for row in conn.execute("SELECT id FROM pending_ads ORDER BY id")]
+
+def approve_pending_ad(pending_id):
+    """
+    Публикует одобренное объявление: переносит его в ads вместе с рассылкой,
+    постом в общий чат и сообщением автору (одна транзакция, как publish_ad).
+    Возвращает (id объявления, рассылка) или None, если решение уже принято.
+    """
+    def approve(conn):
+        ad = _get_pending_ad(conn, pending_id)
+        if ad is None:
+            return None
+        conn.execute("DELETE FROM pending_ads WHERE id = ?", (pending_id,))
+        fields = {key: value for key, value in ad.items() if key != 'id'}
+        ad_id, broadcast = _publish_ad(conn, **fields)
+        outbox.enqueue(conn, f"moderated:{pending_id}", 'message', {
+            'chat_id': ad['user_id'], 'text': rendering.moderation_notice(ad['title'], approved=True)})
+        published.append(ad)
+        return ad_id, broadcast
+    published = []
+    result = database.write(DB_PATH, approve)
+    for ad in published:
+        ad_cache.invalidate(groups=ad_groups(ad['category'], ad['district'], ad['user_id']))
+    return result
+
+def reject_pending_ad(pending_id):
+    """Удаляет отклонённое объявление и сообщает автору. False, если решение уже принято."""
+    def reject(conn):
+        ad = _get_pending_ad(conn, pending_id)
+        if ad is None:
+            return False
+        conn.execute("DELETE FROM pending_ads WHERE id = ?", (pending_id,))
+        outbox.enqueue(conn, f"moderated:{pending_id}", 'message', {
+            'chat_id': ad['user_id'], 'text': rendering.moderation_notice(ad['title'], approved=False)})
+        return True
+    return database.write(DB_PATH, reject)
 
 def extend_ad_expiration(ad_id):
-    """Продлевает объявление на 7 дней, сбрасывает флаги уведомлений."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE ads 
-            SET created_at = CURRENT_TIMESTAMP,
-                notif_1d = 0,
-                notif_12h = 0,
-                notif_6h = 0,
-                notif_1h = 0
-            WHERE id = ?
-        """, (ad_id,))
-        conn.commit()
-        return cursor.rowcount > 0
-
-def get_ads_needing_notifications():
-    """Возвращает объявления, которым нужно отправить уведомления."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        now = datetime.now()
-        
-        # 7 дней назад
-        seven_days_ago = now - timedelta(days=7)
-        # 1 день до истечения (т.е. 6 дней после создания)
-        one_day_before = now - timedelta(days=6)
-        # 12 часов до истечения (6 дней и 12 часов после создания)
-        twelve_hours_before = now - timedelta(days=6, hours=12)
-        # 6 часов до истечения (6 дней и 18 часов после создания)
-        six_hours_before = now - timedelta(days=6, hours=18)
-        # 1 час до истечения (6 дней и 23 часа после создания)
-        one_hour_before = now - timedelta(days=6, hours=23)
-        
-        ads_to_notify = []
-        
-        # Уведомление за 1 день (когда объявлению ровно 6 дней)
-        cursor.execute("""
-            SELECT id, title, user_id, username, created_at
-            FROM ads 
-            WHERE created_at <= ? AND notif_1d = 0
-        """, (one_day_before,))
-        for row in cursor.fetchall():
-            ads_to_notify.append({'id': row[0], 'title': row[1], 'user_id': row[2], 'username': row[3], 'created_at': row[4], 'type': '1d'})
-        
-        # Уведомление за 12 часов (когда объявлению 6 дней 12 часов)
-        cursor.execute("""
-            SELECT id, title, user_id, username, created_at
-            FROM ads 
-            WHERE created_at <= ? AND notif_12h = 0
-        """, (twelve_hours_before,))
-        for row in cursor.fetchall():
-            ads_to_notify.append({'id': row[0], 'title': row[1], 'user_id': row[2], 'username': row[3], 'created_at': row[4], 'type': '12h'})
-        
-        # Уведомление за 6 часов (когда объявлению 6 дней 18 часов)
-        cursor.execute("""
-            SELECT id, title, user_id, username, created_at
-            FROM ads 
-            WHERE created_at <= ? AND notif_6h = 0
-        """, (six_hours_before,))
-        for row in cursor.fetchall():
-            ads_to_notify.append({'id': row[0], 'title': row[1], 'user_id': row[2], 'username': row[3], 'created_at': row[4], 'type': '6h'})
-        
-        # Уведомление за 1 час (когда объявлению 6 дней 23 часа)
-        cursor.execute("""
-            SELECT id, title, user_id, username, created_at
-            FROM ads 
-            WHERE created_at <= ? AND notif_1h = 0
-        """, (one_hour_before,))
-        for row in cursor.fetchall():
-            ads_to_notify.append({'id': row[0], 'title': row[1], 'user_id': row[2], 'username': row[3], 'created_at': row[4], 'type': '1h'})
-        
-        # Удаление через 7 дней
-        cursor.execute("""
-            SELECT id, title, user_id, username, created_at
-            FROM ads 
-            WHERE created_at <= ?
-        """, (seven_days_ago,))
-        for row in cursor.fetchall():
-            ads_to_notify.append({'id': row[0], 'title': row[1], 'user_id': row[2], 'username': row[3], 'created_at': row[4], 'type': '7d_delete'})
-        
-        return ads_to_notify
-
-def mark_notification_sent(ad_id, notif_type):
-    """Отмечает, что уведомление отправлено."""
-    field_map = {
-        '1d': 'notif_1d',
-        '12h': 'notif_12h',
-        '6h': 'notif_6h',
-        '1h': 'notif_1h'
-    }
-    field = field_map.get(notif_type)
-    if not field:
-        return False
-    
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(f"UPDATE ads SET {field} = 1 WHERE id = ?", (ad_id,))
-        conn.commit()
-        return cursor.rowcount > 0
-
-def delete_ad_by_id(ad_id):
-    """Удаляет объявление по ID."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM ads WHERE id = ?", (ad_id,))
-        conn.commit()
-        return cursor.rowcount > 0
-
-def get_all_ads():
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, description, price, category, district, photo_id, username, age_group, gender, condition FROM ads ORDER BY id DESC")
-        rows = cursor.fetchall()
-        ads = []
-        for row in rows:
-            ads.append({
-                'id': row[0],
-                'title': row[1],
-                'description': row[2],
-                'price': row[3],
-                'category': row[4],
-                'district': row[5],
-                'photo': row[6],
-                'username': row[7],
-                'age_group': row[8],
-                'gender': row[9],
-                'condition': row[10]
-            })
-        return ads
-
-def get_ads_by_category(category):
-    """Возвращает объявления указанной категории.""" 
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, description, price, category, district, photo_id, username, age_group, gender, condition FROM ads WHERE category = ? ORDER BY id DESC", (category,))
-        rows = cursor.fetchall()
-        ads = []
-        for row in rows:
-            ads.append({
-                'id': row[0],
-                'title': row[1],
-                'description': row[2],
-                'price': row[3],
-                'category': row[4],
-                'district': row[5],
-                'photo': row[6],
-                'username': row[7],
-                'age_group': row[8],
-                'gender': row[9],
-                'condition': row[10]
-            })
-        return ads
-
-def get_ads_by_district(district):
-    """Возвращает объявления указанного района.""" 
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, description, price, category, district, photo_id, username, age_group, gender, condition FROM ads WHERE district = ? ORDER BY id DESC", (district,))
-        rows = cursor.fetchall()
-        ads = []
-        for row in rows:
-            ads.append({
-                'id': row[0],
-                'title': row[1],
-                'description': row[2],
-                'price': row[3],
-                'category': row[4],
-                'district': row[5],
-                'photo': row[6],
-                'username': row[7],
-                'age_group': row[8],
-                'gender': row[9],
-                'condition': row[10]
-            })
-        return ads
-
-def search_ads(keyword):
-    """Ищет объявления по ключевому слову в названии и описании."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
+    """Продлевает объявление на 7 дней, напоминания начинаются заново."""
+    def extend(conn):
+        row = conn.execute(f"UPDATE ads SET {EXTEND_ASSIGNMENTS} WHERE id = ? RETURNING expires_at", (ad_id,)).fetchone()
+        if row is None:
+            return False
+        schedule_expiry({'id': ad_id, 'expires_at': row[0], 'next_notice_stage': 0})
+        return True
+    extended = database.write(DB_PATH, extend)
+    ad_cache.invalidate([ad_id])
+    return extended
+
+def extend_warned_ads(user_id):
+    """Продлевает на 7 дней все объявления пользователя, о сроке которых уже пришло напоминание. Возвращает их число."""
+    def extend(conn):
+        rows = conn.execute(f"""
+            UPDATE ads SET {EXTEND_ASSIGNMENTS}
+            WHERE user_id = ? AND next_notice_stage > 0
+            RETURNING id, expires_at
+        """, (user_id,)).fetchall()
+        for ad_id, expires_at in rows:
+            schedule_expiry({'id': ad_id, 'expires_at': expires_at, 'next_notice_stage': 0})
+        return [row[0] for row in rows]
+    ad_ids = database.write(DB_PATH, extend)
+    ad_cache.invalidate(ad_ids)
+    return len(ad_ids)
+
+# --- Сроки объявлений: напоминания и удаление ---
+# События жизни объявления: (тип, через сколько после created_at).
+# ads.next_notice_stage — номер ближайшего необработанного события в этом списке.
+EXPIRY_STAGES = (
+    ('1d', timedelta(days=6)),
+    ('12h', timedelta(days=6, hours=12)),
+    ('6h', timedelta(days=6, hours=18)),
+    ('1h', timedelta(days=6, hours=23)),
+    ('7d_delete', timedelta(days=7)),
+)
+AD_LIFETIME = EXPIRY_STAGES[-1][1]
+
+# Продление: срок отсчитывается заново, напоминания начинаются с первого
+EXTEND_ASSIGNMENTS = (f"created_at = CURRENT_TIMESTAMP, expires_at = datetime(CURRENT_TIMESTAMP, '+{AD_LIFETIME.days} days'), "
+                      "next_notice_stage = 0")
+
+# Номер напоминания в EXPIRY_STAGES по типу уведомления
+NOTICE_STAGES = {notif_type: stage for stage, (notif_type, _) in enumerate(EXPIRY_STAGES[:-1])}
+
+EXPIRY_FIELDS = ('id', 'title', 'user_id', 'username', 'expires_at', 'next_notice_stage')
+
+# Ближайшее событие каждого объявления (ключ — id объявления), см. handle_expiry_events
+expiry_scheduler = scheduler.Scheduler()
+
+def parse_ad_time(value):
+    """Время из БД ('ГГГГ-ММ-ДД ЧЧ:ММ:СС') как datetime."""
+    return datetime.fromisoformat(value)
+
+def format_ad_time(moment):
+    """datetime в формате времени БД (обратное parse_ad_time)."""
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def stage_time(ad, stage):
+    """Время события номер stage объявления."""
+    return parse_ad_time(ad['expires_at']) - AD_LIFETIME + EXPIRY_STAGES[stage][1]
+
+def expiry_event(ad, now, early=timedelta(0)):
+    """
+    Самое срочное созревшее событие объявления или None.
+
+    Пропущенные за время простоя бота напоминания не отправляются пачкой:
+    приходит только последнее из них, а если срок вышел — сразу удаление.
+    Напоминания (но не удаление) считаются созревшими на early раньше срока.
+    """
+    for stage in range(len(EXPIRY_STAGES) - 1, ad['next_notice_stage'] - 1, -1):
+        due = stage_time(ad, stage)
+        if stage < len(EXPIRY_STAGES) - 1:
+            due -= early
+        if due <= now:
+            return EXPIRY_STAGES[stage][0]
+    return None
+
+def next_expiry_time(ad):
+    """Время ближайшего необработанного события объявления или None, если событий не осталось."""
+    if ad['next_notice_stage'] >= len(EXPIRY_STAGES):
+        return None
+    return stage_time(ad, ad['next_notice_stage'])
+
+def schedule_expiry(ad):
+    """Передаёт планировщику ближайшее событие объявления."""
+    when = next_expiry_time(ad)
+    if when is not None:
+        expiry_scheduler.schedule(ad['id'], when.timestamp())
+
+def get_expiring_ads(ad_ids=None, horizon=timedelta(0)):
+    """
+    Объявления со сроком и номером следующего события: с указанными ad_ids или
+    все, чьё следующее событие наступает не позже чем через horizon.
+
+    Второй вариант — один запрос, по диапазону индекса (next_notice_stage,
+    expires_at) на каждый номер события; каждое объявление возвращается один раз.
+    """
+    columns = ", ".join(EXPIRY_FIELDS)
+    with database.connect(DB_PATH) as conn:
+        if ad_ids is None:
+            bound = datetime.now() + horizon
+            conditions = " OR ".join("(next_notice_stage = ? AND expires_at <= ?)" for _ in EXPIRY_STAGES)
+            params = []
+            for stage, (_, offset) in enumerate(EXPIRY_STAGES):
+                params += [stage, format_ad_time(bound + AD_LIFETIME - offset)]
+            rows = conn.execute(f"SELECT {columns} FROM ads WHERE {conditions}", params).fetchall()
+        else:
+            ad_ids = list(ad_ids)
+            rows = []
+            for i in range(0, len(ad_ids), 500):
+                chunk = ad_ids[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows += conn.execute(f"SELECT {columns} FROM ads WHERE id IN ({placeholders})", chunk).fetchall()
+    return [dict(zip(EXPIRY_FIELDS, row)) for row in rows]
+
+def queue_expiry_digests(events):
+    """
+    Отмечает напоминания отправленными и ставит их в outbox: одно сообщение на автора.
+
+    events — объявления с созревшим напоминанием (тип — в 'type'). Отметки
+    обновляются одним запросом на пачку; напоминание, уже поставленное или
+    потерявшее смысл после продления объявления, пропускается. Ключ outbox —
+    по самому срочному напоминанию сообщения: его срок (expires_at) меняется
+    при продлении, поэтому после продления напоминания идут заново.
+    Возвращает id отмеченных объявлений.
+    """
+    def queue(conn):
+        marked = set()
+        for i in range(0, len(events), 300):
+            chunk = events[i:i + 300]
+            values = ", ".join("(?, ?, ?)" for _ in chunk)
+            params = [value for event in chunk for value in (event['id'], NOTICE_STAGES[event['type']], event['expires_at'])]
+            rows = conn.execute(f"""
+                UPDATE ads SET next_notice_stage = due.column2 + 1
+                FROM (VALUES {values}) AS due
+                WHERE ads.id = due.column1 AND ads.expires_at = due.column3 AND ads.next_notice_stage <= due.column2
+                RETURNING ads.id
+            """, params)
+            marked.update(row[0] for row in rows)
+        digests = {}
+        for event in sorted(events, key=lambda event: (event['expires_at'], event['id'])):
+            if event['id'] in marked:
+                digests.setdefault(event['user_id'], []).append(event)
+        for user_id, notices in digests.items():
+            first = notices[0]
+            key = f"expiry:{first['id']}:{first['expires_at']}:{first['type']}"
+            outbox.enqueue(conn, key, 'expiry_digest', {
+                'chat_id': user_id, 'text': expiry_digest_text(notices), 'ad_ids': [notice['id'] for notice in notices]})
+        return sorted(marked)
+    return database.write(DB_PATH, queue)
+
+def delete_expired_ads(ad_ids):
+    """
+    Удаляет просроченные объявления одной транзакцией и ставит в outbox
+    уведомления авторам и удаление их постов из общего чата.
+
+    Объявления, продлённые после чтения, не удаляются. Возвращает id удалённых.
+    """
+    def delete(conn):
+        now = format_ad_time(datetime.now())
+        ids = list(ad_ids)
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            rows += conn.execute(f"""
+                DELETE FROM ads WHERE id IN ({placeholders}) AND expires_at <= ?
+                RETURNING id, title, user_id, public_chat_message_id, category, district
+            """, chunk + [now]).fetchall()
+        for ad_id, title, user_id, *_ in rows:
+            outbox.enqueue(conn, f"expired:{ad_id}", 'message',
+                           {'chat_id': user_id, 'text': rendering.expired_notice(title)})
+        queue_chat_cleanup(conn, [(row[0], row[3]) for row in rows if row[3]])
+        return rows
+    rows = database.write(DB_PATH, delete)
+    if rows:
+        ad_cache.invalidate([row[0] for row in rows],
+                            {group for _, _, user_id, _, category, district in rows
+                             for group in ad_groups(category, district, user_id)})
+    return [row[0] for row in rows]
+
+# Колонки объявления в том порядке, в котором их разбирает row_to_ad()
+AD_COLUMNS = adrecord.COLUMNS
+AD_COLUMNS_QUALIFIED = ", ".join(f"ads.{column.strip()}" for column in AD_COLUMNS.split(","))
+
+def row_to_ad(row):
+    """Преобразует строку выборки AD_COLUMNS в объявление adrecord.Ad."""
+    return adrecord.Ad(*row)
+
+# Объявления и списки их id для лент, категорий, районов и авторов (см. cache.py)
+ad_cache = cache.AdCache(lambda: DB_PATH)
+
+def ad_groups(category, district, user_id):
+    """Группы списков кэша, в которые входит объявление."""
+    return [('all', None), ('category', category), ('district', district), ('user', user_id)]
+
+def select_ads(columns, where=None, params=(), before_id=None, limit=None):
+    """
+    Выбирает колонки columns объявлений по условию, от новых к старым.
+
+    Постраничный просмотр идёт по курсору: before_id — id последнего показанного
+    объявления, limit — размер страницы. Условие `id < ?` вместе с составными
+    индексами (фильтр, id DESC) находит начало страницы без пропуска OFFSET строк,
+    так что стоимость запроса не зависит от номера страницы и размера таблицы.
+    Без limit возвращаются все подходящие объявления.
+    """
+    conditions = [f"({where})"] if where else []
+    params = list(params)
+    if before_id is not None:
+        conditions.append("id < ?")
+        params.append(before_id)
+    sql = f"SELECT {columns} FROM ads"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    with database.connect(DB_PATH) as conn:
+        return conn.execute(sql, params).fetchall()
+
+def query_ads(where=None, params=(), before_id=None, limit=None):
+    """Объявления по условию, от новых к старым (см. select_ads)."""
+    return [row_to_ad(row) for row in select_ads(AD_COLUMNS, where, params, before_id, limit)]
+
+def load_ad_records(ad_ids):
+    """{id: объявление Ad}: из кэша, недостающие — одним запросом по первичному ключу."""
+    generation = ad_cache.read_generation()
+    records = ad_cache.get_many(ad_ids)
+    missing = [ad_id for ad_id in ad_ids if ad_id not in records]
+    if missing:
+        loaded = {}
+        with database.connect(DB_PATH) as conn:
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                for row in conn.execute(f"SELECT {AD_COLUMNS} FROM ads WHERE id IN ({placeholders})", chunk):
+                    loaded[row[0]] = row_to_ad(row)
+        ad_cache.put_many(loaded, generation)
+        records.update(loaded)
+    return records
+
+def cached_ads(group, where=None, params=(), before_id=None, limit=None):
+    """
+    Объявления группы кэша (см. ad_groups) от новых к старым: список id и сами
+    объявления берутся из кэша, в БД читается только недостающее.
+    """
+    key = (group, before_id, limit)
+    generation = ad_cache.read_generation()
+    ad_ids = ad_cache.get_ids(key)
+    if ad_ids is None:
+        ad_ids = [row[0] for row in select_ads("id", where, params, before_id, limit)]
+        ad_cache.put_ids(key, ad_ids, generation)
+    records = load_ad_records(list(ad_ids))
+    # Объявление, удалённое между чтением списка и записей, пропускается
+    return [records[ad_id] for ad_id in ad_ids if ad_id in records]
+
+def get_all_ads(before_id=None, limit=None):
+    """Возвращает объявления (страницу после before_id, если задан limit)."""
+    return cached_ads(('all', None), before_id=before_id, limit=limit)
+
+def get_ads_by_category(category, before_id=None, limit=None):
+    """Возвращает объявления указанной категории."""
+    return cached_ads(('category', category), "category = ?", (category,), before_id, limit)
+
+def get_ads_by_district(district, before_id=None, limit=None):
+    """Возвращает объявления указанного района."""
+    return cached_ads(('district', district), "district = ?", (district,), before_id, limit)
+
+# Фасеты: поля объявления, по которым фильтруют на точное совпадение
+FACET_COLUMNS = ('category', 'district', 'age_group', 'gender', 'condition')
+
+# Релевантность (bm25) считается среди стольких самых новых совпадений: для
+# частых слов оценка всех совпадений стоила бы десятки миллисекунд на страницу
+SEARCH_RANK_WINDOW = 2000
+
+def search_ads(keyword, before_id=None, limit=None):
+    """Ищет объявления по словам в названии и описании (см. find_ads)."""
+    return find_ads({'keyword': keyword}, before_id, limit)
+
+def filter_conditions(filters, exclude=None):
+    """
+    Условия WHERE и их параметры для фильтров find_ads(), кроме ключевых слов.
+
+    exclude — фасет, фильтр по которому не применяется: так считаются
+    варианты значений этого фасета при остальных выбранных фильтрах.
+    """
+    conditions, params = [], []
+    for column in FACET_COLUMNS:
+        if column != exclude and filters.get(column) is not None:
+            conditions.append(f"ads.{column} = ?")
+            params.append(filters[column])
+    if filters.get('price_min') is not None:
+        conditions.append("ads.price >= ?")
+        params.append(filters['price_min'])
+    if filters.get('price_max') is not None:
+        conditions.append("ads.price <= ?")
+        params.append(filters['price_max'])
+    return conditions, params
+
+def find_ads(filters, before_id=None, limit=None):
+    """
+    Ищет объявления по любому набору фильтров.
+
+    filters — словарь с необязательными ключами: keyword (слова в названии
+    и описании), category, district, age_group, gender, condition (точное
+    совпадение) и price_min / price_max (цена в рублях, включительно).
+    Фильтрация целиком выполняется в SQL, каждому фасету соответствует
+    составной индекс (фасет, id DESC).
+
+    Без ключевых слов объявления идут от новых к старым, before_id — id
+    последнего показанного объявления. Ключевые слова ищутся по основе
+    (любая словоформа) или по началу, с исправлением опечаток (см.
+    search.fts_query), без учёта регистра; из SEARCH_RANK_WINDOW самых новых
+    совпадений остаются подходящие под фильтры, упорядоченные по релевантности
+    (bm25), и курсор продолжает тот же порядок. Запрос без слов (одни знаки
+    препинания) ищется подстрокой.
+    """
+    conditions, params = filter_conditions(filters)
+    keyword = filters.get('keyword')
+    if keyword:
+        with database.connect(DB_PATH) as conn:
+            match = search.fts_query(conn, keyword)
+            if match is not None:
+                return [row_to_ad(row) for row in query_ads_fts(conn, match, before_id, limit, conditions, params)]
         pattern = f"%{keyword}%"
-        cursor.execute("""
-            SELECT id, title, description, price, category, district, photo_id, username, age_group, gender, condition
-            FROM ads 
-            WHERE title LIKE ? OR description LIKE ? 
-            ORDER BY id DESC
-        """, (pattern, pattern))
-        rows = cursor.fetchall()
-        ads = []
-        for row in rows:
-            ads.append({
-                'id': row[0],
-                'title': row[1],
-                'description': row[2],
-                'price': row[3],
-                'category': row[4],
-                'district': row[5],
-                'photo': row[6],
-                'username': row[7],
-                'age_group': row[8],
-                'gender': row[9],
-                'condition': row[10]
-            })
-        return ads
+        conditions.append("(ads.title LIKE ? OR ads.description LIKE ?)")
+        params += [pattern, pattern]
+    return query_ads(" AND ".join(conditions) or None, params, before_id, limit)
+
+def search_window_start(conn, match):
+    """id самого старого из SEARCH_RANK_WINDOW новейших совпадений (None — совпадений меньше)."""
+    row = conn.execute(
+        "SELECT rowid FROM ads_fts WHERE ads_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+        (match, SEARCH_RANK_WINDOW - 1),
+    ).fetchone()
+    return row[0] if row else None
+
+def query_ads_fts(conn, match, before_id=None, limit=None, conditions=(), params=()):
+    """Выборка объявлений по запросу MATCH и условиям conditions в порядке релевантности (см. find_ads)."""
+    filters = "".join(f" AND {condition}" for condition in conditions)
+    sql = f"SELECT {AD_COLUMNS_QUALIFIED} FROM ads_fts JOIN ads ON ads.id = ads_fts.rowid WHERE ads_fts MATCH ?{filters}"
+    params = [match, *params]
+    oldest = search_window_start(conn, match)
+    if oldest is not None:
+        sql += " AND ads_fts.rowid >= ?"
+        params.append(oldest)
+    if before_id is not None:
+        row = conn.execute("SELECT rank FROM ads_fts WHERE ads_fts MATCH ? AND rowid = ?", (match, before_id)).fetchone()
+        if row is None:
+            # Объявление-курсор удалено или изменено: продолжаем по id
+            sql += " AND ads.id < ?"
+            params.append(before_id)
+        else:
+            sql += " AND (ads_fts.rank > ? OR (ads_fts.rank = ? AND ads.id < ?))"
+            params += [row[0], row[0], before_id]
+    sql += " ORDER BY ads_fts.rank, ads.id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+def count_facets(filters):
+    """
+    Число объявлений по значениям каждого фасета при фильтрах filters.
+
+    Для фасета учитываются все фильтры, кроме его собственного: пользователь
+    видит, сколько объявлений найдётся, если выбрать другое значение.
+    Возвращает {'total': N, 'category': {значение: число}, ...}; значения
+    без объявлений не попадают в словарь. Числа совпадают с тем, что
+    отдаст find_ads (для ключевых слов — в пределах SEARCH_RANK_WINDOW).
+    """
+    with database.connect(DB_PATH) as conn:
+        base_conditions, base_params = [], []
+        keyword = filters.get('keyword')
+        if keyword:
+            match = search.fts_query(conn, keyword)
+            if match is not None:
+                oldest = search_window_start(conn, match)
+                base_conditions.append("ads.id IN (SELECT rowid FROM ads_fts WHERE ads_fts MATCH ? AND rowid >= ?)")
+                base_params += [match, oldest or 0]
+            else:
+                base_conditions.append("(ads.title LIKE ? OR ads.description LIKE ?)")
+                base_params += [f"%{keyword}%"] * 2
+
+        def query(select, exclude=None):
+            conditions, params = filter_conditions(filters, exclude)
+            source = "ads"
+            if conditions and not keyword:
+                # Счётчик с фильтрами считается по покрывающему индексу фасетов
+                # (участку выбранной категории или целиком), не читая строки
+                # таблицы. Без подсказки планировщик берёт индекс одного фасета
+                # и читает строку каждого подходящего под него объявления.
+                source = "ads INDEXED BY idx_ads_facets"
+            conditions = base_conditions + conditions
+            where = " WHERE " + " AND ".join(conditions) if conditions else ""
+            return conn.execute(f"SELECT {select} FROM {source}{where}" + (f" GROUP BY ads.{exclude}" if exclude else ""),
+                                base_params + params)
+
+        counts = {'total': query("COUNT(*)").fetchone()[0]}
+        for column in FACET_COLUMNS:
+            counts[column] = {value: count for value, count in query(f"ads.{column}, COUNT(*)", column) if value is not None}
+        return counts
 
 def get_user_ads(user_id):
     """Возвращает объявления конкретного пользователя."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, description, price, category, district, age_group, gender, condition, photo_id, username FROM ads WHERE user_id = ? ORDER BY id DESC", (user_id,))
-        rows = cursor.fetchall()
-        ads = []
-        for row in rows:
-            try:
-                ad = {
-                    'id': row[0],
-                    'title': row[1],
-                    'description': row[2],
-                    'price': row[3],
-                    'category': row[4],
-                    'district': row[5],
-                    'age_group': row[6],
-                    'gender': row[7],
-                    'condition': row[8],
-                    'photo': row[9],
-                    'username': row[10]
-                }
-                ads.append(ad)
-            except Exception as e:
-                logging.error(f"Ошибка при обработке объявления: {e}")
-                continue
-        return ads
+    return cached_ads(('user', user_id), "user_id = ?", (user_id,))
+
+def find_duplicate_ad(user_id, title, description):
+    """ID объявления пользователя с тем же названием и описанием (без учёта регистра и пробелов) или None."""
+    key = (moderation.normalize_text(title), moderation.normalize_text(description))
+    with database.connect(DB_PATH) as conn:
+        rows = conn.execute("SELECT id, title, description FROM ads WHERE user_id = ?", (user_id,)).fetchall()
+    for ad_id, ad_title, ad_description in rows:
+        if (moderation.normalize_text(ad_title), moderation.normalize_text(ad_description)) == key:
+            return ad_id
+    return None
 
 def get_ad_by_id(ad_id):
     """Возвращает данные объявления по ID (для редактирования)."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, description, price, category, district, photo_id, user_id, age_group, gender, condition FROM ads WHERE id = ?", (ad_id,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'title': row[1],
-                'description': row[2],
-                'price': row[3],
-                'category': row[4],
-                'district': row[5],
-                'photo': row[6],
-                'user_id': row[7],
-                'age_group': row[8],
-                'gender': row[9],
-                'condition': row[10]
-            }
-        return None
+    return load_ad_records([ad_id]).get(ad_id)
 
 def update_ad_field(ad_id, field, value):
     """Обновляет поле объявления (для редактирования)."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(f"UPDATE ads SET {field} = ? WHERE id = ?", (value, ad_id))
-        conn.commit()
+    def update(conn):
+        cursor = conn.execute(f"UPDATE ads SET {field} = ? WHERE id = ?", (value, ad_id))
+        if field in ('title', 'description'):
+            search.index_ad(conn, ad_id)
         return cursor.rowcount > 0
+    updated = database.write(DB_PATH, update)
+    # Смена категории или района переносит объявление в другие списки
+    ad_cache.invalidate([ad_id], None if field in ('category', 'district', 'user_id') else ())
+    return updated
 
 def update_ad_photo(ad_id, photo_id):
     """Обновляет фото объявления."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE ads SET photo_id = ? WHERE id = ?", (photo_id, ad_id))
-        conn.commit()
-        return cursor.rowcount > 0
+    result = database.execute_write(DB_PATH, "UPDATE ads SET photo_id = ? WHERE id = ?", (photo_id, ad_id))
+    ad_cache.invalidate([ad_id])
+    return result.rowcount > 0
 
 def delete_ad_by_id(ad_id):
-    """Удаляет объявление по ID."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM ads WHERE id = ?", (ad_id,))
-        conn.commit()
-        return cursor.rowcount > 0
+    """Удаляет объявление по ID; удаление его поста из общего чата ставится в outbox той же транзакцией."""
+    def delete(conn):
+        row = conn.execute("""
+            DELETE FROM ads WHERE id = ? RETURNING public_chat_message_id, category, district, user_id
+        """, (ad_id,)).fetchone()
+        if row is not None and row[0]:
+            queue_chat_cleanup(conn, [(ad_id, row[0])])
+        return row
+    row = database.write(DB_PATH, delete)
+    expiry_scheduler.cancel(ad_id)
+    if row is None:
+        return False
+    ad_cache.invalidate([ad_id], ad_groups(*row[1:]))
+    return True
 
 # --- Функции для работы с избранным ---
 def add_favorite(user_id, ad_id):
     """Добавляет объявление в избранное пользователя."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO favorites (user_id, ad_id) VALUES (?, ?)", (user_id, ad_id))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            # Уже в избранном
-            return False
+    try:
+        database.execute_write(DB_PATH, "INSERT INTO favorites (user_id, ad_id) VALUES (?, ?)", (user_id, ad_id))
+        return True
+    except sqlite3.IntegrityError:
+        # Уже в избранном
+        return False
 
 def remove_favorite(user_id, ad_id):
     """Удаляет объявление из избранного пользователя."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM favorites WHERE user_id = ? AND ad_id = ?", (user_id, ad_id))
-        conn.commit()
-        return cursor.rowcount > 0
+    result = database.execute_write(DB_PATH, "DELETE FROM favorites WHERE user_id = ? AND ad_id = ?", (user_id, ad_id))
+    return result.rowcount > 0
 
 def get_user_favorites(user_id):
-    """Возвращает список избранных объявлений пользователя."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT a.id, a.title, a.description, a.price, a.category, a.district, a.photo_id, a.username, a.age_group, a.gender, a.condition
-            FROM ads a
-            JOIN favorites f ON a.id = f.ad_id
-            WHERE f.user_id = ?
-            ORDER BY f.created_at DESC
-        """, (user_id,))
-        rows = cursor.fetchall()
-        ads = []
-        for row in rows:
-            ads.append({
-                'id': row[0],
-                'title': row[1],
-                'description': row[2],
-                'price': row[3],
-                'category': row[4],
-                'district': row[5],
-                'photo': row[6],
-                'username': row[7],
-                'age_group': row[8],
-                'gender': row[9],
-                'condition': row[10]
-            })
-        return ads
+    """Возвращает список избранных объявлений пользователя (последние добавленные первыми)."""
+    with database.connect(DB_PATH) as conn:
+        ad_ids = [row[0] for row in conn.execute(
+            "SELECT ad_id FROM favorites WHERE user_id = ? ORDER BY created_at DESC", (user_id,))]
+    # Объявления берутся из кэша; удалённые пропускаются
+    records = load_ad_records(ad_ids)
+    return [records[ad_id] for ad_id in ad_ids if ad_id in records]
 
 def is_favorite(user_id, ad_id):
     """Проверяет, находится ли объявление в избранном у пользователя."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with database.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT 1 FROM favorites WHERE user_id = ? AND ad_id = ?", (user_id, ad_id))
         return cursor.fetchone() is not None
 
+def get_favorite_ids(user_id, ad_ids):
+    """Возвращает множество id из ad_ids, которые есть в избранном у пользователя (один запрос)."""
+    ad_ids = list(ad_ids)
+    if not ad_ids:
+        return set()
+    placeholders = ", ".join("?" * len(ad_ids))
+    with database.connect(DB_PATH) as conn:
+        cursor = conn.execute(
+            f"SELECT ad_id FROM favorites WHERE user_id = ? AND ad_id IN ({placeholders})",
+            (user_id, *ad_ids),
+        )
+        return {row[0] for row in cursor}
+
 # --- Функции для работы с подписками ---
 def add_subscription(user_id, category):
     """Подписывает пользователя на категорию."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO subscriptions (user_id, category) VALUES (?, ?)", (user_id, category))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            # Уже подписан
-            return False
+    try:
+        database.execute_write(DB_PATH, "INSERT INTO subscriptions (user_id, category) VALUES (?, ?)", (user_id, category))
+        return True
+    except sqlite3.IntegrityError:
+        # Уже подписан
+        return False
 
 def remove_subscription(user_id, category):
     """Отписывает пользователя от категории."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM subscriptions WHERE user_id = ? AND category = ?", (user_id, category))
-        conn.commit()
-        return cursor.rowcount > 0
+    result = database.execute_write(DB_PATH, "DELETE FROM subscriptions WHERE user_id = ? AND category = ?", (user_id, category))
+    return result.rowcount > 0
 
 def get_user_subscriptions(user_id):
     """Возвращает список категорий, на которые подписан пользователь."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with database.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT category FROM subscriptions WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
         rows = cursor.fetchall()
@@ -595,7 +764,7 @@ def get_user_subscriptions(user_id):
 
 def get_subscribers_for_category(category):
     """Возвращает список user_id подписчиков данной категории."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with database.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT user_id FROM subscriptions WHERE category = ?", (category,))
         rows = cursor.fetchall()
@@ -603,79 +772,110 @@ def get_subscribers_for_category(category):
 
 def is_subscribed(user_id, category):
     """Проверяет, подписан ли пользователь на категорию."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with database.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT 1 FROM subscriptions WHERE user_id = ? AND category = ?", (user_id, category))
         return cursor.fetchone() is not None
 
+# --- Функции для работы с рассылками подписчикам ---
+BROADCAST_COLUMNS = "id, category, text, photo_id, author_user_id, last_user_id"
+
+def _create_broadcast(conn, category, text, photo_id=None, author_user_id=None):
+    cursor = conn.execute("""
+        INSERT INTO broadcasts (category, text, photo_id, author_user_id) VALUES (?, ?, ?, ?)
+    """, (category, text, photo_id, author_user_id))
+    return {'id': cursor.lastrowid, 'category': category, 'text': text, 'photo_id': photo_id,
+            'author_user_id': author_user_id, 'last_user_id': 0}
+
+def create_broadcast(category, text, photo_id=None, author_user_id=None):
+    """Сохраняет новую рассылку подписчикам категории и возвращает её как словарь."""
+    return database.write(DB_PATH, _create_broadcast, category, text, photo_id, author_user_id)
+
+def get_pending_broadcasts():
+    """Возвращает незавершённые рассылки (прерванные остановкой бота)."""
+    with database.connect(DB_PATH) as conn:
+        cursor = conn.execute(f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE status = 'pending' ORDER BY id")
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+def get_broadcast_recipients(broadcast, after_user_id, limit):
+    """
+    Следующая порция подписчиков рассылки: user_id больше after_user_id,
+    по возрастанию, без автора и без уже получивших рассылку.
+    """
+    with database.connect(DB_PATH) as conn:
+        cursor = conn.execute("""
+            SELECT s.user_id FROM subscriptions s
+            WHERE s.category = ? AND s.user_id > ? AND s.user_id IS NOT ?
+              AND NOT EXISTS (SELECT 1 FROM broadcast_deliveries d
+                              WHERE d.broadcast_id = ? AND d.user_id = s.user_id)
+            ORDER BY s.user_id
+            LIMIT ?
+        """, (broadcast['category'], after_user_id, broadcast['author_user_id'], broadcast['id'], limit))
+        return [row[0] for row in cursor]
+
+def record_broadcast_delivery(broadcast_id, user_id, status):
+    """Отмечает, что получателю рассылки отправлено сообщение ('sent') или отправить не удалось ('failed')."""
+    database.execute_write(DB_PATH, """
+        INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, status) VALUES (?, ?, ?)
+    """, (broadcast_id, user_id, status))
+
+def advance_broadcast(broadcast_id, last_user_id):
+    """Запоминает, что подписчики до last_user_id включительно обработаны."""
+    database.execute_write(DB_PATH, "UPDATE broadcasts SET last_user_id = ? WHERE id = ?", (last_user_id, broadcast_id))
+
+def _finish_broadcast(conn, broadcast_id):
+    counts = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status", (broadcast_id,)
+    ).fetchall())
+    sent, failed = counts.get('sent', 0), counts.get('failed', 0)
+    conn.execute("""
+        UPDATE broadcasts SET status = 'done', sent_count = ?, failed_count = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (sent, failed, broadcast_id))
+    # Отметки нужны только для продолжения рассылки, итог остаётся в счётчиках
+    conn.execute("DELETE FROM broadcast_deliveries WHERE broadcast_id = ?", (broadcast_id,))
+    return sent, failed
+
+def finish_broadcast(broadcast_id):
+    """Завершает рассылку: сохраняет счётчики и удаляет отметки о доставке. Возвращает (отправлено, ошибок)."""
+    return database.write(DB_PATH, _finish_broadcast, broadcast_id)
+
 # --- Функции для работы с жалобами ---
-async def add_complaint(ad_id, user_id, reason=''):
-    """Добавляет новую жалобу со статусом 'new'. Возвращает id жалобы и отправляет уведомление администратору."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
+def insert_complaint(ad_id, user_id, reason=''):
+    """
+    Сохраняет жалобу со статусом 'new' и ставит уведомление администратору в outbox
+    (одной транзакцией). Возвращает id жалобы.
+    """
+    def insert(conn):
+        complaint_id = conn.execute("""
             INSERT INTO complaints (ad_id, user_id, reason, status)
             VALUES (?, ?, ?, 'new')
-        """, (ad_id, user_id, reason))
-        conn.commit()
-        complaint_id = cursor.lastrowid
-        
-        # Получаем данные объявления для уведомления
-        cursor.execute("""
+        """, (ad_id, user_id, reason)).lastrowid
+        # Данные объявления для уведомления
+        row = conn.execute("""
             SELECT a.title, a.description, a.price, a.category, a.username, a.user_id
             FROM ads a WHERE a.id = ?
-        """, (ad_id,))
-        row = cursor.fetchone()
-        
+        """, (ad_id,)).fetchone()
         if row:
             ad_title, ad_description, ad_price, ad_category, ad_username, ad_user_id = row
-            
-            # Формируем текст уведомления
-            text = (
-                f"⚠️ *Новая жалоба*\n\n"
-                f"🆔 Жалоба #{complaint_id}\n"
-                f"📌 Объявление #{ad_id}\n"
-                f"👤 Автор объявления: @{ad_username} (id: {ad_user_id})\n"
-                f"👤 Пожаловался пользователь: id {user_id}\n"
-                f"📝 Причина: {reason}\n"
-                f"🕐 Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                f"📌 *Объявление:*\n"
-                f"<b>{ad_title}</b>\n"
-                f"{ad_description}\n"
-                f"💰 {ad_price} руб.\n"
-                f"🏷️ Категория: {ad_category}"
-            )
-            
-            # Создаём inline-клавиатуру для админа
-            keyboard = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(text="✅ Пометить решённой", callback_data=f"resolve_complaint_{complaint_id}"),
-                        InlineKeyboardButton(text="❌ Удалить объявление", callback_data=f"delete_ad_from_complaint_{ad_id}_{complaint_id}")
-                    ],
-                    [
-                        InlineKeyboardButton(text="⏳ Оставить", callback_data=f"ignore_complaint_{complaint_id}")
-                    ]
-                ]
-            )
-            
-            try:
-                # Отправляем уведомление админу
-                await bot.send_message(
-                    chat_id=ADMIN_ID,
-                    text=text,
-                    parse_mode='HTML',
-                    reply_markup=keyboard
-                )
-                logging.info(f"Уведомление о жалобе #{complaint_id} отправлено администратору")
-            except Exception as e:
-                logging.error(f"Ошибка отправки уведомления админу: {e}")
-        
+            text = rendering.complaint_alert(
+                complaint_id, ad_id, ad_username, ad_user_id, user_id, reason,
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'), ad_title, ad_description, ad_price, ad_category)
+            outbox.enqueue(conn, f"complaint:{complaint_id}", 'complaint',
+                           {'complaint_id': complaint_id, 'ad_id': ad_id, 'text': text})
         return complaint_id
+    return database.write(DB_PATH, insert)
+
+async def add_complaint(ad_id, user_id, reason=''):
+    """Добавляет новую жалобу со статусом 'new'. Возвращает id жалобы; уведомление администратору доставляет outbox."""
+    complaint_id = await database.run(insert_complaint, ad_id, user_id, reason)
+    outbox_worker.wake()
+    return complaint_id
 
 def get_new_complaints(limit=10):
     """Возвращает список последних нерассмотренных жалоб (для админа)."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with database.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT c.id, c.ad_id, c.user_id, c.reason, c.created_at, 
@@ -705,7 +905,7 @@ def get_new_complaints(limit=10):
 
 def get_complaint_by_id(complaint_id):
     """Получить данные конкретной жалобы."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with database.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT c.id, c.ad_id, c.user_id, c.reason, c.status, c.created_at,
@@ -733,23 +933,17 @@ def get_complaint_by_id(complaint_id):
 
 def resolve_complaint(complaint_id):
     """Меняет статус жалобы на 'resolved'."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE complaints SET status = 'resolved' WHERE id = ?", (complaint_id,))
-        conn.commit()
-        return cursor.rowcount > 0
+    result = database.execute_write(DB_PATH, "UPDATE complaints SET status = 'resolved' WHERE id = ?", (complaint_id,))
+    return result.rowcount > 0
 
 def delete_complaint(complaint_id):
     """Полностью удаляет жалобу."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM complaints WHERE id = ?", (complaint_id,))
-        conn.commit()
-        return cursor.rowcount > 0
+    result = database.execute_write(DB_PATH, "DELETE FROM complaints WHERE id = ?", (complaint_id,))
+    return result.rowcount > 0
 
 def get_complaints_for_ad(ad_id):
     """Все жалобы на конкретное объявление (для админа)."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with database.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT c.id, c.user_id, c.reason, c.status, c.created_at
@@ -772,7 +966,7 @@ def get_complaints_for_ad(ad_id):
 # --- Статистика для админа ---
 def get_stats():
     """Возвращает словарь со статистикой."""
-    with sqlite3.connect(DB_PATH) as conn:
+    with database.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         # Общее количество объявлений
         cursor.execute("SELECT COUNT(*) FROM ads")
@@ -793,38 +987,105 @@ def get_stats():
             'last_ads': last_ads
         }
 
-# Инициализируем БД при запуске
-init_db()
+def set_public_chat_message_id(ad_id, message_id):
+    """Сохраняет ID сообщения объявления в общем чате."""
+    result = database.execute_write(DB_PATH, "UPDATE ads SET public_chat_message_id = ? WHERE id = ?", (message_id, ad_id))
+    return result.rowcount > 0
+
+# Сколько сообщений Telegram удаляет одним запросом deleteMessages
+CHAT_CLEANUP_BATCH = 100
+
+def queue_chat_cleanup(conn, posts):
+    """
+    Ставит в outbox удаление постов удалённых объявлений из общего чата.
+
+    posts — [(id объявления, message_id)]; посты удаляются пачками по
+    CHAT_CLEANUP_BATCH (запрос deleteMessages). Ключ — id первого объявления
+    пачки: объявление удаляется один раз, поэтому ключи не повторяются.
+    """
+    if not CHAT_ID:
+        return
+    for i in range(0, len(posts), CHAT_CLEANUP_BATCH):
+        chunk = posts[i:i + CHAT_CLEANUP_BATCH]
+        outbox.enqueue(conn, f"chat_cleanup:{chunk[0][0]}", 'chat_cleanup',
+                       {'message_ids': [message_id for _, message_id in chunk]})
+
+def get_public_chat_message_id(ad_id):
+    """Возвращает ID сообщения объявления в общем чате (или None)."""
+    with database.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT public_chat_message_id FROM ads WHERE id = ?", (ad_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+# --- Асинхронные обёртки: запросы выполняются в пуле потоков БД, не блокируя цикл событий ---
+add_ad_to_db_async = database.awaitable(add_ad_to_db)
+extend_ad_expiration_async = database.awaitable(extend_ad_expiration)
+get_expiring_ads_async = database.awaitable(get_expiring_ads)
+queue_expiry_digests_async = database.awaitable(queue_expiry_digests)
+extend_warned_ads_async = database.awaitable(extend_warned_ads)
+delete_expired_ads_async = database.awaitable(delete_expired_ads)
+publish_ad_async = database.awaitable(publish_ad)
+submit_pending_ad_async = database.awaitable(submit_pending_ad)
+get_pending_ad_async = database.awaitable(get_pending_ad)
+get_pending_ad_ids_async = database.awaitable(get_pending_ad_ids)
+approve_pending_ad_async = database.awaitable(approve_pending_ad)
+reject_pending_ad_async = database.awaitable(reject_pending_ad)
+delete_ad_by_id_async = database.awaitable(delete_ad_by_id)
+get_all_ads_async = database.awaitable(get_all_ads)
+get_ads_by_category_async = database.awaitable(get_ads_by_category)
+get_ads_by_district_async = database.awaitable(get_ads_by_district)
+search_ads_async = database.awaitable(search_ads)
+find_ads_async = database.awaitable(find_ads)
+count_facets_async = database.awaitable(count_facets)
+get_user_ads_async = database.awaitable(get_user_ads)
+get_ad_by_id_async = database.awaitable(get_ad_by_id)
+update_ad_field_async = database.awaitable(update_ad_field)
+update_ad_photo_async = database.awaitable(update_ad_photo)
+add_favorite_async = database.awaitable(add_favorite)
+remove_favorite_async = database.awaitable(remove_favorite)
+get_user_favorites_async = database.awaitable(get_user_favorites)
+get_favorite_ids_async = database.awaitable(get_favorite_ids)
+add_subscription_async = database.awaitable(add_subscription)
+remove_subscription_async = database.awaitable(remove_subscription)
+get_user_subscriptions_async = database.awaitable(get_user_subscriptions)
+get_subscribers_for_category_async = database.awaitable(get_subscribers_for_category)
+is_subscribed_async = database.awaitable(is_subscribed)
+get_pending_broadcasts_async = database.awaitable(get_pending_broadcasts)
+get_broadcast_recipients_async = database.awaitable(get_broadcast_recipients)
+record_broadcast_delivery_async = database.awaitable(record_broadcast_delivery)
+advance_broadcast_async = database.awaitable(advance_broadcast)
+finish_broadcast_async = database.awaitable(finish_broadcast)
+get_new_complaints_async = database.awaitable(get_new_complaints)
+get_complaint_by_id_async = database.awaitable(get_complaint_by_id)
+resolve_complaint_async = database.awaitable(resolve_complaint)
+delete_complaint_async = database.awaitable(delete_complaint)
+get_complaints_for_ad_async = database.awaitable(get_complaints_for_ad)
+get_stats_async = database.awaitable(get_stats)
+find_duplicate_ad_async = database.awaitable(find_duplicate_ad)
+set_public_chat_message_id_async = database.awaitable(set_public_chat_message_id)
+get_public_chat_message_id_async = database.awaitable(get_public_chat_message_id)
 
 # --- Функция AI-модерации через DeepSeek ---
-async def moderate_with_deepseek(text: str) -> bool:
-    """Возвращает True, если объявление чистое, иначе False."""
-    logging.info(f"Отправка текста на модерацию: {text[:50]}...")
-    try:
-        response = openai.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "Ты модератор доски объявлений. Определи, содержит ли текст спам, нецензурную лексику, оскорбления или явное мошенничество. Если текст — обычное объявление о продаже товара (даже с ошибками или неполное), ответь 'ok'. Если есть явные нарушения, ответь 'fail'. Отвечай только одним словом."},
-                {"role": "user", "content": text}
-            ],
-            temperature=0.1,
-            max_tokens=20
-        )
-        full_answer = response.choices[0].message.content
-        result = full_answer.strip().lower()
-        first_word = result.split()[0] if result else ""
-        first_word = first_word.rstrip('.,!?;:')
-        logging.info(f"DeepSeek ответил: {result}, первое слово: {first_word}")
-        return first_word == "ok"
-    except Exception as e:
-        logging.error(f"Ошибка DeepSeek API: {e}")
-        return False
+# Общий асинхронный клиент: keep-alive соединение, тайм-аут, предел параллелизма и размыкатель цепи.
+# Очевидные случаи решает локальный фильтр, вердикты модели кэшируются (повторная
+# подача того же текста не ждёт ответа API), тексты, пришедшие вместе, уходят одним запросом
+moderator = moderation.ModerationClient(DEEPSEEK_API_KEY, cache=moderation.VerdictCache(lambda: DB_PATH),
+                                        prefilter=prefilter.PreFilter(), batch_window=moderation.BATCH_WINDOW)
+
+async def moderate_with_deepseek(text: str) -> bool | None:
+    """True, если объявление чистое, False — если нет, None — если вердикта нет (API временно недоступен)."""
+    return await moderator.moderate(text)
+
+def moderation_text(title, description, price):
+    """Текст объявления, который отправляется на модерацию."""
+    return f"{title}\n{description}\nЦена: {price}"
 
 # --- Клавиатуры ---
 def get_main_keyboard(user_id=None):
     """Главное меню с кнопками команд.""" 
     keyboard_buttons = [
-        [KeyboardButton(text="📋 Список объявлений")],
+        [KeyboardButton(text="📋 Список объявлений"), KeyboardButton(text="🎛 Фильтры")],
         [KeyboardButton(text="➕ Добавить объявление")],
         [KeyboardButton(text="📁 Категории"), KeyboardButton(text="👤 Мои объявления")],
         [KeyboardButton(text="🔍 Поиск"), KeyboardButton(text="⭐ Избранное")],
@@ -850,39 +1111,144 @@ def get_search_keyboard():
     )
     return keyboard
 
-def get_favorite_keyboard(user_id, ad_id):
-    """Создаёт inline-клавиатуру с кнопкой избранного и жалобы."""
-    is_fav = is_favorite(user_id, ad_id)
-    if is_fav:
-        fav_button = InlineKeyboardButton(text="✅ В избранном", callback_data=f"fav_remove_{ad_id}")
-    else:
-        fav_button = InlineKeyboardButton(text="⭐ В избранное", callback_data=f"fav_add_{ad_id}")
+def get_favorite_keyboard(user_id, ad_id, is_fav=None):
+    """
+    Создаёт inline-клавиатуру с кнопкой избранного и жалобы.
+
+    is_fav — уже известный статус избранного (например, из get_favorite_ids()
+    для целой страницы); если не передан, он запрашивается из БД.
+    """
+    if is_fav is None:
+        is_fav = is_favorite(user_id, ad_id)
+    fav_button = favorite_button(ad_id, is_fav)
     
     complaint_button = InlineKeyboardButton(text="⚠️ Пожаловаться", callback_data=f"complaint_{ad_id}")
     
     return InlineKeyboardMarkup(inline_keyboard=[[fav_button, complaint_button]])
 
+def favorite_button(ad_id, is_fav, number=None):
+    """Кнопка избранного; с number — короткая кнопка нумерованной клавиатуры альбома."""
+    if number is None:
+        text = "✅ В избранном" if is_fav else "⭐ В избранное"
+    else:
+        text = f"{'✅' if is_fav else '⭐'} {number}"
+    return InlineKeyboardButton(text=text, callback_data=f"fav_remove_{ad_id}" if is_fav else f"fav_add_{ad_id}")
+
+def toggle_favorite_button(markup, ad_id, is_fav):
+    """
+    Клавиатура markup, в которой кнопка избранного объявления ad_id показывает
+    новое состояние is_fav; остальные кнопки и номер кнопки в клавиатуре
+    альбома не меняются. None — такой кнопки в markup нет.
+    """
+    targets = {f"fav_add_{ad_id}", f"fav_remove_{ad_id}"}
+    found = False
+    rows = []
+    for row in getattr(markup, 'inline_keyboard', None) or []:
+        buttons = []
+        for button in row:
+            if button.callback_data in targets:
+                number = button.text.split()[-1]
+                button = favorite_button(ad_id, is_fav, int(number) if number.isdigit() else None)
+                found = True
+            buttons.append(button)
+        rows.append(buttons)
+    return InlineKeyboardMarkup(inline_keyboard=rows) if found else None
+
+async def update_favorite_button(callback, ad_id, is_fav):
+    """Перерисовывает на месте кнопку избранного в сообщении, из которого она нажата."""
+    markup = toggle_favorite_button(callback.message.reply_markup, ad_id, is_fav)
+    if markup is None:
+        return
+    try:
+        await callback.message.edit_reply_markup(reply_markup=markup)
+    except Exception as e:
+        logging.warning(f"Не удалось обновить кнопку избранного: {e}")
+
 def format_ad_text(ad):
-    """Форматирует текст объявления с учётом новых полей."""
-    text = f"<b>{ad['title']}</b> [{ad['category']}]\n{ad['description']}\n💰 {ad['price']} руб.\n👤 @{ad['username']}"
-    
-    # Добавляем информацию о районе, если она есть
-    if ad.get('district'):
-        text += f"\n📍 Район: {ad['district']}"
-    
-    # Добавляем возрастную группу, если она есть
-    if ad.get('age_group'):
-        text += f"\n👶 Возраст: {ad['age_group']}"
-    
-    # Добавляем пол, если он есть
-    if ad.get('gender'):
-        text += f"\n🚻 Пол: {ad['gender']}"
-    
-    # Добавляем состояние, если оно есть
-    if ad.get('condition'):
-        text += f"\n📦 Состояние: {ad['condition']}"
-    
-    return text
+    """Карточка объявления (adrecord.Ad или словарь с теми же ключами), см. rendering.ad_card."""
+    if isinstance(ad, dict):
+        ad = adrecord.Ad.from_dict(ad)
+    return rendering.ad_card(ad)
+
+# Сколько объявлений показывать за раз; остальные — по кнопке «▶ Ещё»
+PAGE_SIZE = 10
+
+# Альбом (sendMediaGroup) — от 2 до 10 фото
+ALBUM_MIN = 2
+ALBUM_MAX = 10
+
+def album_keyboard(album, favorite_ids, more_callback=None):
+    """
+    Нумерованная клавиатура к альбому: избранное и жалоба для каждого фото
+    (номер — как в подписи), по два объявления в ряду, и «▶ Ещё», если есть
+    следующая страница.
+    """
+    rows = []
+    for number, ad in enumerate(album, 1):
+        buttons = [favorite_button(ad.id, ad.id in favorite_ids, number),
+                   InlineKeyboardButton(text=f"⚠️ {number}", callback_data=f"complaint_{ad.id}")]
+        if number % 2 == 0:
+            rows[-1].extend(buttons)
+        else:
+            rows.append(buttons)
+    if more_callback:
+        rows.append([InlineKeyboardButton(text="▶ Ещё", callback_data=more_callback)])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def without_more_button(markup):
+    """Клавиатура markup без ряда с кнопкой «▶ Ещё» (None, если других кнопок нет)."""
+    rows = [row for row in getattr(markup, 'inline_keyboard', None) or []
+            if not any((button.callback_data or "").startswith("more_") for button in row)]
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+async def send_ads_page(message, user_id, ads, more_callback):
+    """
+    Отправляет страницу объявлений с кнопками избранного.
+
+    ads выбираются с limit=PAGE_SIZE + 1: лишнее объявление не показывается,
+    а только означает, что есть следующая страница. Тогда в конце отправляется
+    кнопка «▶ Ещё» с callback_data more_callback + id последнего показанного
+    объявления. Возвращает True, если следующая страница есть.
+
+    В режиме LISTING_MODE='album' фото-объявления страницы (если их не меньше
+    ALBUM_MIN) отправляются после остальных одним альбомом с пронумерованными
+    подписями, а кнопки избранного, жалоб и «▶ Ещё» — одним сообщением с
+    album_keyboard: два запроса к Telegram вместо запроса на объявление.
+    """
+    page = ads[:PAGE_SIZE]
+    more = f"{more_callback}{page[-1].id}" if len(ads) > PAGE_SIZE else None
+    # Статус избранного для всей страницы — одним запросом, а не по запросу на объявление
+    favorite_ids = await get_favorite_ids_async(user_id, [ad.id for ad in page])
+    album = [ad for ad in page if ad.photo] if LISTING_MODE == 'album' else []
+    if len(album) < ALBUM_MIN:
+        album = []
+    album_ids = {ad.id for ad in album}
+    for ad in page:
+        if ad.id in album_ids:
+            continue
+        text = format_ad_text(ad)
+        keyboard = get_favorite_keyboard(user_id, ad.id, ad.id in favorite_ids)
+        if ad.photo:
+            await message.answer_photo(photo=ad.photo, caption=text, parse_mode='HTML', reply_markup=keyboard)
+        else:
+            await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
+    if album:
+        # Альбомы поровну, чтобы последний не остался из одного фото
+        size = -(-len(album) // -(-len(album) // ALBUM_MAX))
+        for start in range(0, len(album), size):
+            await message.answer_media_group(media=[
+                InputMediaPhoto(media=ad.photo, caption=rendering.numbered_card(ad, number), parse_mode='HTML')
+                for number, ad in enumerate(album[start:start + size], start + 1)
+            ])
+        await message.answer(f"Показано {len(page)} объявлений. Кнопки ⭐ и ⚠️ — по номеру фото.",
+                             reply_markup=album_keyboard(album, favorite_ids, more))
+        return more is not None
+    if more is None:
+        return False
+    builder = InlineKeyboardBuilder()
+    builder.button(text="▶ Ещё", callback_data=more)
+    await message.answer(f"Показано {len(page)} объявлений.", reply_markup=builder.as_markup())
+    return True
 
 # --- Состояния FSM для добавления ---
 class AddAd(StatesGroup):
@@ -903,9 +1269,8 @@ async def process_category(callback: types.CallbackQuery, state: FSMContext):
     await state.update_data(category=category)
     await callback.message.edit_reply_markup(reply_markup=None)
     # Показываем inline-кнопки для выбора возрастной группы
-    age_groups = ["0–3 мес", "3–12 мес", "1–3 года", "3–7 лет", "7–12 лет"]
     builder = InlineKeyboardBuilder()
-    for age in age_groups:
+    for age in AGE_GROUPS:
         builder.button(text=age, callback_data=f"age_{age}")
     builder.adjust(1)
     await callback.message.answer("Выберите возрастную группу:", reply_markup=builder.as_markup())
@@ -920,9 +1285,8 @@ async def process_age(callback: types.CallbackQuery, state: FSMContext):
     await state.update_data(age_group=age)
     await callback.message.edit_reply_markup(reply_markup=None)
     # Показываем inline-кнопки для выбора пола
-    gender_options = ["👧 Девочка", "👦 Мальчик", "👪 Унисекс"]
     builder = InlineKeyboardBuilder()
-    for gender in gender_options:
+    for gender in GENDERS:
         builder.button(text=gender, callback_data=f"gender_{gender}")
     builder.adjust(1)
     await callback.message.answer("Выберите пол:", reply_markup=builder.as_markup())
@@ -937,9 +1301,8 @@ async def process_gender(callback: types.CallbackQuery, state: FSMContext):
     await state.update_data(gender=gender)
     await callback.message.edit_reply_markup(reply_markup=None)
     # Показываем inline-кнопки для выбора состояния
-    condition_options = ["🆕 Новое", "✨ Как новое", "🔄 Б/у", "🔧 Требует ремонта"]
     builder = InlineKeyboardBuilder()
-    for cond in condition_options:
+    for cond in CONDITIONS:
         builder.button(text=cond, callback_data=f"cond_{cond}")
     builder.adjust(1)
     await callback.message.answer("Выберите состояние:", reply_markup=builder.as_markup())
@@ -1002,14 +1365,10 @@ async def process_favorite_add(callback: types.CallbackQuery, state: FSMContext)
         ad_id = int(callback.data.replace('fav_add_', ''))
         user_id = callback.from_user.id
         
-        # Проверяем, уже ли в избранном
-        if is_favorite(user_id, ad_id):
-            await callback.answer("✅ Уже в избранном")
-            return
-        
-        # Добавляем в избранное
-        success = add_favorite(user_id, ad_id)
+        # Добавляем в избранное; повтор отсекает UNIQUE(user_id, ad_id)
+        success = await add_favorite_async(user_id, ad_id)
         if success:
+            await update_favorite_button(callback, ad_id, True)
             await callback.answer("⭐ Добавлено в избранное", show_alert=True)
         else:
             await callback.answer("✅ Уже в избранном")
@@ -1036,6 +1395,91 @@ class EditAd(StatesGroup):
 class SearchState(StatesGroup):
     waiting_for_query = State()
 
+# --- Состояния для фильтров (выбранные фильтры лежат в данных FSM под ключом filters) ---
+class FilterState(StatesGroup):
+    choosing = State()
+    waiting_for_price = State()
+    waiting_for_keyword = State()
+
+# Фасеты в панели фильтров: код в callback_data → (поле, значения, подпись).
+# В callback_data передаётся номер значения: названия длинные для 64 байт
+FILTER_FACETS = {
+    'cat': ('category', CATEGORIES, "📁 Категория"),
+    'dist': ('district', YAKUTSK_DISTRICTS, "📍 Район"),
+    'age': ('age_group', AGE_GROUPS, "👶 Возраст"),
+    'gender': ('gender', GENDERS, "🚻 Пол"),
+    'cond': ('condition', CONDITIONS, "📦 Состояние"),
+}
+
+def format_price_range(filters):
+    """Диапазон цен из фильтров в виде текста."""
+    low, high = filters.get('price_min'), filters.get('price_max')
+    if low is not None and high is not None:
+        return f"{low}–{high} руб."
+    if low is not None:
+        return f"от {low} руб."
+    if high is not None:
+        return f"до {high} руб."
+    return "не важно"
+
+def parse_price_range(text):
+    """
+    Разбирает диапазон цен: «1000-5000», «от 1000», «до 5000» или «5000» (до).
+
+    Возвращает (price_min, price_max), где отсутствующая граница — None,
+    или None, если в тексте нет чисел.
+    """
+    # «1 000» — одно число
+    text = re.sub(r"(?<=\d)\s+(?=\d)", "", text.lower()).strip()
+    numbers = [int(number) for number in re.findall(r"\d+", text)]
+    if len(numbers) == 2:
+        return min(numbers), max(numbers)
+    if len(numbers) == 1:
+        return (numbers[0], None) if text.startswith("от") else (None, numbers[0])
+    return None
+
+def get_filter_panel(filters, counts):
+    """Текст и inline-клавиатура панели фильтров; counts — результат count_facets()."""
+    lines = ["🎛 Фильтры объявлений"]
+    builder = InlineKeyboardBuilder()
+    for code, (column, _, label) in FILTER_FACETS.items():
+        lines.append(f"{label}: {filters.get(column) or 'не важно'}")
+        builder.button(text=label, callback_data=f"flt_{code}")
+    lines.append(f"💰 Цена: {format_price_range(filters)}")
+    builder.button(text="💰 Цена", callback_data="flt_price")
+    lines.append(f"🔤 Слова: {filters.get('keyword') or 'не важно'}")
+    builder.button(text="🔤 Слова", callback_data="flt_kw")
+    builder.adjust(2)
+    builder.row(
+        InlineKeyboardButton(text=f"🔍 Показать ({counts['total']})", callback_data="flt_show"),
+        InlineKeyboardButton(text="♻️ Сбросить", callback_data="flt_reset"),
+    )
+    lines.append(f"\nНайдено объявлений: {counts['total']}")
+    return "\n".join(lines), builder.as_markup()
+
+def get_facet_keyboard(code, filters, counts):
+    """Значения фасета с числом объявлений при остальных фильтрах (пустые значения скрыты)."""
+    column, values, _ = FILTER_FACETS[code]
+    builder = InlineKeyboardBuilder()
+    for i, value in enumerate(values):
+        count = counts[column].get(value, 0)
+        selected = filters.get(column) == value
+        if count or selected:
+            builder.button(text=f"{'✅ ' if selected else ''}{value} ({count})", callback_data=f"fltset_{code}_{i}")
+    builder.button(text="Не важно", callback_data=f"fltset_{code}_any")
+    builder.button(text="⬅ Назад", callback_data="flt_back")
+    builder.adjust(1)
+    return builder.as_markup()
+
+async def send_filter_panel(message, filters, edit=False):
+    """Показывает панель фильтров новым сообщением или вместо message (edit=True)."""
+    counts = await count_facets_async(filters)
+    text, keyboard = get_filter_panel(filters, counts)
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard)
+    else:
+        await message.answer(text, reply_markup=keyboard)
+
 # --- Состояния для поддержки ---
 class Support(StatesGroup):
     waiting_for_message = State()   # пользователь пишет сообщение админу
@@ -1166,28 +1610,50 @@ async def cmd_start(message: types.Message, state: FSMContext):
 async def cmd_extend(message: types.Message, state: FSMContext):
     """Показывает список объявлений пользователя для продления."""
     await state.clear()
-    user_ads = get_user_ads(message.from_user.id)
+    user_ads = await get_user_ads_async(message.from_user.id)
     if not user_ads:
         await message.answer("📭 У вас пока нет объявлений для продления.", reply_markup=get_main_keyboard())
         return
     
-    # Создаём inline-кнопки для выбора объявления
+    await message.answer("Выберите объявление для продления на 7 дней:", reply_markup=extend_choice_keyboard(user_ads))
+
+def extend_choice_keyboard(user_ads):
+    """Inline-кнопки выбора объявления для продления."""
     builder = InlineKeyboardBuilder()
     for ad in user_ads:
-        title_preview = ad['title'][:30] + "..." if len(ad['title']) > 30 else ad['title']
+        title_preview = ad.title[:30] + "..." if len(ad.title) > 30 else ad.title
         builder.button(
-            text=f"{title_preview} — {ad['price']} руб.",
-            callback_data=f"extend_ad_{ad['id']}"
+            text=f"{title_preview} — {ad.price} руб.",
+            callback_data=f"extend_ad_{ad.id}"
         )
     builder.adjust(1)
-    
-    await message.answer("Выберите объявление для продления на 7 дней:", reply_markup=builder.as_markup())
+    return builder.as_markup()
+
+@dp.callback_query(lambda c: c.data == "extend_all")
+async def handle_extend_all(callback: types.CallbackQuery):
+    """Кнопка «Продлить все» в напоминании: продлевает все объявления, о которых пришли напоминания."""
+    count = await extend_warned_ads_async(callback.from_user.id)
+    if count:
+        await callback.message.edit_text(f"✅ Продлено объявлений: {count}. Они будут опубликованы ещё 7 дней.", reply_markup=None)
+    else:
+        await callback.message.edit_text("ℹ️ Объявлений, ожидающих продления, нет.", reply_markup=None)
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data == "extend_choose")
+async def handle_extend_choose(callback: types.CallbackQuery):
+    """Кнопка «Выбрать» в напоминании: список объявлений, как в /extend."""
+    user_ads = await get_user_ads_async(callback.from_user.id)
+    if not user_ads:
+        await callback.answer("📭 У вас пока нет объявлений для продления.")
+        return
+    await callback.message.answer("Выберите объявление для продления на 7 дней:", reply_markup=extend_choice_keyboard(user_ads))
+    await callback.answer()
 
 @dp.callback_query(lambda c: c.data and c.data.startswith("extend_ad_"))
 async def handle_extend_ad(callback: types.CallbackQuery):
     """Обработчик выбора объявления для продления."""
     ad_id = int(callback.data.replace("extend_ad_", ""))
-    ad_data = get_ad_by_id(ad_id)
+    ad_data = await get_ad_by_id_async(ad_id)
     
     if not ad_data:
         await callback.answer("❌ Объявление не найдено.")
@@ -1198,7 +1664,7 @@ async def handle_extend_ad(callback: types.CallbackQuery):
         return
     
     # Продлеваем объявление
-    success = extend_ad_expiration(ad_id)
+    success = await extend_ad_expiration_async(ad_id)
     if success:
         await callback.message.edit_text(
             f"✅ Объявление «{ad_data['title']}» продлено на 7 дней.\n"
@@ -1213,13 +1679,10 @@ async def handle_extend_ad(callback: types.CallbackQuery):
     
     await callback.answer()
 
-# --- Функция для отправки уведомлений ---
-async def send_notification(ad, notif_type):
-    """Отправляет уведомление пользователю о скором удалении объявления."""
-    user_id = ad['user_id']
-    title = ad['title']
-    
-    # Текст уведомления в зависимости от типа
+# --- Тексты напоминаний об удалении ---
+def expiry_notice_text(title, notif_type):
+    """Текст напоминания автору о скором удалении объявления (HTML, название экранируется)."""
+    title = rendering.escape(title)
     if notif_type == '1d':
         text = (
             f"⏰ Напоминание: ваше объявление «{title}» будет удалено через 1 день.\n"
@@ -1242,53 +1705,97 @@ async def send_notification(ad, notif_type):
         )
     else:
         text = f"⏰ Напоминание: ваше объявление «{title}» будет удалено."
-    
-    try:
-        await bot.send_message(user_id, text, parse_mode='HTML')
-        logging.info(f"Уведомление {notif_type} отправлено пользователю {user_id} для объявления {ad['id']}")
-        return True
-    except Exception as e:
-        logging.error(f"Ошибка отправки уведомления {notif_type} пользователю {user_id}: {e}")
-        return False
+    return text
 
-# --- Функция для автоматического удаления ---
-async def auto_delete_expired_ads():
-    """Проверяет и удаляет просроченные объявления, отправляет уведомления."""
-    ads_to_notify = get_ads_needing_notifications()
-    
-    for ad in ads_to_notify:
-        ad_id = ad['id']
-        notif_type = ad['type']
-        
+# Сроки в сводке напоминаний по типу уведомления
+NOTICE_DEADLINES = {'1d': "через 1 день", '12h': "через 12 часов", '6h': "через 6 часов", '1h': "через 1 час"}
+
+def expiry_digest_text(notices):
+    """Текст напоминания автору: одно объявление — как expiry_notice_text, несколько — списком."""
+    if len(notices) == 1:
+        return expiry_notice_text(notices[0]['title'], notices[0]['type'])
+    lines = [f"• «{rendering.escape(notice['title'])}» — {NOTICE_DEADLINES[notice['type']]}" for notice in notices]
+    return (
+        f"⏰ Напоминание: скоро будут удалены ваши объявления ({len(notices)}):\n"
+        + "\n".join(lines)
+        + "\n\nПродлите их на 7 дней кнопками ниже или командой /extend."
+    )
+
+# --- Удаление просроченных объявлений и напоминания ---
+# Через сколько повторить событие, обработка которого не удалась
+EXPIRY_RETRY = timedelta(minutes=1)
+# На сколько вперёд планировщик загружает сроки из БД (загрузка повторяется вдвое чаще)
+EXPIRY_HORIZON = timedelta(days=1)
+# Ключ события планировщика «загрузить следующее окно сроков»
+EXPIRY_RELOAD = 'reload'
+# Напоминания, наступающие в ближайшие EXPIRY_COALESCE, отправляются вместе с созревшими:
+# автор получает одну сводку вместо сообщения на каждое объявление
+EXPIRY_COALESCE = timedelta(minutes=10)
+
+async def auto_delete_expired_ads(horizon=timedelta(0)):
+    """
+    Удаляет просроченные объявления и ставит созревшие напоминания в outbox.
+    Следующие события объявлений, наступающие в пределах horizon, передаются
+    планировщику.
+    """
+    await process_expiring_ads(await get_expiring_ads_async(horizon=max(horizon, EXPIRY_COALESCE)))
+
+async def process_expiring_ads(ads):
+    """Обрабатывает созревшие события объявлений и планирует их следующие события."""
+    now = datetime.now()
+    events, expired = [], []
+    for ad in ads:
+        notif_type = expiry_event(ad, now, EXPIRY_COALESCE)
         if notif_type == '7d_delete':
-            # Удаляем объявление
-            success = delete_ad_by_id(ad_id)
-            if success:
-                # Отправляем уведомление автору
-                try:
-                    await bot.send_message(
-                        ad['user_id'],
-                        f"❌ Ваше объявление «{ad['title']}» удалено по истечении 7 дней.",
-                        parse_mode='HTML'
-                    )
-                    logging.info(f"Объявление {ad_id} удалено, уведомление отправлено автору {ad['user_id']}")
-                except Exception as e:
-                    logging.error(f"Ошибка отправки уведомления об удалении автору {ad['user_id']}: {e}")
+            expired.append(ad['id'])
+        elif notif_type:
+            events.append(dict(ad, type=notif_type))
+    failed = set()
+    # Номер следующего события после обработанного
+    next_stages = {}
+    if events:
+        # Напоминания группируются по авторам: одна сводка и одна транзакция на все
+        try:
+            marked = await queue_expiry_digests_async(events)
+            logging.info(f"Поставлено напоминаний: {len(marked)}, авторов: {len({event['user_id'] for event in events})}")
+            next_stages.update((event['id'], NOTICE_STAGES[event['type']] + 1) for event in events)
+        except Exception as e:
+            logging.error(f"Ошибка постановки напоминаний: {e}")
+            failed.update(event['id'] for event in events)
+    if expired:
+        # Просроченные объявления удаляются все сразу, одной транзакцией
+        try:
+            deleted = await delete_expired_ads_async(expired)
+            logging.info(f"Удалено просроченных объявлений: {len(deleted)}, уведомления авторам поставлены в outbox")
+            next_stages.update((ad_id, len(EXPIRY_STAGES)) for ad_id in expired)
+        except Exception as e:
+            logging.error(f"Ошибка удаления просроченных объявлений: {e}")
+            failed.update(expired)
+    for ad in ads:
+        if ad['id'] in failed:
+            expiry_scheduler.schedule(ad['id'], (now + EXPIRY_RETRY).timestamp())
         else:
-            # Отправляем уведомление
-            sent = await send_notification(ad, notif_type)
-            if sent:
-                # Отмечаем, что уведомление отправлено
-                mark_notification_sent(ad_id, notif_type)
+            schedule_expiry(dict(ad, next_notice_stage=next_stages.get(ad['id'], ad['next_notice_stage'])))
+    if events or expired:
+        outbox_worker.wake()
+
+async def handle_expiry_events(keys):
+    """Обработчик планировщика: созревшие события объявлений и загрузка следующего окна сроков."""
+    if EXPIRY_RELOAD in keys:
+        expiry_scheduler.schedule(EXPIRY_RELOAD, (datetime.now() + EXPIRY_HORIZON / 2).timestamp())
+        await auto_delete_expired_ads(EXPIRY_HORIZON)
+    ad_ids = [key for key in keys if key != EXPIRY_RELOAD]
+    if ad_ids:
+        # Решение принимается по текущей записи в БД: объявление могли продлить или удалить.
+        # Вместе с созревшими обрабатываются напоминания ближайших EXPIRY_COALESCE.
+        ads = {ad['id']: ad for ad in await get_expiring_ads_async(ad_ids)}
+        for ad in await get_expiring_ads_async(horizon=EXPIRY_COALESCE):
+            ads.setdefault(ad['id'], ad)
+        await process_expiring_ads(list(ads.values()))
 
 # --- Команда /stats (только для админа) ---
-@dp.message(Command('stats'))
-async def cmd_stats(message: types.Message, state: FSMContext):
-    if message.from_user.id != ADMIN_ID:
-        await message.answer("⛔ Эта команда только для администратора.", reply_markup=get_main_keyboard(message.from_user.id))
-        return
-    await state.clear()
-    stats = get_stats()
+def format_stats(stats):
+    """Текст статистики для администратора (/stats и кнопка «📊 Статистика»)."""
     text = f"📊 <b>Статистика бота</b>\n\n"
     text += f"📝 Всего объявлений: {stats['total_ads']}\n"
     text += f"👥 Уникальных пользователей: {stats['total_users']}\n\n"
@@ -1297,7 +1804,26 @@ async def cmd_stats(message: types.Message, state: FSMContext):
         text += f"  {cat}: {count}\n"
     text += "\n<b>Последние 5 объявлений:</b>\n"
     for ad_id, title, price, username in stats['last_ads']:
-        text += f"  • {title} — {price} руб. (от @{username})\n"
+        text += rendering.stats_line(title, price, username) + "\n"
+    local = moderator.prefilter
+    text += (f"\n🛡 Без запроса к API: {local.avoided_rate:.0%} "
+             f"(одобрено {local.stats['approved']}, отклонено {local.stats['rejected']}, модели {local.stats['escalated']})\n")
+    verdicts = moderator.cache
+    text += (f"🛡 Кэш модерации: {verdicts.hit_rate:.0%} попаданий "
+             f"(память {verdicts.stats['memory_hits']}, БД {verdicts.stats['db_hits']}, промахов {verdicts.stats['misses']})\n")
+    text += (f"🗃 Кэш объявлений: {ad_cache.hit_rate:.0%} попаданий "
+             f"(объявления {ad_cache.stats['hits']}/{ad_cache.stats['hits'] + ad_cache.stats['misses']}, "
+             f"списки {ad_cache.stats['list_hits']}/{ad_cache.stats['list_hits'] + ad_cache.stats['list_misses']}, "
+             f"сбросов {ad_cache.stats['invalidations']})\n")
+    return text
+
+@dp.message(Command('stats'))
+async def cmd_stats(message: types.Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("⛔ Эта команда только для администратора.", reply_markup=get_main_keyboard(message.from_user.id))
+        return
+    await state.clear()
+    text = format_stats(await get_stats_async())
     await message.answer(text, parse_mode='HTML', reply_markup=get_main_keyboard(message.from_user.id))
 
 # --- Команда /search ---
@@ -1326,18 +1852,12 @@ async def cmd_exit(message: types.Message, state: FSMContext):
 @dp.message(lambda message: message.text == "📋 Список объявлений")
 async def handle_list_button(message: types.Message, state: FSMContext):
     await state.clear()
-    ads = get_all_ads()
+    ads = await get_all_ads_async(limit=PAGE_SIZE + 1)
     if not ads:
         await message.answer("📭 Пока нет объявлений.", reply_markup=get_main_keyboard(message.from_user.id))
         return
-    for ad in ads:
-        text = format_ad_text(ad)
-        keyboard = get_favorite_keyboard(message.from_user.id, ad['id'])
-        if ad['photo']:
-            await message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=keyboard)
-        else:
-            await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
-    await message.answer("🔍 Что ищем дальше?", reply_markup=get_main_keyboard(message.from_user.id))
+    if not await send_ads_page(message, message.from_user.id, ads, "more_all_"):
+        await message.answer("🔍 Что ищем дальше?", reply_markup=get_main_keyboard(message.from_user.id))
 
 @dp.message(lambda message: message.text == "➕ Добавить объявление")
 async def handle_add_button(message: types.Message, state: FSMContext):
@@ -1352,23 +1872,22 @@ async def categories_button_handler(message: types.Message, state: FSMContext):
 @dp.message(lambda message: message.text == "👤 Мои объявления")
 async def handle_myads_button(message: types.Message, state: FSMContext):
     await state.clear()
-    user_ads = get_user_ads(message.from_user.id)
+    user_ads = await get_user_ads_async(message.from_user.id)
     if not user_ads:
         await message.answer("📭 У вас пока нет объявлений.", reply_markup=get_main_keyboard(message.from_user.id))
         return
     for ad in user_ads:
-        info = f"Возраст: {ad.get('age_group', 'Не указан')} | Пол: {ad.get('gender', 'Не указан')} | Состояние: {ad.get('condition', 'Не указано')}"
-        text = f"<b>{ad['title']}</b> [{ad['category']}]\n{info}\n{ad['description']}\n💰 {ad['price']} руб.\n📍 Район: {ad.get('district', 'Не указан')}\n👤 @{ad.get('username', 'Не указан')}"
+        text = rendering.owner_card(ad)
         kb = InlineKeyboardMarkup(
             inline_keyboard=[
                 [
-                    InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_{ad['id']}"),
-                    InlineKeyboardButton(text="❌ Удалить", callback_data=f"del_{ad['id']}")
+                    InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_{ad.id}"),
+                    InlineKeyboardButton(text="❌ Удалить", callback_data=f"del_{ad.id}")
                 ]
             ]
         )
-        if ad['photo']:
-            await message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=kb)
+        if ad.photo:
+            await message.answer_photo(photo=ad.photo, caption=text, parse_mode='HTML', reply_markup=kb)
         else:
             await message.answer(text, parse_mode='HTML', reply_markup=kb)
     await message.answer("Вот ваши объявления", reply_markup=get_main_keyboard(message.from_user.id))
@@ -1384,10 +1903,14 @@ async def handle_search_button(message: types.Message, state: FSMContext):
         reply_markup=get_search_keyboard()
     )
 
+@dp.message(lambda message: message.text == "🎛 Фильтры")
+async def handle_filter_button(message: types.Message, state: FSMContext):
+    await cmd_filter(message, state)
+
 @dp.message(lambda message: message.text == "⭐ Избранное")
 async def handle_favorites_button(message: types.Message, state: FSMContext):
     await state.clear()
-    favorites = get_user_favorites(message.from_user.id)
+    favorites = await get_user_favorites_async(message.from_user.id)
     if not favorites:
         await message.answer("⭐ У вас пока нет избранных объявлений.", reply_markup=get_main_keyboard(message.from_user.id))
         return
@@ -1395,10 +1918,10 @@ async def handle_favorites_button(message: types.Message, state: FSMContext):
     for ad in favorites:
         text = format_ad_text(ad)
         keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="❌ Удалить из избранного", callback_data=f"fav_remove_{ad['id']}")]]
+            inline_keyboard=[[InlineKeyboardButton(text="❌ Удалить из избранного", callback_data=f"fav_remove_{ad.id}")]]
         )
-        if ad['photo']:
-            await message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=keyboard)
+        if ad.photo:
+            await message.answer_photo(photo=ad.photo, caption=text, parse_mode='HTML', reply_markup=keyboard)
         else:
             await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
     await message.answer("Вот ваши избранные объявления", reply_markup=get_main_keyboard(message.from_user.id))
@@ -1406,7 +1929,7 @@ async def handle_favorites_button(message: types.Message, state: FSMContext):
 @dp.message(lambda message: message.text == "🔔 Мои подписки")
 async def handle_mysubs_button(message: types.Message, state: FSMContext):
     await state.clear()
-    subscriptions = get_user_subscriptions(message.from_user.id)
+    subscriptions = await get_user_subscriptions_async(message.from_user.id)
     if not subscriptions:
         await message.answer("🔔 Вы пока не подписаны ни на одну категорию.", reply_markup=get_main_keyboard(message.from_user.id))
         return
@@ -1429,16 +1952,7 @@ async def handle_stats_button(message: types.Message, state: FSMContext):
         await message.answer("⛔ Эта кнопка только для администратора.", reply_markup=get_main_keyboard())
         return
     await state.clear()
-    stats = get_stats()
-    text = f"📊 <b>Статистика бота</b>\n\n"
-    text += f"📝 Всего объявлений: {stats['total_ads']}\n"
-    text += f"👥 Уникальных пользователей: {stats['total_users']}\n\n"
-    text += "<b>По категориям:</b>\n"
-    for cat, count in stats['category_stats']:
-        text += f"  {cat}: {count}\n"
-    text += "\n<b>Последние 5 объявлений:</b>\n"
-    for ad_id, title, price, username in stats['last_ads']:
-        text += f"  • {title} — {price} руб. (от @{username})\n"
+    text = format_stats(await get_stats_async())
     await message.answer(text, parse_mode='HTML', reply_markup=get_main_keyboard())
 
 @dp.message(lambda message: message.text == "❌ Отмена")
@@ -1447,45 +1961,138 @@ async def handle_cancel_button(message: types.Message, state: FSMContext):
     if current_state == SearchState.waiting_for_query:
         await state.clear()
         await message.answer("🚪 Вы вышли из режима поиска.", reply_markup=get_main_keyboard())
+    elif current_state in FilterState:
+        await state.clear()
+        await message.answer("🚪 Фильтры закрыты.", reply_markup=get_main_keyboard())
     else:
         await message.answer("✅ Возврат в главное меню.", reply_markup=get_main_keyboard())
 
-# --- Обработчик поиска в состоянии ---
-@dp.message(SearchState.waiting_for_query)
-async def process_search_query(message: types.Message, state: FSMContext):
-    # Обработка команды exit через кнопку
-    if message.text == "❌ Отмена":
-        await state.clear()
-        await message.answer("🚪 Вы вышли из режима поиска.", reply_markup=get_main_keyboard())
+# --- Обработчик поиска в состоянии ---
+@dp.message(SearchState.waiting_for_query)
+async def process_search_query(message: types.Message, state: FSMContext):
+    # Обработка команды exit через кнопку
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("🚪 Вы вышли из режима поиска.", reply_markup=get_main_keyboard())
+        return
+
+    query = message.text.strip()
+    if not query:
+        await message.answer("❌ Пустой запрос. Введите что-нибудь.")
+        return
+
+    ads = await search_ads_async(query, limit=PAGE_SIZE + 1)
+    if not ads:
+        await message.answer(f"📭 По запросу «{query}» ничего не найдено.")
+    else:
+        # Запрос нужен кнопке «▶ Ещё»: в callback_data он может не поместиться
+        await state.update_data(search_query=query)
+        await message.answer(f"🔍 Результаты поиска по запросу «{query}»:")
+        if not await send_ads_page(message, message.from_user.id, ads, "more_search_"):
+            await message.answer("Продолжайте поиск или нажмите '❌ Отмена' для выхода.")
+    # Состояние не очищаем, остаёмся в режиме поиска
+
+# --- Фильтры: категория, район, цена, возраст, пол, состояние и слова вместе ---
+@dp.message(Command('filter'))
+async def cmd_filter(message: types.Message, state: FSMContext):
+    logging.info(f"Command /filter from user {message.from_user.id}")
+    await state.clear()
+    await state.set_state(FilterState.choosing)
+    await state.update_data(filters={})
+    await send_filter_panel(message, {})
+
+@dp.callback_query(lambda c: c.data and c.data.startswith("flt_"))
+async def filter_menu(callback: types.CallbackQuery, state: FSMContext):
+    """Кнопки панели фильтров: выбор фасета, цены, слов, показ и сброс."""
+    action = callback.data.replace("flt_", "", 1)
+    filters = (await state.get_data()).get('filters')
+    if filters is None:
+        await callback.answer("Фильтры устарели, откройте их заново: /filter", show_alert=True)
+        return
+    await state.set_state(FilterState.choosing)
+    if action in FILTER_FACETS:
+        counts = await count_facets_async(filters)
+        await callback.message.edit_text(
+            f"{FILTER_FACETS[action][2]}: выберите значение",
+            reply_markup=get_facet_keyboard(action, filters, counts)
+        )
+    elif action == "price":
+        builder = InlineKeyboardBuilder()
+        builder.button(text="Не важно", callback_data="fltset_price_any")
+        await state.set_state(FilterState.waiting_for_price)
+        await callback.message.answer(
+            "💰 Введите цену, например: 1000-5000, от 1000 или до 5000",
+            reply_markup=builder.as_markup()
+        )
+    elif action == "kw":
+        builder = InlineKeyboardBuilder()
+        builder.button(text="Не важно", callback_data="fltset_kw_any")
+        await state.set_state(FilterState.waiting_for_keyword)
+        await callback.message.answer("🔤 Введите слова для поиска в названии и описании:", reply_markup=builder.as_markup())
+    elif action == "back":
+        await send_filter_panel(callback.message, filters, edit=True)
+    elif action == "reset":
+        await state.update_data(filters={})
+        await send_filter_panel(callback.message, {}, edit=True)
+    elif action == "show":
+        ads = await find_ads_async(filters, limit=PAGE_SIZE + 1)
+        if not ads:
+            await callback.message.answer("📭 По выбранным фильтрам ничего не найдено.")
+        else:
+            # Фильтры для кнопки «▶ Ещё» остаются в состоянии FSM
+            await send_ads_page(callback.message, callback.from_user.id, ads, "more_filter_")
+    else:
+        logging.error(f"Unknown filter callback: {callback.data}")
+    await callback.answer()
+
+async def update_filters(message, state, edit=False, **changes):
+    """Применяет изменения фильтров (None снимает фильтр) и показывает панель."""
+    filters = dict((await state.get_data()).get('filters') or {})
+    filters.update(changes)
+    filters = {key: value for key, value in filters.items() if value is not None}
+    await state.update_data(filters=filters)
+    await state.set_state(FilterState.choosing)
+    await send_filter_panel(message, filters, edit=edit)
+
+@dp.callback_query(lambda c: c.data and c.data.startswith("fltset_"))
+async def filter_set_value(callback: types.CallbackQuery, state: FSMContext):
+    """Выбор значения фасета или снятие фильтра («Не важно»)."""
+    if (await state.get_data()).get('filters') is None:
+        await callback.answer("Фильтры устарели, откройте их заново: /filter", show_alert=True)
+        return
+    code, _, value = callback.data.replace("fltset_", "", 1).partition("_")
+    try:
+        if code in FILTER_FACETS:
+            column, values, _ = FILTER_FACETS[code]
+            changes = {column: None if value == "any" else values[int(value)]}
+        elif code == "price" and value == "any":
+            changes = {'price_min': None, 'price_max': None}
+        elif code == "kw" and value == "any":
+            changes = {'keyword': None}
+        else:
+            raise ValueError(code)
+    except (IndexError, ValueError) as e:
+        logging.error(f"Error parsing filter callback: {callback.data}, error: {e}")
+        await callback.answer("Ошибка выбора фильтра", show_alert=True)
+        return
+    await update_filters(callback.message, state, edit=True, **changes)
+    await callback.answer()
+
+@dp.message(FilterState.waiting_for_price)
+async def filter_price(message: types.Message, state: FSMContext):
+    price = parse_price_range(message.text or "")
+    if price is None:
+        await message.answer("❌ Не удалось разобрать цену. Пример: 1000-5000, от 1000 или до 5000")
         return
+    await update_filters(message, state, price_min=price[0], price_max=price[1])
 
-    query = message.text.strip()
-    if not query:
+@dp.message(FilterState.waiting_for_keyword)
+async def filter_keyword(message: types.Message, state: FSMContext):
+    keyword = (message.text or "").strip()
+    if not keyword:
         await message.answer("❌ Пустой запрос. Введите что-нибудь.")
         return
-
-    ads = search_ads(query)
-    if not ads:
-        await message.answer(f"📭 По запросу «{query}» ничего не найдено.")
-    else:
-        await message.answer(f"🔍 Результаты поиска по запросу «{query}»:")
-        for ad in ads:
-            text = f"<b>{ad['title']}</b> [{ad['category']}]\n{ad['description']}\n💰 {ad['price']} руб.\n👤 @{ad['username']}"
-            if ad.get('district'):
-                text += f"\n📍 Район: {ad['district']}"
-            if ad.get('age_group'):
-                text += f"\n👶 Возраст: {ad['age_group']}"
-            if ad.get('gender'):
-                text += f"\n🚻 Пол: {ad['gender']}"
-            if ad.get('condition'):
-                text += f"\n📦 Состояние: {ad['condition']}"
-            keyboard = get_favorite_keyboard(message.from_user.id, ad['id'])
-            if ad['photo']:
-                await message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=keyboard)
-            else:
-                await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
-        await message.answer("Продолжайте поиск или нажмите '❌ Отмена' для выхода.")
-    # Состояние не очищаем, остаёмся в режиме поиска
+    await update_filters(message, state, keyword=keyword)
 
 # --- Добавление объявления с AI-модерацией ---
 @dp.message(Command('add'))
@@ -1534,8 +2141,7 @@ async def choose_category(callback: types.CallbackQuery, state: FSMContext):
 
     # Показываем кнопки с возрастными группами
     builder = InlineKeyboardBuilder()
-    age_groups = ["0–3 мес", "3–12 мес", "1–3 года", "3–7 лет", "7–12 лет"]
-    for age_group in age_groups:
+    for age_group in AGE_GROUPS:
         builder.button(text=age_group, callback_data=f"age_{age_group}")
     builder.adjust(1)
     await callback.message.answer("Выберите возрастную группу:", reply_markup=builder.as_markup())
@@ -1579,11 +2185,27 @@ async def add_photo(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
+    # Повтор собственного объявления отклоняется без модерации
+    if await find_duplicate_ad_async(message.from_user.id, data['title'], data['description']):
+        await message.answer("❌ У вас уже есть такое объявление. Продлить его можно командой /extend.", reply_markup=get_main_keyboard())
+        await state.clear()
+        return
     photo_id = message.photo[-1].file_id if message.photo else None
-    full_text = f"{data['title']}\n{data['description']}\nЦена: {data['price']}"
+    if MODERATION_MODE == 'async':
+        await submit_for_moderation(data, photo_id, message.from_user)
+        await message.answer("📨 Объявление отправлено на модерацию. Как только оно будет опубликовано, придёт сообщение.", reply_markup=get_main_keyboard())
+        await state.clear()
+        return
+    full_text = moderation_text(data['title'], data['description'], data['price'])
     is_clean = await moderate_with_deepseek(full_text)
+    if is_clean is None:
+        # Модерация недоступна: объявление ждёт её в фоновой очереди, а не отклоняется
+        await submit_for_moderation(data, photo_id, message.from_user)
+        await message.answer("📨 Модерация сейчас недоступна, объявление поставлено в очередь. Как только оно будет опубликовано, придёт сообщение.", reply_markup=get_main_keyboard())
+        await state.clear()
+        return
     if is_clean:
-        ad_id = add_ad_to_db(
+        ad_id, broadcast = await publish_ad_async(
             title=data['title'],
             description=data['description'],
             price=data['price'],
@@ -1598,35 +2220,10 @@ async def add_photo(message: types.Message, state: FSMContext):
         )
         await message.answer("✅ Объявление прошло модерацию и опубликовано!", reply_markup=get_main_keyboard())
         
-        # Отправляем уведомления подписчикам
-        await notify_subscribers(
-            category=data['category'],
-            title=data['title'],
-            description=data['description'],
-            price=data['price'],
-            username=message.from_user.username or "NoUsername",
-            author_user_id=message.from_user.id,
-            photo_id=photo_id
-        )
-        
-        # Отправляем в общий чат, если CHAT_ID задан
-        logging.info(f"CHAT_ID value: {CHAT_ID}")
-        if CHAT_ID:
-            logging.info(f"Sending to public chat {CHAT_ID}")
-            await send_to_public_chat(
-                ad_id=ad_id,
-                title=data['title'],
-                description=data['description'],
-                price=data['price'],
-                username=message.from_user.username or "NoUsername",
-                district=data.get('district', '📍 Другой район'),
-                photo_id=photo_id,
-                age_group=data.get('age_group'),
-                gender=data.get('gender'),
-                condition=data.get('condition')
-            )
-        else:
-            logging.info("CHAT_ID is not set, skipping public chat notification")
+        # Рассылка подписчикам и пост в общий чат записаны вместе с объявлением и уходят в фоне
+        logging.info(f"Объявление {ad_id} опубликовано")
+        start_broadcast(broadcast)
+        outbox_worker.wake()
     else:
         await message.answer("❌ Объявление не прошло модерацию (содержит недопустимый контент).", reply_markup=get_main_keyboard())
     await state.clear()
@@ -1634,11 +2231,27 @@ async def add_photo(message: types.Message, state: FSMContext):
 @dp.message(AddAd.photo, Command('skip'))
 async def skip_photo(message: types.Message, state: FSMContext):
     data = await state.get_data()
-    full_text = f"{data['title']}\n{data['description']}\nЦена: {data['price']}"
+    # Повтор собственного объявления отклоняется без модерации
+    if await find_duplicate_ad_async(message.from_user.id, data['title'], data['description']):
+        await message.answer("❌ У вас уже есть такое объявление. Продлить его можно командой /extend.", reply_markup=get_main_keyboard())
+        await state.clear()
+        return
+    if MODERATION_MODE == 'async':
+        await submit_for_moderation(data, None, message.from_user)
+        await message.answer("📨 Объявление отправлено на модерацию. Как только оно будет опубликовано, придёт сообщение.", reply_markup=get_main_keyboard())
+        await state.clear()
+        return
+    full_text = moderation_text(data['title'], data['description'], data['price'])
     is_clean = await moderate_with_deepseek(full_text)
+    if is_clean is None:
+        # Модерация недоступна: объявление ждёт её в фоновой очереди, а не отклоняется
+        await submit_for_moderation(data, None, message.from_user)
+        await message.answer("📨 Модерация сейчас недоступна, объявление поставлено в очередь. Как только оно будет опубликовано, придёт сообщение.", reply_markup=get_main_keyboard())
+        await state.clear()
+        return
     if is_clean:
         # Добавляем объявление в базу данных
-        ad_id = add_ad_to_db(
+        ad_id, broadcast = await publish_ad_async(
             title=data['title'],
             description=data['description'],
             price=data['price'],
@@ -1653,35 +2266,10 @@ async def skip_photo(message: types.Message, state: FSMContext):
         )
         await message.answer("✅ Объявление прошло модерацию и опубликовано!", reply_markup=get_main_keyboard())
         
-        # Отправляем уведомления подписчикам
-        await notify_subscribers(
-            category=data['category'],
-            title=data['title'],
-            description=data['description'],
-            price=data['price'],
-            username=message.from_user.username or "NoUsername",
-            author_user_id=message.from_user.id,
-            photo_id=None
-        )
-        
-        # Отправляем в общий чат, если CHAT_ID задан
-        logging.info(f"CHAT_ID value: {CHAT_ID}")
-        if CHAT_ID:
-            logging.info(f"Sending to public chat {CHAT_ID}")
-            await send_to_public_chat(
-                ad_id=ad_id,
-                title=data['title'],
-                description=data['description'],
-                price=data['price'],
-                username=message.from_user.username or "NoUsername",
-                district=data.get('district', '📍 Другой район'),
-                photo_id=None,
-                age_group=data.get('age_group'),
-                gender=data.get('gender'),
-                condition=data.get('condition')
-            )
-        else:
-            logging.info("CHAT_ID is not set, skipping public chat notification")
+        # Рассылка подписчикам и пост в общий чат записаны вместе с объявлением и уходят в фоне
+        logging.info(f"Объявление {ad_id} опубликовано")
+        start_broadcast(broadcast)
+        outbox_worker.wake()
     else:
         await message.answer("❌ Объявление не прошло модерацию (содержит недопустимый контент).", reply_markup=get_main_keyboard())
     await state.clear()
@@ -1691,37 +2279,21 @@ async def skip_photo(message: types.Message, state: FSMContext):
 async def cmd_by_district(message: types.Message, state: FSMContext):
     await state.clear()
     builder = InlineKeyboardBuilder()
-    for district in YAKUTSK_DISTRICTS:
-        builder.button(text=district, callback_data=f"district_{district}")
+    for i, district in enumerate(YAKUTSK_DISTRICTS):
+        builder.button(text=district, callback_data=f"bydist_{i}")
     builder.adjust(1)
     await message.answer("Выберите район для просмотра:", reply_markup=builder.as_markup())
 
-@dp.callback_query(lambda c: c.data and c.data.startswith("district_"))
-async def show_district(callback: types.CallbackQuery):
-    district = callback.data.replace("district_", "")
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT title, description, price, category, photo_id, username FROM ads WHERE district = ? ORDER BY id DESC", (district,))
-    rows = cursor.fetchall()
-    conn.close()
-
-    if not rows:
-        await callback.message.answer(f"В районе «{district}» пока нет объявлений.")
-        await callback.answer()
-        return
-
-    for row in rows:
-        text = f"<b>{row[0]}</b> [{row[3]}]\n{row[1]}\n💰 {row[2]} руб.\n👤 @{row[5]}\n📍 Район: {district}"
-        if row[4]:
-            await callback.message.answer_photo(photo=row[4], caption=text, parse_mode='HTML')
-        else:
-            await callback.message.answer(text, parse_mode='HTML')
-    await callback.answer()
 @dp.callback_query(lambda c: c.data and c.data.startswith("bydist_"))
 async def show_district_ads(callback: types.CallbackQuery):
     """Показывает объявления выбранного района."""
-    district = callback.data.replace("bydist_", "")
-    ads = get_ads_by_district(district)
+    try:
+        district_index = int(callback.data.replace("bydist_", ""))
+        district = YAKUTSK_DISTRICTS[district_index]
+    except (IndexError, ValueError):
+        await callback.answer("Ошибка выбора района", show_alert=True)
+        return
+    ads = await get_ads_by_district_async(district, limit=PAGE_SIZE + 1)
     
     if not ads:
         await callback.message.answer(f"📭 В районе «{district}» пока нет объявлений.")
@@ -1729,16 +2301,7 @@ async def show_district_ads(callback: types.CallbackQuery):
         return
     
     await callback.message.answer(f"📍 Объявления в районе: {district}")
-    
-    for ad in ads:
-        # Добавляем информацию о районе в текст объявления
-        text = f"<b>{ad['title']}</b> [{ad['category']}]\n📍 {ad['district']}\n{ad['description']}\n💰 {ad['price']} руб.\n👤 @{ad['username']}"
-        keyboard = get_favorite_keyboard(callback.from_user.id, ad['id'])
-        if ad['photo']:
-            await callback.message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=keyboard)
-        else:
-            await callback.message.answer(text, parse_mode='HTML', reply_markup=keyboard)
-    
+    await send_ads_page(callback.message, callback.from_user.id, ads, f"more_dist_{district_index}_")
     await callback.answer()
 
 # --- Команда /list (все объявления) ---
@@ -1746,18 +2309,12 @@ async def show_district_ads(callback: types.CallbackQuery):
 async def cmd_list(message: types.Message, state: FSMContext):
     logging.info(f"Command /list from user {message.from_user.id}")
     await state.clear()
-    ads = get_all_ads()
+    ads = await get_all_ads_async(limit=PAGE_SIZE + 1)
     if not ads:
         await message.answer("📭 Пока нет объявлений.", reply_markup=get_main_keyboard())
         return
-    for ad in ads:
-        text = format_ad_text(ad)
-        keyboard = get_favorite_keyboard(message.from_user.id, ad['id'])
-        if ad['photo']:
-            await message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=keyboard)
-        else:
-            await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
-    await message.answer("🔍 Что ищем дальше?", reply_markup=get_main_keyboard())
+    if not await send_ads_page(message, message.from_user.id, ads, "more_all_"):
+        await message.answer("🔍 Что ищем дальше?", reply_markup=get_main_keyboard())
 
 # --- Команда /categories ---
 @dp.message(Command('categories'))
@@ -1771,12 +2328,16 @@ async def cmd_categories(message: types.Message, state: FSMContext):
 
 @dp.callback_query(lambda c: c.data and c.data.startswith("show_"))
 async def show_category_ads(callback: types.CallbackQuery):
-    await callback.answer()
+    """Показывает объявления выбранной категории и кнопку подписки на неё."""
     category = callback.data.replace("show_", "")
+    if category not in CATEGORIES:
+        await callback.answer("Ошибка выбора категории", show_alert=True)
+        return
+    await callback.answer()
     logging.info(f"Просмотр категории: {category}")
     
     # ВСЕГДА отправляем кнопки подписки, независимо от того, есть ли объявления в категории
-    is_subscribed_status = is_subscribed(callback.from_user.id, category)
+    is_subscribed_status = await is_subscribed_async(callback.from_user.id, category)
     builder = InlineKeyboardBuilder()
     if is_subscribed_status:
         builder.button(text="🔕 Отписаться", callback_data=f"sub_remove_{category}")
@@ -1788,20 +2349,58 @@ async def show_category_ads(callback: types.CallbackQuery):
         reply_markup=builder.as_markup()
     )
     
-    ads = get_ads_by_category(category)
+    ads = await get_ads_by_category_async(category, limit=PAGE_SIZE + 1)
     
     if not ads:
         await callback.message.answer(f"В категории «{category}» пока нет объявлений.")
         return
     
     await callback.message.answer(f"📂 Объявления в категории «{category}»:")
-    for ad in ads:
-        text = format_ad_text(ad)
-        keyboard = get_favorite_keyboard(callback.from_user.id, ad['id'])
-        if ad['photo']:
-            await callback.message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=keyboard)
+    # Название категории длинное для callback_data (64 байта), передаём её номер
+    await send_ads_page(callback.message, callback.from_user.id, ads, f"more_cat_{CATEGORIES.index(category)}_")
+
+@dp.callback_query(lambda c: c.data and c.data.startswith("more_"))
+async def show_more_ads(callback: types.CallbackQuery, state: FSMContext):
+    """Кнопка «▶ Ещё»: следующая страница ленты после объявления с id из callback_data."""
+    kind, _, rest = callback.data.replace("more_", "", 1).partition("_")
+    try:
+        *key, cursor = rest.split("_")
+        cursor = int(cursor)
+        if kind == "all":
+            ads = await get_all_ads_async(cursor, PAGE_SIZE + 1)
+        elif kind == "cat":
+            ads = await get_ads_by_category_async(CATEGORIES[int(key[0])], cursor, PAGE_SIZE + 1)
+        elif kind == "dist":
+            ads = await get_ads_by_district_async(YAKUTSK_DISTRICTS[int(key[0])], cursor, PAGE_SIZE + 1)
+        elif kind == "search":
+            query = (await state.get_data()).get('search_query')
+            if not query:
+                await callback.answer("Поиск завершён, повторите запрос.", show_alert=True)
+                return
+            ads = await search_ads_async(query, cursor, PAGE_SIZE + 1)
+        elif kind == "filter":
+            filters = (await state.get_data()).get('filters')
+            if filters is None:
+                await callback.answer("Фильтры устарели, откройте их заново: /filter", show_alert=True)
+                return
+            ads = await find_ads_async(filters, cursor, PAGE_SIZE + 1)
+        else:
+            raise ValueError(kind)
+    except (IndexError, ValueError) as e:
+        logging.error(f"Error parsing pagination callback: {callback.data}, error: {e}")
+        await callback.answer("Ошибка загрузки страницы", show_alert=True)
+        return
+
+    # Убираем кнопку с прошлой страницы, чтобы её нельзя было нажать повторно;
+    # кнопки избранного и жалоб альбома в том же сообщении остаются
+    await callback.message.edit_reply_markup(reply_markup=without_more_button(callback.message.reply_markup))
+    if not ads:
+        await callback.message.answer("📭 Больше объявлений нет.")
+    elif not await send_ads_page(callback.message, callback.from_user.id, ads, "_".join(["more", kind, *key, ""])):
+        if kind == "search":
+            await callback.message.answer("Продолжайте поиск или нажмите '❌ Отмена' для выхода.")
         else:
-            await callback.message.answer(text, parse_mode='HTML', reply_markup=keyboard)
+            await callback.message.answer("🔍 Что ищем дальше?", reply_markup=get_main_keyboard(callback.from_user.id))
     await callback.answer()
 
 # --- Команда /myads (личный кабинет) ---
@@ -1809,22 +2408,22 @@ async def show_category_ads(callback: types.CallbackQuery):
 async def cmd_myads(message: types.Message, state: FSMContext):
     logging.info(f"Command /myads from user {message.from_user.id}")
     await state.clear()
-    user_ads = get_user_ads(message.from_user.id)
+    user_ads = await get_user_ads_async(message.from_user.id)
     if not user_ads:
         await message.answer("📭 У вас пока нет объявлений.", reply_markup=get_main_keyboard())
         return
     for ad in user_ads:
-        text = f"<b>{ad['title']}</b> [{ad['category']}]\n{ad['description']}\n💰 {ad['price']} руб."
+        text = rendering.owner_short_card(ad)
         kb = InlineKeyboardMarkup(
             inline_keyboard=[
                 [
-                    InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_{ad['id']}"),
-                    InlineKeyboardButton(text="❌ Удалить", callback_data=f"del_{ad['id']}")
+                    InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_{ad.id}"),
+                    InlineKeyboardButton(text="❌ Удалить", callback_data=f"del_{ad.id}")
                 ]
             ]
         )
-        if ad['photo']:
-            await message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=kb)
+        if ad.photo:
+            await message.answer_photo(photo=ad.photo, caption=text, parse_mode='HTML', reply_markup=kb)
         else:
             await message.answer(text, parse_mode='HTML', reply_markup=kb)
     await message.answer("Вот ваши объявления", reply_markup=get_main_keyboard())
@@ -1867,8 +2466,7 @@ async def edit_category_start(callback: types.CallbackQuery, state: FSMContext):
 @dp.callback_query(EditAd.choosing_field, lambda c: c.data == 'edit_age_group')
 async def edit_age_group_start(callback: types.CallbackQuery, state: FSMContext):
     builder = InlineKeyboardBuilder()
-    age_groups = ["0–3 мес", "3–12 мес", "1–3 года", "3–7 лет", "7–12 лет"]
-    for age in age_groups:
+    for age in AGE_GROUPS:
         builder.button(text=age, callback_data=f"editage_{age}")
     builder.button(text="❌ Отмена", callback_data="edit_cancel")
     builder.adjust(1)
@@ -1880,8 +2478,7 @@ async def edit_age_group_start(callback: types.CallbackQuery, state: FSMContext)
 @dp.callback_query(EditAd.choosing_field, lambda c: c.data == 'edit_gender')
 async def edit_gender_start(callback: types.CallbackQuery, state: FSMContext):
     builder = InlineKeyboardBuilder()
-    gender_options = ["👧 Девочка", "👦 Мальчик", "👪 Унисекс"]
-    for gender in gender_options:
+    for gender in GENDERS:
         builder.button(text=gender, callback_data=f"editgender_{gender}")
     builder.button(text="❌ Отмена", callback_data="edit_cancel")
     builder.adjust(1)
@@ -1893,8 +2490,7 @@ async def edit_gender_start(callback: types.CallbackQuery, state: FSMContext):
 @dp.callback_query(EditAd.choosing_field, lambda c: c.data == 'edit_condition')
 async def edit_condition_start(callback: types.CallbackQuery, state: FSMContext):
     builder = InlineKeyboardBuilder()
-    condition_options = ["🆕 Новое", "✨ Как новое", "🔄 Б/у", "🔧 Требует ремонта"]
-    for cond in condition_options:
+    for cond in CONDITIONS:
         builder.button(text=cond, callback_data=f"editcond_{cond}")
     builder.button(text="❌ Отмена", callback_data="edit_cancel")
     builder.adjust(1)
@@ -1932,7 +2528,7 @@ async def edit_cancel(callback: types.CallbackQuery, state: FSMContext):
 @dp.callback_query(lambda c: c.data and c.data.startswith("edit_") and c.data.replace("edit_", "").isdigit() and len(c.data.split('_')) == 2)
 async def edit_ad_start(callback: types.CallbackQuery, state: FSMContext):
     ad_id = int(callback.data.replace("edit_", ""))
-    ad_data = get_ad_by_id(ad_id)
+    ad_data = await get_ad_by_id_async(ad_id)
     if not ad_data:
         await callback.answer("❌ Объявление не найдено.")
         return
@@ -1940,7 +2536,9 @@ async def edit_ad_start(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("❌ Это не ваше объявление.")
         return
     await state.clear()
-    await state.update_data(edit_ad_id=ad_id, edit_ad_data=ad_data)
+    # В состоянии FSM — только простые значения: хранилище может их сериализовать,
+    # а запись кэша общая для всех читателей. Ad восстанавливается через Ad.from_dict
+    await state.update_data(edit_ad_id=ad_id, edit_ad_data=ad_data.as_dict())
     builder = InlineKeyboardBuilder()
     builder.button(text="📝 Название", callback_data="edit_title")
     builder.button(text="📄 Описание", callback_data="edit_description")
@@ -1962,7 +2560,7 @@ async def edit_ad_start(callback: types.CallbackQuery, state: FSMContext):
 async def edit_title_finish(message: types.Message, state: FSMContext):
     data = await state.get_data()
     ad_id = data['edit_ad_id']
-    success = update_ad_field(ad_id, 'title', message.text)
+    success = await update_ad_field_async(ad_id, 'title', message.text)
     if success:
         await message.answer("✅ Название обновлено!", reply_markup=get_main_keyboard())
     else:
@@ -1973,7 +2571,7 @@ async def edit_title_finish(message: types.Message, state: FSMContext):
 async def edit_description_finish(message: types.Message, state: FSMContext):
     data = await state.get_data()
     ad_id = data['edit_ad_id']
-    success = update_ad_field(ad_id, 'description', message.text)
+    success = await update_ad_field_async(ad_id, 'description', message.text)
     if success:
         await message.answer("✅ Описание обновлено!", reply_markup=get_main_keyboard())
     else:
@@ -1987,7 +2585,7 @@ async def edit_price_finish(message: types.Message, state: FSMContext):
         return
     data = await state.get_data()
     ad_id = data['edit_ad_id']
-    success = update_ad_field(ad_id, 'price', int(message.text))
+    success = await update_ad_field_async(ad_id, 'price', int(message.text))
     if success:
         await message.answer("✅ Цена обновлена!", reply_markup=get_main_keyboard())
     else:
@@ -1999,7 +2597,7 @@ async def edit_category_finish(callback: types.CallbackQuery, state: FSMContext)
     category = callback.data.replace("editcat_", "")
     data = await state.get_data()
     ad_id = data['edit_ad_id']
-    success = update_ad_field(ad_id, 'category', category)
+    success = await update_ad_field_async(ad_id, 'category', category)
     if success:
         await callback.message.edit_reply_markup(reply_markup=None)
         await callback.message.answer("✅ Категория обновлена!", reply_markup=get_main_keyboard())
@@ -2013,7 +2611,7 @@ async def edit_age_group_finish(callback: types.CallbackQuery, state: FSMContext
     age_group = callback.data.replace("editage_", "")
     data = await state.get_data()
     ad_id = data['edit_ad_id']
-    success = update_ad_field(ad_id, 'age_group', age_group)
+    success = await update_ad_field_async(ad_id, 'age_group', age_group)
     if success:
         await callback.message.edit_reply_markup(reply_markup=None)
         await callback.message.answer("✅ Возрастная группа обновлена!", reply_markup=get_main_keyboard())
@@ -2027,7 +2625,7 @@ async def edit_gender_finish(callback: types.CallbackQuery, state: FSMContext):
     gender = callback.data.replace("editgender_", "")
     data = await state.get_data()
     ad_id = data['edit_ad_id']
-    success = update_ad_field(ad_id, 'gender', gender)
+    success = await update_ad_field_async(ad_id, 'gender', gender)
     if success:
         await callback.message.edit_reply_markup(reply_markup=None)
         await callback.message.answer("✅ Пол обновлён!", reply_markup=get_main_keyboard())
@@ -2041,7 +2639,7 @@ async def edit_condition_finish(callback: types.CallbackQuery, state: FSMContext
     condition = callback.data.replace("editcond_", "")
     data = await state.get_data()
     ad_id = data['edit_ad_id']
-    success = update_ad_field(ad_id, 'condition', condition)
+    success = await update_ad_field_async(ad_id, 'condition', condition)
     if success:
         await callback.message.edit_reply_markup(reply_markup=None)
         await callback.message.answer("✅ Состояние обновлено!", reply_markup=get_main_keyboard())
@@ -2065,7 +2663,7 @@ async def edit_district_finish(callback: types.CallbackQuery, state: FSMContext)
             
         data = await state.get_data()
         ad_id = data['edit_ad_id']
-        success = update_ad_field(ad_id, 'district', district)
+        success = await update_ad_field_async(ad_id, 'district', district)
         if success:
             await callback.message.edit_reply_markup(reply_markup=None)
             await callback.message.answer("✅ Район обновлён!", reply_markup=get_main_keyboard())
@@ -2085,7 +2683,7 @@ async def edit_photo_finish(message: types.Message, state: FSMContext):
     ad_id = data['edit_ad_id']
     photo_id = message.photo[-1].file_id if message.photo else None
     if photo_id:
-        success = update_ad_photo(ad_id, photo_id)
+        success = await update_ad_photo_async(ad_id, photo_id)
         if success:
             await message.answer("✅ Фото обновлено!", reply_markup=get_main_keyboard())
         else:
@@ -2119,10 +2717,10 @@ async def process_delete(callback: types.CallbackQuery, state: FSMContext):
 @dp.callback_query(lambda c: c.data and c.data.startswith("confirm_del_"))
 async def confirm_delete(callback: types.CallbackQuery, state: FSMContext):
     ad_id = int(callback.data.replace("confirm_del_", ""))
-    success = delete_ad_by_id(ad_id)
+    success = await delete_ad_by_id_async(ad_id)
     if success:
-        # Удаляем сообщение из общего чата, если оно есть
-        await delete_public_chat_message(ad_id)
+        # Пост из общего чата удаляет outbox (см. delete_ad_by_id)
+        outbox_worker.wake()
         await callback.message.edit_text("✅ Объявление удалено.")
     else:
         await callback.message.edit_text("❌ Не удалось удалить объявление (возможно, оно уже удалено).")
@@ -2138,7 +2736,7 @@ async def cancel_delete(callback: types.CallbackQuery, state: FSMContext):
 async def cmd_favorites(message: types.Message, state: FSMContext):
     logging.info(f"Command /favorites from user {message.from_user.id}")
     await state.clear()
-    favorites = get_user_favorites(message.from_user.id)
+    favorites = await get_user_favorites_async(message.from_user.id)
     if not favorites:
         await message.answer("⭐ У вас пока нет избранных объявлений.", reply_markup=get_main_keyboard())
         return
@@ -2146,10 +2744,10 @@ async def cmd_favorites(message: types.Message, state: FSMContext):
     for ad in favorites:
         text = format_ad_text(ad)
         keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="❌ Удалить из избранного", callback_data=f"fav_remove_{ad['id']}")]]
+            inline_keyboard=[[InlineKeyboardButton(text="❌ Удалить из избранного", callback_data=f"fav_remove_{ad.id}")]]
         )
-        if ad['photo']:
-            await message.answer_photo(photo=ad['photo'], caption=text, parse_mode='HTML', reply_markup=keyboard)
+        if ad.photo:
+            await message.answer_photo(photo=ad.photo, caption=text, parse_mode='HTML', reply_markup=keyboard)
         else:
             await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
     await message.answer("Вот ваши избранные объявления", reply_markup=get_main_keyboard())
@@ -2159,7 +2757,7 @@ async def cmd_favorites(message: types.Message, state: FSMContext):
 async def cmd_mysubs(message: types.Message, state: FSMContext):
     logging.info(f"Command /mysubs from user {message.from_user.id}")
     await state.clear()
-    subscriptions = get_user_subscriptions(message.from_user.id)
+    subscriptions = await get_user_subscriptions_async(message.from_user.id)
     if not subscriptions:
         await message.answer("🔔 Вы пока не подписаны ни на одну категорию.", reply_markup=get_main_keyboard())
         return
@@ -2182,10 +2780,10 @@ async def add_to_favorites(callback: types.CallbackQuery):
     ad_id = int(callback.data.replace("fav_add_", ""))
     user_id = callback.from_user.id
     
-    success = add_favorite(user_id, ad_id)
+    success = await add_favorite_async(user_id, ad_id)
     if success:
         # Обновляем клавиатуру
-        new_keyboard = get_favorite_keyboard(user_id, ad_id)
+        new_keyboard = get_favorite_keyboard(user_id, ad_id, is_fav=True)
         try:
             if callback.message.photo:
                 await callback.message.edit_reply_markup(reply_markup=new_keyboard)
@@ -2202,23 +2800,16 @@ async def remove_from_favorites(callback: types.CallbackQuery):
     ad_id = int(callback.data.replace("fav_remove_", ""))
     user_id = callback.from_user.id
     
-    success = remove_favorite(user_id, ad_id)
+    success = await remove_favorite_async(user_id, ad_id)
     if success:
         # Если это сообщение из раздела избранного, удаляем его
         if "❌ Удалить из избранного" in callback.message.reply_markup.inline_keyboard[0][0].text:
             await callback.message.delete()
             await callback.answer("❌ Удалено из избранного")
         else:
-            # Иначе обновляем клавиатуру
-            new_keyboard = get_favorite_keyboard(user_id, ad_id)
-            try:
-                if callback.message.photo:
-                    await callback.message.edit_reply_markup(reply_markup=new_keyboard)
-                else:
-                    await callback.message.edit_reply_markup(reply_markup=new_keyboard)
-                await callback.answer("❌ Удалено из избранного")
-            except Exception as e:
-                await callback.answer("❌ Удалено из избранного")
+            # Иначе меняем только кнопку этого объявления (в альбоме их несколько)
+            await update_favorite_button(callback, ad_id, False)
+            await callback.answer("❌ Удалено из избранного")
     else:
         await callback.answer("⚠️ Не было в избранном")
 
@@ -2228,7 +2819,7 @@ async def add_subscription_handler(callback: types.CallbackQuery):
     category = callback.data.replace("sub_add_", "")
     user_id = callback.from_user.id
     
-    success = add_subscription(user_id, category)
+    success = await add_subscription_async(user_id, category)
     if success:
         # Обновляем кнопку на "Отписаться"
         new_kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -2244,7 +2835,7 @@ async def remove_subscription_handler(callback: types.CallbackQuery):
     category = callback.data.replace("sub_remove_", "")
     user_id = callback.from_user.id
     
-    success = remove_subscription(user_id, category)
+    success = await remove_subscription_async(user_id, category)
     if success:
         # Обновляем кнопку на "Подписаться"
         new_kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -2314,53 +2905,6 @@ async def handle_complaint_reason(callback: types.CallbackQuery):
     
     await callback.answer()
 
-async def notify_admin_about_complaint(complaint_id):
-    """Отправляет уведомление администратору о новой жалобе."""
-    complaint = get_complaint_by_id(complaint_id)
-    if not complaint:
-        logging.error(f"Жалоба #{complaint_id} не найдена")
-        return
-    
-    # Формируем текст уведомления
-    text = (
-        f"⚠️ *Новая жалоба*\n\n"
-        f"🆔 Жалоба #{complaint['id']}\n"
-        f"📌 Объявление #{complaint['ad_id']}\n"
-        f"👤 Автор объявления: @{complaint['ad_username']} (id: {complaint['user_id']})\n"
-        f"📝 Причина: {complaint['reason']}\n"
-        f"🕐 Время: {complaint['created_at']}\n\n"
-        f"📌 *Объявление:*\n"
-        f"<b>{complaint['ad_title']}</b>\n"
-        f"{complaint['ad_description']}\n"
-        f"💰 {complaint['ad_price']} руб.\n"
-        f"🏷️ Категория: {complaint['ad_category']}"
-    )
-    
-    # Создаём inline-клавиатуру для админа
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Пометить решённой", callback_data=f"resolve_complaint_{complaint_id}"),
-                InlineKeyboardButton(text="❌ Удалить объявление", callback_data=f"delete_ad_from_complaint_{complaint['ad_id']}_{complaint_id}")
-            ],
-            [
-                InlineKeyboardButton(text="⏳ Оставить", callback_data=f"ignore_complaint_{complaint_id}")
-            ]
-        ]
-    )
-    
-    try:
-        # Отправляем уведомление админу
-        await bot.send_message(
-            chat_id=ADMIN_ID,
-            text=text,
-            parse_mode='HTML',
-            reply_markup=keyboard
-        )
-        logging.info(f"Уведомление о жалобе #{complaint_id} отправлено администратору")
-    except Exception as e:
-        logging.error(f"Ошибка отправки уведомления админу: {e}")
-
 @dp.callback_query(lambda c: c.data and c.data.startswith("resolve_complaint_"))
 async def handle_resolve_complaint(callback: types.CallbackQuery):
     """Обработчик кнопки '✅ Пометить решённой'."""
@@ -2370,7 +2914,7 @@ async def handle_resolve_complaint(callback: types.CallbackQuery):
     
     complaint_id = int(callback.data.replace("resolve_complaint_", ""))
     
-    success = resolve_complaint(complaint_id)
+    success = await resolve_complaint_async(complaint_id)
     if success:
         await callback.message.edit_text(
             f"✅ Жалоба #{complaint_id} помечена как решённая.",
@@ -2384,39 +2928,25 @@ async def handle_resolve_complaint(callback: types.CallbackQuery):
     
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data and c.data.startswith("delete_ad_from_complaint_"))
-async def handle_delete_ad_from_complaint(callback: types.CallbackQuery):
-    """Обработчик кнопки '❌ Удалить объявление'.""" 
-    if callback.from_user.id != ADMIN_ID:
-        await callback.answer("⛔ Эта кнопка только для администратора.")
-        return
-    
-    # Разбираем callback_data: delete_ad_from_complaint_<ad_id>_<complaint_id>
-    parts = callback.data.split("_")
-    if len(parts) < 6:
-        await callback.answer("❌ Ошибка в данных.")
-        return
-    
-    ad_id = int(parts[4])
-    complaint_id = int(parts[5])
-    
+async def delete_ad_by_complaint(callback, ad_id, complaint_id):
+    """Удаляет объявление по жалобе, сообщает об этом администратору и автору объявления."""
     # Получаем данные жалобы для уведомления автора
-    complaint = get_complaint_by_id(complaint_id)
+    complaint = await get_complaint_by_id_async(complaint_id)
     if not complaint:
         await callback.answer("❌ Жалоба не найдена.")
         return
     
     # Получаем данные объявления для уведомления автора
-    ad_data = get_ad_by_id(ad_id)
+    ad_data = await get_ad_by_id_async(ad_id)
     if not ad_data:
         await callback.answer("❌ Объявление не найдено.")
         return
     
     # Удаляем объявление (каскадно удалятся и все жалобы на него)
-    success = delete_ad_by_id(ad_id)
+    success = await delete_ad_by_id_async(ad_id)
     if success:
-        # Удаляем сообщение из общего чата, если оно есть
-        await delete_public_chat_message(ad_id)
+        # Пост из общего чата удаляет outbox (см. delete_ad_by_id)
+        outbox_worker.wake()
         
         # Редактируем сообщение админу
         await callback.message.edit_text(
@@ -2444,6 +2974,21 @@ async def handle_delete_ad_from_complaint(callback: types.CallbackQuery):
     
     await callback.answer()
 
+@dp.callback_query(lambda c: c.data and c.data.startswith("delete_ad_from_complaint_"))
+async def handle_delete_ad_from_complaint(callback: types.CallbackQuery):
+    """Обработчик кнопки '❌ Удалить объявление'.""" 
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Эта кнопка только для администратора.")
+        return
+    
+    # Разбираем callback_data: delete_ad_from_complaint_<ad_id>_<complaint_id>
+    parts = callback.data.split("_")
+    if len(parts) < 6:
+        await callback.answer("❌ Ошибка в данных.")
+        return
+    
+    await delete_ad_by_complaint(callback, int(parts[4]), int(parts[5]))
+
 @dp.callback_query(lambda c: c.data and c.data.startswith("delete_ad_complaint_"))
 async def handle_delete_ad_complaint(callback: types.CallbackQuery):
     """Обработчик кнопки '❌ Удалить объявление' (альтернативный формат)."""
@@ -2457,49 +3002,7 @@ async def handle_delete_ad_complaint(callback: types.CallbackQuery):
         await callback.answer("❌ Ошибка в данных.")
         return
     
-    ad_id = int(parts[3])
-    complaint_id = int(parts[4])
-    
-    # Получаем данные жалобы для уведомления автора
-    complaint = get_complaint_by_id(complaint_id)
-    if not complaint:
-        await callback.answer("❌ Жалоба не найдена.")
-        return
-    
-    # Получаем данные объявления для уведомления автора
-    ad_data = get_ad_by_id(ad_id)
-    if not ad_data:
-        await callback.answer("❌ Объявление не найдено.")
-        return
-    
-    # Удаляем объявление (каскадно удалятся и все жалобы на него)
-    success = delete_ad_by_id(ad_id)
-    if success:
-        # Редактируем сообщение админу
-        await callback.message.edit_text(
-            f"❌ Объявление #{ad_id} удалено. Жалоба автоматически закрыта.",
-            reply_markup=None
-        )
-        
-        # Отправляем уведомление автору объявления
-        try:
-            await bot.send_message(
-                chat_id=ad_data['user_id'],
-                text=(
-                    f"❌ Ваше объявление '{complaint['ad_title']}' удалено по жалобе пользователя.\n"
-                    f"Причина: {complaint['reason']}.\n"
-                    f"Если вы считаете это ошибкой, свяжитесь с поддержкой."
-                )
-            )
-        except Exception as e:
-            logging.error(f"Ошибка отправки уведомления автору объявления: {e}")
-    else:
-        await callback.message.edit_text(
-            f"❌ Не удалось удалить объявление.",
-            reply_markup=None
-        )
-    
-    await callback.answer()
+    await delete_ad_by_complaint(callback, int(parts[3]), int(parts[4]))
 
 @dp.callback_query(lambda c: c.data and c.data.startswith("ignore_complaint_"))
 async def handle_ignore_complaint(callback: types.CallbackQuery):
@@ -2523,7 +3026,7 @@ async def cmd_complaints(message: types.Message, state: FSMContext):
         return
     
     await state.clear()
-    complaints = get_new_complaints(limit=10)
+    complaints = await get_new_complaints_async(limit=10)
     
     if not complaints:
         await message.answer("📭 Нет нерассмотренных жалоб.", reply_markup=get_main_keyboard())
@@ -2557,7 +3060,7 @@ async def handle_show_complaint(callback: types.CallbackQuery):
         return
     
     complaint_id = int(callback.data.replace("show_complaint_", ""))
-    complaint = get_complaint_by_id(complaint_id)
+    complaint = await get_complaint_by_id_async(complaint_id)
     
     if not complaint:
         await callback.answer("❌ Жалоба не найдена.")
@@ -2594,132 +3097,278 @@ async def handle_show_complaint(callback: types.CallbackQuery):
     await callback.answer()
 
 # --- Функция отправки уведомлений подписчикам ---
-async def notify_subscribers(category, title, description, price, username, author_user_id=None, photo_id=None):
-    """Отправляет уведомления всем подписчикам категории (кроме автора)."""
-    subscribers = get_subscribers_for_category(category)
-    if not subscribers:
-        return
-    
-    # Исключаем автора из списка получателей
-    if author_user_id is not None:
-        subscribers = [user_id for user_id in subscribers if user_id != author_user_id]
-    
-    if not subscribers:
-        return
-    
-    notification_text = (
-        f"🔔 Новое объявление в категории {category}:\n\n"
-        f"<b>{title}</b>\n"
-        f"{description}\n"
-        f"💰 {price} руб.\n"
-        f"Автор: @{username}"
+# Сколько подписчиков читать из БД за раз и сколько сообщений рассылки держать в очереди отправки
+BROADCAST_CHUNK = 500
+BROADCAST_CONCURRENCY = 30
+
+# Запущенные рассылки (ссылки держим, чтобы задачи не собрал сборщик мусора)
+broadcast_tasks = set()
+
+def start_broadcast(broadcast):
+    """Запускает рассылку фоновой задачей."""
+    task = asyncio.create_task(run_broadcast(broadcast))
+    broadcast_tasks.add(task)
+    task.add_done_callback(broadcast_tasks.discard)
+    return task
+
+async def resume_broadcasts():
+    """Продолжает рассылки, прерванные остановкой бота."""
+    for broadcast in await get_pending_broadcasts_async():
+        logging.info(f"Продолжаем рассылку {broadcast['id']} с подписчика {broadcast['last_user_id']}")
+        start_broadcast(broadcast)
+
+async def run_broadcast(broadcast):
+    """
+    Рассылает сообщение подписчикам порциями по BROADCAST_CHUNK.
+
+    Каждому получателю ставится отметка о доставке, после порции сохраняется
+    последний обработанный user_id, поэтому прерванная рассылка продолжается
+    с места остановки. Одновременно в очереди отправки не больше
+    BROADCAST_CONCURRENCY сообщений рассылки.
+    """
+    broadcast_id = broadcast['id']
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def deliver(user_id):
+        async with semaphore:
+            try:
+                if broadcast['photo_id']:
+                    await bot.send_photo(
+                        chat_id=user_id,
+                        photo=broadcast['photo_id'],
+                        caption=broadcast['text'],
+                        parse_mode='HTML'
+                    )
+                else:
+                    await bot.send_message(
+                        chat_id=user_id,
+                        text=broadcast['text'],
+                        parse_mode='HTML'
+                    )
+                status = 'sent'
+            except Exception as e:
+                logging.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+                status = 'failed'
+        await record_broadcast_delivery_async(broadcast_id, user_id, status)
+
+    try:
+        last_user_id = broadcast['last_user_id']
+        # Темп задаёт send_queue, ответы пользователям идут вне очереди рассылки
+        with sender.broadcast():
+            while True:
+                recipients = await get_broadcast_recipients_async(broadcast, last_user_id, BROADCAST_CHUNK)
+                if not recipients:
+                    break
+                await asyncio.gather(*(deliver(user_id) for user_id in recipients))
+                last_user_id = recipients[-1]
+                await advance_broadcast_async(broadcast_id, last_user_id)
+        sent, failed = await finish_broadcast_async(broadcast_id)
+        logging.info(f"Рассылка {broadcast_id} ({broadcast['category']}) завершена: отправлено {sent}, ошибок {failed}")
+    except Exception as e:
+        # Рассылка остаётся незавершённой и продолжится после перезапуска
+        logging.error(f"Ошибка рассылки {broadcast_id}: {e}")
+
+# --- Функция отправки в общий чат ---
+# --- Фоновая модерация (MODERATION_MODE='async') ---
+# Сколько объявлений модерируется одновременно
+MODERATION_WORKERS = moderation.CONCURRENCY
+
+# Повтор модерации, оставшейся без вердикта (API недоступен): через 5, 10, 20 … секунд, но не реже раза в 10 минут
+MODERATION_RETRY_BASE = 5
+MODERATION_RETRY_MAX = 600
+
+# Номера объявлений из pending_ads, ожидающих обработчика
+pending_moderation = asyncio.Queue()
+moderation_tasks = set()
+# Номер ожидающего объявления -> сколько раз подряд модерация осталась без вердикта
+moderation_retries = {}
+
+async def submit_for_moderation(data, photo_id, user):
+    """Сохраняет объявление из данных формы как ожидающее и ставит его в очередь модерации."""
+    pending_id = await submit_pending_ad_async(
+        title=data['title'],
+        description=data['description'],
+        price=data['price'],
+        category=data['category'],
+        age_group=data.get('age_group'),
+        gender=data.get('gender'),
+        condition=data.get('condition'),
+        district=data.get('district', '📍 Другой район'),
+        photo_id=photo_id,
+        user_id=user.id,
+        username=user.username or "NoUsername"
     )
-    
-    for user_id in subscribers:
+    logging.info(f"Объявление ожидает модерации: {pending_id}")
+    pending_moderation.put_nowait(pending_id)
+    return pending_id
+
+def retry_moderation(pending_id):
+    """Возвращает ожидающее объявление в очередь с растущей задержкой. Возвращает задержку, секунд."""
+    attempts = moderation_retries[pending_id] = moderation_retries.get(pending_id, 0) + 1
+    delay = min(MODERATION_RETRY_MAX, MODERATION_RETRY_BASE * 2 ** (attempts - 1))
+    asyncio.get_running_loop().call_later(delay, pending_moderation.put_nowait, pending_id)
+    return delay
+
+async def moderate_pending_ad(pending_id):
+    """
+    Модерирует ожидающее объявление; одобренное публикуется, автору приходит решение.
+
+    Без вердикта (API недоступен) объявление остаётся ожидающим и возвращается
+    в очередь с растущей задержкой. Возвращает вердикт или None.
+    """
+    ad = await get_pending_ad_async(pending_id)
+    if ad is None:
+        moderation_retries.pop(pending_id, None)
+        return None
+    is_clean = await moderate_with_deepseek(moderation_text(ad['title'], ad['description'], ad['price']))
+    if is_clean is None:
+        delay = retry_moderation(pending_id)
+        logging.warning(f"Объявление {pending_id} осталось без вердикта модерации, повтор через {delay} с")
+        return None
+    moderation_retries.pop(pending_id, None)
+    if is_clean:
+        published = await approve_pending_ad_async(pending_id)
+        if published:
+            ad_id, broadcast = published
+            logging.info(f"Объявление {ad_id} опубликовано после модерации ({pending_id})")
+            start_broadcast(broadcast)
+    else:
+        await reject_pending_ad_async(pending_id)
+        logging.info(f"Объявление {pending_id} отклонено модерацией")
+    outbox_worker.wake()
+    return is_clean
+
+async def moderation_worker():
+    """Обработчик очереди модерации (их MODERATION_WORKERS)."""
+    while True:
+        pending_id = await pending_moderation.get()
         try:
-            if photo_id:
-                await bot.send_photo(
-                    chat_id=user_id,
-                    photo=photo_id,
-                    caption=notification_text,
-                    parse_mode='HTML'
-                )
-            else:
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=notification_text,
-                    parse_mode='HTML'
-                )
+            await moderate_pending_ad(pending_id)
         except Exception as e:
-            logging.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-
-# --- Функция отправки в общий чат ---
-async def send_to_public_chat(ad_id, title, description, price, username, district, photo_id=None, age_group=None, gender=None, condition=None):
-    """Отправляет сообщение о новом объявлении в общий чат и сохраняет message_id."""
+            # Объявление остаётся в pending_ads и возвращается в очередь, как и без вердикта
+            delay = retry_moderation(pending_id)
+            logging.error(f"Ошибка фоновой модерации объявления {pending_id}: {e}, повтор через {delay} с")
+        finally:
+            pending_moderation.task_done()
+
+async def start_moderation_workers():
+    """Запускает обработчики модерации и возвращает в очередь объявления, не дождавшиеся решения до остановки."""
+    for pending_id in await get_pending_ad_ids_async():
+        pending_moderation.put_nowait(pending_id)
+    for _ in range(MODERATION_WORKERS):
+        task = asyncio.create_task(moderation_worker())
+        moderation_tasks.add(task)
+        task.add_done_callback(moderation_tasks.discard)
+
+async def send_to_public_chat(payload):
+    """
+    Обработчик outbox 'public_post': публикует объявление в общем чате и сохраняет message_id.
+
+    Пост не отправляется повторно, если message_id уже сохранён, и не
+    отправляется для объявления, удалённого до публикации.
+    """
+    ad_id = payload['ad_id']
     if not CHAT_ID:
-        return None
-    
-    text = (
-        f"📢 Новое объявление:\n\n"
-        f"<b>{title}</b>\n"
-        f"{description}\n"
-        f"💰 {price} руб.\n"
-        f"👤 @{username}\n"
-        f"📍 {district}"
-    )
+        return
+    ad = await get_ad_by_id_async(ad_id)
+    if not ad or await get_public_chat_message_id_async(ad_id):
+        return
     
-    # Добавляем дополнительную информацию, если она есть
-    additional = []
-    if age_group:
-        additional.append(f"👶 Возраст: {age_group}")
-    if gender:
-        additional.append(f"🚻 Пол: {gender}")
-    if condition:
-        additional.append(f"📦 Состояние: {condition}")
-    if additional:
-        text += "\n" + "\n".join(additional)
-    
-    # Получаем username бота
-    try:
-        bot_info = await bot.get_me()
-        bot_username = bot_info.username
-    except Exception as e:
-        logging.error(f"Ошибка получения username бота: {e}")
-        bot_username = "your_bot_username"
+    # Username бота (aiogram запоминает ответ getMe)
+    bot_info = await bot.me()
     
     # Кнопка-ссылка на бота
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="🤖 Перейти в бот", url=f"https://t.me/{bot_username}")]
+            [InlineKeyboardButton(text="🤖 Перейти в бот", url=f"https://t.me/{bot_info.username}")]
         ]
     )
     
-    try:
-        if photo_id:
-            sent_message = await bot.send_photo(
-                chat_id=CHAT_ID,
-                photo=photo_id,
-                caption=text,
-                parse_mode='HTML',
-                reply_markup=keyboard
-            )
-        else:
-            sent_message = await bot.send_message(
-                chat_id=CHAT_ID,
-                text=text,
-                parse_mode='HTML',
-                reply_markup=keyboard
-            )
-        
-        # Сохраняем ID сообщения в базу данных
-        if sent_message:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("UPDATE ads SET public_chat_message_id = ? WHERE id = ?", (sent_message.message_id, ad_id))
-                conn.commit()
-            logging.info(f"Сообщение о новом объявлении отправлено в чат {CHAT_ID}, message_id={sent_message.message_id}")
-        return sent_message
-    except Exception as e:
-        logging.error(f"Ошибка отправки сообщения в общий чат: {e}")
-        return None
+    if payload['photo_id']:
+        sent_message = await bot.send_photo(
+            chat_id=CHAT_ID,
+            photo=payload['photo_id'],
+            caption=payload['text'],
+            parse_mode='HTML',
+            reply_markup=keyboard
+        )
+    else:
+        sent_message = await bot.send_message(
+            chat_id=CHAT_ID,
+            text=payload['text'],
+            parse_mode='HTML',
+            reply_markup=keyboard
+        )
+    
+    # Сохраняем ID сообщения в базу данных
+    await set_public_chat_message_id_async(ad_id, sent_message.message_id)
+    logging.info(f"Сообщение о новом объявлении отправлено в чат {CHAT_ID}, message_id={sent_message.message_id}")
 
-# --- Функция для удаления сообщения из общего чата ---
-async def delete_public_chat_message(ad_id):
-    """Удаляет сообщение из общего чата по ID объявления."""
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT public_chat_message_id FROM ads WHERE id = ?", (ad_id,))
-        row = cursor.fetchone()
-        if row and row[0] and CHAT_ID:
-            try:
-                await bot.delete_message(chat_id=CHAT_ID, message_id=row[0])
-                logging.info(f"Сообщение объявления {ad_id} удалено из чата {CHAT_ID}")
-            except Exception as e:
-                logging.error(f"Ошибка удаления сообщения из чата для объявления {ad_id}: {e}")
+# --- Удаление постов из общего чата ---
+async def delete_chat_messages(payload):
+    """
+    Обработчик outbox 'chat_cleanup': удаляет посты удалённых объявлений из общего
+    чата одним запросом deleteMessages (запрос проходит через очередь sender).
+    """
+    if not CHAT_ID:
+        return
+    await bot.delete_messages(chat_id=CHAT_ID, message_ids=payload['message_ids'])
+    logging.info(f"Из чата {CHAT_ID} удалено постов: {len(payload['message_ids'])}")
+
+# --- Доставка уведомлений из outbox ---
+async def deliver_message(payload):
+    """Обработчик outbox 'message': сообщение пользователю."""
+    await bot.send_message(payload['chat_id'], payload['text'], parse_mode='HTML')
+
+async def deliver_expiry_digest(payload):
+    """Обработчик outbox 'expiry_digest': напоминание автору о сроке объявлений с кнопками продления."""
+    ad_ids = payload['ad_ids']
+    if len(ad_ids) == 1:
+        buttons = [[InlineKeyboardButton(text="🔄 Продлить на 7 дней", callback_data=f"extend_ad_{ad_ids[0]}")]]
+    else:
+        buttons = [
+            [InlineKeyboardButton(text="🔄 Продлить все", callback_data="extend_all")],
+            [InlineKeyboardButton(text="📋 Выбрать", callback_data="extend_choose")],
+        ]
+    await bot.send_message(payload['chat_id'], payload['text'], parse_mode='HTML',
+                           reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+async def deliver_complaint(payload):
+    """Обработчик outbox 'complaint': уведомление администратору о жалобе с кнопками решения."""
+    complaint_id, ad_id = payload['complaint_id'], payload['ad_id']
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✅ Пометить решённой", callback_data=f"resolve_complaint_{complaint_id}"),
+                InlineKeyboardButton(text="❌ Удалить объявление", callback_data=f"delete_ad_from_complaint_{ad_id}_{complaint_id}")
+            ],
+            [
+                InlineKeyboardButton(text="⏳ Оставить", callback_data=f"ignore_complaint_{complaint_id}")
+            ]
+        ]
+    )
+    await bot.send_message(
+        chat_id=ADMIN_ID,
+        text=payload['text'],
+        parse_mode='HTML',
+        reply_markup=keyboard
+    )
+    logging.info(f"Уведомление о жалобе #{complaint_id} отправлено администратору")
+
+OUTBOX_HANDLERS = {
+    'message': deliver_message,
+    'complaint': deliver_complaint,
+    'public_post': send_to_public_chat,
+    'chat_cleanup': delete_chat_messages,
+    'expiry_digest': deliver_expiry_digest,
+}
+
+outbox_worker = outbox.OutboxWorker(lambda: DB_PATH, OUTBOX_HANDLERS)
 
 # --- Запуск бота ---
 async def main():
     global bot
+    init_db()
     proxy_url = os.getenv('PROXY_URL')  # например, socks5://127.0.0.1:1080
     if proxy_url:
         connector = ProxyConnector.from_url(proxy_url)
@@ -2728,24 +3377,23 @@ async def main():
     else:
         bot = Bot(token=API_TOKEN)
     
+    bot.session.middleware(sender.ThrottlingMiddleware(send_queue))
+    
     await bot.delete_webhook()
     logging.info("Webhook удалён, запускаем polling...")
     
-    # Запускаем фоновую задачу для автоматического удаления
-    asyncio.create_task(auto_delete_expired_ads_loop())
+    # Продолжаем рассылки, прерванные прошлой остановкой, и доставку из outbox
+    await resume_broadcasts()
+    asyncio.create_task(outbox_worker.run())
+    await start_moderation_workers()
+    
+    # Напоминания и удаление по сроку: накопившееся за время остановки обрабатывается сразу,
+    # дальше планировщик спит до ближайшего срока
+    await auto_delete_expired_ads(EXPIRY_HORIZON)
+    expiry_scheduler.schedule(EXPIRY_RELOAD, (datetime.now() + EXPIRY_HORIZON / 2).timestamp())
+    asyncio.create_task(expiry_scheduler.run(handle_expiry_events))
     
     await dp.start_polling(bot)
 
-# --- Фоновая задача для автоматического удаления ---
-async def auto_delete_expired_ads_loop():
-    """Фоновая задача, которая каждые 10 минут проверяет и удаляет просроченные объявления."""
-    while True:
-        try:
-            await auto_delete_expired_ads()
-        except Exception as e:
-            logging.error(f"Ошибка в фоновой задаче auto_delete_expired_ads_loop: {e}")
-        # Ждём 10 минут перед следующей проверкой
-        await asyncio.sleep(600)  # 600 секунд = 10 минут
-
 if __name__ == '__main__':
     asyncio.run(main())
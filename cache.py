@@ -0,0 +1,145 @@
+"""
+Кэш объявлений в памяти процесса.
+
+AdCache хранит последние RECORDS_SIZE объявлений (запись — adrecord.Ad,
+ключ — id) и последние LISTS_SIZE списков id объявлений: страниц ленты,
+категории, района и объявлений автора. Функции чтения bot.py сначала
+обращаются к кэшу и идут в БД только за недостающим (read-through), а
+функции записи после фиксации транзакции сбрасывают ровно то, что изменили:
+записи изменённых объявлений и списки затронутых групп.
+
+Гонку «чтение из БД началось до записи, а в кэш попадает после неё»
+закрывает поколение: читатель запоминает generation до запроса, а put()
+отбрасывает результат, если за это время был сброс.
+
+Кэш знает только о записях через функции бота: после изменения ads в обход
+них (другой процесс, ручной SQL) кэш нужно очистить (clear()).
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Сколько объявлений и списков id держать в памяти
+RECORDS_SIZE = int(os.getenv('AD_CACHE_SIZE', '5000'))
+LISTS_SIZE = int(os.getenv('AD_LIST_CACHE_SIZE', '500'))
+
+
+class AdCache:
+    """
+    LRU объявлений {id: запись} и списков {(группа, курсор, размер): (id, ...)}.
+
+    Группа списка — кортеж вроде ('category', 'Одежда') или ('all', None).
+    path — функция, возвращающая путь к БД (как у outbox.OutboxWorker): при
+    смене БД кэш очищается. Методы потокобезопасны — их вызывают функции БД
+    в пуле потоков. stats считает попадания и промахи записей и списков.
+    """
+
+    def __init__(self, path, records_size=RECORDS_SIZE, lists_size=LISTS_SIZE):
+        self.path = path
+        self.records_size = records_size
+        self.lists_size = lists_size
+        self.stats = {'hits': 0, 'misses': 0, 'list_hits': 0, 'list_misses': 0, 'invalidations': 0}
+        self.generation = 0
+        self._records = OrderedDict()
+        self._lists = OrderedDict()
+        self._lock = threading.Lock()
+        self._bound_path = None
+
+    @property
+    def hit_rate(self):
+        """Доля обращений к записям и спискам, обслуженных кэшем."""
+        hits = self.stats['hits'] + self.stats['list_hits']
+        total = hits + self.stats['misses'] + self.stats['list_misses']
+        return hits / total if total else 0.0
+
+    def _check_path(self):
+        # Вызывается под блокировкой
+        path = self.path()
+        if path != self._bound_path:
+            self._bound_path = path
+            self._records.clear()
+            self._lists.clear()
+            self.generation += 1
+
+    def read_generation(self):
+        """Поколение, которое читатель передаёт в put_many()/put_ids(): берётся до запроса к БД."""
+        with self._lock:
+            self._check_path()
+            return self.generation
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._lists.clear()
+            self.generation += 1
+
+    def get_many(self, ad_ids):
+        """{id: запись} для найденных в кэше объявлений; остальные считаются промахами."""
+        found = {}
+        with self._lock:
+            self._check_path()
+            for ad_id in ad_ids:
+                record = self._records.get(ad_id)
+                if record is None:
+                    self.stats['misses'] += 1
+                    continue
+                self._records.move_to_end(ad_id)
+                self.stats['hits'] += 1
+                found[ad_id] = record
+        return found
+
+    def get(self, ad_id):
+        return self.get_many((ad_id,)).get(ad_id)
+
+    def put_many(self, records, generation):
+        """Запоминает записи {id: запись}, прочитанные при поколении generation."""
+        with self._lock:
+            self._check_path()
+            if generation != self.generation:
+                return
+            for ad_id, record in records.items():
+                self._records[ad_id] = record
+                self._records.move_to_end(ad_id)
+            while len(self._records) > self.records_size:
+                self._records.popitem(last=False)
+
+    def get_ids(self, key):
+        """Список id по ключу (группа, курсор, размер) или None."""
+        with self._lock:
+            self._check_path()
+            ids = self._lists.get(key)
+            if ids is None:
+                self.stats['list_misses'] += 1
+                return None
+            self._lists.move_to_end(key)
+            self.stats['list_hits'] += 1
+            return ids
+
+    def put_ids(self, key, ids, generation):
+        with self._lock:
+            self._check_path()
+            if generation != self.generation:
+                return
+            self._lists[key] = tuple(ids)
+            self._lists.move_to_end(key)
+            while len(self._lists) > self.lists_size:
+                self._lists.popitem(last=False)
+
+    def invalidate(self, ad_ids=(), groups=()):
+        """
+        Сбрасывает записи ad_ids и списки групп groups (None — все списки).
+        Вызывается после фиксации транзакции, изменившей объявления.
+        """
+        with self._lock:
+            self._check_path()
+            self.generation += 1
+            self.stats['invalidations'] += 1
+            for ad_id in ad_ids:
+                self._records.pop(ad_id, None)
+            if groups is None:
+                self._lists.clear()
+            elif groups:
+                groups = set(groups)
+                for key in [key for key in self._lists if key[0] in groups]:
+                    del self._lists[key]
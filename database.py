@@ -0,0 +1,346 @@
+"""
+Слой доступа к SQLite.
+
+Держит небольшой пул долгоживущих соединений на каждый файл БД и пул потоков,
+в котором выполняются запросы. Синхронные функции работы с данными берут
+соединение через connect(), а обработчики aiogram вызывают их через
+awaitable-обёртки, чтобы запросы не блокировали цикл событий.
+
+В режиме хранения 'wal' (по умолчанию) БД работает в журнале WAL, а все
+изменения проходят через единственный поток-писатель (write/execute_write),
+который объединяет накопившиеся записи в одну транзакцию. Читатели при этом
+не ждут писателя. Режим 'rollback' сохраняет прежнее поведение: журнал отката
+и запись через любое соединение пула.
+"""
+
+import asyncio
+import functools
+import os
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Файл БД бота; его же используют служебный скрипт миграций fix_db.py
+DEFAULT_DB_PATH = os.getenv('DB_PATH', '/app/data/ads.db')
+
+# 'wal' — журнал WAL, настроенные PRAGMA и единый писатель; 'rollback' — как раньше
+STORAGE_MODE = os.getenv('DB_STORAGE_MODE', 'wal')
+
+# Размер пула соединений и число потоков, обслуживающих запросы
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+# Сколько ждать свободного соединения, прежде чем считать пул исчерпанным
+ACQUIRE_TIMEOUT = 30
+# Сколько записей писатель может объединить в одну транзакцию
+WRITE_BATCH_SIZE = 64
+
+# PRAGMA для режима WAL: synchronous=NORMAL безопасен в WAL и не делает fsync на
+# каждый коммит, кэш 16 МБ, отображение файла в память до 256 МБ, временные
+# структуры (сортировки, индексы для GROUP BY) — в памяти
+WAL_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
+
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+
+# Обработчик трассировки SQL для читающих соединений (см. set_trace_callback)
+_trace_callback = None
+
+
+def open_connection(path, **kwargs):
+    """Открывает соединение и применяет PRAGMA текущего режима хранения."""
+    conn = sqlite3.connect(path, timeout=ACQUIRE_TIMEOUT, check_same_thread=False, **kwargs)
+    if STORAGE_MODE == 'wal':
+        for pragma in WAL_PRAGMAS:
+            conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений к одному файлу БД."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create_connection(self):
+        conn = open_connection(self.path)
+        conn.set_trace_callback(_trace_callback)
+        return conn
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        """Выдаёт свободное соединение, при необходимости создавая новое."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._create_connection()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Нет свободных соединений к {self.path}")
+
+    def release(self, conn):
+        """Возвращает соединение в пул."""
+        if self._closed:
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def idle_connections(self):
+        """Снимок простаивающих соединений (для настройки трассировки)."""
+        with self._idle.mutex:
+            return list(self._idle.queue)
+
+    def close(self):
+        """Закрывает все простаивающие соединения."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class Writer:
+    """
+    Единственный поток, который пишет в файл БД.
+
+    Задания ставятся в очередь; поток забирает все накопившиеся (не больше
+    WRITE_BATCH_SIZE), выполняет каждое в своей точке сохранения и фиксирует
+    пачку одним COMMIT. Ошибка в одном задании откатывает только его.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f'db-writer:{os.path.basename(path)}', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        """Ставит задание func(conn, *args) в очередь и возвращает Future с его результатом."""
+        future = Future()
+        self._queue.put((func, args, future))
+        return future
+
+    def in_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = self.conn = open_connection(self.path, isolation_level=None)
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    return
+                batch = [job]
+                while len(batch) < WRITE_BATCH_SIZE:
+                    try:
+                        job = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        self._queue.put(None)
+                        break
+                    batch.append(job)
+                self._run_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _run_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, args, future in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((future, func(conn, *args), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for func, args, future in batch:
+                future.set_exception(e)
+            return
+        # Результаты отдаём только после фиксации: вызывающий сразу видит свои данные
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_pools = {}
+_writers = {}
+_pools_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='db')
+
+
+def get_pool(path):
+    """Возвращает пул соединений для указанного файла БД."""
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = ConnectionPool(path)
+                _pools[path] = pool
+    return pool
+
+
+@contextmanager
+def connect(path):
+    """
+    Берёт соединение из пула на время блока.
+
+    Ведёт себя как `with sqlite3.connect(path) as conn`: при успешном выходе
+    фиксирует транзакцию, при исключении откатывает её. Соединение при этом
+    не закрывается, а возвращается в пул.
+    """
+    pool = get_pool(path)
+    conn = pool.acquire()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.release(conn)
+
+
+def get_writer(path):
+    """Возвращает поток-писатель для указанного файла БД."""
+    writer = _writers.get(path)
+    if writer is None:
+        with _pools_lock:
+            writer = _writers.get(path)
+            if writer is None:
+                writer = Writer(path)
+                _writers[path] = writer
+    return writer
+
+
+def write(path, func, *args):
+    """
+    Выполняет func(conn, *args) как одну атомарную запись и возвращает её результат.
+
+    Функция не должна вызывать commit(): транзакцией управляет писатель
+    (в режиме 'wal') или connect() (в режиме 'rollback').
+    """
+    if STORAGE_MODE != 'wal':
+        with connect(path) as conn:
+            return func(conn, *args)
+    writer = get_writer(path)
+    if writer.in_writer_thread():
+        # Вложенная запись из задания писателя выполняется в его же транзакции
+        return func(writer.conn, *args)
+    return writer.submit(func, *args).result()
+
+
+def _execute(conn, sql, params):
+    cursor = conn.execute(sql, params)
+    return WriteResult(cursor.lastrowid, cursor.rowcount)
+
+
+def execute_write(path, sql, params=()):
+    """Выполняет один изменяющий запрос через писателя. Возвращает WriteResult(lastrowid, rowcount)."""
+    return write(path, _execute, sql, params)
+
+
+def set_trace_callback(callback):
+    """
+    Включает трассировку SQL на всех читающих соединениях (None — выключает).
+
+    callback получает текст каждого выполненного запроса с подставленными
+    параметрами. Используется в тестах планов запросов и в бенчмарках.
+    """
+    global _trace_callback
+    _trace_callback = callback
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        for conn in pool.idle_connections():
+            conn.set_trace_callback(callback)
+
+
+def ensure_indexes(conn, indexes):
+    """
+    Приводит индексы к описанию indexes ({имя: CREATE INDEX ...}).
+
+    Недостающие индексы создаются, а индексы с изменившимся определением
+    пересоздаются. Возвращает список имён созданных индексов.
+    """
+    def normalize(sql):
+        return " ".join(sql.replace("IF NOT EXISTS ", "").split())
+
+    existing = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"))
+    created = []
+    for name, ddl in indexes.items():
+        if name in existing:
+            if normalize(existing[name]) == normalize(ddl):
+                continue
+            conn.execute(f"DROP INDEX {name}")
+        conn.execute(ddl)
+        created.append(name)
+    if created:
+        # Обновляем статистику планировщика для новых индексов
+        conn.execute("PRAGMA optimize")
+    return created
+
+
+def close_all():
+    """Останавливает писателей и закрывает все пулы (при остановке бота и в тестах)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        writers = list(_writers.values())
+        _pools.clear()
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
+    for pool in pools:
+        pool.close()
+
+
+async def run(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в пуле потоков."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def awaitable(func):
+    """Делает из синхронной функции работы с БД корутину, выполняемую в пуле потоков."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
@@ -0,0 +1,94 @@
+"""
+Локальный сервер, отвечающий как DeepSeek (OpenAI-совместимый /chat/completions),
+для тестов и bench.py.
+
+Отвечает 'fail', если в тексте объявления есть слово из banned, иначе 'ok',
+с задержкой latency; на пачку пронумерованных текстов ([1], [2], ...) — строками
+«N: ok» / «N: fail». Режим failing=True отвечает ошибкой 500, hang=True — не
+отвечает до остановки сервера (для проверки тайм-аута), garble=True отвечает на
+пачку без номеров. Считает запросы, размеры пачек и наибольшее число
+одновременных запросов.
+
+    api = FakeDeepSeek(latency=1.0)
+    base_url = await api.start()
+    client = moderation.ModerationClient("key", base_url=base_url)
+    ...
+    await api.stop()
+"""
+
+import asyncio
+import re
+import time
+
+from aiohttp import web
+
+
+BATCH_MARKER_RE = re.compile(r"^\[(\d+)\]$", re.MULTILINE)
+
+
+class FakeDeepSeek:
+    """Поддельный API модерации с настраиваемой задержкой и сбоями."""
+
+    def __init__(self, latency=0.05, banned=("мошенник", "спам")):
+        self.latency = latency
+        self.banned = banned
+        self.failing = False
+        self.hang = False
+        self.garble = False
+        self.requests = 0
+        self.batch_sizes = []      # число текстов в каждом запросе
+        self.active = 0
+        self.max_active = 0
+        self.connections = set()   # адреса клиентских соединений (проверка keep-alive)
+        self._runner = None
+        self._stopping = asyncio.Event()
+        self.base_url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/v1/"
+        return self.base_url
+
+    async def stop(self):
+        self._stopping.set()
+        await self._runner.cleanup()
+
+    async def _handle(self, request):
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info('peername'))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            data = await request.json()
+            if self.hang:
+                await self._stopping.wait()
+            await asyncio.sleep(self.latency)
+            if self.failing:
+                return web.json_response({'error': {'message': "internal error", 'type': 'server_error'}}, status=500)
+            content = data['messages'][-1]['content'].lower()
+            # Текст до первой строки [1] пуст; дальше — пары (номер, текст)
+            parts = BATCH_MARKER_RE.split(content)
+            items = list(zip(parts[1::2], parts[2::2])) if len(parts) > 1 else [(None, content)]
+            self.batch_sizes.append(len(items))
+            verdicts = [(number, "fail" if any(word in text for word in self.banned) else "ok") for number, text in items]
+            if items[0][0] is None:
+                answer = verdicts[0][1]
+            elif self.garble:
+                answer = " ".join(verdict for _, verdict in verdicts)
+            else:
+                answer = "\n".join(f"{number}: {verdict}" for number, verdict in verdicts)
+            return web.json_response({
+                'id': f"chatcmpl-{self.requests}", 'object': 'chat.completion', 'created': int(time.time()),
+                'model': data['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': answer}}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 1, 'total_tokens': 11},
+            })
+        finally:
+            self.active -= 1
@@ -0,0 +1,116 @@
+"""
+Локальный сервер, отвечающий как Telegram Bot API (для тестов и bench.py).
+
+Понимает методы, которыми пользуется бот (sendMessage, sendPhoto,
+sendMediaGroup, getMe, deleteMessage и др.), отвечает с задержкой latency и, как настоящий API,
+ограничивает частоту: не больше rate запросов за любую секунду на бота и
+chat_burst запросов подряд в один чат (дальше — один в chat_interval секунд).
+Сверх лимита отвечает 429 с retry_after.
+
+    api = FakeTelegramAPI()
+    await api.start()
+    bot = api.make_bot()
+    ...
+    await bot.session.close()
+    await api.stop()
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+TOKEN = "123456:FAKE-TOKEN"
+
+
+class FakeTelegramAPI:
+    """Поддельный Bot API с ограничением частоты и журналом доставленных сообщений."""
+
+    def __init__(self, rate=30, chat_burst=20, chat_interval=1.0, latency=0.03, retry_after=1):
+        self.rate = rate
+        self.chat_burst = chat_burst
+        self.chat_interval = chat_interval
+        self.latency = latency
+        self.retry_after = retry_after
+        self.delivered = []   # (chat_id, method)
+        self.rejected = 0     # ответов 429
+        self._recent = deque()   # время принятых запросов за последнюю секунду
+        self._chats = {}          # chat_id -> deque времени последних chat_burst запросов
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.base_url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def make_bot(self):
+        """Бот aiogram, отправляющий запросы в этот сервер."""
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+        return Bot(token=TOKEN, session=session)
+
+    def _allow(self, chat_id):
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate:
+            return False
+        if chat_id is not None:
+            history = self._chats.setdefault(chat_id, deque(maxlen=self.chat_burst))
+            # chat_burst запросов подряд, затем не чаще одного в chat_interval
+            if len(history) == self.chat_burst and now - history[0] < self.chat_burst * self.chat_interval:
+                return False
+            history.append(now)
+        self._recent.append(now)
+        return True
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        data = await request.post()
+        chat_id = data.get('chat_id')
+        if chat_id is not None and chat_id.lstrip('-').isdigit():
+            chat_id = int(chat_id)
+        await asyncio.sleep(self.latency)
+        if not self._allow(chat_id):
+            self.rejected += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            })
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': "Fake", 'username': "fake_bot"}
+        elif method in ('sendMessage', 'sendPhoto'):
+            self.delivered.append((chat_id, method))
+            result = self._message(chat_id, data.get('text') or data.get('caption') or "")
+        elif method == 'sendMediaGroup':
+            # Альбом — один запрос, но по сообщению на каждое фото
+            self.delivered.append((chat_id, method))
+            result = [self._message(chat_id, item.get('caption') or "") for item in json.loads(data['media'])]
+        else:
+            self.delivered.append((chat_id, method))
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    def _message(self, chat_id, text):
+        return {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if isinstance(chat_id, int) and chat_id > 0 else 'group'},
+            'text': text,
+        }
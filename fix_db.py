@@ -1,50 +1,13 @@
-import sqlite3
-
-DB_PATH = "ads.db"
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-
-# Таблица ads (объявления)
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS ads (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT NOT NULL,
-        price INTEGER NOT NULL,
-        category TEXT NOT NULL,
-        photo_id TEXT,
-        user_id INTEGER NOT NULL,
-        username TEXT
-    )
-''')
-
-# Таблица favorites (избранное)
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS favorites (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        ad_id INTEGER NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (ad_id) REFERENCES ads(id) ON DELETE CASCADE,
-        UNIQUE(user_id, ad_id)
-    )
-''')
-
-# Таблица subscriptions (подписки на категории)
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS subscriptions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        category TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        UNIQUE(user_id, category)
-    )
-''')
-
-# Индексы (для ускорения)
-cursor.execute('CREATE INDEX IF NOT EXISTS idx_favorites_user ON favorites(user_id)')
-cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions(user_id)')
-
-conn.commit()
-conn.close()
-print("✅ Все недостающие таблицы созданы (или уже существовали).")
+"""Приводит схему БД бота к актуальной версии — те же миграции, что бот применяет при запуске."""
+import os
+
+import database
+import migrations
+
+os.makedirs(os.path.dirname(database.DEFAULT_DB_PATH) or ".", exist_ok=True)
+applied = migrations.migrate(database.DEFAULT_DB_PATH)
+database.close_all()
+if applied:
+    print(f"✅ Применены миграции: {', '.join(map(str, applied))}")
+else:
+    print("✅ Схема БД уже актуальна.")
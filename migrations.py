@@ -0,0 +1,451 @@
+"""
+Версионные миграции схемы БД.
+
+Каждая миграция — функция, получающая соединение писателя, с номером версии.
+Применённые версии записываются в таблицу schema_version, поэтому каждый шаг
+выполняется ровно один раз. На актуальной БД migrate() только читает номер
+версии и не выполняет ни одного DDL-запроса.
+
+Новую миграцию добавляют в конец MIGRATIONS со следующим номером; уже
+применённые миграции не меняют.
+"""
+
+import logging
+from types import MappingProxyType
+
+import database
+import search
+
+# Индексы, которые создаёт каждая миграция индексов. Наборы неизменяемы, как и
+# сами применённые миграции: новый индекс добавляется новой миграцией со своим набором.
+# Составные индексы (фильтр, id DESC) отдают ленты объявлений без сортировки.
+SECONDARY_INDEXES = MappingProxyType({
+    'idx_ads_category_id': "CREATE INDEX idx_ads_category_id ON ads(category, id DESC)",
+    'idx_ads_district_id': "CREATE INDEX idx_ads_district_id ON ads(district, id DESC)",
+    'idx_ads_user_id': "CREATE INDEX idx_ads_user_id ON ads(user_id, id DESC)",
+    'idx_ads_created_at': "CREATE INDEX idx_ads_created_at ON ads(created_at)",
+    'idx_favorites_user': "CREATE INDEX idx_favorites_user ON favorites(user_id)",
+    'idx_subscriptions_user': "CREATE INDEX idx_subscriptions_user ON subscriptions(user_id)",
+    'idx_subscriptions_category': "CREATE INDEX idx_subscriptions_category ON subscriptions(category, user_id)",
+    'idx_complaints_status': "CREATE INDEX idx_complaints_status ON complaints(status)",
+    'idx_complaints_ad_id': "CREATE INDEX idx_complaints_ad_id ON complaints(ad_id)",
+})
+
+FACET_INDEXES = MappingProxyType({
+    'idx_ads_age_group_id': "CREATE INDEX idx_ads_age_group_id ON ads(age_group, id DESC)",
+    'idx_ads_gender_id': "CREATE INDEX idx_ads_gender_id ON ads(gender, id DESC)",
+    'idx_ads_condition_id': "CREATE INDEX idx_ads_condition_id ON ads(condition, id DESC)",
+    'idx_ads_price_id': "CREATE INDEX idx_ads_price_id ON ads(price, id DESC)",
+    # Покрывающий индекс для подсчёта фасетов фильтра (bot.count_facets)
+    'idx_ads_facets': "CREATE INDEX idx_ads_facets ON ads(category, district, age_group, gender, condition, price)",
+})
+
+# Все индексы этих миграций в актуальной схеме
+SCHEMA_INDEXES = MappingProxyType({**SECONDARY_INDEXES, **FACET_INDEXES})
+
+# Колонки ads, которые добавлялись к таблице по ходу развития бота.
+# В старых БД (созданных fix_db.py и ранними версиями бота) их может не быть.
+ADS_LATER_COLUMNS = (
+    ('district', 'TEXT'),
+    ('age_group', 'TEXT'),
+    ('gender', 'TEXT'),
+    ('condition', 'TEXT'),
+    # ALTER TABLE не умеет DEFAULT CURRENT_TIMESTAMP, значение заполняется отдельно
+    ('created_at', 'TIMESTAMP'),
+    ('notif_1d', 'INTEGER DEFAULT 0'),
+    ('notif_12h', 'INTEGER DEFAULT 0'),
+    ('notif_6h', 'INTEGER DEFAULT 0'),
+    ('notif_1h', 'INTEGER DEFAULT 0'),
+    ('public_chat_message_id', 'INTEGER'),
+)
+
+
+def table_columns(conn, table):
+    """Возвращает множество имён колонок таблицы."""
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def migration_base_schema(conn):
+    """Таблицы объявлений, избранного, подписок и жалоб."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            district TEXT,
+            photo_id TEXT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            age_group TEXT,
+            gender TEXT,
+            condition TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            notif_1d INTEGER DEFAULT 0,
+            notif_12h INTEGER DEFAULT 0,
+            notif_6h INTEGER DEFAULT 0,
+            notif_1h INTEGER DEFAULT 0,
+            public_chat_message_id INTEGER
+        )
+    """)
+    # Старая таблица ads: добавляем недостающие колонки
+    existing = table_columns(conn, 'ads')
+    for name, declaration in ADS_LATER_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE ads ADD COLUMN {name} {declaration}")
+            logging.info(f"Колонка ads.{name} добавлена")
+    # Объявления, созданные до появления created_at, считаем созданными сейчас.
+    # Выполняется один раз: новые объявления получают created_at при вставке.
+    conn.execute("UPDATE ads SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS favorites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ad_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (ad_id) REFERENCES ads(id) ON DELETE CASCADE,
+            UNIQUE(user_id, ad_id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, category)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS complaints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ad_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            reason TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'new',
+            FOREIGN KEY (ad_id) REFERENCES ads(id) ON DELETE CASCADE
+        )
+    """)
+
+
+def create_indexes(conn, indexes):
+    created = database.ensure_indexes(conn, indexes)
+    if created:
+        logging.info(f"Созданы индексы: {', '.join(created)}")
+
+
+def migration_indexes(conn):
+    """Индексы под ленты по категории и району, подписки и жалобы."""
+    create_indexes(conn, SECONDARY_INDEXES)
+
+
+def migration_facet_indexes(conn):
+    """Индексы фасетов фильтра: возраст, пол, состояние, цена и покрывающий для подсчёта."""
+    create_indexes(conn, FACET_INDEXES)
+
+
+def migration_fts(conn):
+    """
+    Полнотекстовый индекс ads_fts по названию и описанию.
+
+    Таблица без собственного содержимого (content=''): тексты хранятся только
+    в ads, а индекс заполняют триггеры. В индекс попадает нормализованный текст
+    (search.normalize_sql), поэтому удаление из индекса передаёт те же значения.
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS ads_fts USING fts5(
+            title, description,
+            content='',
+            tokenize="unicode61 remove_diacritics 2",
+            prefix='2 3'
+        )
+    """)
+    # Совпадение в названии весит вдвое больше, чем в описании
+    conn.execute("INSERT INTO ads_fts (ads_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')")
+    title, description = search.normalize_sql('new.title'), search.normalize_sql('new.description')
+    old_title, old_description = search.normalize_sql('old.title'), search.normalize_sql('old.description')
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS ads_fts_insert AFTER INSERT ON ads BEGIN
+            INSERT INTO ads_fts (rowid, title, description) VALUES (new.id, {title}, {description});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS ads_fts_delete AFTER DELETE ON ads BEGIN
+            INSERT INTO ads_fts (ads_fts, rowid, title, description) VALUES ('delete', old.id, {old_title}, {old_description});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS ads_fts_update AFTER UPDATE OF title, description ON ads BEGIN
+            INSERT INTO ads_fts (ads_fts, rowid, title, description) VALUES ('delete', old.id, {old_title}, {old_description});
+            INSERT INTO ads_fts (rowid, title, description) VALUES (new.id, {title}, {description});
+        END
+    """)
+    conn.execute(f"""
+        INSERT INTO ads_fts (rowid, title, description)
+        SELECT id, {search.normalize_sql('title')}, {search.normalize_sql('description')} FROM ads
+    """)
+
+
+def migration_stemmed_search(conn):
+    """
+    Поиск по основам слов и словарь основ для исправления опечаток.
+
+    Основы вычисляет Python (search.index_ad), поэтому они хранятся в обычной
+    таблице ads_search, а ads_fts индексирует её как внешнее содержимое.
+    Удаление объявления убирает его поисковую запись триггером, так что индекс
+    не отстаёт даже при удалении в обход функций бота.
+    """
+    for trigger in ('ads_fts_insert', 'ads_fts_delete', 'ads_fts_update'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS ads_fts")
+    conn.execute("""
+        CREATE TABLE ads_search (
+            ad_id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE ads_fts USING fts5(
+            title, description,
+            content='ads_search', content_rowid='ad_id',
+            tokenize="unicode61 remove_diacritics 2",
+            prefix='2 3'
+        )
+    """)
+    # Совпадение в названии весит вдвое больше, чем в описании
+    conn.execute("INSERT INTO ads_fts (ads_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')")
+    # Основы, которые сейчас есть в индексе, с числом объявлений
+    conn.execute("CREATE VIRTUAL TABLE ads_fts_terms USING fts5vocab(ads_fts, 'row')")
+    conn.execute("""
+        CREATE TRIGGER ads_search_insert AFTER INSERT ON ads_search BEGIN
+            INSERT INTO ads_fts (rowid, title, description) VALUES (new.ad_id, new.title, new.description);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER ads_search_delete AFTER DELETE ON ads_search BEGIN
+            INSERT INTO ads_fts (ads_fts, rowid, title, description) VALUES ('delete', old.ad_id, old.title, old.description);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER ads_search_update AFTER UPDATE ON ads_search BEGIN
+            INSERT INTO ads_fts (ads_fts, rowid, title, description) VALUES ('delete', old.ad_id, old.title, old.description);
+            INSERT INTO ads_fts (rowid, title, description) VALUES (new.ad_id, new.title, new.description);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER ads_search_cleanup AFTER DELETE ON ads BEGIN
+            DELETE FROM ads_search WHERE ad_id = old.id;
+        END
+    """)
+    conn.execute("CREATE TABLE search_vocab (term TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("""
+        CREATE TABLE search_trigrams (
+            trigram TEXT NOT NULL,
+            term TEXT NOT NULL,
+            PRIMARY KEY (trigram, term)
+        ) WITHOUT ROWID
+    """)
+    search.rebuild(conn)
+
+
+def migration_broadcasts(conn):
+    """
+    Рассылки подписчикам и отметки о доставке.
+
+    Рассылка идёт по подписчикам в порядке user_id; last_user_id — докуда
+    порции обработаны полностью, а broadcast_deliveries отмечает каждого
+    получателя текущей порции. После перезапуска бот продолжает незавершённые
+    рассылки (status = 'pending') с места остановки, никому не отправляя дважды.
+    """
+    conn.execute("""
+        CREATE TABLE broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            text TEXT NOT NULL,
+            photo_id TEXT,
+            author_user_id INTEGER,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            sent_count INTEGER,
+            failed_count INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX idx_broadcasts_pending ON broadcasts(id) WHERE status = 'pending'")
+    conn.execute("""
+        CREATE TABLE broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            PRIMARY KEY (broadcast_id, user_id),
+            FOREIGN KEY (broadcast_id) REFERENCES broadcasts(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+
+
+def migration_outbox(conn):
+    """
+    Outbox уведомлений (см. outbox.py).
+
+    Запись добавляется в транзакции изменения, вызвавшего уведомление;
+    next_attempt_at — время следующей попытки (секунды time.time()).
+    """
+    conn.execute("""
+        CREATE TABLE outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX idx_outbox_due ON outbox(next_attempt_at) WHERE status = 'pending'")
+
+
+def migration_moderation_cache(conn):
+    """
+    Вердикты модерации по хешу нормализованного текста (см. moderation.VerdictCache).
+
+    created_at — время получения вердикта (секунды time.time()), по нему
+    отсчитывается срок жизни записи.
+    """
+    conn.execute("""
+        CREATE TABLE moderation_cache (
+            text_hash TEXT PRIMARY KEY,
+            verdict INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def migration_pending_ads(conn):
+    """
+    Объявления, ожидающие фоновой модерации (режим MODERATION_MODE='async' в bot.py).
+
+    После решения запись удаляется: одобренное объявление переносится в ads.
+    """
+    conn.execute("""
+        CREATE TABLE pending_ads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            district TEXT,
+            photo_id TEXT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            age_group TEXT,
+            gender TEXT,
+            condition TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# Срок жизни объявления (bot.AD_LIFETIME) в виде модификатора datetime()
+AD_LIFETIME_MODIFIER = '+7 days'
+
+
+def migration_expiry_stage(conn):
+    """
+    Срок объявления expires_at и номер его следующего события next_notice_stage.
+
+    expires_at всегда равен created_at + 7 дней: триггеры пересчитывают его при
+    вставке и при изменении created_at, в том числе в обход функций бота.
+    next_notice_stage — номер ближайшего необработанного события в
+    bot.EXPIRY_STAGES (0 — напоминание за сутки, ..., 4 — удаление). Индекс
+    (next_notice_stage, expires_at) находит созревшие события без сканирования.
+    Номер восстанавливается по флагам notif_*, которые больше не используются.
+    """
+    conn.execute("ALTER TABLE ads ADD COLUMN expires_at TIMESTAMP")
+    conn.execute("ALTER TABLE ads ADD COLUMN next_notice_stage INTEGER NOT NULL DEFAULT 0")
+    conn.execute(f"""
+        UPDATE ads SET
+            expires_at = datetime(created_at, '{AD_LIFETIME_MODIFIER}'),
+            next_notice_stage = CASE
+                WHEN notif_1h THEN 4 WHEN notif_6h THEN 3 WHEN notif_12h THEN 2 WHEN notif_1d THEN 1 ELSE 0
+            END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER ads_expires_insert AFTER INSERT ON ads BEGIN
+            UPDATE ads SET expires_at = datetime(new.created_at, '{AD_LIFETIME_MODIFIER}') WHERE id = new.id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER ads_expires_update AFTER UPDATE OF created_at ON ads BEGIN
+            UPDATE ads SET expires_at = datetime(new.created_at, '{AD_LIFETIME_MODIFIER}') WHERE id = new.id;
+        END
+    """)
+    conn.execute("CREATE INDEX idx_ads_notice_due ON ads(next_notice_stage, expires_at)")
+
+
+# (версия, описание, функция) — строго по возрастанию версии
+MIGRATIONS = [
+    (1, 'base schema', migration_base_schema),
+    (2, 'secondary indexes', migration_indexes),
+    (3, 'full-text search index', migration_fts),
+    (4, 'stemmed and fuzzy search', migration_stemmed_search),
+    (5, 'facet indexes', migration_facet_indexes),
+    (6, 'subscriber broadcasts', migration_broadcasts),
+    (7, 'notification outbox', migration_outbox),
+    (8, 'moderation verdict cache', migration_moderation_cache),
+    (9, 'pending ads', migration_pending_ads),
+    (10, 'expiry stage columns', migration_expiry_stage),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """Номер последней применённой миграции (0 — схема ещё не создавалась)."""
+    has_table = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not has_table:
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def apply_pending(conn):
+    """Применяет недостающие миграции в переданном соединении. Возвращает список версий."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Перечитываем версию уже под блокировкой записи: другой процесс мог успеть раньше
+    version = current_version(conn)
+    applied = []
+    for number, description, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        migration(conn)
+        conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (number, description))
+        logging.info(f"Применена миграция {number}: {description}")
+        applied.append(number)
+    return applied
+
+
+def migrate(path):
+    """
+    Приводит схему БД к последней версии и возвращает список применённых миграций.
+
+    Все недостающие миграции выполняются одной транзакцией писателя: при ошибке
+    БД остаётся в прежней версии. Если схема актуальна, запись не выполняется.
+    """
+    with database.connect(path) as conn:
+        if current_version(conn) >= LATEST_VERSION:
+            return []
+    return database.write(path, apply_pending)
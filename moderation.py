@@ -0,0 +1,405 @@
+"""
+AI-модерация объявлений через DeepSeek (OpenAI-совместимый API).
+
+ModerationClient не блокирует цикл событий: запрос идёт через AsyncOpenAI,
+соединения с keep-alive переиспользуются между запросами. Кроме того:
+- TIMEOUT ограничивает ожидание ответа;
+- не больше CONCURRENCY запросов одновременно, остальные ждут своей очереди,
+  не мешая обработке других обновлений;
+- CircuitBreaker: после BREAKER_THRESHOLD ошибок подряд запросы не
+  отправляются BREAKER_RESET секунд (вердикта сразу нет), затем один
+  пробный запрос решает, вернуться ли к обычной работе.
+
+moderate() возвращает True или False по вердикту и None, если вердикта нет
+(ошибка или тайм-аут, цепь разомкнута): такой текст не отклоняется, его
+проверяют позже. Без ключа API модель недоступна совсем — это ошибка
+настройки, а не временный сбой: текст, который не решили локальный фильтр
+и кэш, не проходит модерацию (False).
+
+С prefilter (prefilter.PreFilter) очевидные случаи решаются локально, и в
+API уходят только неоднозначные тексты.
+
+С batch_window > 0 тексты, пришедшие за batch_window секунд (не больше
+batch_size), уходят одним запросом: модель получает пронумерованные тексты
+и отвечает строкой «N: ok» или «N: fail» на каждый. Тексты, вердикт для
+которых разобрать не удалось, проверяются по одному.
+
+VerdictCache запоминает вердикты по хешу нормализованного текста и
+инструкции, по которой вердикт получен (SYSTEM_PROMPT или BATCH_PROMPT):
+повторная подача того же объявления (или отличающегося только регистром и
+пробелами) не идёт в API, а смена инструкции отменяет только её вердикты.
+Последние CACHE_SIZE вердиктов лежат в памяти (LRU), все — в таблице
+moderation_cache, поэтому переживают перезапуск бота. Запись действительна
+CACHE_TTL секунд; ошибки API не кэшируются.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+import openai
+
+import database
+import search
+
+BASE_URL = os.getenv('DEEPSEEK_BASE_URL', "https://api.deepseek.com/v1/")
+MODEL = "deepseek-chat"
+# Ожидание ответа, секунд
+TIMEOUT = float(os.getenv('MODERATION_TIMEOUT', '10'))
+# Одновременных запросов к API
+CONCURRENCY = int(os.getenv('MODERATION_CONCURRENCY', '4'))
+# Сколько ошибок подряд размыкают цепь и на сколько секунд
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 60
+# Сбор пачки для одного запроса: сколько ждать текстов, секунд, и сколько текстов в пачке
+BATCH_WINDOW = float(os.getenv('MODERATION_BATCH_WINDOW', '0.2'))
+BATCH_SIZE = int(os.getenv('MODERATION_BATCH_SIZE', '10'))
+# Вердиктов в памяти и срок жизни вердикта, секунд (по умолчанию 30 дней)
+CACHE_SIZE = 1000
+CACHE_TTL = float(os.getenv('MODERATION_CACHE_TTL', str(30 * 24 * 3600)))
+# Как часто удалять из таблицы устаревшие вердикты, секунд
+CACHE_PURGE_INTERVAL = 3600
+
+SYSTEM_PROMPT = (
+    "Ты модератор доски объявлений. Определи, содержит ли текст спам, нецензурную лексику, оскорбления "
+    "или явное мошенничество. Если текст — обычное объявление о продаже товара (даже с ошибками или "
+    "неполное), ответь 'ok'. Если есть явные нарушения, ответь 'fail'. Отвечай только одним словом."
+)
+
+BATCH_PROMPT = (
+    "Ты модератор доски объявлений. Тебе дано несколько объявлений, каждое начинается строкой [N]. "
+    "Для каждого определи, содержит ли оно спам, нецензурную лексику, оскорбления или явное мошенничество. "
+    "Обычное объявление о продаже товара (даже с ошибками или неполное) — 'ok', явные нарушения — 'fail'. "
+    "Ответь по одной строке на объявление в формате 'N: ok' или 'N: fail' и ничего больше."
+)
+
+# Строка-номер текста в пачке; такие же строки внутри объявления экранируются
+BATCH_MARKER_RE = re.compile(r"^\[(\d+)\]$", re.MULTILINE)
+BATCH_VERDICT_RE = re.compile(r"^\W*(\d+)\W+(ok|fail)\b", re.MULTILINE)
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи: после threshold ошибок подряд запросы не выполняются
+    reset_after секунд, затем пропускается один пробный запрос.
+
+    Состояния: 'closed' — работаем, 'open' — отказываем сразу,
+    'half-open' — пробный запрос в пути.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_after=BREAKER_RESET, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        """Можно ли выполнить запрос сейчас."""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and self.clock() - self.opened_at >= self.reset_after:
+            self.state = 'half-open'
+            return True
+        return False
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half-open' or self.failures >= self.threshold:
+            if self.state != 'open':
+                logging.warning(f"Модерация недоступна ({self.failures} ошибок подряд), пауза {self.reset_after} с")
+            self.state = 'open'
+            self.opened_at = self.clock()
+
+
+def parse_verdict(answer):
+    """True, если ответ модели начинается со слова 'ok'."""
+    result = (answer or "").strip().lower()
+    first_word = result.split()[0] if result else ""
+    return first_word.rstrip('.,!?;:') == "ok"
+
+
+def batch_prompt(texts):
+    """Пронумерованные тексты для одного запроса."""
+    escaped = (BATCH_MARKER_RE.sub(r"(\1)", text) for text in texts)
+    return "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(escaped, 1))
+
+
+def parse_batch_verdicts(answer):
+    """{номер: вердикт} из ответа на пачку; строки не по формату пропускаются."""
+    return {int(number): verdict == "ok" for number, verdict in BATCH_VERDICT_RE.findall((answer or "").lower())}
+
+
+def normalize_text(text):
+    """Текст без различий в регистре, «ё» и пробелах: такие варианты получают один вердикт."""
+    return " ".join(search.normalize(text or "").split())
+
+
+def text_hash(text, model=MODEL, prompt=SYSTEM_PROMPT):
+    """
+    Ключ кэша: SHA-256 модели, инструкции, по которой получен вердикт, и
+    нормализованного текста. Смена модели или инструкции делает старые
+    вердикты недействительными.
+    """
+    key = f"{model}\n{prompt}\n{normalize_text(text)}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _load_verdicts(path, keys):
+    with database.connect(path) as conn:
+        placeholders = ", ".join("?" * len(keys))
+        return conn.execute(f"SELECT text_hash, verdict, created_at FROM moderation_cache WHERE text_hash IN ({placeholders})"
+                            " ORDER BY created_at DESC", keys).fetchall()
+
+
+def _store_verdict(conn, key, verdict, created_at, purge_before=None):
+    conn.execute("INSERT OR REPLACE INTO moderation_cache (text_hash, verdict, created_at) VALUES (?, ?, ?)",
+                 (key, int(verdict), created_at))
+    if purge_before is not None:
+        conn.execute("DELETE FROM moderation_cache WHERE created_at < ?", (purge_before,))
+
+
+class VerdictCache:
+    """
+    Кэш вердиктов модерации: LRU в памяти поверх таблицы moderation_cache.
+
+    path — функция, возвращающая путь к БД (как у outbox.OutboxWorker).
+    stats считает попадания в память, в БД и промахи; hit_rate — их доля.
+    """
+
+    def __init__(self, path, size=CACHE_SIZE, ttl=CACHE_TTL, clock=time.time):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+        self._entries = OrderedDict()   # хеш -> (вердикт, время получения)
+        self._purged_at = 0
+
+    @property
+    def hit_rate(self):
+        """Доля обращений, обслуженных кэшем (0.0, пока обращений не было)."""
+        hits = self.stats['memory_hits'] + self.stats['db_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+    def _remember(self, key, verdict, created_at):
+        self._entries[key] = (verdict, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def _fresh(self, created_at):
+        return self.clock() - created_at < self.ttl
+
+    async def get(self, text):
+        """
+        Вердикт для текста, полученный по любой из инструкций (одиночной или
+        пачкой), или None, если его нет или он устарел.
+        """
+        keys = [text_hash(text, prompt=prompt) for prompt in (SYSTEM_PROMPT, BATCH_PROMPT)]
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if self._fresh(entry[1]):
+                self._entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry[0]
+            del self._entries[key]
+        try:
+            rows = await database.run(_load_verdicts, self.path(), keys)
+        except Exception as e:
+            logging.error(f"Ошибка чтения кэша модерации: {e}")
+            rows = []
+        # Свежайший из вердиктов по обеим инструкциям
+        if rows and self._fresh(rows[0][2]):
+            key, verdict, created_at = rows[0]
+            verdict = bool(verdict)
+            self._remember(key, verdict, created_at)
+            self.stats['db_hits'] += 1
+            return verdict
+        self.stats['misses'] += 1
+        return None
+
+    async def put(self, text, verdict, prompt=SYSTEM_PROMPT):
+        """
+        Запоминает вердикт, полученный по инструкции prompt; заодно не чаще раза
+        в CACHE_PURGE_INTERVAL удаляет устаревшие.
+        """
+        key = text_hash(text, prompt=prompt)
+        now = self.clock()
+        self._remember(key, verdict, now)
+        purge_before = None
+        if now - self._purged_at > CACHE_PURGE_INTERVAL:
+            self._purged_at = now
+            purge_before = now - self.ttl
+        try:
+            await database.run(database.write, self.path(), _store_verdict, key, verdict, now, purge_before)
+        except Exception as e:
+            # Вердикт остаётся в памяти; без записи в БД он лишь не переживёт перезапуск
+            logging.error(f"Ошибка записи в кэш модерации: {e}")
+
+
+class ModerationClient:
+    """
+    Асинхронный клиент модерации с тайм-аутом, ограничением параллелизма и размыкателем цепи.
+    С prefilter очевидные случаи решаются без API, с cache (VerdictCache) повторные
+    тексты получают сохранённый вердикт без запроса к API. batch_window > 0
+    включает сбор текстов в пачки (по умолчанию каждый текст — отдельный запрос).
+    """
+
+    def __init__(self, api_key, base_url=BASE_URL, timeout=TIMEOUT, concurrency=CONCURRENCY, breaker=None, model=MODEL,
+                 cache=None, prefilter=None, batch_window=0, batch_size=BATCH_SIZE):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.model = model
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = cache
+        self.prefilter = prefilter
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.stats = {'requests': 0, 'errors': 0, 'rejected': 0, 'batched': 0, 'fallbacks': 0}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = None
+        self._batch = []            # (текст, future) ожидающие отправки
+        self._flush_handle = None
+        self._batch_tasks = set()
+
+    @property
+    def client(self):
+        """AsyncOpenAI создаётся при первом запросе; его пул соединений общий для всех запросов."""
+        if self._client is None:
+            # Повторы отключены: при сбоях решает размыкатель, а не удвоенное ожидание пользователя
+            self._client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                              timeout=self.timeout, max_retries=0)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def moderate(self, text):
+        """
+        True, если объявление чистое, False — если нет (или ключ API не задан),
+        None — если вердикта нет (API временно недоступен).
+        """
+        if self.prefilter is not None:
+            decision = self.prefilter.check(text)
+            if decision.verdict is not None:
+                return decision.verdict
+        if self.cache is not None:
+            verdict = await self.cache.get(text)
+            if verdict is not None:
+                logging.info(f"Вердикт модерации из кэша: {verdict}")
+                return verdict
+        if not self.api_key:
+            logging.error("Модерация невозможна: DEEPSEEK_API_KEY не задан")
+            return False
+        if self.batch_window > 0:
+            verdict, prompt = await self._ask_batched(text)
+        else:
+            verdict, prompt = await self._ask(text), SYSTEM_PROMPT
+        if verdict is None:
+            return None
+        if self.cache is not None:
+            await self.cache.put(text, verdict, prompt)
+        return verdict
+
+    async def _complete(self, system, content, max_tokens):
+        """Ответ модели или None, если ответа нет (ошибка, цепь разомкнута)."""
+        async with self._semaphore:
+            # Проверяем после очереди: пока ждали, цепь могла разомкнуться
+            if not self.breaker.allow():
+                self.stats['rejected'] += 1
+                logging.warning("Модерация пропущена: API недоступен, цепь разомкнута")
+                return None
+            logging.info(f"Отправка текста на модерацию: {content[:50]}...")
+            self.stats['requests'] += 1
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system},
+                        {"role": "user", "content": content}
+                    ],
+                    temperature=0.1,
+                    max_tokens=max_tokens
+                )
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.breaker.record_failure()
+                logging.error(f"Ошибка DeepSeek API: {e}")
+                return None
+        self.breaker.record_success()
+        answer = response.choices[0].message.content
+        logging.info(f"DeepSeek ответил: {answer}")
+        return answer
+
+    async def _ask(self, text):
+        """Вердикт API: True/False, или None, если ответа нет (ошибка, цепь разомкнута)."""
+        answer = await self._complete(SYSTEM_PROMPT, text, max_tokens=20)
+        return None if answer is None else parse_verdict(answer)
+
+    async def _ask_many(self, texts):
+        """
+        Вердикты для нескольких текстов одним запросом: пары (вердикт, инструкция,
+        по которой он получен). Неразобранные тексты проверяются по одному.
+        """
+        if len(texts) == 1:
+            return [(await self._ask(texts[0]), SYSTEM_PROMPT)]
+        answer = await self._complete(BATCH_PROMPT, batch_prompt(texts), max_tokens=8 * len(texts))
+        if answer is None:
+            return [(None, BATCH_PROMPT)] * len(texts)
+        self.stats['batched'] += len(texts)
+        verdicts = {i: (verdict, BATCH_PROMPT) for i, verdict in parse_batch_verdicts(answer).items()}
+        missing = [i for i in range(1, len(texts) + 1) if i not in verdicts]
+        if missing:
+            logging.warning(f"В ответе на пачку из {len(texts)} нет вердиктов для {len(missing)}, проверяем по одному")
+            self.stats['fallbacks'] += len(missing)
+            singles = await asyncio.gather(*(self._ask(texts[i - 1]) for i in missing))
+            verdicts.update((i, (verdict, SYSTEM_PROMPT)) for i, verdict in zip(missing, singles))
+        return [verdicts[i] for i in range(1, len(texts) + 1)]
+
+    async def _ask_batched(self, text):
+        """Ставит текст в текущую пачку и ждёт её вердикта: (вердикт, инструкция)."""
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((text, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self):
+        """Отправляет накопленную пачку (по заполнению или по истечении batch_window)."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.create_task(self._resolve(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _resolve(self, batch):
+        try:
+            verdicts = await self._ask_many([text for text, _ in batch])
+        except Exception as e:
+            logging.error(f"Ошибка модерации пачки: {e}")
+            verdicts = [(None, BATCH_PROMPT)] * len(batch)
+        for (_, future), verdict in zip(batch, verdicts):
+            # Ожидавший вердикта мог быть отменён
+            if not future.done():
+                future.set_result(verdict)
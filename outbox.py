@@ -0,0 +1,199 @@
+"""
+Outbox: надёжная доставка уведомлений.
+
+Уведомление записывается в таблицу outbox (enqueue) в той же транзакции, что
+и изменение, которое его вызвало: новое объявление, жалоба, отметка о
+напоминании. Откатилась транзакция — уведомления нет; зафиксирована — оно
+будет доставлено, даже если бот перезапустится раньше отправки.
+
+OutboxWorker забирает созревшие записи пачками по BATCH, вызывает обработчик
+по виду записи (kind) и отмечает результаты пачки одной транзакцией. Ошибка
+откладывает запись с экспоненциальной задержкой (до MAX_ATTEMPTS попыток),
+постоянные ошибки Telegram (бот заблокирован, неверный запрос) не повторяются.
+
+Ключ идемпотентности уникален: повторная постановка того же уведомления
+(повторный проход планировщика, повтор обработчика) ничего не добавляет.
+Доставка — «хотя бы один раз»: если бот остановится между отправкой и
+отметкой пачки, после перезапуска пачка уйдёт повторно.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+import database
+import sender
+
+# Сколько записей обрабатывать за раз
+BATCH = 50
+# Сколько раз пытаться доставить запись
+MAX_ATTEMPTS = 8
+# Задержка перед повтором: BACKOFF_BASE * 2^(попытка - 1), но не больше BACKOFF_MAX, секунд
+BACKOFF_BASE = 5
+BACKOFF_MAX = 3600
+# Как часто проверять таблицу без сигнала wake() (записи другого процесса), секунд
+POLL_INTERVAL = 60
+# Сколько дней хранить доставленные записи (ключи идемпотентности) и как часто их чистить
+RETENTION_DAYS = 7
+PURGE_INTERVAL = 3600
+
+
+class UnknownKind(LookupError):
+    """Для вида записи нет обработчика."""
+
+
+# Ошибки, после которых повтор бессмысленен
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, UnknownKind)
+
+
+def enqueue(conn, key, kind, payload, delay=0):
+    """
+    Ставит уведомление в outbox в транзакции conn.
+
+    payload — словарь, сохраняемый как JSON. Возвращает False, если запись
+    с таким ключом уже есть.
+    """
+    cursor = conn.execute("""
+        INSERT OR IGNORE INTO outbox (idempotency_key, kind, payload, next_attempt_at)
+        VALUES (?, ?, ?, ?)
+    """, (key, kind, json.dumps(payload, ensure_ascii=False), time.time() + delay))
+    return cursor.rowcount > 0
+
+
+def fetch_due(path, now, limit):
+    """Созревшие записи: [(id, kind, payload, attempts)] в порядке времени попытки."""
+    with database.connect(path) as conn:
+        cursor = conn.execute("""
+            SELECT id, kind, payload, attempts FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+        """, (now, limit))
+        return [(row[0], row[1], json.loads(row[2]), row[3]) for row in cursor]
+
+
+def next_attempt_time(path):
+    """Время ближайшей попытки (time.time()) или None, если ждать нечего."""
+    with database.connect(path) as conn:
+        return conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+
+def backoff(attempts):
+    """Задержка перед следующей попыткой после attempts неудачных."""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+
+
+def _record_results(conn, sent, retry, failed):
+    conn.executemany("""
+        UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, [(outbox_id,) for outbox_id in sent])
+    conn.executemany("""
+        UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?
+    """, retry)
+    conn.executemany("""
+        UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?
+    """, failed)
+
+
+def _purge(conn, days):
+    return conn.execute("""
+        DELETE FROM outbox WHERE status != 'pending' AND created_at < datetime('now', ?)
+    """, (f"-{days} days",)).rowcount
+
+
+class OutboxWorker:
+    """
+    Доставляет записи outbox обработчиками handlers ({kind: async def handler(payload)}).
+
+    path — функция, возвращающая путь к БД: бот читает его при каждом обращении
+    (в тестах путь меняется). wake() будит обработчик сразу после фиксации
+    транзакции с новой записью.
+    """
+
+    def __init__(self, path, handlers, batch=BATCH):
+        self.path = path
+        self.handlers = handlers
+        self.batch = batch
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+        self._wakeup = None
+        self._purged_at = 0
+
+    def wake(self):
+        """Сообщает обработчику о новых записях."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """Бесконечный цикл доставки (фоновая задача бота)."""
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.process_batch() == self.batch:
+                    continue
+                if time.monotonic() - self._purged_at > PURGE_INTERVAL:
+                    self._purged_at = time.monotonic()
+                    purged = await database.run(database.write, self.path(), _purge, RETENTION_DAYS)
+                    if purged:
+                        logging.info(f"Из outbox удалено {purged} старых записей")
+                due = await database.run(next_attempt_time, self.path())
+            except Exception as e:
+                logging.error(f"Ошибка обработки outbox: {e}")
+                due = None
+            delay = POLL_INTERVAL if due is None else min(POLL_INTERVAL, max(0.0, due - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self):
+        """Доставляет все созревшие записи и возвращает их число (для тестов и остановки бота)."""
+        total = 0
+        while True:
+            processed = await self.process_batch()
+            total += processed
+            if processed < self.batch:
+                return total
+
+    async def process_batch(self):
+        """Доставляет одну пачку созревших записей. Возвращает число обработанных."""
+        path = self.path()
+        rows = await database.run(fetch_due, path, time.time(), self.batch)
+        if not rows:
+            return 0
+        # Уведомления идут с приоритетом рассылки: ответы пользователям важнее
+        with sender.broadcast():
+            errors = await asyncio.gather(*(self._deliver(kind, payload) for _, kind, payload, _ in rows))
+        sent, retry, failed = [], [], []
+        now = time.time()
+        for (outbox_id, kind, _, attempts), error in zip(rows, errors):
+            if error is None:
+                sent.append(outbox_id)
+                continue
+            attempts += 1
+            if isinstance(error, PERMANENT_ERRORS) or attempts >= MAX_ATTEMPTS:
+                logging.error(f"Уведомление outbox #{outbox_id} ({kind}) не доставлено: {error}")
+                failed.append((str(error), outbox_id))
+            else:
+                logging.warning(f"Уведомление outbox #{outbox_id} ({kind}), попытка {attempts}: {error}")
+                retry.append((now + backoff(attempts), str(error), outbox_id))
+        await database.run(database.write, path, _record_results, sent, retry, failed)
+        self.stats['sent'] += len(sent)
+        self.stats['retried'] += len(retry)
+        self.stats['failed'] += len(failed)
+        return len(rows)
+
+    async def _deliver(self, kind, payload):
+        """Вызывает обработчик записи; возвращает исключение или None при успехе."""
+        handler = self.handlers.get(kind)
+        if handler is None:
+            return UnknownKind(f"нет обработчика для '{kind}'")
+        try:
+            await handler(payload)
+        except Exception as e:
+            return e
+        return None
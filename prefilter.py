@@ -0,0 +1,173 @@
+"""
+Локальная предварительная проверка объявлений перед AI-модерацией.
+
+Очевидные случаи решаются за микросекунды без запроса к DeepSeek:
+- нецензурные слова и спам-фразы — отказ. Списки BANNED_STEMS, SPAM_PHRASES
+  и SUSPICIOUS_STEMS собраны в один автомат Ахо — Корасик, который находит
+  все вхождения за один проход по тексту. Слово из списка засчитывается
+  только с начала слова текста: «страхуй» не содержит мата, а «закладка
+  для книг» — не спам;
+- ссылки, упоминания @аккаунтов и мессенджеров, много телефонов, КАПС и
+  повторы символов — признаки, при которых решает модель;
+- текст без единого признака — одобрение.
+
+Перед поиском текст нормализуется (регистр, «ё»), а латинские буквы,
+похожие на русские («xyй»), заменяются русскими.
+"""
+
+import logging
+import re
+from collections import deque, namedtuple
+
+import search
+
+# Основы нецензурных слов: отказ
+BANNED_STEMS = (
+    "хуй", "хуе", "хуя", "хуи", "пизд", "еба", "ебл", "ебн", "ебу", "ебет", "выеб", "заеб", "наеб",
+    "отъеб", "поеб", "проеб", "разъеб", "съеб", "уеб", "долбоеб", "бляд", "блят", "сука", "суки",
+    "сучар", "сукин", "мудак", "мудил", "гандон", "гондон", "залуп", "шлюх", "пидор", "пидар", "дроч",
+)
+
+# Фразы, которых не бывает в объявлениях о детских товарах: отказ
+SPAM_PHRASES = (
+    "казино", "ставки на спорт", "букмекер", "форекс", "бинарные опцион", "криптовалют", "биткоин",
+    "пассивный доход", "заработок в интернет", "заработок без вложений", "без вложений",
+    "быстрый заработок", "легкий заработок", "быстрые деньги", "наркот", "эскорт", "вебкам",
+    "порно", "накрутк", "раскрутк", "микрозайм", "займ без", "кредит без", "обнал",
+)
+
+# Слова, при которых решение остаётся за моделью
+SUSPICIOUS_STEMS = (
+    "мошен", "обман", "развод", "предоплат", "перевод на карт", "переведите", "оплата на карт",
+    "заработ", "доход", "подработ", "работа на", "ваканси", "требуются", "инвест", "кредит", "займ", "выигр",
+    "розыгрыш", "подпиш", "подписыва", "переходи", "жми", "ссылк", "канал", "реклам", "интим",
+    "вотсап", "ватсап", "телеграм", "вайбер", "инстаграм",
+)
+
+# Латинские буквы, которыми маскируют русские
+HOMOGLYPHS = str.maketrans("aceopxykmthb", "асеорхукмтнв")
+
+LINK_RE = re.compile(
+    r"(?:https?://|www\.)\S+|\b[a-z0-9][a-z0-9-]*\.(?:ru|рф|su|com|net|org|me|io|info|biz|xyz|top|site|online|link|ly)\b"
+)
+MENTION_RE = re.compile(r"(?<!\w)@[a-z0-9_]{4,}")
+MESSENGER_RE = re.compile(r"whats\s?app|telegram|viber|instagram")
+PHONE_RE = re.compile(r"(?<!\d)(?:\+7|8)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?!\d)")
+# Пять и больше одинаковых знаков подряд («!!!!!», «ааааа»); цифры не в счёт — это цены
+REPEAT_RE = re.compile(r"([^\d\s])\1{4,}")
+
+# Больше ссылок — спам; больше телефонов — решает модель
+MAX_LINKS = 2
+MAX_PHONES = 2
+# Доля заглавных среди букв, с которой текст считается КАПСОМ (если букв не меньше CAPS_MIN_LETTERS)
+CAPS_SHARE = 0.6
+CAPS_MIN_LETTERS = 20
+
+# verdict: True — одобрить, False — отклонить, None — решает модель; reason — для журнала
+Decision = namedtuple('Decision', 'verdict reason')
+
+
+class Automaton:
+    """
+    Автомат Ахо — Корасик: находит вхождения всех образцов за один проход по тексту.
+
+    patterns — {образец: метка}; find() выдаёт (начало, образец, метка).
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, label in patterns.items():
+            node = 0
+            for char in pattern:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            self._out[node].append((pattern, label))
+        # Суффиксные ссылки строятся обходом в ширину: у детей корня ссылка на корень
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text):
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for pattern, label in self._out[node]:
+                yield i - len(pattern) + 1, pattern, label
+
+
+def build_automaton(banned=BANNED_STEMS, spam=SPAM_PHRASES, suspicious=SUSPICIOUS_STEMS):
+    patterns = {pattern: 'suspicious' for pattern in suspicious}
+    patterns.update((pattern, 'spam') for pattern in spam)
+    patterns.update((pattern, 'banned') for pattern in banned)
+    return Automaton(patterns)
+
+
+class PreFilter:
+    """
+    Первая ступень модерации: check(text) решает очевидные случаи локально.
+
+    stats считает одобренные, отклонённые и переданные модели тексты;
+    avoided_rate — доля текстов, решённых без запроса к API.
+    """
+
+    def __init__(self, automaton=None):
+        self.automaton = automaton or build_automaton()
+        self.stats = {'approved': 0, 'rejected': 0, 'escalated': 0}
+
+    @property
+    def avoided_rate(self):
+        total = sum(self.stats.values())
+        return (self.stats['approved'] + self.stats['rejected']) / total if total else 0.0
+
+    def check(self, text):
+        decision = self.decide(text)
+        key = {True: 'approved', False: 'rejected', None: 'escalated'}[decision.verdict]
+        self.stats[key] += 1
+        if decision.verdict is not None:
+            logging.info(f"Предмодерация: {decision.reason}")
+        return decision
+
+    def decide(self, text):
+        """Decision для текста, без учёта в статистике."""
+        text = text or ""
+        plain = search.normalize(text)
+        folded = plain.translate(HOMOGLYPHS)
+        hits = {'banned': [], 'spam': [], 'suspicious': []}
+        for start, pattern, label in self.automaton.find(folded):
+            if start == 0 or not folded[start - 1].isalnum():
+                hits[label].append(pattern)
+        if hits['banned']:
+            return Decision(False, f"нецензурная лексика ({hits['banned'][0]})")
+        if hits['spam']:
+            return Decision(False, f"спам ({hits['spam'][0]})")
+        links = LINK_RE.findall(plain)
+        if len(links) > MAX_LINKS:
+            return Decision(False, f"{len(links)} ссылок")
+
+        if hits['suspicious']:
+            return Decision(None, f"подозрительные слова ({', '.join(hits['suspicious'])})")
+        if links or MENTION_RE.search(plain) or MESSENGER_RE.search(plain):
+            return Decision(None, "ссылка или контакт вне бота")
+        if len(PHONE_RE.findall(text)) > MAX_PHONES:
+            return Decision(None, "много телефонов")
+        letters = [char for char in text if char.isalpha()]
+        if len(letters) >= CAPS_MIN_LETTERS and sum(char.isupper() for char in letters) > CAPS_SHARE * len(letters):
+            return Decision(None, "текст капсом")
+        if REPEAT_RE.search(plain):
+            return Decision(None, "повторы символов")
+        return Decision(True, "признаков нарушений нет")
@@ -0,0 +1,210 @@
+"""
+Тексты карточек объявлений для Telegram (parse_mode='HTML').
+
+Поля объявления вставляются экранированными: название или описание с «<»
+или «&» иначе ломает разметку, и Telegram отклоняет сообщение. Карточка
+укладывается в лимит Telegram — CAPTION_LIMIT для подписи к фото,
+MESSAGE_LIMIT для сообщения. Лимит считается по видимому тексту (без тегов
+и экранирования) в единицах UTF-16, как его считает Telegram; лишнее
+срезается с конца описания, а если его не хватает — и названия.
+
+Карточка ленты (ad_card) рисуется один раз на запись adrecord.Ad и хранится
+в ней же. Записи раздаёт кэш объявлений (cache.py), а правка объявления
+сбрасывает его запись — вместе с ней уходит и карточка.
+"""
+
+import html
+
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+# Строка объявления в списке внутри сообщения (статистика администратора)
+LINE_LIMIT = 200
+
+
+def text_length(text):
+    """Длина текста так, как её считает Telegram (единицы UTF-16)."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def truncate(text, limit):
+    """Текст, сокращённый до limit единиц UTF-16 (с «…» на конце, если сокращён)."""
+    if text_length(text) <= limit:
+        return text
+    if limit <= 0:
+        return ""
+    # Половинка суррогатной пары на границе среза отбрасывается
+    cut = text.encode('utf-16-le')[:2 * (limit - 1)].decode('utf-16-le', errors='ignore')
+    return cut.rstrip() + "…"
+
+
+def limit_for(photo_id):
+    return CAPTION_LIMIT if photo_id else MESSAGE_LIMIT
+
+
+def escape(value):
+    return html.escape(str(value), quote=False)
+
+
+def bold(text):
+    return f"<b>{text}</b>"
+
+
+def plain(text):
+    return text
+
+
+def fit(compose, title, description, limit):
+    """
+    Собирает карточку compose(title, description, escape, bold), сокращая
+    описание так, чтобы видимый текст уложился в limit; если не хватает и
+    пустого описания, сокращается название. Длина считается по той же
+    карточке без разметки: compose(title, description, str, plain).
+    """
+    card = compose(title, description, escape, bold)
+    # Видимый текст не длиннее разметки, а символ — не больше двух единиц UTF-16:
+    # обычная карточка заведомо в лимите, и считать её длину не нужно
+    if 2 * len(card) <= limit:
+        return card
+    excess = text_length(compose(title, description, str, plain)) - limit
+    if excess <= 0:
+        return card
+    description = str(description or "")
+    excess -= text_length(description)
+    description = truncate(description, -excess)
+    if excess > 0:
+        title = str(title)
+        title = truncate(title, text_length(title) - excess)
+    return compose(title, description, escape, bold)
+
+
+def _listing(ad, title, description, esc, b):
+    text = f"{b(esc(title))} [{esc(ad.category)}]\n{esc(description)}\n💰 {esc(ad.price)} руб.\n👤 @{esc(ad.username)}"
+    if ad.district:
+        text += f"\n📍 Район: {esc(ad.district)}"
+    if ad.age_group:
+        text += f"\n👶 Возраст: {esc(ad.age_group)}"
+    if ad.gender:
+        text += f"\n🚻 Пол: {esc(ad.gender)}"
+    if ad.condition:
+        text += f"\n📦 Состояние: {esc(ad.condition)}"
+    return text
+
+
+def ad_card(ad):
+    """Карточка объявления в ленте, поиске и избранном; рисуется один раз на запись Ad."""
+    card = ad.card
+    if card is None:
+        card = ad.card = fit(lambda title, description, esc, b: _listing(ad, title, description, esc, b),
+                             ad.title, ad.description, limit_for(ad.photo))
+    return card
+
+
+def numbered_card(ad, number):
+    """Карточка с номером на странице — подпись к фото в альбоме (см. bot.send_ads_page)."""
+    prefix = f"{number}. "
+    card = ad_card(ad)
+    limit = limit_for(ad.photo)
+    if 2 * (len(prefix) + len(card)) <= limit:
+        return prefix + card
+    return fit(lambda title, description, esc, b: prefix + _listing(ad, title, description, esc, b),
+               ad.title, ad.description, limit)
+
+
+def owner_card(ad):
+    """Карточка объявления в «Моих объявлениях» (все поля, включая незаполненные)."""
+    def compose(title, description, esc, b):
+        info = (f"Возраст: {esc(ad.age_group)} | Пол: {esc(ad.gender)} | "
+                f"Состояние: {esc(ad.condition)}")
+        return (f"{b(esc(title))} [{esc(ad.category)}]\n{info}\n{esc(description)}\n"
+                f"💰 {esc(ad.price)} руб.\n📍 Район: {esc(ad.district)}\n👤 @{esc(ad.username)}")
+    return fit(compose, ad.title, ad.description, limit_for(ad.photo))
+
+
+def owner_short_card(ad):
+    """Краткая карточка объявления в /myads."""
+    def compose(title, description, esc, b):
+        return f"{b(esc(title))} [{esc(ad.category)}]\n{esc(description)}\n💰 {esc(ad.price)} руб."
+    return fit(compose, ad.title, ad.description, limit_for(ad.photo))
+
+
+def subscriber_notice(category, title, description, price, username, photo_id=None):
+    """Текст уведомления подписчикам категории о новом объявлении."""
+    def compose(title, description, esc, b):
+        return (
+            f"🔔 Новое объявление в категории {esc(category)}:\n\n"
+            f"{b(esc(title))}\n"
+            f"{esc(description)}\n"
+            f"💰 {esc(price)} руб.\n"
+            f"Автор: @{esc(username)}"
+        )
+    return fit(compose, title, description, limit_for(photo_id))
+
+
+def public_post(title, description, price, username, district, age_group=None, gender=None, condition=None,
+                photo_id=None):
+    """Текст поста о новом объявлении в общем чате."""
+    def compose(title, description, esc, b):
+        text = (
+            f"📢 Новое объявление:\n\n"
+            f"{b(esc(title))}\n"
+            f"{esc(description)}\n"
+            f"💰 {esc(price)} руб.\n"
+            f"👤 @{esc(username)}\n"
+            f"📍 {esc(district)}"
+        )
+        additional = []
+        if age_group:
+            additional.append(f"👶 Возраст: {esc(age_group)}")
+        if gender:
+            additional.append(f"🚻 Пол: {esc(gender)}")
+        if condition:
+            additional.append(f"📦 Состояние: {esc(condition)}")
+        if additional:
+            text += "\n" + "\n".join(additional)
+        return text
+    return fit(compose, title, description, limit_for(photo_id))
+
+
+def complaint_alert(complaint_id, ad_id, ad_username, ad_user_id, user_id, reason, time,
+                    title, description, price, category):
+    """Уведомление администратору о новой жалобе на объявление."""
+    def compose(title, description, esc, b):
+        return (
+            f"⚠️ {b('Новая жалоба')}\n\n"
+            f"🆔 Жалоба #{complaint_id}\n"
+            f"📌 Объявление #{ad_id}\n"
+            f"👤 Автор объявления: @{esc(ad_username)} (id: {ad_user_id})\n"
+            f"👤 Пожаловался пользователь: id {user_id}\n"
+            f"📝 Причина: {esc(reason)}\n"
+            f"🕐 Время: {time}\n\n"
+            f"📌 {b('Объявление:')}\n"
+            f"{b(esc(title))}\n"
+            f"{esc(description)}\n"
+            f"💰 {esc(price)} руб.\n"
+            f"🏷️ Категория: {esc(category)}"
+        )
+    return fit(compose, title, description, MESSAGE_LIMIT)
+
+
+def stats_line(title, price, username):
+    """Строка объявления в статистике администратора; длинное название сокращается до LINE_LIMIT."""
+    def compose(title, description, esc, b):
+        return f"  • {esc(title)} — {esc(price)} руб. (от @{esc(username)})"
+    return fit(compose, title, "", LINE_LIMIT)
+
+
+def _title_notice(template, title):
+    """Сообщение автору по шаблону с названием объявления на месте {title}."""
+    return fit(lambda title, description, esc, b: template.format(title=esc(title)), title, "", MESSAGE_LIMIT)
+
+
+def expired_notice(title):
+    """Сообщение автору об удалении объявления по сроку."""
+    return _title_notice("❌ Ваше объявление «{title}» удалено по истечении 7 дней.", title)
+
+
+def moderation_notice(title, approved):
+    """Сообщение автору о решении фоновой модерации."""
+    if approved:
+        return _title_notice("✅ Объявление «{title}» прошло модерацию и опубликовано!", title)
+    return _title_notice("❌ Объявление «{title}» не прошло модерацию (содержит недопустимый контент).", title)
@@ -0,0 +1,102 @@
+"""
+Планировщик событий по времени.
+
+Scheduler хранит для каждого ключа срок ближайшего события в куче
+(срок, ключ). Перепланирование и отмена не ищут старую запись в куче:
+она остаётся там и пропускается, когда доходит до вершины (ленивое
+удаление). run() спит ровно до ближайшего срока и передаёт обработчику
+ключи созревших событий; событие раньше текущего ближайшего будит его сразу.
+
+schedule() и cancel() потокобезопасны: их вызывают функции работы с БД,
+выполняемые в пуле потоков (см. database.awaitable).
+"""
+
+import asyncio
+import heapq
+import logging
+import threading
+import time
+
+
+class Scheduler:
+    """Куча событий {ключ: срок} со сном до ближайшего срока (секунды clock())."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._heap = []
+        self._due = {}               # ключ -> актуальный срок
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._due)
+
+    def schedule(self, key, when):
+        """Назначает событию key срок when, заменяя прежний."""
+        with self._lock:
+            earliest = self._peek()
+            self._due[key] = when
+            heapq.heappush(self._heap, (when, key))
+        if earliest is None or when < earliest:
+            self._wake()
+
+    def cancel(self, key):
+        with self._lock:
+            self._due.pop(key, None)
+
+    def when(self, key):
+        """Срок события key или None."""
+        return self._due.get(key)
+
+    def next_time(self):
+        """Срок ближайшего события или None, если событий нет."""
+        with self._lock:
+            return self._peek()
+
+    def pop_due(self, now=None):
+        """Снимает с кучи и возвращает ключи событий, срок которых наступил."""
+        now = self.clock() if now is None else now
+        keys = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, key = heapq.heappop(self._heap)
+                if self._due.get(key) == when:
+                    del self._due[key]
+                    keys.append(key)
+        return keys
+
+    def _peek(self):
+        # Устаревшие записи (перепланированные и отменённые) выбрасываются с вершины
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def _wake(self):
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Цикл событий уже закрыт
+            pass
+
+    async def run(self, handler):
+        """Бесконечный цикл: ждёт ближайшего срока и вызывает await handler(ключи)."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            keys = self.pop_due()
+            if keys:
+                try:
+                    await handler(keys)
+                except Exception as e:
+                    logging.error(f"Ошибка обработки запланированных событий: {e}")
+                continue
+            when = self.next_time()
+            delay = None if when is None else max(0.0, when - self.clock())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,264 @@
+"""
+Полнотекстовый поиск объявлений.
+
+Для каждого объявления в таблице ads_search хранятся основы слов его
+названия и описания (нормализация + стемминг Snowball для русского языка),
+а виртуальная таблица FTS5 ads_fts индексирует их (см. migrations.py).
+Так «коляску», «коляски» и «коляска» находят друг друга.
+
+Опечатки («каляска») исправляются по словарю основ: для каждой основы
+в search_trigrams хранятся её триграммы, и слово запроса, не найденное
+в индексе, заменяется близкими по расстоянию редактирования основами.
+
+Индекс обновляется по одному объявлению (index_ad) в той же транзакции,
+что и изменение объявления; при удалении объявления запись из ads_search
+убирает триггер.
+"""
+
+import functools
+import re
+
+# Слова: буквы и цифры любого алфавита (так же делит текст токенизатор unicode61)
+WORD_RE = re.compile(r"[^\W_]+")
+
+
+def normalize(text):
+    """Нижний регистр и «ё» → «е»: «Ёлка» и «елка» должны находить друг друга."""
+    return text.lower().replace("ё", "е")
+
+
+def normalize_sql(column):
+    """SQL-выражение, нормализующее колонку так же, как normalize() (для триггеров FTS)."""
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def words(text):
+    """Нормализованные слова текста."""
+    return WORD_RE.findall(normalize(text or ""))
+
+
+# --- Стемминг: алгоритм Snowball для русского языка ---
+
+VOWELS = "аеиоуыэюя"
+
+# Окончания из групп *_1 удаляются, только если перед ними стоит «а» или «я»
+PERFECTIVE_GERUND_1 = ("в", "вши", "вшись")
+PERFECTIVE_GERUND_2 = ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись")
+ADJECTIVE = ("ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+             "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+REFLEXIVE = ("ся", "сь")
+VERB_1 = ("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны", "ть", "ешь", "нно")
+VERB_2 = ("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл", "им", "ым", "ен",
+          "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить", "ыть", "ишь", "ую", "ю")
+NOUN = ("а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей", "ой", "ий", "й",
+        "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы", "ь", "ию", "ью", "ю", "ия", "ья", "я")
+SUPERLATIVE = ("ейше", "ейш")
+DERIVATIONAL = ("ость", "ост")
+
+
+def _regions(word):
+    """Начала областей RV и R2 (индексы в слове)."""
+    def after_vowel_consonant(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in VOWELS), len(word))
+    r1 = after_vowel_consonant(0)
+    r2 = after_vowel_consonant(r1)
+    return rv, r2
+
+
+def _strip(word, start, endings, after_a_ya=()):
+    """
+    Удаляет самое длинное окончание из endings или after_a_ya, лежащее в word[start:].
+
+    Окончания after_a_ya удаляются, только если им предшествует «а» или «я»
+    (тоже внутри области). Возвращает укороченное слово или None.
+    """
+    best, needs_a_ya = "", False
+    for group, condition in ((endings, False), (after_a_ya, True)):
+        for ending in group:
+            if len(ending) > len(best) and word.endswith(ending) and len(word) - len(ending) >= start:
+                best, needs_a_ya = ending, condition
+    if not best:
+        return None
+    cut = len(word) - len(best)
+    if needs_a_ya and (cut - 1 < start or word[cut - 1] not in "ая"):
+        return None
+    return word[:cut]
+
+
+def _adjectival(word, rv):
+    stripped = _strip(word, rv, ADJECTIVE)
+    if stripped is None:
+        return None
+    participle = _strip(stripped, rv, PARTICIPLE_2, PARTICIPLE_1)
+    return stripped if participle is None else participle
+
+
+@functools.lru_cache(maxsize=100000)
+def stem(word):
+    """Основа русского слова по алгоритму Snowball (слово — уже нормализованное)."""
+    rv, r2 = _regions(word)
+    stemmed = _strip(word, rv, PERFECTIVE_GERUND_2, PERFECTIVE_GERUND_1)
+    if stemmed is None:
+        stemmed = _strip(word, rv, REFLEXIVE) or word
+        for step in (_adjectival,
+                     lambda w, start: _strip(w, start, VERB_2, VERB_1),
+                     lambda w, start: _strip(w, start, NOUN)):
+            result = step(stemmed, rv)
+            if result is not None:
+                stemmed = result
+                break
+    if stemmed.endswith("и") and len(stemmed) - 1 >= rv:
+        stemmed = stemmed[:-1]
+    stemmed = _strip(stemmed, r2, DERIVATIONAL) or stemmed
+    if stemmed.endswith("нн") and len(stemmed) - 2 >= rv:
+        stemmed = stemmed[:-1]
+    else:
+        superlative = _strip(stemmed, rv, SUPERLATIVE)
+        if superlative is not None:
+            stemmed = superlative
+            if stemmed.endswith("нн") and len(stemmed) - 2 >= rv:
+                stemmed = stemmed[:-1]
+        elif stemmed.endswith("ь") and len(stemmed) - 1 >= rv:
+            stemmed = stemmed[:-1]
+    return stemmed
+
+
+def terms(text):
+    """Основы слов текста в том виде, в каком они лежат в индексе."""
+    return [stem(word) for word in words(text)]
+
+
+# --- Нечёткий поиск по триграммам ---
+
+def trigrams(term):
+    """Триграммы основы с границами слова: «ляск» → « ля», «ляс», «яск», «ск »."""
+    padded = f" {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_typos(term):
+    """Сколько опечаток допускается в основе такой длины."""
+    if len(term) < 4:
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def edit_distance(a, b, limit):
+    """Расстояние Дамерау—Левенштейна (с перестановкой соседних букв); > limit — limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return current[-1]
+
+
+def similar_terms(conn, term, limit=5):
+    """Основы из индекса, отличающиеся от term не больше чем на max_typos(term) правок."""
+    typos = max_typos(term)
+    if not typos:
+        return []
+    grams = trigrams(term)
+    # Каждая правка портит не больше трёх триграмм
+    min_shared = max(1, len(grams) - 3 * typos)
+    placeholders = ", ".join("?" * len(grams))
+    candidates = conn.execute(f"""
+        SELECT term, COUNT(*) AS shared FROM search_trigrams
+        WHERE trigram IN ({placeholders})
+        GROUP BY term HAVING shared >= ?
+        ORDER BY shared DESC LIMIT 50
+    """, (*grams, min_shared)).fetchall()
+    close = sorted((edit_distance(term, candidate, typos), -shared, candidate)
+                   for candidate, shared in candidates if candidate != term)
+    close = [candidate for distance, _, candidate in close if distance <= typos]
+    if not close:
+        return []
+    # Словарь только пополняется: оставляем основы, которые ещё есть в объявлениях
+    placeholders = ", ".join("?" * len(close))
+    live = {row[0] for row in conn.execute(f"SELECT term FROM ads_fts_terms WHERE term IN ({placeholders})", close)}
+    return [candidate for candidate in close if candidate in live][:limit]
+
+
+def has_matches(conn, term, word):
+    """Есть ли в индексе основа term или слова, начинающиеся с word."""
+    row = conn.execute(
+        "SELECT 1 FROM ads_fts_terms WHERE term = ? OR (term >= ? AND term < ?) LIMIT 1",
+        (term, word, word + "\uffff"),
+    ).fetchone()
+    return row is not None
+
+
+def fts_query(conn, text):
+    """
+    Строит запрос FTS5 MATCH из пользовательского ввода.
+
+    Каждое слово ищется по основе или по началу («коля» найдёт «коляска»);
+    если ни того, ни другого в индексе нет, к нему добавляются близкие
+    основы с опечаткой. Слова объединяются через AND и берутся в кавычки,
+    поэтому операторы FTS5 во вводе не интерпретируются. Возвращает None,
+    если в запросе нет ни одного слова.
+    """
+    groups = []
+    for word in words(text):
+        term = stem(word)
+        alternatives = [f'"{term}"', f'"{word}"*']
+        if not has_matches(conn, term, word):
+            alternatives += [f'"{similar}"' for similar in similar_terms(conn, term)]
+        groups.append("(" + " OR ".join(dict.fromkeys(alternatives)) + ")")
+    return " AND ".join(groups) or None
+
+
+# --- Обновление индекса ---
+
+def index_ad(conn, ad_id):
+    """Пересчитывает поисковую запись объявления (вызывается в транзакции записи)."""
+    row = conn.execute("SELECT title, description FROM ads WHERE id = ?", (ad_id,)).fetchone()
+    if row is None:
+        return
+    title_terms, description_terms = terms(row[0]), terms(row[1])
+    conn.execute("""
+        INSERT INTO ads_search (ad_id, title, description) VALUES (?, ?, ?)
+        ON CONFLICT(ad_id) DO UPDATE SET title = excluded.title, description = excluded.description
+    """, (ad_id, " ".join(title_terms), " ".join(description_terms)))
+    add_to_vocabulary(conn, set(title_terms) | set(description_terms))
+
+
+def add_to_vocabulary(conn, new_terms, chunk_size=500):
+    """Добавляет в словарь основ незнакомые основы вместе с их триграммами."""
+    new_terms = list(new_terms)
+    for start in range(0, len(new_terms), chunk_size):
+        chunk = new_terms[start:start + chunk_size]
+        placeholders = ", ".join("?" * len(chunk))
+        known = {row[0] for row in conn.execute(f"SELECT term FROM search_vocab WHERE term IN ({placeholders})", chunk)}
+        unknown = [term for term in chunk if term not in known]
+        conn.executemany("INSERT INTO search_vocab (term) VALUES (?)", [(term,) for term in unknown])
+        conn.executemany("INSERT OR IGNORE INTO search_trigrams (trigram, term) VALUES (?, ?)",
+                         [(gram, term) for term in unknown for gram in trigrams(term)])
+
+
+def rebuild(conn):
+    """Индексирует все объявления заново (миграция, загрузка данных в обход бота)."""
+    conn.execute("DELETE FROM ads_search")
+    vocabulary = set()
+    rows = []
+    for ad_id, title, description in conn.execute("SELECT id, title, description FROM ads"):
+        title_terms, description_terms = terms(title), terms(description)
+        vocabulary.update(title_terms)
+        vocabulary.update(description_terms)
+        rows.append((ad_id, " ".join(title_terms), " ".join(description_terms)))
+    conn.executemany("INSERT INTO ads_search (ad_id, title, description) VALUES (?, ?, ?)", rows)
+    add_to_vocabulary(conn, vocabulary)
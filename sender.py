@@ -0,0 +1,296 @@
+"""
+Очередь исходящих запросов к Telegram.
+
+Bot API ограничивает частоту отправки: около 30 сообщений в секунду на бота,
+не чаще сообщения в секунду в один чат и 20 сообщений в минуту в группу.
+При превышении API отвечает 429 Too Many Requests с retry_after, и сообщение,
+которое не отправили повторно, теряется.
+
+SendQueue пропускает через себя все запросы, адресованные чату (методы с
+chat_id), и отправляет их:
+- не чаще GLOBAL_RATE в секунду на весь бот;
+- в каждый чат — по порядку, по одному, с собственным ограничителем
+  (chat_limits: личный чат — сообщение в секунду с пачкой не больше
+  CHAT_BURST, группа — 20 сообщений в минуту);
+- с приоритетом: ответы пользователям (INTERACTIVE) уходят раньше рассылок
+  (BROADCAST), даже если рассылка поставлена в очередь раньше;
+- не больше WORKERS запросов одновременно;
+- при 429 чат ставится на паузу на retry_after, а запрос повторяется
+  (до MAX_RETRIES раз), вместо того чтобы потеряться.
+
+К боту очередь подключается как middleware сессии aiogram
+(ThrottlingMiddleware), поэтому ограничения действуют и на message.answer()
+в обработчиках. Рассылки помечаются контекстом: `with sender.broadcast(): ...`;
+задачи, созданные внутри блока (asyncio.gather), наследуют приоритет.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+from collections import deque
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+# Общий предел бота, запросов в секунду
+GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+# Личный чат: одно сообщение в секунду, подряд — не больше CHAT_BURST. Telegram
+# терпит лишь короткие всплески сверх сообщения в секунду, дальше отвечает 429
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+# Группы и каналы: 20 сообщений в минуту
+GROUP_RATE = 20 / 60
+GROUP_BURST = 3
+# Сколько запросов выполняется одновременно
+WORKERS = int(os.getenv('SEND_WORKERS', '8'))
+# Сколько раз повторять запрос после 429
+MAX_RETRIES = 3
+# Сверх стольких ограничителей чатов неактивные удаляются
+MAX_IDLE_BUCKETS = 10000
+
+# Приоритеты: меньше — раньше
+INTERACTIVE = 0
+BROADCAST = 1
+
+_priority = contextvars.ContextVar('send_priority', default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def broadcast():
+    """Запросы внутри блока (и созданных в нём задач) отправляются с приоритетом рассылки."""
+    token = _priority.set(BROADCAST)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def chat_limits(chat_id):
+    """(запросов в секунду, пачка подряд) для чата: группы и каналы строже личных чатов."""
+    if isinstance(chat_id, str) or chat_id < 0:
+        return GROUP_RATE, GROUP_BURST
+    return CHAT_RATE, CHAT_BURST
+
+
+class TokenBucket:
+    """
+    Ограничитель «ведро токенов»: rate токенов в секунду, в запасе не больше capacity.
+
+    Время передаётся явно (now — секунды монотонных часов), поэтому
+    ограничитель не зависит от цикла событий.
+    """
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд появится токен (0 — уже есть)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now, seconds):
+        """Следующий токен — не раньше чем через seconds (ответ 429 с retry_after)."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('call', 'chat_id', 'priority', 'seq', 'future', 'attempts')
+
+    def __init__(self, call, chat_id, priority, seq, future):
+        self.call = call
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.attempts = 0
+
+
+class SendQueue:
+    """
+    Очередь запросов с общим и початовым ограничением частоты (см. описание модуля).
+
+    Запросы одного чата стоят в своей очереди (FIFO). Чат, у которого есть
+    запросы и свободен ограничитель, лежит в куче готовых по приоритету
+    первого запроса; чат, ждущий ограничителя, — в куче отложенных по времени.
+    Обработчики (WORKERS штук) берут из кучи готовых самый приоритетный чат,
+    как только общий ограничитель даёт токен.
+    """
+
+    def __init__(self, rate=GLOBAL_RATE, workers=WORKERS, limits=chat_limits, max_retries=MAX_RETRIES):
+        self.rate = rate
+        self.workers = workers
+        self.limits = limits
+        self.max_retries = max_retries
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+        self._loop = None
+        self._tasks = []
+        self._seq = itertools.count()
+        self._chats = {}     # chat_id -> deque[_Job]
+        self._buckets = {}   # chat_id -> TokenBucket
+        self._ready = []     # (приоритет, номер, chat_id)
+        self._delayed = []   # (время, номер, chat_id)
+        self._busy = set()   # чаты, запрос в которые сейчас выполняется
+
+    def _start(self):
+        """Запускает обработчики в текущем цикле событий (при первом запросе)."""
+        self._loop = asyncio.get_running_loop()
+        self._global = TokenBucket(self.rate, 1, self._loop.time())
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        """Останавливает обработчики; невыполненные запросы завершаются отменой."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        for jobs in self._chats.values():
+            for job in jobs:
+                job.future.cancel()
+        self._chats.clear()
+        self._ready.clear()
+        self._delayed.clear()
+        self._busy.clear()
+
+    def pending(self):
+        """Сколько запросов ждёт отправки."""
+        return sum(len(jobs) for jobs in self._chats.values())
+
+    async def submit(self, call, chat_id, priority=None):
+        """
+        Ставит запрос в очередь и ждёт его результата.
+
+        call — функция без аргументов, возвращающая корутину запроса (её
+        вызывают заново при повторе). Ошибки запроса пробрасываются вызывающему.
+        """
+        if self._loop is not asyncio.get_running_loop():
+            self._start()
+        future = self._loop.create_future()
+        job = _Job(call, chat_id, _priority.get() if priority is None else priority, next(self._seq), future)
+        jobs = self._chats.setdefault(chat_id, deque())
+        jobs.append(job)
+        if len(jobs) == 1 and chat_id not in self._busy:
+            self._schedule(chat_id)
+        return await future
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate, burst = self.limits(chat_id)
+            bucket = self._buckets[chat_id] = TokenBucket(rate, burst, self._loop.time())
+        return bucket
+
+    def _schedule(self, chat_id):
+        """Кладёт чат с запросами в кучу готовых или отложенных по его ограничителю."""
+        now = self._loop.time()
+        delay = self._bucket(chat_id).wait_time(now)
+        if delay:
+            heapq.heappush(self._delayed, (now + delay, next(self._seq), chat_id))
+        else:
+            head = self._chats[chat_id][0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._wakeup.set()
+
+    async def _next_job(self):
+        """Ждёт, пока самый приоритетный готовый запрос можно отправить, и забирает его."""
+        async with self._lock:
+            while True:
+                now = self._loop.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, chat_id = heapq.heappop(self._delayed)
+                    self._schedule(chat_id)
+                if self._ready:
+                    delay = self._global.wait_time(now)
+                    if not delay:
+                        _, _, chat_id = heapq.heappop(self._ready)
+                        job = self._chats[chat_id].popleft()
+                        if job.future.done():
+                            # Вызывающий перестал ждать (отмена): запрос не отправляем
+                            self._release(chat_id)
+                            continue
+                        self._busy.add(chat_id)
+                        self._global.take(now)
+                        self._bucket(chat_id).take(now)
+                        return job
+                else:
+                    delay = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _release(self, chat_id):
+        """Чат снова может отправлять: планируем следующий запрос или забываем чат."""
+        self._busy.discard(chat_id)
+        if self._chats.get(chat_id):
+            self._schedule(chat_id)
+            return
+        self._chats.pop(chat_id, None)
+        if len(self._buckets) > MAX_IDLE_BUCKETS:
+            now = self._loop.time()
+            self._buckets = {chat: bucket for chat, bucket in self._buckets.items()
+                             if chat in self._chats or not bucket.is_full(now)}
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            try:
+                result = await job.call()
+            except TelegramRetryAfter as e:
+                if job.attempts < self.max_retries and not job.future.done():
+                    job.attempts += 1
+                    self.stats['retried'] += 1
+                    logging.warning(f"Telegram просит подождать {e.retry_after} с перед отправкой в чат {job.chat_id}")
+                    self._bucket(job.chat_id).pause(self._loop.time(), e.retry_after)
+                    self._chats[job.chat_id].appendleft(job)
+                else:
+                    self.stats['failed'] += 1
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            except Exception as e:
+                self.stats['failed'] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.stats['sent'] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self._release(job.chat_id)
+
+
+class ThrottlingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии aiogram: запросы с chat_id проходят через SendQueue, остальные — напрямую."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        return await self.queue.submit(lambda: make_request(bot, method), chat_id)
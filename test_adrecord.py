@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Тесты записи объявления (adrecord.py) и того, что все выборки бота отдают её.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import adrecord
+import bot
+import database
+
+ROW = (7, "Санки", "Деревянные", 900, "Игрушки", "Центр", None, "mama", None, "👦 Мальчик", None, 42)
+
+
+class TestAd(unittest.TestCase):
+    """Ad со __slots__ читается и как объект, и как словарь."""
+
+    def test_dict_compatibility(self):
+        ad = adrecord.Ad(*ROW)
+        self.assertEqual((ad.id, ad['title'], ad.get('gender'), ad.get('nope', 1)), (7, "Санки", "👦 Мальчик", 1))
+        self.assertIn('user_id', ad)
+        self.assertNotIn('nope', ad)
+        with self.assertRaises(KeyError):
+            ad['nope']
+        self.assertEqual(ad, dict(zip(adrecord.FIELDS, ROW)))
+        self.assertEqual(adrecord.Ad.from_dict({'id': 7, 'title': "Санки"}).price, None)
+        self.assertFalse(hasattr(ad, '__dict__'))
+
+    def test_replace_keeps_original(self):
+        ad = adrecord.Ad(*ROW)
+        changed = ad.replace(price=500)
+        self.assertEqual((ad.price, changed.price), (900, 500))
+        self.assertNotEqual(ad, changed)
+
+
+class TestBotReturnsAd(unittest.TestCase):
+    """Все функции чтения отдают Ad с одинаковыми полями."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        self.original_db_path = bot.DB_PATH
+        bot.DB_PATH = self.db_path
+        bot.init_db()
+
+    def tearDown(self):
+        bot.DB_PATH = self.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def test_all_readers_agree(self):
+        category, district = bot.CATEGORIES[0], bot.YAKUTSK_DISTRICTS[0]
+        ad_id = bot.add_ad_to_db("Коляска", "Прогулочная", 5000, category, district, "photo-1", 42, "mama",
+                                 condition=bot.CONDITIONS[0])
+        bot.add_favorite(43, ad_id)
+        expected = bot.get_ad_by_id(ad_id)
+        self.assertIsInstance(expected, adrecord.Ad)
+        self.assertEqual((expected.photo, expected.user_id, expected.username), ("photo-1", 42, "mama"))
+        for ads in (bot.get_all_ads(), bot.get_ads_by_category(category), bot.get_ads_by_district(district),
+                    bot.get_user_ads(42), bot.get_user_favorites(43), bot.search_ads("коляска"),
+                    bot.find_ads({'price_max': 6000})):
+            self.assertEqual(ads, [expected])
+        self.assertIn("📦 Состояние", bot.format_ad_text(expected))
+
+    def test_fsm_state_gets_plain_dict(self):
+        """В состояние FSM при правке попадает словарь, а не общий объект Ad из кэша."""
+        ad_id = bot.add_ad_to_db("Коляска", "Прогулочная", 5000, bot.CATEGORIES[0], None, None, 42, "mama")
+        callback = MagicMock(data=f"edit_{ad_id}")
+        callback.from_user.id = 42
+        callback.answer = callback.message.answer = callback.message.edit_reply_markup = AsyncMock()
+        state = AsyncMock()
+        asyncio.run(bot.edit_ad_start(callback, state))
+        data = state.update_data.call_args.kwargs['edit_ad_data']
+        self.assertIs(type(data), dict)
+        self.assertEqual(adrecord.Ad.from_dict(json.loads(json.dumps(data))), bot.get_ad_by_id(ad_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Тесты режима фоновой модерации (MODERATION_MODE='async'): объявление сохраняется
+как ожидающее, пользователь получает ответ сразу, публикация — после одобрения.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+import database
+
+FORM = {
+    'title': "Коляска", 'description': "Прогулочная", 'price': 5000, 'category': bot.CATEGORIES[1],
+    'district': bot.YAKUTSK_DISTRICTS[0], 'age_group': None, 'gender': None, 'condition': None,
+}
+
+
+class TestAsyncModeration(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        self.original_db_path = bot.DB_PATH
+        bot.DB_PATH = self.db_path
+        bot.init_db()
+        bot.add_subscription(1, FORM['category'])
+        self.mock_bot = MagicMock()
+        self.mock_bot.send_message = AsyncMock(return_value=MagicMock(message_id=555))
+        self.moderate = AsyncMock(return_value=True)
+        for patcher in (patch('bot.bot', self.mock_bot), patch.object(bot, 'CHAT_ID', '-100500'),
+                        patch.object(bot, 'MODERATION_MODE', 'async'),
+                        patch.object(bot, 'moderate_with_deepseek', self.moderate),
+                        # Очередь привязывается к циклу событий теста
+                        patch.object(bot, 'pending_moderation', asyncio.Queue()),
+                        patch.dict(bot.moderation_retries, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        bot.DB_PATH = self.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def outbox_keys(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return sorted(row[0].split(':')[0] for row in conn.execute("SELECT idempotency_key FROM outbox"))
+
+    async def submit(self, user_id=42):
+        return await bot.submit_for_moderation(FORM, None, MagicMock(id=user_id, username="mama"))
+
+    async def test_handler_answers_before_moderation(self):
+        message = MagicMock()
+        message.from_user = MagicMock(id=42, username="mama")
+        message.photo = None
+        message.answer = AsyncMock()
+        state = AsyncMock()
+        state.get_data.return_value = dict(FORM)
+        await bot.add_photo(message, state)
+        self.assertIn("отправлено на модерацию", message.answer.call_args.args[0])
+        self.moderate.assert_not_called()
+        self.assertEqual(bot.get_pending_ad_ids(), [1])
+        self.assertEqual(bot.pending_moderation.get_nowait(), 1)
+        # До решения объявление не видно и уведомления не отправляются
+        self.assertEqual(bot.get_all_ads(), [])
+        self.assertEqual(self.outbox_keys(), [])
+
+    async def test_approved_ad_is_published(self):
+        pending_id = await self.submit()
+        self.assertTrue(await bot.moderate_pending_ad(pending_id))
+        await asyncio.gather(*bot.broadcast_tasks)
+        ads = bot.get_all_ads()
+        self.assertEqual([ad['title'] for ad in ads], ["Коляска"])
+        self.assertEqual(bot.get_pending_ad_ids(), [])
+        self.assertEqual(self.outbox_keys(), ['moderated', 'public_post'])
+        self.assertEqual(self.mock_bot.send_message.call_args.kwargs['chat_id'], 1)
+        self.assertEqual(self.moderate.call_args.args[0], "Коляска\nПрогулочная\nЦена: 5000")
+
+        await bot.outbox_worker.drain()
+        texts = {call.args[0]: call.args[1] for call in self.mock_bot.send_message.call_args_list if call.args}
+        self.assertIn("прошло модерацию", texts[42])
+        # Повторное решение по тому же объявлению ничего не делает
+        self.assertIsNone(await bot.moderate_pending_ad(pending_id))
+        self.assertIsNone(bot.approve_pending_ad(pending_id))
+
+    async def test_rejected_ad_is_dropped(self):
+        self.moderate.return_value = False
+        pending_id = await self.submit()
+        self.assertFalse(await bot.moderate_pending_ad(pending_id))
+        self.assertEqual(bot.get_all_ads(), [])
+        self.assertEqual(bot.get_pending_ad_ids(), [])
+        self.assertEqual(self.outbox_keys(), ['moderated'])
+
+    async def test_no_verdict_keeps_ad_pending(self):
+        """Без вердикта (API недоступен) объявление не отклоняется, а возвращается в очередь с задержкой."""
+        self.moderate.return_value = None
+        pending_id = await self.submit()
+        bot.pending_moderation.get_nowait()
+        with patch.object(bot, 'MODERATION_RETRY_BASE', 0.05):
+            self.assertIsNone(await bot.moderate_pending_ad(pending_id))
+            self.assertIsNone(await bot.moderate_pending_ad(pending_id))
+        self.assertEqual(bot.moderation_retries, {pending_id: 2})
+        self.assertEqual(bot.get_pending_ad_ids(), [pending_id])
+        self.assertEqual(self.outbox_keys(), [])
+        self.assertTrue(bot.pending_moderation.empty())
+        # Повторы — через 0.05 и 0.1 с
+        self.assertEqual(await asyncio.wait_for(bot.pending_moderation.get(), 1), pending_id)
+        self.assertEqual(await asyncio.wait_for(bot.pending_moderation.get(), 1), pending_id)
+
+        self.moderate.return_value = True
+        self.assertTrue(await bot.moderate_pending_ad(pending_id))
+        await asyncio.gather(*bot.broadcast_tasks)
+        self.assertEqual(bot.moderation_retries, {})
+        self.assertEqual(bot.get_pending_ad_ids(), [])
+
+    async def test_worker_retries_after_error(self):
+        """Ошибка обработчика не теряет объявление: оно возвращается в очередь с задержкой."""
+        self.moderate.side_effect = [RuntimeError("boom"), True]
+        pending_id = await self.submit()
+        with patch.object(bot, 'MODERATION_RETRY_BASE', 0.05):
+            task = asyncio.create_task(bot.moderation_worker())
+            try:
+                for _ in range(100):
+                    if bot.get_all_ads():
+                        break
+                    await asyncio.sleep(0.02)
+            finally:
+                task.cancel()
+                await asyncio.gather(task, *bot.broadcast_tasks, return_exceptions=True)
+        self.assertEqual(self.moderate.await_count, 2)
+        self.assertEqual(bot.get_pending_ad_ids(), [])
+        self.assertEqual([ad['title'] for ad in bot.get_all_ads()], ["Коляска"])
+        self.assertNotIn(pending_id, bot.moderation_retries)
+
+    async def test_sync_mode_queues_ad_without_verdict(self):
+        """В синхронном режиме объявление без вердикта уходит в фоновую очередь."""
+        self.moderate.return_value = None
+        message = MagicMock()
+        message.from_user = MagicMock(id=42, username="mama")
+        message.answer = AsyncMock()
+        state = AsyncMock()
+        state.get_data.return_value = dict(FORM)
+        with patch.object(bot, 'MODERATION_MODE', 'sync'):
+            await bot.skip_photo(message, state)
+        self.assertIn("Модерация сейчас недоступна", message.answer.call_args.args[0])
+        self.assertEqual(bot.get_pending_ad_ids(), [1])
+        self.assertEqual(bot.pending_moderation.get_nowait(), 1)
+        self.assertEqual(bot.get_all_ads(), [])
+
+    async def test_workers_resume_pending_ads(self):
+        """Объявления, не дождавшиеся решения до остановки, модерируются после запуска."""
+        for user_id in (42, 43, 44):
+            bot.submit_pending_ad("Санки", "Деревянные", 900, FORM['category'], None, None, user_id, "user")
+        await bot.start_moderation_workers()
+        await asyncio.wait_for(bot.pending_moderation.join(), 5)
+        for task in list(bot.moderation_tasks):
+            task.cancel()
+        await asyncio.gather(*bot.moderation_tasks, *bot.broadcast_tasks, return_exceptions=True)
+        self.assertEqual(self.moderate.await_count, 3)
+        self.assertEqual(len(bot.get_all_ads()), 3)
+        self.assertEqual(bot.get_pending_ad_ids(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Тесты фоновой рассылки подписчикам: порции, отметки о доставке и продолжение после остановки.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+import database
+
+CATEGORY = bot.CATEGORIES[0]
+DISTRICT = bot.YAKUTSK_DISTRICTS[0]
+AUTHOR_ID = 7
+
+
+class TestBroadcasts(unittest.IsolatedAsyncioTestCase):
+    """Рассылка о новом объявлении подписчикам категории."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        self.original_db_path = bot.DB_PATH
+        bot.DB_PATH = self.db_path
+        bot.init_db()
+        self.subscribers = list(range(1, 26))
+        for user_id in self.subscribers:
+            bot.add_subscription(user_id, CATEGORY)
+        bot.add_subscription(100, bot.CATEGORIES[1])
+        self.mock_bot = MagicMock()
+        self.mock_bot.send_message = AsyncMock()
+        self.mock_bot.send_photo = AsyncMock()
+        patcher = patch('bot.bot', self.mock_bot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(bot, 'BROADCAST_CHUNK', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        bot.DB_PATH = self.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def recipients(self, mock):
+        return [call.kwargs['chat_id'] for call in mock.call_args_list]
+
+    def broadcast_row(self, broadcast_id):
+        with database.connect(self.db_path) as conn:
+            return conn.execute(
+                "SELECT status, last_user_id, sent_count, failed_count FROM broadcasts WHERE id = ?", (broadcast_id,)
+            ).fetchone()
+
+    async def test_runs_in_background(self):
+        """Рассылка идёт в фоне; после неё все подписчики, кроме автора, получили сообщение."""
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_send(**kwargs):
+            started.set()
+            await release.wait()
+
+        self.mock_bot.send_message.side_effect = slow_send
+        _, broadcast = bot.publish_ad("Коляска", "Описание", 1000, CATEGORY, DISTRICT, None, AUTHOR_ID, "user")
+        task = bot.start_broadcast(broadcast)
+        self.assertFalse(task.done())
+        await started.wait()
+        release.set()
+        await task
+        self.assertEqual(sorted(self.recipients(self.mock_bot.send_message)), [u for u in self.subscribers if u != AUTHOR_ID])
+        self.assertIn("<b>Коляска</b>", self.mock_bot.send_message.call_args.kwargs['text'])
+        self.assertEqual(bot.get_pending_broadcasts(), [])
+
+    async def test_photo_and_failures_counted(self):
+        async def send_photo(chat_id, **kwargs):
+            if chat_id == 3:
+                raise RuntimeError("Forbidden: bot was blocked by the user")
+
+        self.mock_bot.send_photo.side_effect = send_photo
+        _, broadcast = bot.publish_ad("Коляска", "Описание", 1000, CATEGORY, DISTRICT, "photo", 999, "user")
+        await bot.start_broadcast(broadcast)
+        self.assertEqual(len(self.mock_bot.send_photo.call_args_list), 25)
+        self.mock_bot.send_message.assert_not_called()
+        self.assertEqual(self.broadcast_row(1), ('done', 25, 24, 1))
+        with database.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM broadcast_deliveries").fetchone()[0], 0)
+
+    async def test_resume_after_interruption(self):
+        """Прерванная рассылка продолжается без повторов: ни порция до курсора, ни отмеченные получатели."""
+        broadcast = bot.create_broadcast(CATEGORY, "Текст", author_user_id=AUTHOR_ID)
+        # Бот остановился посреди второй порции: первая (1–10) завершена, 11 и 12 уже получили сообщение
+        bot.advance_broadcast(broadcast['id'], 10)
+        bot.record_broadcast_delivery(broadcast['id'], 11, 'sent')
+        bot.record_broadcast_delivery(broadcast['id'], 12, 'failed')
+
+        await bot.resume_broadcasts()
+        await asyncio.gather(*bot.broadcast_tasks)
+        self.assertEqual(self.recipients(self.mock_bot.send_message), list(range(13, 26)))
+        self.assertEqual(self.broadcast_row(broadcast['id']), ('done', 25, 14, 1))
+
+    async def test_recipients_stream_in_chunks(self):
+        broadcast = bot.create_broadcast(CATEGORY, "Текст", author_user_id=AUTHOR_ID)
+        first = bot.get_broadcast_recipients(broadcast, 0, 10)
+        self.assertEqual(first, [1, 2, 3, 4, 5, 6, 8, 9, 10, 11])
+        self.assertEqual(bot.get_broadcast_recipients(broadcast, first[-1], 100), list(range(12, 26)))
+
+
+if __name__ == '__main__':
+    unittest.main()
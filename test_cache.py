@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Тесты кэша объявлений (cache.py) и его сброса функциями записи bot.py.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+import cache
+import database
+
+
+class TestAdCache(unittest.TestCase):
+    """LRU записей и списков, поколения и смена БД."""
+
+    def setUp(self):
+        self.path = 'a.db'
+        self.cache = cache.AdCache(lambda: self.path, records_size=2, lists_size=2)
+
+    def test_lru_and_stats(self):
+        generation = self.cache.read_generation()
+        self.cache.put_many({1: ('a',), 2: ('b',)}, generation)
+        self.assertEqual(self.cache.get(1), ('a',))
+        self.cache.put_many({3: ('c',)}, generation)
+        # Вытеснена самая давно прочитанная запись
+        self.assertEqual(self.cache.get_many([1, 2, 3]), {1: ('a',), 3: ('c',)})
+        self.assertEqual((self.cache.stats['hits'], self.cache.stats['misses']), (3, 1))
+        self.assertEqual(self.cache.hit_rate, 0.75)
+
+    def test_stale_read_is_not_cached(self):
+        """Результат чтения, начатого до сброса, в кэш не попадает."""
+        generation = self.cache.read_generation()
+        self.cache.invalidate([1], [('all', None)])
+        self.cache.put_many({1: ('old',)}, generation)
+        self.cache.put_ids((('all', None), None, None), [1], generation)
+        self.assertIsNone(self.cache.get(1))
+        self.assertIsNone(self.cache.get_ids((('all', None), None, None)))
+
+    def test_invalidate_groups(self):
+        generation = self.cache.read_generation()
+        self.cache.put_ids((('category', 'A'), None, 10), [2, 1], generation)
+        self.cache.put_ids((('district', 'B'), None, 10), [3], generation)
+        self.cache.invalidate(groups=[('category', 'A')])
+        self.assertIsNone(self.cache.get_ids((('category', 'A'), None, 10)))
+        self.assertEqual(self.cache.get_ids((('district', 'B'), None, 10)), (3,))
+        self.cache.invalidate(groups=None)
+        self.assertIsNone(self.cache.get_ids((('district', 'B'), None, 10)))
+
+    def test_new_database_starts_empty(self):
+        self.cache.put_many({1: ('a',)}, self.cache.read_generation())
+        self.path = 'b.db'
+        self.assertIsNone(self.cache.get(1))
+
+
+class TestBotAdCache(unittest.TestCase):
+    """Чтение через кэш видит каждую запись функциями бота."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        self.original_db_path = bot.DB_PATH
+        bot.DB_PATH = self.db_path
+        bot.init_db()
+
+    def tearDown(self):
+        bot.DB_PATH = self.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def add(self, title, category=bot.CATEGORIES[0], district=bot.YAKUTSK_DISTRICTS[0], user_id=42):
+        return bot.add_ad_to_db(title, "Описание", 100, category, district, None, user_id, "user")
+
+    def test_reads_hit_cache(self):
+        ad_id = self.add("Санки")
+        self.assertEqual(bot.get_ad_by_id(ad_id)['title'], "Санки")
+        list_hits = bot.ad_cache.stats['list_hits']
+        statements = []
+        database.set_trace_callback(statements.append)
+        try:
+            self.assertEqual(bot.get_ad_by_id(ad_id)['user_id'], 42)
+            bot.get_ads_by_category(bot.CATEGORIES[0])
+            bot.get_ads_by_category(bot.CATEGORIES[0])
+        finally:
+            database.set_trace_callback(None)
+        # Повторное чтение списка не обращается к БД: объявление уже в кэше
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(bot.ad_cache.stats['list_hits'] - list_hits, 1)
+
+    def test_writes_invalidate(self):
+        first = self.add("Санки")
+        second = self.add("Лыжи", category=bot.CATEGORIES[1], user_id=43)
+        self.assertEqual([ad['id'] for ad in bot.get_all_ads()], [second, first])
+        self.assertEqual([ad['id'] for ad in bot.get_ads_by_category(bot.CATEGORIES[1])], [second])
+
+        bot.update_ad_field(first, 'title', "Ледянка")
+        self.assertEqual(bot.get_ad_by_id(first)['title'], "Ледянка")
+        self.assertEqual(bot.get_user_ads(42)[0]['title'], "Ледянка")
+        bot.update_ad_field(first, 'category', bot.CATEGORIES[1])
+        self.assertEqual([ad['id'] for ad in bot.get_ads_by_category(bot.CATEGORIES[1])], [second, first])
+        self.assertEqual(bot.get_ads_by_category(bot.CATEGORIES[0]), [])
+        bot.update_ad_photo(first, "photo-1")
+        self.assertEqual(bot.get_ad_by_id(first)['photo'], "photo-1")
+
+        third = self.add("Коньки", user_id=43)
+        self.assertEqual([ad['id'] for ad in bot.get_user_ads(43)], [third, second])
+        bot.delete_ad_by_id(second)
+        self.assertIsNone(bot.get_ad_by_id(second))
+        self.assertEqual([ad['id'] for ad in bot.get_user_ads(43)], [third])
+        self.assertEqual([ad['id'] for ad in bot.get_all_ads()], [third, first])
+
+    def test_random_interleaving_matches_database(self):
+        """Случайная смесь записей и чтений: кэш всегда отдаёт то же, что БД."""
+        rnd = random.Random(7)
+        categories, districts = bot.CATEGORIES[:3], bot.YAKUTSK_DISTRICTS[:3]
+        ids = []
+
+        def uncached(read, *args):
+            # То же чтение с пустым кэшем, не трогая основной
+            with patch.object(bot, 'ad_cache', cache.AdCache(lambda: bot.DB_PATH)):
+                return read(*args)
+
+        for step in range(300):
+            action = rnd.random()
+            if action < 0.25 or not ids:
+                ids.append(self.add(f"Объявление {step}", rnd.choice(categories), rnd.choice(districts), rnd.randint(1, 3)))
+            elif action < 0.45:
+                field, value = rnd.choice([('title', f"Новое {step}"), ('price', step),
+                                           ('category', rnd.choice(categories)), ('district', rnd.choice(districts))])
+                bot.update_ad_field(rnd.choice(ids), field, value)
+            elif action < 0.5:
+                bot.update_ad_photo(rnd.choice(ids), f"photo-{step}")
+            elif action < 0.55:
+                bot.extend_ad_expiration(rnd.choice(ids))
+            elif action < 0.65:
+                ad_id = rnd.choice(ids)
+                bot.delete_ad_by_id(ad_id)
+                ids.remove(ad_id)
+            else:
+                read, args = rnd.choice([
+                    (bot.get_ad_by_id, (rnd.choice(ids),)),
+                    (bot.get_all_ads, (None, 5)),
+                    (bot.get_ads_by_category, (rnd.choice(categories),)),
+                    (bot.get_ads_by_district, (rnd.choice(districts), None, 3)),
+                    (bot.get_user_ads, (rnd.randint(1, 3),)),
+                ])
+                cached = read(*args)
+                self.assertEqual(cached, uncached(read, *args), f"шаг {step}: {read.__name__}{args}")
+        self.assertGreater(bot.ad_cache.stats['hits'], 0)
+        self.assertGreater(bot.ad_cache.stats['list_hits'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
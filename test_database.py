@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Тесты слоя доступа к SQLite (database.py).
+Проверяют пул соединений, фиксацию/откат транзакций, поток-писатель и awaitable-обёртки.
+"""
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Тесты пула соединений."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        with database.connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+
+    def tearDown(self):
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def test_connection_is_reused(self):
+        """Повторные обращения получают одно и то же соединение из пула."""
+        with database.connect(self.db_path) as first:
+            pass
+        with database.connect(self.db_path) as second:
+            pass
+        self.assertIs(first, second)
+
+    def test_commit_on_success(self):
+        """При успешном выходе из блока изменения фиксируются."""
+        with database.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO items (name) VALUES ('a')")
+        with database.connect(self.db_path) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        self.assertEqual(count, 1)
+
+    def test_rollback_on_error(self):
+        """При исключении транзакция откатывается, а соединение возвращается в пул."""
+        with self.assertRaises(RuntimeError):
+            with database.connect(self.db_path) as conn:
+                conn.execute("INSERT INTO items (name) VALUES ('a')")
+                raise RuntimeError("boom")
+        with database.connect(self.db_path) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            self.assertFalse(conn.in_transaction)
+        self.assertEqual(count, 0)
+
+    def test_pool_size_is_bounded(self):
+        """Пул не создаёт больше соединений, чем задано."""
+        pool = database.ConnectionPool(self.db_path, size=2)
+        first = pool.acquire()
+        second = pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.05)
+        pool.release(first)
+        self.assertIs(pool.acquire(timeout=0.05), first)
+        pool.release(first)
+        pool.release(second)
+        pool.close()
+
+
+class TestWriter(unittest.TestCase):
+    """Тесты режима WAL и единого писателя."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        database.execute_write(self.db_path, "CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+
+    def tearDown(self):
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def test_wal_mode_and_pragmas(self):
+        """Соединения пула работают в WAL с настроенными PRAGMA."""
+        with database.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute("PRAGMA temp_store").fetchone()[0], 2)  # MEMORY
+
+    def test_write_result_is_visible_to_readers(self):
+        """После возврата из execute_write запись видна читающим соединениям."""
+        result = database.execute_write(self.db_path, "INSERT INTO items (name) VALUES (?)", ('a',))
+        self.assertEqual(result.rowcount, 1)
+        with database.connect(self.db_path) as conn:
+            row = conn.execute("SELECT name FROM items WHERE id = ?", (result.lastrowid,)).fetchone()
+        self.assertEqual(row[0], 'a')
+
+    def test_failed_job_does_not_affect_batch(self):
+        """Ошибка одной записи откатывает только её, остальные из пачки сохраняются."""
+        names = [f"n{i}" for i in range(50)] + ['n0']
+
+        def insert(name):
+            try:
+                return database.execute_write(self.db_path, "INSERT INTO items (name) VALUES (?)", (name,)).lastrowid
+            except sqlite3.IntegrityError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(insert, names))
+        self.assertEqual(results.count(None), 1)
+        with database.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM items").fetchone()[0], 50)
+
+    def test_multi_statement_write_is_atomic(self):
+        """write() выполняет функцию целиком или не выполняет вовсе."""
+        def insert_two(conn, first, second):
+            conn.execute("INSERT INTO items (name) VALUES (?)", (first,))
+            conn.execute("INSERT INTO items (name) VALUES (?)", (second,))
+
+        database.write(self.db_path, insert_two, 'x', 'y')
+        with self.assertRaises(sqlite3.IntegrityError):
+            database.write(self.db_path, insert_two, 'z', 'x')
+        with database.connect(self.db_path) as conn:
+            names = {row[0] for row in conn.execute("SELECT name FROM items")}
+        self.assertEqual(names, {'x', 'y'})
+
+    def test_nested_write_runs_inline(self):
+        """Запись, вызванная из задания писателя, не блокирует его."""
+        def outer(conn):
+            conn.execute("INSERT INTO items (name) VALUES ('outer')")
+            return database.execute_write(self.db_path, "INSERT INTO items (name) VALUES ('inner')").rowcount
+
+        self.assertEqual(database.write(self.db_path, outer), 1)
+
+
+class TestAwaitableWrappers(unittest.IsolatedAsyncioTestCase):
+    """Тесты выполнения запросов вне цикла событий."""
+
+    async def test_runs_in_worker_thread(self):
+        """Обёртка выполняет функцию не в потоке цикла событий."""
+        loop_thread = threading.get_ident()
+        wrapped = database.awaitable(threading.get_ident)
+        self.assertNotEqual(await wrapped(), loop_thread)
+
+    async def test_passes_arguments_and_result(self):
+        """Обёртка передаёт аргументы и возвращает результат функции."""
+        def add(a, b=0):
+            return a + b
+        self.assertEqual(await database.awaitable(add)(2, b=3), 5)
+
+    async def test_loop_is_not_blocked(self):
+        """Пока запрос выполняется в пуле, цикл событий обрабатывает другие задачи."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_query():
+            started.set()
+            release.wait(5)
+            return 'done'
+
+        task = asyncio.create_task(database.run(slow_query))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        # Цикл событий свободен: задача ещё не завершена, а мы продолжаем работать
+        self.assertFalse(task.done())
+        release.set()
+        self.assertEqual(await task, 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Тесты фильтров объявлений: find_ads, count_facets и панель /filter.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+import database
+from test_pagination import MockState, make_callback, make_message, more_button, shown_ad_ids
+
+STROLLERS = bot.CATEGORIES[1]
+SAISARY = bot.YAKUTSK_DISTRICTS[5]
+CENTER = bot.YAKUTSK_DISTRICTS[0]
+
+
+def add_ad(title, price, category=STROLLERS, district=SAISARY, age_group=None, gender=None, condition=None):
+    return bot.add_ad_to_db(title, "Описание", price, category, district, None, 1000, "user",
+                            age_group, gender, condition)
+
+
+class TestFindAds(unittest.TestCase):
+    """Выборка по набору фильтров и подсчёт фасетов."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_path = tempfile.mktemp(suffix='.db')
+        cls.original_db_path = bot.DB_PATH
+        bot.DB_PATH = cls.db_path
+        bot.init_db()
+        cls.cheap = add_ad("Коляска прогулочная", 4500, age_group=bot.AGE_GROUPS[2], condition=bot.CONDITIONS[2])
+        cls.expensive = add_ad("Коляска трансформер", 12000, age_group=bot.AGE_GROUPS[0], condition=bot.CONDITIONS[0])
+        cls.center = add_ad("Коляска для двойни", 3000, district=CENTER, condition=bot.CONDITIONS[2])
+        cls.sled = add_ad("Санки", 2000, category=bot.CATEGORIES[3], gender=bot.GENDERS[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        bot.DB_PATH = cls.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cls.db_path + suffix):
+                os.unlink(cls.db_path + suffix)
+
+    def ids(self, filters, **kwargs):
+        return [ad['id'] for ad in bot.find_ads(filters, **kwargs)]
+
+    def test_combined_filters(self):
+        """Коляска дешевле 5000 в Сайсарском округе."""
+        filters = {'category': STROLLERS, 'district': SAISARY, 'price_max': 5000}
+        self.assertEqual(self.ids(filters), [self.cheap])
+        self.assertEqual(self.ids({'price_min': 3000, 'price_max': 4500}), [self.center, self.cheap])
+        self.assertEqual(self.ids({'condition': bot.CONDITIONS[2], 'district': CENTER}), [self.center])
+        self.assertEqual(self.ids({'gender': bot.GENDERS[0]}), [self.sled])
+
+    def test_keyword_with_filters(self):
+        self.assertEqual(self.ids({'keyword': "коляску", 'price_min': 10000}), [self.expensive])
+        self.assertEqual(self.ids({'keyword': "санки", 'category': STROLLERS}), [])
+
+    def test_no_filters_returns_everything(self):
+        self.assertEqual(self.ids({}), [self.sled, self.center, self.expensive, self.cheap])
+
+    def test_cursor_pages(self):
+        first = self.ids({'category': STROLLERS}, limit=2)
+        second = self.ids({'category': STROLLERS}, before_id=first[-1], limit=2)
+        self.assertEqual(first + second, [self.center, self.expensive, self.cheap])
+
+    def test_facet_counts_ignore_own_filter(self):
+        """Счётчики фасета учитывают остальные фильтры, но не его собственный."""
+        counts = bot.count_facets({'category': STROLLERS, 'district': SAISARY})
+        self.assertEqual(counts['total'], 2)
+        self.assertEqual(counts['category'], {STROLLERS: 2, bot.CATEGORIES[3]: 1})
+        self.assertEqual(counts['district'], {SAISARY: 2, CENTER: 1})
+        self.assertEqual(counts['condition'], {bot.CONDITIONS[0]: 1, bot.CONDITIONS[2]: 1})
+        self.assertEqual(counts['gender'], {})
+
+    def test_facet_counts_with_keyword(self):
+        counts = bot.count_facets({'keyword': "коляска", 'price_max': 5000})
+        self.assertEqual(counts['total'], 2)
+        self.assertEqual(counts['district'], {SAISARY: 1, CENTER: 1})
+
+    def test_parse_price_range(self):
+        self.assertEqual(bot.parse_price_range("1000-5000"), (1000, 5000))
+        self.assertEqual(bot.parse_price_range("от 1 000 до 5 000"), (1000, 5000))
+        self.assertEqual(bot.parse_price_range("до 5000"), (None, 5000))
+        self.assertEqual(bot.parse_price_range("От 700"), (700, None))
+        self.assertEqual(bot.parse_price_range("5000"), (None, 5000))
+        self.assertIsNone(bot.parse_price_range("дёшево"))
+
+
+class TestFilterHandlers(unittest.IsolatedAsyncioTestCase):
+    """Панель фильтров: выбор значений, цена и показ результатов."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_path = tempfile.mktemp(suffix='.db')
+        cls.original_db_path = bot.DB_PATH
+        bot.DB_PATH = cls.db_path
+        bot.init_db()
+        cls.ad_ids = [add_ad(f"Коляска {i}", 1000 * i) for i in range(15)]
+        add_ad("Куртка", 1000, category=bot.CATEGORIES[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        bot.DB_PATH = cls.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cls.db_path + suffix):
+                os.unlink(cls.db_path + suffix)
+
+    async def test_filter_flow(self):
+        state = MockState()
+        message = make_message()
+        await bot.cmd_filter(message, state)
+        self.assertEqual(state.data['filters'], {})
+        self.assertIn("Найдено объявлений: 16", message.answer.call_args.args[0])
+
+        # Кнопки значений показывают число объявлений, пустые значения скрыты
+        callback = make_callback("flt_cat")
+        await bot.filter_menu(callback, state)
+        buttons = [b.text for row in callback.message.edit_text.call_args.kwargs['reply_markup'].inline_keyboard for b in row]
+        self.assertIn(f"{STROLLERS} (15)", buttons)
+        self.assertNotIn(f"{bot.CATEGORIES[2]} (0)", buttons)
+
+        await bot.filter_set_value(make_callback("fltset_cat_1"), state)
+        await bot.filter_price(make_message("до 11000"), state)
+        self.assertEqual(state.data['filters'], {'category': STROLLERS, 'price_max': 11000})
+
+        callback = make_callback("flt_show")
+        await bot.filter_menu(callback, state)
+        expected = [ad_id for ad_id in reversed(self.ad_ids) if bot.get_ad_by_id(ad_id)['price'] <= 11000]
+        self.assertEqual(shown_ad_ids(callback.message), expected[:bot.PAGE_SIZE])
+        self.assertEqual(more_button(callback.message), f"more_filter_{expected[bot.PAGE_SIZE - 1]}")
+
+        callback = make_callback(more_button(callback.message))
+        await bot.show_more_ads(callback, state)
+        self.assertEqual(shown_ad_ids(callback.message), expected[bot.PAGE_SIZE:])
+
+    async def test_reset_and_any(self):
+        state = MockState({'filters': {'category': STROLLERS, 'keyword': "коляска"}})
+        await bot.filter_set_value(make_callback("fltset_cat_any"), state)
+        self.assertEqual(state.data['filters'], {'keyword': "коляска"})
+        await bot.filter_menu(make_callback("flt_reset"), state)
+        self.assertEqual(state.data['filters'], {})
+
+    async def test_stale_callbacks(self):
+        """Кнопки старой панели после сброса состояния не ломают обработчики."""
+        callback = make_callback("fltset_cat_1")
+        await bot.filter_set_value(callback, MockState())
+        callback.answer.assert_called_once()
+        callback = make_callback("fltset_cat_99")
+        await bot.filter_set_value(callback, MockState({'filters': {}}))
+        self.assertTrue(callback.answer.call_args.kwargs.get('show_alert'))
+
+
+if __name__ == '__main__':
+    unittest.main()
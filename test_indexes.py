@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Проверка планов запросов: горячие запросы к объявлениям и подпискам
+должны идти по индексам, а не полным сканированием таблицы.
+
+Запросы перехватываются трассировкой SQL ровно в том виде, в каком их
+выполняют функции bot.py, и для каждого строится EXPLAIN QUERY PLAN.
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+import database
+import migrations
+import outbox
+
+# Полное сканирование таблицы или сортировка результата во временном B-дереве
+BAD_PLAN = re.compile(r'^SCAN (ads|subscriptions|favorites|complaints|broadcast_deliveries|outbox)\b|USE TEMP B-TREE FOR ORDER BY')
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Горячие запросы используют индексы."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_path = tempfile.mktemp(suffix='.db')
+        cls.original_db_path = bot.DB_PATH
+        bot.DB_PATH = cls.db_path
+        bot.init_db()
+        for i in range(20):
+            bot.add_ad_to_db(f"Объявление {i}", "Описание", 100 * i, bot.CATEGORIES[i % 3],
+                             bot.YAKUTSK_DISTRICTS[i % 4], None, 1000 + i % 5, "user")
+            bot.add_subscription(2000 + i, bot.CATEGORIES[i % 3])
+
+    @classmethod
+    def tearDownClass(cls):
+        bot.DB_PATH = cls.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cls.db_path + suffix):
+                os.unlink(cls.db_path + suffix)
+
+    def capture_queries(self, func, *args):
+        """Выполняет функцию и возвращает выполненные ею SELECT-запросы."""
+        # Функции чтения обращаются к БД только на промахе кэша объявлений
+        bot.ad_cache.clear()
+        statements = []
+        database.set_trace_callback(statements.append)
+        try:
+            func(*args)
+        finally:
+            database.set_trace_callback(None)
+        return [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+    def assert_uses_indexes(self, func, *args):
+        queries = self.capture_queries(func, *args)
+        self.assertTrue(queries, f"{func.__name__} не выполнила ни одного запроса")
+        with sqlite3.connect(self.db_path) as conn:
+            for sql in queries:
+                plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                bad = [step for step in plan if BAD_PLAN.search(step)]
+                self.assertFalse(bad, f"{func.__name__}: запрос не использует индекс\n{sql}\nплан: {plan}")
+
+    def test_ads_by_category(self):
+        self.assert_uses_indexes(bot.get_ads_by_category, bot.CATEGORIES[0])
+
+    def test_ads_by_district(self):
+        self.assert_uses_indexes(bot.get_ads_by_district, bot.YAKUTSK_DISTRICTS[0])
+
+    def test_user_ads(self):
+        self.assert_uses_indexes(bot.get_user_ads, 1000)
+
+    def test_subscribers_for_category(self):
+        self.assert_uses_indexes(bot.get_subscribers_for_category, bot.CATEGORIES[0])
+
+    def test_broadcast_recipients(self):
+        """Порция рассылки читается по индексу подписок (category, user_id) без сортировки."""
+        broadcast = {'id': 1, 'category': bot.CATEGORIES[0], 'author_user_id': 2000}
+        self.assert_uses_indexes(bot.get_broadcast_recipients, broadcast, 2003, 10)
+
+    def test_outbox_due(self):
+        """Созревшие записи outbox читаются по частичному индексу, без сортировки."""
+        self.assert_uses_indexes(outbox.fetch_due, self.db_path, 0, 50)
+        self.assert_uses_indexes(outbox.next_attempt_time, self.db_path)
+
+    def test_paged_listings(self):
+        """Следующая страница ищется по индексу через id < курсор, без OFFSET и сортировки."""
+        self.assert_uses_indexes(bot.get_all_ads, 10, 5)
+        self.assert_uses_indexes(bot.get_ads_by_category, bot.CATEGORIES[0], 10, 5)
+        self.assert_uses_indexes(bot.get_ads_by_district, bot.YAKUTSK_DISTRICTS[0], 10, 5)
+
+    def test_faceted_filters(self):
+        """Каждый фасет фильтра находит объявления по своему индексу."""
+        self.assert_uses_indexes(bot.find_ads, {'age_group': bot.AGE_GROUPS[0], 'price_max': 5000}, 10, 5)
+        self.assert_uses_indexes(bot.find_ads, {'gender': bot.GENDERS[0]})
+        self.assert_uses_indexes(bot.find_ads, {'condition': bot.CONDITIONS[0], 'district': bot.YAKUTSK_DISTRICTS[0]})
+
+    def test_ads_needing_notifications(self):
+        self.assert_uses_indexes(bot.get_expiring_ads)
+        self.assert_uses_indexes(bot.get_expiring_ads, [1, 2, 3])
+
+    def test_indexes_are_maintained(self):
+        """Изменённое определение индекса пересоздаётся, повторный запуск ничего не делает."""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DROP INDEX idx_ads_district_id")
+            conn.execute("CREATE INDEX idx_ads_district_id ON ads(district)")
+        created = database.write(self.db_path, database.ensure_indexes, migrations.SCHEMA_INDEXES)
+        self.assertEqual(created, ['idx_ads_district_id'])
+        self.assertEqual(database.write(self.db_path, database.ensure_indexes, migrations.SCHEMA_INDEXES), [])
+        self.assert_uses_indexes(bot.get_ads_by_district, bot.YAKUTSK_DISTRICTS[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
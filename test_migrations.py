@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Тесты версионных миграций схемы (migrations.py).
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import database
+import migrations
+
+# Схема ads из первых версий бота и fix_db.py — без колонок, добавленных позже
+LEGACY_ADS = """
+    CREATE TABLE ads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        price INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        photo_id TEXT,
+        user_id INTEGER NOT NULL,
+        username TEXT
+    )
+"""
+
+
+class TestMigrations(unittest.TestCase):
+    """Тесты применения миграций."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+
+    def tearDown(self):
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def test_fresh_database(self):
+        """Пустая БД получает все миграции и полную схему."""
+        self.assertEqual(migrations.migrate(self.db_path), [number for number, _, _ in migrations.MIGRATIONS])
+        with database.connect(self.db_path) as conn:
+            self.assertEqual(migrations.current_version(conn), migrations.LATEST_VERSION)
+            columns = migrations.table_columns(conn, 'ads')
+            conn.execute("INSERT INTO ads (title, description, price, category, user_id) VALUES ('a', 'b', 1, 'c', 1)")
+            created_at = conn.execute("SELECT created_at FROM ads").fetchone()[0]
+        self.assertTrue({name for name, _ in migrations.ADS_LATER_COLUMNS} <= columns)
+        self.assertIsNotNone(created_at)
+
+    def test_legacy_database_is_upgraded(self):
+        """Старая таблица ads дополняется колонками, created_at заполняется один раз."""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(LEGACY_ADS)
+            conn.execute("INSERT INTO ads (title, description, price, category, user_id) VALUES ('a', 'b', 1, 'c', 1)")
+        migrations.migrate(self.db_path)
+        with database.connect(self.db_path) as conn:
+            row = conn.execute("SELECT district, created_at, notif_1d FROM ads").fetchone()
+            indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIsNone(row[0])
+        self.assertIsNotNone(row[1])
+        self.assertEqual(row[2], 0)
+        self.assertTrue(set(migrations.SCHEMA_INDEXES) <= indexes)
+
+    def test_expiry_stage_from_notice_flags(self):
+        """Номер следующего события восстанавливается по флагам отправленных напоминаний."""
+        with patch.object(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:9]), \
+                patch.object(migrations, 'LATEST_VERSION', 9):
+            migrations.migrate(self.db_path)
+        with sqlite3.connect(self.db_path) as conn:
+            for flags in ((0, 0, 0, 0), (1, 0, 0, 0), (1, 1, 1, 0)):
+                conn.execute("""
+                    INSERT INTO ads (title, description, price, category, user_id, created_at, notif_1d, notif_12h, notif_6h, notif_1h)
+                    VALUES ('a', 'b', 1, 'c', 1, '2024-03-01 10:00:00', ?, ?, ?, ?)
+                """, flags)
+        migrations.migrate(self.db_path)
+        with database.connect(self.db_path) as conn:
+            rows = conn.execute("SELECT expires_at, next_notice_stage FROM ads ORDER BY id").fetchall()
+            conn.execute("UPDATE ads SET created_at = '2024-03-05 12:30:00' WHERE id = 1")
+            expires_at = conn.execute("SELECT expires_at FROM ads WHERE id = 1").fetchone()[0]
+        self.assertEqual(rows, [('2024-03-08 10:00:00', 0), ('2024-03-08 10:00:00', 1), ('2024-03-08 10:00:00', 3)])
+        self.assertEqual(expires_at, '2024-03-12 12:30:00')
+
+    def test_up_to_date_database_runs_no_ddl(self):
+        """Повторный запуск на актуальной БД не пишет в неё и не выполняет DDL."""
+        migrations.migrate(self.db_path)
+        statements = []
+        database.set_trace_callback(statements.append)
+        try:
+            with patch('database.write') as write:
+                self.assertEqual(migrations.migrate(self.db_path), [])
+        finally:
+            database.set_trace_callback(None)
+        write.assert_not_called()
+        self.assertTrue(statements)
+        self.assertTrue(all(sql.lstrip().upper().startswith('SELECT') for sql in statements), statements)
+
+    def test_facet_indexes_only_in_their_migration(self):
+        """Миграция 2 создаёт только свои индексы, индексы фасетов появляются в миграции 5."""
+        def indexes():
+            with database.connect(self.db_path) as conn:
+                return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+        for version in (4, 5):
+            with patch.object(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:version]), \
+                    patch.object(migrations, 'LATEST_VERSION', version):
+                migrations.migrate(self.db_path)
+            if version == 4:
+                self.assertTrue(set(migrations.SECONDARY_INDEXES) <= indexes())
+                self.assertFalse(set(migrations.FACET_INDEXES) & indexes())
+        self.assertTrue(set(migrations.FACET_INDEXES) <= indexes())
+        with self.assertRaises(TypeError):
+            migrations.SECONDARY_INDEXES['idx_extra'] = "CREATE INDEX idx_extra ON ads(title)"
+
+    def test_each_migration_applied_once(self):
+        """Новая миграция применяется только к БД, где её ещё нет."""
+        migrations.migrate(self.db_path)
+        calls = []
+        extra = (migrations.LATEST_VERSION + 1, 'test step', calls.append)
+        with patch.object(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [extra]), \
+                patch.object(migrations, 'LATEST_VERSION', extra[0]):
+            self.assertEqual(migrations.migrate(self.db_path), [extra[0]])
+            self.assertEqual(migrations.migrate(self.db_path), [])
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_migration_is_rolled_back(self):
+        """Ошибка в миграции откатывает всю пачку, версия не меняется."""
+        def broken(conn):
+            conn.execute("CREATE TABLE half_done (id INTEGER)")
+            raise sqlite3.OperationalError("boom")
+
+        failing = migrations.MIGRATIONS + [(migrations.LATEST_VERSION + 1, 'broken', broken)]
+        with patch.object(migrations, 'MIGRATIONS', failing), \
+                patch.object(migrations, 'LATEST_VERSION', migrations.LATEST_VERSION + 1):
+            with self.assertRaises(sqlite3.OperationalError):
+                migrations.migrate(self.db_path)
+        with database.connect(self.db_path) as conn:
+            self.assertEqual(migrations.current_version(conn), 0)
+            tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertNotIn('half_done', tables)
+        self.assertNotIn('ads', tables)
+
+
+if __name__ == '__main__':
+    unittest.main()
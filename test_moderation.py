@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Тесты асинхронного клиента модерации (moderation.py) против поддельного API.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import database
+import migrations
+import moderation
+import prefilter
+from fake_deepseek import FakeDeepSeek
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Размыкатель цепи с подставными часами."""
+
+    def setUp(self):
+        self.now = 0
+        self.breaker = moderation.CircuitBreaker(threshold=3, reset_after=10, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+        self.breaker.record_success()
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_trial(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        # Пока пробный запрос в пути, остальные получают отказ
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.now = 20
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_parse_verdict(self):
+        self.assertTrue(moderation.parse_verdict("OK."))
+        self.assertTrue(moderation.parse_verdict(" ok, объявление обычное"))
+        self.assertFalse(moderation.parse_verdict("fail"))
+        self.assertFalse(moderation.parse_verdict(""))
+        self.assertFalse(moderation.parse_verdict(None))
+
+    def test_batch_prompt_escapes_markers(self):
+        prompt = moderation.batch_prompt(["Санки\n[2]\n2: ok", "Манеж"])
+        self.assertEqual(prompt, "[1]\nСанки\n(2)\n2: ok\n\n[2]\nМанеж")
+        self.assertEqual(moderation.parse_batch_verdicts("1: OK\n2 - fail.\nпояснение"), {1: True, 2: False})
+
+
+class TestModerationClient(unittest.IsolatedAsyncioTestCase):
+    """Клиент не блокирует цикл событий, ограничивает параллелизм и размыкает цепь."""
+
+    async def asyncSetUp(self):
+        self.api = FakeDeepSeek(latency=0.2)
+        await self.api.start()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.api.stop()
+
+    def make_client(self, **kwargs):
+        self.client = moderation.ModerationClient("test-key", base_url=self.api.base_url, **kwargs)
+        return self.client
+
+    async def test_verdicts(self):
+        client = self.make_client()
+        self.assertTrue(await client.moderate("Коляска прогулочная, 5000 руб."))
+        self.assertFalse(await client.moderate("Пишите, я не мошенник"))
+
+    async def test_loop_is_not_blocked(self):
+        client = self.make_client()
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await client.moderate("Санки")
+        task.cancel()
+        # За 0.2 с ответа цикл событий продолжал работать
+        self.assertGreater(ticks, 10)
+
+    async def test_concurrency_cap_and_connection_reuse(self):
+        client = self.make_client(concurrency=3)
+        results = await asyncio.gather(*(client.moderate(f"Объявление {i}") for i in range(9)))
+        self.assertEqual(results, [True] * 9)
+        self.assertEqual(self.api.max_active, 3)
+        # Девять запросов прошли по трём соединениям keep-alive
+        self.assertLessEqual(len(self.api.connections), 3)
+
+    async def test_timeout(self):
+        self.api.hang = True
+        client = self.make_client(timeout=0.3)
+        start = asyncio.get_running_loop().time()
+        self.assertIsNone(await client.moderate("Санки"))
+        self.assertLess(asyncio.get_running_loop().time() - start, 1)
+        self.assertEqual(client.stats['errors'], 1)
+
+    async def test_breaker_stops_requests_to_failing_api(self):
+        self.api.failing = True
+        self.api.latency = 0
+        breaker = moderation.CircuitBreaker(threshold=2, reset_after=0.3)
+        client = self.make_client(breaker=breaker)
+        for _ in range(5):
+            self.assertIsNone(await client.moderate("Санки"))
+        self.assertEqual(self.api.requests, 2)
+        self.assertEqual(client.stats['rejected'], 3)
+
+        # После паузы пробный запрос проходит, и клиент снова работает
+        self.api.failing = False
+        await asyncio.sleep(0.3)
+        self.assertTrue(await client.moderate("Санки"))
+        self.assertEqual(breaker.state, 'closed')
+
+    async def test_batches_texts_arriving_together(self):
+        client = self.make_client(batch_window=0.05, batch_size=10)
+        texts = [f"Объявление {i}" for i in range(6)] + ["Пишите, я не мошенник"]
+        results = await asyncio.gather(*(client.moderate(text) for text in texts))
+        self.assertEqual(results, [True] * 6 + [False])
+        self.assertEqual(self.api.batch_sizes, [7])
+        self.assertEqual(client.stats['batched'], 7)
+
+    async def test_full_batch_is_sent_without_waiting(self):
+        client = self.make_client(batch_window=10, batch_size=10, concurrency=3)
+        results = await asyncio.wait_for(asyncio.gather(*(client.moderate(f"Санки {i}") for i in range(20))), 2)
+        self.assertEqual(results, [True] * 20)
+        self.assertEqual(self.api.batch_sizes, [10, 10])
+
+    async def test_lone_text_is_sent_as_single_request(self):
+        client = self.make_client(batch_window=0.05)
+        self.assertFalse(await client.moderate("Пишите, я не мошенник"))
+        self.assertEqual(self.api.batch_sizes, [1])
+
+    async def test_unparsed_batch_falls_back_to_single_requests(self):
+        self.api.garble = True
+        client = self.make_client(batch_window=0.05)
+        texts = ["Санки", "Пишите, я не мошенник", "Манеж"]
+        self.assertEqual(await asyncio.gather(*(client.moderate(text) for text in texts)), [True, False, True])
+        self.assertEqual(self.api.batch_sizes, [3, 1, 1, 1])
+        self.assertEqual(client.stats['fallbacks'], 3)
+
+    async def test_prefilter_decides_obvious_cases(self):
+        client = self.make_client(prefilter=prefilter.PreFilter())
+        self.assertTrue(await client.moderate("Санки"))
+        self.assertFalse(await client.moderate("Казино онлайн"))
+        self.assertEqual(self.api.requests, 0)
+        # Неоднозначный текст решает модель
+        self.assertFalse(await client.moderate("Пишите, я не мошенник"))
+        self.assertEqual(self.api.requests, 1)
+        self.assertEqual(client.prefilter.stats, {'approved': 1, 'rejected': 1, 'escalated': 1})
+
+    async def test_without_api_key(self):
+        self.client = moderation.ModerationClient(None, base_url=self.api.base_url)
+        self.assertFalse(await self.client.moderate("Санки"))
+        self.assertEqual(self.api.requests, 0)
+
+
+class TestVerdictCache(unittest.IsolatedAsyncioTestCase):
+    """Повторные тексты получают вердикт из кэша (памяти или БД) без запроса к API."""
+
+    async def asyncSetUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        migrations.migrate(self.db_path)
+        self.now = 1000.0
+        self.api = FakeDeepSeek(latency=0)
+        await self.api.start()
+        self.clients = []
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.close()
+        await self.api.stop()
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def make_client(self, size=moderation.CACHE_SIZE, ttl=100):
+        cache = moderation.VerdictCache(lambda: self.db_path, size=size, ttl=ttl, clock=lambda: self.now)
+        client = moderation.ModerationClient("test-key", base_url=self.api.base_url, cache=cache)
+        self.clients.append(client)
+        return client
+
+    def test_normalized_variants_share_key(self):
+        self.assertEqual(moderation.text_hash("Ёлка  искусственная\nЦена: 500"),
+                         moderation.text_hash(" елка искусственная Цена: 500 "))
+        self.assertNotEqual(moderation.text_hash("Ёлка"), moderation.text_hash("Ёлка 2"))
+        self.assertNotEqual(moderation.text_hash("Ёлка"), moderation.text_hash("Ёлка", prompt=moderation.BATCH_PROMPT))
+
+    async def test_repeat_submission_hits_memory(self):
+        client = self.make_client()
+        self.assertTrue(await client.moderate("Коляска\nПрогулочная\nЦена: 5000"))
+        self.assertFalse(await client.moderate("Пишите, я не мошенник"))
+        self.assertTrue(await client.moderate("коляска прогулочная  цена: 5000"))
+        self.assertFalse(await client.moderate("Пишите, я не мошенник"))
+        self.assertEqual(self.api.requests, 2)
+        self.assertEqual(client.cache.stats, {'memory_hits': 2, 'db_hits': 0, 'misses': 2})
+        self.assertEqual(client.cache.hit_rate, 0.5)
+
+    async def test_verdicts_survive_restart(self):
+        await self.make_client().moderate("Санки")
+        await self.make_client().moderate("Пишите, я не мошенник")
+        # Новый клиент (перезапуск бота) находит оба вердикта в БД
+        client = self.make_client(size=1)
+        self.assertTrue(await client.moderate("Санки"))
+        self.assertFalse(await client.moderate("Пишите, я не мошенник"))
+        self.assertEqual(self.api.requests, 2)
+        self.assertEqual(client.cache.stats['db_hits'], 2)
+
+    async def test_expired_verdict_is_asked_again(self):
+        client = self.make_client(ttl=100)
+        await client.moderate("Санки")
+        self.now += 101
+        await client.moderate("Санки")
+        self.assertEqual(self.api.requests, 2)
+        # Новый вердикт сохранён, а устаревшие записи удалены из таблицы
+        self.now += moderation.CACHE_PURGE_INTERVAL
+        await client.moderate("Манеж")
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM moderation_cache").fetchone()[0], 1)
+
+    async def test_batch_verdicts_keyed_by_batch_prompt(self):
+        """Вердикт из пачки хранится под ключом BATCH_PROMPT и находится при повторной подаче."""
+        cache = moderation.VerdictCache(lambda: self.db_path, ttl=100, clock=lambda: self.now)
+        client = moderation.ModerationClient("test-key", base_url=self.api.base_url, cache=cache, batch_window=0.05)
+        self.clients.append(client)
+        texts = ["Санки", "Пишите, я не мошенник"]
+        self.assertEqual(await asyncio.gather(*(client.moderate(text) for text in texts)), [True, False])
+        with sqlite3.connect(self.db_path) as conn:
+            keys = {row[0] for row in conn.execute("SELECT text_hash FROM moderation_cache")}
+        self.assertEqual(keys, {moderation.text_hash(text, prompt=moderation.BATCH_PROMPT) for text in texts})
+        self.assertNotIn(moderation.text_hash("Санки"), keys)
+
+        # Новый клиент без пачек находит вердикты пачки в БД
+        client = self.make_client(size=1)
+        self.assertTrue(await client.moderate("Санки"))
+        self.assertFalse(await client.moderate("Пишите, я не мошенник"))
+        self.assertEqual(self.api.requests, 1)
+        self.assertEqual(client.cache.stats['db_hits'], 2)
+
+    async def test_cache_answers_without_api_key(self):
+        """Сохранённый вердикт действует и без ключа API; новый текст без ключа не проходит."""
+        await self.make_client().moderate("Санки")
+        client = self.make_client()
+        client.api_key = None
+        self.assertTrue(await client.moderate("Санки"))
+        self.assertFalse(await client.moderate("Манеж"))
+        self.assertEqual(self.api.requests, 1)
+
+    async def test_errors_are_not_cached(self):
+        client = self.make_client()
+        self.api.failing = True
+        self.assertIsNone(await client.moderate("Санки"))
+        self.api.failing = False
+        self.assertTrue(await client.moderate("Санки"))
+        self.assertEqual(self.api.requests, 2)
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertEqual(conn.execute("SELECT verdict FROM moderation_cache").fetchall(), [(1,)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Тесты outbox уведомлений (outbox.py) и постановки уведомлений бота в outbox.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+import bot
+import database
+import outbox
+
+
+class OutboxTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        self.original_db_path = bot.DB_PATH
+        bot.DB_PATH = self.db_path
+        bot.init_db()
+
+    def tearDown(self):
+        bot.DB_PATH = self.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def enqueue(self, key, kind='message', payload=None):
+        return database.write(self.db_path, outbox.enqueue, key, kind, payload or {'key': key})
+
+    def rows(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute("SELECT idempotency_key, kind, status, attempts FROM outbox ORDER BY id").fetchall()
+
+
+class TestOutboxWorker(OutboxTestCase):
+    """Доставка пачками, повторы с задержкой и ключи идемпотентности."""
+
+    def make_worker(self, handler, batch=outbox.BATCH):
+        self.delivered = []
+
+        async def record(payload):
+            await handler(payload)
+            self.delivered.append(payload['key'])
+
+        return outbox.OutboxWorker(lambda: self.db_path, {'message': record}, batch=batch)
+
+    async def test_enqueue_is_idempotent_and_transactional(self):
+        self.assertTrue(self.enqueue("a"))
+        self.assertFalse(self.enqueue("a"))
+
+        def enqueue_and_fail(conn):
+            outbox.enqueue(conn, "b", 'message', {})
+            raise sqlite3.IntegrityError("изменение не удалось")
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            database.write(self.db_path, enqueue_and_fail)
+        self.assertEqual([row[0] for row in self.rows()], ["a"])
+
+    async def test_delivers_in_batches(self):
+        worker = self.make_worker(AsyncMock(), batch=3)
+        for i in range(7):
+            self.enqueue(f"m{i}")
+        self.assertEqual(await worker.drain(), 7)
+        self.assertEqual(sorted(self.delivered), [f"m{i}" for i in range(7)])
+        self.assertEqual({row[2] for row in self.rows()}, {'sent'})
+        self.assertEqual(await worker.drain(), 0)
+
+    async def test_retry_with_backoff(self):
+        handler = AsyncMock(side_effect=[RuntimeError("сеть недоступна"), None])
+        worker = self.make_worker(handler)
+        self.enqueue("m")
+        before = time.time()
+        await worker.drain()
+        self.assertEqual(self.rows(), [("m", 'message', 'pending', 1)])
+        with sqlite3.connect(self.db_path) as conn:
+            next_attempt_at = conn.execute("SELECT next_attempt_at FROM outbox").fetchone()[0]
+        self.assertGreaterEqual(next_attempt_at, before + outbox.BACKOFF_BASE)
+        # До срока повтор не выполняется
+        self.assertEqual(await worker.drain(), 0)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("UPDATE outbox SET next_attempt_at = 0")
+        await worker.drain()
+        self.assertEqual(self.rows(), [("m", 'message', 'sent', 2)])
+        self.assertEqual(outbox.backoff(3), outbox.BACKOFF_BASE * 4)
+        self.assertEqual(outbox.backoff(100), outbox.BACKOFF_MAX)
+
+    async def test_permanent_errors_are_not_retried(self):
+        blocked = TelegramForbiddenError(method=SendMessage(chat_id=1, text="x"), message="Forbidden: bot was blocked by the user")
+        worker = self.make_worker(AsyncMock(side_effect=blocked))
+        self.enqueue("blocked")
+        self.enqueue("unknown", kind='no_such_kind')
+        await worker.drain()
+        self.assertEqual(self.rows(), [("blocked", 'message', 'failed', 1), ("unknown", 'no_such_kind', 'failed', 1)])
+        self.assertEqual(worker.stats, {'sent': 0, 'retried': 0, 'failed': 2})
+
+    async def test_gives_up_after_max_attempts(self):
+        worker = self.make_worker(AsyncMock(side_effect=RuntimeError("ошибка")))
+        self.enqueue("m")
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("UPDATE outbox SET attempts = ?", (outbox.MAX_ATTEMPTS - 1,))
+        await worker.drain()
+        self.assertEqual(self.rows(), [("m", 'message', 'failed', outbox.MAX_ATTEMPTS)])
+
+    async def test_run_wakes_on_new_entries(self):
+        delivered = asyncio.Event()
+
+        async def handler(payload):
+            delivered.set()
+
+        worker = self.make_worker(handler)
+        task = asyncio.create_task(worker.run())
+        self.addAsyncCleanup(self.cancel, task)
+        await asyncio.sleep(0.05)
+        self.enqueue("m")
+        worker.wake()
+        await asyncio.wait_for(delivered.wait(), 2)
+
+    async def cancel(self, task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+class TestBotNotifications(OutboxTestCase):
+    """Уведомления бота ставятся в outbox вместе с изменением, которое их вызвало."""
+
+    def setUp(self):
+        super().setUp()
+        self.mock_bot = MagicMock()
+        self.mock_bot.send_message = AsyncMock(return_value=MagicMock(message_id=555))
+        self.mock_bot.send_photo = AsyncMock(return_value=MagicMock(message_id=556))
+        self.mock_bot.me = AsyncMock(return_value=MagicMock(username="test_bot"))
+        self.mock_bot.delete_messages = AsyncMock(return_value=True)
+        for patcher in (patch('bot.bot', self.mock_bot), patch.object(bot, 'CHAT_ID', '-100500')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_ad(self, title="Коляска", user_id=42, created_days_ago=0):
+        ad_id = bot.add_ad_to_db(title, "Описание", 1000, bot.CATEGORIES[0], bot.YAKUTSK_DISTRICTS[0], None, user_id, "user")
+        created_at = (datetime.now() - timedelta(days=created_days_ago)).strftime('%Y-%m-%d %H:%M:%S')
+        database.execute_write(self.db_path, "UPDATE ads SET created_at = ? WHERE id = ?", (created_at, ad_id))
+        return ad_id
+
+    def due_events(self):
+        """Объявления с созревшим событием (тип самого срочного — в 'type')."""
+        now = datetime.now()
+        return [dict(ad, type=event) for ad in bot.get_expiring_ads() if (event := bot.expiry_event(ad, now))]
+
+    async def test_public_post(self):
+        ad_id, _ = bot.publish_ad("Коляска", "Описание", 1000, bot.CATEGORIES[0], bot.YAKUTSK_DISTRICTS[0], None, 42, "user")
+        self.assertEqual(self.rows(), [(f"public_post:{ad_id}", 'public_post', 'pending', 0)])
+        await bot.outbox_worker.drain()
+        kwargs = self.mock_bot.send_message.call_args.kwargs
+        self.assertEqual(kwargs['chat_id'], '-100500')
+        self.assertIn("<b>Коляска</b>", kwargs['text'])
+        self.assertEqual(bot.get_public_chat_message_id(ad_id), 555)
+
+        # Повтор записи (бот упал до отметки) не публикует объявление второй раз
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("UPDATE outbox SET status = 'pending'")
+        await bot.outbox_worker.drain()
+        self.mock_bot.send_message.assert_called_once()
+
+    async def test_complaint_alert(self):
+        ad_id = self.add_ad()
+        complaint_id = await bot.add_complaint(ad_id, 7, "Спам")
+        await bot.outbox_worker.drain()
+        kwargs = self.mock_bot.send_message.call_args.kwargs
+        self.assertEqual(kwargs['chat_id'], bot.ADMIN_ID)
+        self.assertIn(f"Жалоба #{complaint_id}", kwargs['text'])
+        buttons = [button.callback_data for row in kwargs['reply_markup'].inline_keyboard for button in row]
+        self.assertIn(f"delete_ad_from_complaint_{ad_id}_{complaint_id}", buttons)
+
+    async def test_expiry_notices_queued_once(self):
+        reminded = self.add_ad("Санки", user_id=42, created_days_ago=6.6)
+        expired = self.add_ad("Манеж", user_id=43, created_days_ago=8)
+        await bot.auto_delete_expired_ads()
+        await bot.auto_delete_expired_ads()
+        kinds = sorted(row[0].split(':')[0] + ':' + row[0].split(':')[-1] for row in self.rows())
+        # Пропущенное напоминание за сутки не отправляется вдогонку: только самое срочное
+        self.assertEqual(kinds, ["expired:" + str(expired), "expiry:12h"])
+        self.assertIsNone(bot.get_ad_by_id(expired))
+
+        await bot.outbox_worker.drain()
+        sent = sorted((call.args[0], call.args[1][:20]) for call in self.mock_bot.send_message.call_args_list)
+        self.assertEqual([chat_id for chat_id, _ in sent], [42, 43])
+
+        # После продления напоминания ставятся заново
+        bot.extend_ad_expiration(reminded)
+        database.execute_write(self.db_path, "UPDATE ads SET created_at = datetime(created_at, '-6 days', '-1 hours') WHERE id = ?", (reminded,))
+        await bot.auto_delete_expired_ads()
+        self.assertEqual(len(self.rows()), 3)
+
+    async def test_one_event_per_ad_after_downtime(self):
+        """После простоя каждое объявление получает одно событие, а следующим становится более позднее."""
+        ads = {days: self.add_ad(user_id=days, created_days_ago=days) for days in (1, 6.1, 6.8, 6.99, 7.5)}
+        due = {ad['id']: ad['type'] for ad in self.due_events()}
+        self.assertEqual(due, {ads[6.1]: '1d', ads[6.8]: '6h', ads[6.99]: '1h', ads[7.5]: '7d_delete'})
+        await bot.auto_delete_expired_ads()
+        self.assertEqual(self.due_events(), [])
+        stages = {ad['id']: ad['next_notice_stage'] for ad in bot.get_expiring_ads(ads.values())}
+        self.assertEqual(stages, {ads[1]: 0, ads[6.1]: 1, ads[6.8]: 3, ads[6.99]: 4})
+
+    async def test_expiry_digest_escapes_titles(self):
+        """Названия в напоминаниях экранируются: сообщение уходит с parse_mode='HTML'."""
+        self.add_ad("Санки <b & ледянка", user_id=42, created_days_ago=6.1)
+        self.add_ad("Манеж <i>", user_id=43, created_days_ago=6.2)
+        self.add_ad("Коляска & люлька", user_id=43, created_days_ago=6.3)
+        await bot.auto_delete_expired_ads()
+        await bot.outbox_worker.drain()
+        calls = {call.args[0]: call.args[1] for call in self.mock_bot.send_message.call_args_list}
+        self.assertIn("«Санки &lt;b &amp; ледянка»", calls[42])
+        self.assertIn("«Манеж &lt;i&gt;»", calls[43])
+        self.assertIn("«Коляска &amp; люлька»", calls[43])
+
+    async def test_expiry_digest_per_user(self):
+        """Напоминания одного автора приходят одной сводкой с кнопкой «Продлить все»."""
+        # 6 дней 23 часа 55 минут: до напоминания 1d осталось 5 минут — оно уходит вместе со сводкой
+        own = [self.add_ad(f"Санки {days}", user_id=42, created_days_ago=days) for days in (6.1, 6.8, 5.9965)]
+        other = self.add_ad("Манеж", user_id=43, created_days_ago=6.2)
+        self.add_ad("Коляска", user_id=42, created_days_ago=3)
+        await bot.auto_delete_expired_ads()
+        rows = self.rows()
+        self.assertEqual([row[1] for row in rows], ['expiry_digest'] * 2)
+
+        await bot.outbox_worker.drain()
+        calls = {call.args[0]: call for call in self.mock_bot.send_message.call_args_list}
+        self.assertEqual(sorted(calls), [42, 43])
+        digest = calls[42].args[1]
+        self.assertIn("ваши объявления (3)", digest)
+        self.assertLess(digest.index("Санки 6.8"), digest.index("Санки 6.1"))
+        buttons = [button.callback_data for row in calls[42].kwargs['reply_markup'].inline_keyboard for button in row]
+        self.assertEqual(buttons, ["extend_all", "extend_choose"])
+        buttons = [button.callback_data for row in calls[43].kwargs['reply_markup'].inline_keyboard for button in row]
+        self.assertEqual(buttons, [f"extend_ad_{other}"])
+
+        # «Продлить все» продлевает только объявления с напоминанием
+        self.assertEqual(bot.extend_warned_ads(42), 3)
+        self.assertEqual({ad['id']: ad['next_notice_stage'] for ad in bot.get_expiring_ads(own)}, dict.fromkeys(own, 0))
+        self.assertEqual(bot.extend_warned_ads(42), 0)
+
+    async def test_expired_ads_deleted_with_chat_posts(self):
+        """Просроченные объявления удаляются одной транзакцией, их посты — одним deleteMessages."""
+        expired = [self.add_ad(user_id=40 + i, created_days_ago=8) for i in range(3)]
+        fresh = self.add_ad(user_id=50)
+        for message_id, ad_id in enumerate(expired[:2] + [fresh], start=700):
+            bot.set_public_chat_message_id(ad_id, message_id)
+        with patch.object(bot, 'delete_expired_ads_async', wraps=bot.delete_expired_ads_async) as delete:
+            await bot.auto_delete_expired_ads()
+        delete.assert_called_once()
+        self.assertEqual(sorted(delete.call_args.args[0]), expired)
+        self.assertEqual([ad['id'] for ad in bot.get_all_ads()], [fresh])
+        self.assertEqual(sorted(row[1] for row in self.rows()), ['chat_cleanup'] + ['message'] * 3)
+
+        await bot.outbox_worker.drain()
+        self.mock_bot.delete_messages.assert_awaited_once_with(chat_id='-100500', message_ids=[700, 701])
+        self.assertEqual(sorted(call.args[0] for call in self.mock_bot.send_message.call_args_list), [40, 41, 42])
+
+    async def test_deleted_ad_post_removed_from_chat(self):
+        ad_id = self.add_ad()
+        bot.set_public_chat_message_id(ad_id, 777)
+        self.assertTrue(bot.delete_ad_by_id(ad_id))
+        self.assertFalse(bot.delete_ad_by_id(ad_id))
+        await bot.outbox_worker.drain()
+        self.mock_bot.delete_messages.assert_awaited_once_with(chat_id='-100500', message_ids=[777])
+
+    async def test_complaint_delete_wakes_outbox(self):
+        """Обе кнопки удаления по жалобе будят outbox: пост из общего чата удаляется сразу."""
+        for data in ("delete_ad_from_complaint_{}_{}", "delete_ad_complaint_{}_{}"):
+            ad_id = self.add_ad()
+            complaint_id = bot.insert_complaint(ad_id, 7, "Спам")
+            callback = MagicMock(data=data.format(ad_id, complaint_id))
+            callback.from_user.id = bot.ADMIN_ID
+            callback.answer, callback.message.edit_text = AsyncMock(), AsyncMock()
+            handler = bot.handle_delete_ad_from_complaint if "from" in data else bot.handle_delete_ad_complaint
+            with patch.object(bot.outbox_worker, 'wake') as wake:
+                await handler(callback)
+            wake.assert_called_once()
+            self.assertIsNone(bot.get_ad_by_id(ad_id))
+            callback.answer.assert_called_once()
+
+    async def test_scheduler_follows_ad_lifetime(self):
+        """Планировщик знает ближайшее событие объявления и узнаёт о продлении и удалении."""
+        ad_id = self.add_ad()
+        expires_at = bot.parse_ad_time(bot.get_expiring_ads([ad_id])[0]['expires_at'])
+        self.assertEqual(bot.expiry_scheduler.when(ad_id), (expires_at - timedelta(days=1)).timestamp())
+
+        # Созревшее событие обрабатывается по текущей записи: 6 дней 15 часов — напоминание 12h, дальше 6h
+        database.execute_write(self.db_path, "UPDATE ads SET created_at = datetime(created_at, '-6 days', '-15 hours') WHERE id = ?", (ad_id,))
+        await bot.handle_expiry_events([ad_id])
+        self.assertEqual([row[0].split(':')[-1] for row in self.rows()], ["12h"])
+        ad = bot.get_expiring_ads([ad_id])[0]
+        self.assertEqual(bot.expiry_scheduler.when(ad_id),
+                         (bot.parse_ad_time(ad['expires_at']) - timedelta(hours=6)).timestamp())
+
+        self.assertTrue(bot.extend_ad_expiration(ad_id))
+        ad = bot.get_expiring_ads([ad_id])[0]
+        self.assertEqual(ad['next_notice_stage'], 0)
+        self.assertEqual(bot.expiry_scheduler.when(ad_id), (bot.parse_ad_time(ad['expires_at']) - timedelta(days=1)).timestamp())
+        bot.delete_ad_by_id(ad_id)
+        self.assertIsNone(bot.expiry_scheduler.when(ad_id))
+        # Событие удалённого объявления ничего не делает
+        await bot.handle_expiry_events([ad_id])
+        self.assertEqual(len(self.rows()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
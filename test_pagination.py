@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Тесты постраничного просмотра объявлений: выборки по курсору и кнопка «▶ Ещё».
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+import database
+
+TEST_USER_ID = 123456789
+
+
+class MockState:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.state = None
+
+    async def get_state(self):
+        return self.state
+
+    async def set_state(self, state=None):
+        self.state = state
+
+    async def get_data(self):
+        return self.data
+
+    async def update_data(self, **kwargs):
+        self.data.update(kwargs)
+
+    async def clear(self):
+        self.data = {}
+        self.state = None
+
+
+def make_message(text=None):
+    message = MagicMock()
+    message.text = text
+    message.from_user.id = TEST_USER_ID
+    message.answer = AsyncMock()
+    message.answer_photo = AsyncMock()
+    message.answer_media_group = AsyncMock()
+    message.edit_reply_markup = AsyncMock()
+    message.edit_text = AsyncMock()
+    return message
+
+
+def make_callback(data):
+    callback = MagicMock()
+    callback.data = data
+    callback.from_user.id = TEST_USER_ID
+    callback.message = make_message()
+    callback.answer = AsyncMock()
+    return callback
+
+
+def more_button(message):
+    """callback_data кнопки «▶ Ещё» из отправленных сообщений (None — кнопки нет)."""
+    for call in message.answer.call_args_list:
+        markup = call.kwargs.get('reply_markup')
+        for row in getattr(markup, 'inline_keyboard', None) or []:
+            for button in row:
+                if button.text == "▶ Ещё":
+                    return button.callback_data
+    return None
+
+
+def shown_ad_ids(message):
+    """id объявлений, показанных в сообщениях (по кнопке избранного)."""
+    ids = []
+    for call in message.answer.call_args_list + message.answer_photo.call_args_list:
+        markup = call.kwargs.get('reply_markup')
+        for row in getattr(markup, 'inline_keyboard', None) or []:
+            for button in row:
+                if button.callback_data and button.callback_data.startswith('fav_'):
+                    ids.append(int(button.callback_data.rsplit('_', 1)[1]))
+    return ids
+
+
+class TestPagination(unittest.IsolatedAsyncioTestCase):
+    """Постраничная выдача объявлений."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_path = tempfile.mktemp(suffix='.db')
+        cls.original_db_path = bot.DB_PATH
+        bot.DB_PATH = cls.db_path
+        bot.init_db()
+        cls.ad_ids = [
+            bot.add_ad_to_db(f"Коляска {i}", "Описание", 1000 + i, bot.CATEGORIES[i % 2],
+                             bot.YAKUTSK_DISTRICTS[0], None, 1000, "user")
+            for i in range(25)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        bot.DB_PATH = cls.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cls.db_path + suffix):
+                os.unlink(cls.db_path + suffix)
+
+    def test_pages_cover_all_ads_once(self):
+        """Проход по страницам через курсор возвращает каждое объявление ровно один раз."""
+        seen, cursor = [], None
+        while True:
+            page = bot.get_all_ads(before_id=cursor, limit=7)
+            if not page:
+                break
+            seen.extend(ad['id'] for ad in page)
+            cursor = page[-1]['id']
+        self.assertEqual(seen, sorted(self.ad_ids, reverse=True))
+
+    def test_filtered_page(self):
+        """Курсор и размер страницы работают вместе с фильтром."""
+        category = bot.CATEGORIES[0]
+        first = bot.get_ads_by_category(category, limit=5)
+        second = bot.get_ads_by_category(category, before_id=first[-1]['id'], limit=5)
+        self.assertEqual(len(first), 5)
+        self.assertTrue(all(ad['category'] == category for ad in first + second))
+        self.assertLess(second[0]['id'], first[-1]['id'])
+        self.assertEqual(len(bot.search_ads("Коляска", limit=3)), 3)
+
+    def test_default_returns_everything(self):
+        """Без limit функции по-прежнему возвращают все объявления."""
+        self.assertEqual(len(bot.get_all_ads()), len(self.ad_ids))
+
+    async def test_list_sends_one_page(self):
+        """Список отправляет не больше PAGE_SIZE объявлений и кнопку «▶ Ещё»."""
+        message = make_message()
+        await bot.handle_list_button(message, MockState())
+        shown = shown_ad_ids(message)
+        self.assertEqual(shown, sorted(self.ad_ids, reverse=True)[:bot.PAGE_SIZE])
+        self.assertEqual(more_button(message), f"more_all_{shown[-1]}")
+
+    async def test_page_favorite_status_in_one_query(self):
+        """Статус избранного для всей страницы берётся одним запросом."""
+        newest = sorted(self.ad_ids, reverse=True)[:bot.PAGE_SIZE]
+        bot.add_favorite(TEST_USER_ID, newest[1])
+        self.addCleanup(bot.remove_favorite, TEST_USER_ID, newest[1])
+        ads = bot.get_all_ads(limit=bot.PAGE_SIZE + 1)
+        message = make_message()
+        statements = []
+        database.set_trace_callback(statements.append)
+        try:
+            await bot.send_ads_page(message, TEST_USER_ID, ads, "more_all_")
+        finally:
+            database.set_trace_callback(None)
+        self.assertEqual(len(statements), 1, statements)
+        buttons = {}
+        for call in message.answer.call_args_list:
+            markup = call.kwargs.get('reply_markup')
+            for row in getattr(markup, 'inline_keyboard', None) or []:
+                buttons.update({b.callback_data: b.text for b in row if b.callback_data.startswith('fav_')})
+        self.assertEqual(buttons[f"fav_remove_{newest[1]}"], "✅ В избранном")
+        self.assertEqual(buttons[f"fav_add_{newest[0]}"], "⭐ В избранное")
+
+    async def test_more_button_walks_to_the_end(self):
+        """Кнопка «▶ Ещё» догружает страницы, пока объявления не кончатся."""
+        seen, data = [], "more_all_" + str(max(self.ad_ids) + 1)
+        while data:
+            callback = make_callback(data)
+            await bot.show_more_ads(callback, MockState())
+            seen.extend(shown_ad_ids(callback.message))
+            self.assertLessEqual(len(shown_ad_ids(callback.message)), bot.PAGE_SIZE)
+            data = more_button(callback.message)
+        self.assertEqual(seen, sorted(self.ad_ids, reverse=True))
+
+    async def test_photo_page_is_one_album(self):
+        """Фото-объявления страницы — один альбом и одно сообщение с нумерованными кнопками."""
+        newest = sorted(self.ad_ids, reverse=True)
+        bot.add_favorite(TEST_USER_ID, newest[2])
+        self.addCleanup(bot.remove_favorite, TEST_USER_ID, newest[2])
+        ads = bot.get_all_ads(limit=bot.PAGE_SIZE + 1)
+        # Два объявления без фото уходят отдельными сообщениями
+        ads = [ad if i in (3, 7) else ad.replace(photo=f"photo-{ad.id}") for i, ad in enumerate(ads)]
+        message = make_message()
+        self.assertTrue(await bot.send_ads_page(message, TEST_USER_ID, ads, "more_all_"))
+
+        message.answer_photo.assert_not_called()
+        media = message.answer_media_group.call_args.kwargs['media']
+        album = [ad for i, ad in enumerate(ads[:bot.PAGE_SIZE]) if i not in (3, 7)]
+        self.assertEqual([item.media for item in media], [ad.photo for ad in album])
+        self.assertTrue(media[2].caption.startswith(f"3. <b>{album[2].title}</b>"))
+        self.assertEqual(message.answer.await_count, 3)
+        self.assertEqual(sorted(shown_ad_ids(message), reverse=True), newest[:bot.PAGE_SIZE])
+        self.assertEqual(more_button(message), f"more_all_{newest[bot.PAGE_SIZE - 1]}")
+
+        keyboard = message.answer.call_args.kwargs['reply_markup']
+        labels = {b.callback_data: b.text for row in keyboard.inline_keyboard for b in row}
+        self.assertEqual(labels[f"fav_remove_{newest[2]}"], "✅ 3")
+        self.assertEqual(labels[f"complaint_{newest[0]}"], "⚠️ 1")
+        # Нажатие меняет только кнопку своего объявления, номер сохраняется
+        toggled = bot.toggle_favorite_button(keyboard, newest[0], True)
+        labels = {b.callback_data: b.text for row in toggled.inline_keyboard for b in row}
+        self.assertEqual((labels[f"fav_remove_{newest[0]}"], labels[f"fav_remove_{newest[2]}"]), ("✅ 1", "✅ 3"))
+        self.assertNotIn(f"fav_add_{newest[0]}", labels)
+        self.assertIsNone(bot.toggle_favorite_button(keyboard, -1, True))
+
+    async def test_more_keeps_album_buttons(self):
+        """«▶ Ещё» под альбомом убирает только себя, кнопки ⭐ и ⚠️ прошлой страницы остаются."""
+        ads = [ad.replace(photo=f"photo-{ad.id}") for ad in bot.get_all_ads(limit=bot.PAGE_SIZE + 1)]
+        message = make_message()
+        await bot.send_ads_page(message, TEST_USER_ID, ads, "more_all_")
+        callback = make_callback(more_button(message))
+        callback.message.reply_markup = message.answer.call_args.kwargs['reply_markup']
+        await bot.show_more_ads(callback, MockState())
+        markup = callback.message.edit_reply_markup.call_args.kwargs['reply_markup']
+        data = [button.callback_data for row in markup.inline_keyboard for button in row]
+        self.assertEqual(len(data), 2 * bot.PAGE_SIZE)
+        self.assertFalse([item for item in data if item.startswith("more_")])
+        callback.answer.assert_called_once()
+
+    async def test_category_page(self):
+        """Категория показывает первую страницу; неизвестная категория — предупреждение. Ответ на нажатие один."""
+        callback = make_callback(f"show_{bot.CATEGORIES[0]}")
+        await bot.show_category_ads(callback)
+        callback.answer.assert_called_once_with()
+        shown = shown_ad_ids(callback.message)
+        self.assertEqual(len(shown), bot.PAGE_SIZE)
+        self.assertEqual(more_button(callback.message), f"more_cat_0_{shown[-1]}")
+
+        callback = make_callback("show_Нет такой")
+        await bot.show_category_ads(callback)
+        callback.answer.assert_called_once_with("Ошибка выбора категории", show_alert=True)
+        callback.message.answer.assert_not_called()
+
+    async def test_search_more_uses_saved_query(self):
+        """Следующая страница поиска берёт запрос из состояния FSM."""
+        state = MockState({'search_query': "Коляска 1"})
+        callback = make_callback(f"more_search_{max(self.ad_ids) + 1}")
+        await bot.show_more_ads(callback, state)
+        titles = [bot.get_ad_by_id(ad_id)['title'] for ad_id in shown_ad_ids(callback.message)]
+        self.assertTrue(titles)
+        self.assertTrue(all(title.startswith("Коляска 1") for title in titles))
+
+        callback = make_callback("more_search_100")
+        await bot.show_more_ads(callback, MockState())
+        callback.answer.assert_called_once()
+        self.assertFalse(shown_ad_ids(callback.message))
+
+
+if __name__ == '__main__':
+    unittest.main()
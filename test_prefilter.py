@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Тесты локальной предмодерации (prefilter.py) и поиска повторов объявлений.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+import database
+import prefilter
+
+
+class TestAutomaton(unittest.TestCase):
+    """Автомат Ахо — Корасик находит те же вхождения, что и наивный поиск."""
+
+    def test_classic_example(self):
+        automaton = prefilter.Automaton({'he': 1, 'she': 2, 'his': 3, 'hers': 4})
+        self.assertEqual(sorted(automaton.find("ushers")), [(1, 'she', 2), (2, 'he', 1), (2, 'hers', 4)])
+
+    def test_matches_naive_search(self):
+        rng = random.Random(5)
+        patterns = {''.join(rng.choice("аб") for _ in range(rng.randint(1, 4))): i for i in range(20)}
+        automaton = prefilter.Automaton(patterns)
+        for _ in range(50):
+            text = ''.join(rng.choice("абв") for _ in range(30))
+            naive = sorted((i, p, label) for p, label in patterns.items()
+                           for i in range(len(text)) if text.startswith(p, i))
+            self.assertEqual(sorted(automaton.find(text)), naive)
+
+
+class TestPreFilter(unittest.TestCase):
+    """Очевидные случаи решаются локально, неоднозначные — передаются модели."""
+
+    def setUp(self):
+        self.filter = prefilter.PreFilter()
+
+    def verdict(self, text):
+        return self.filter.check(text).verdict
+
+    def test_clean_ads_are_approved(self):
+        for text in ("Коляска прогулочная\nВсё работает, без дефектов\nЦена: 100000",
+                     "Закладка для книг ручной работы\nЦена: 150",
+                     "Комбинезон зимний, звоните 8 914 123-45-67\nЦена: 2000",
+                     "Переходник для ванночки\nЦена: 300"):
+            self.assertIs(self.verdict(text), True, text)
+
+    def test_obvious_violations_are_rejected(self):
+        for text in ("Сука, продаю коляску", "Продам санки xyйня", "Казино онлайн, бонус новичкам",
+                     "Пассивный доход без вложений", "a.ru b.com c.net — скидки"):
+            self.assertIs(self.verdict(text), False, text)
+
+    def test_profanity_only_at_word_start(self):
+        self.assertIs(self.verdict("Застрахуй коляску заранее"), True)
+
+    def test_ambiguous_texts_are_escalated(self):
+        for text in ("Пишите, я не мошенник", "Только предоплата на карту", "Подробнее на www.example.ru",
+                     "Пишите @seller_mama", "Пишите в WhatsApp", "ПРОДАЮ КОЛЯСКУ СРОЧНО ДЕШЕВО ЗВОНИТЕ",
+                     "Санки!!!!!!", "8 914 111-11-11, 8 914 222-22-22, 8 914 333-33-33"):
+            self.assertIsNone(self.verdict(text), text)
+
+    def test_stats(self):
+        for text in ("Санки", "Казино", "Пишите, я не мошенник", "Манеж"):
+            self.filter.check(text)
+        self.assertEqual(self.filter.stats, {'approved': 2, 'rejected': 1, 'escalated': 1})
+        self.assertEqual(self.filter.avoided_rate, 0.75)
+
+
+class TestDuplicateAds(unittest.TestCase):
+    """Повтор собственного объявления находится без учёта регистра и пробелов."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        self.original_db_path = bot.DB_PATH
+        bot.DB_PATH = self.db_path
+        bot.init_db()
+
+    def tearDown(self):
+        bot.DB_PATH = self.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def test_find_duplicate_ad(self):
+        ad_id = bot.add_ad_to_db("Ёлка", "Искусственная,  1 м", 500, bot.CATEGORIES[3], bot.YAKUTSK_DISTRICTS[0], None, 42, "user")
+        self.assertEqual(bot.find_duplicate_ad(42, "елка", "искусственная, 1 м"), ad_id)
+        self.assertIsNone(bot.find_duplicate_ad(42, "Ёлка", "Живая, 1 м"))
+        self.assertIsNone(bot.find_duplicate_ad(43, "Ёлка", "Искусственная,  1 м"))
+
+
+if __name__ == '__main__':
+    unittest.main()
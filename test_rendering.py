@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Тесты карточек объявлений (rendering.py): экранирование, лимиты Telegram и
+хранение готовой карточки в записи объявления.
+"""
+
+import asyncio
+import html
+import os
+import re
+import sys
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import adrecord
+import bot
+import database
+import rendering
+
+
+def visible(text):
+    """Видимый текст HTML-сообщения: без тегов и экранирования."""
+    return html.unescape(re.sub(r"<[^>]+>", "", text))
+
+
+def make_ad(**fields):
+    ad = dict.fromkeys(adrecord.FIELDS)
+    ad.update(id=1, title="Санки", description="Деревянные", price=900, category="Игрушки", username="mama")
+    ad.update(fields)
+    return adrecord.Ad(**ad)
+
+
+class TestRendering(unittest.TestCase):
+
+    def test_fields_are_escaped(self):
+        card = rendering.ad_card(make_ad(title="<Санки> & ледянка", description="a<b", district="Центр"))
+        self.assertTrue(card.startswith("<b>&lt;Санки&gt; &amp; ледянка</b>"))
+        self.assertIn("a&lt;b", card)
+        self.assertIn("📍 Район: Центр", card)
+
+    def test_caption_limit_counts_utf16(self):
+        """С фото карточка — подпись: видимый текст не длиннее CAPTION_LIMIT в единицах UTF-16."""
+        ad = make_ad(description="🧸" * 2000 + "<", photo="photo-1")
+        card = rendering.ad_card(ad)
+        visible = card.replace("<b>", "").replace("</b>", "")
+        self.assertEqual(rendering.text_length(visible), rendering.CAPTION_LIMIT)
+        self.assertIn("🧸…\n💰 900 руб.", card)
+        # Без фото то же описание помещается в сообщение целиком
+        card = rendering.ad_card(make_ad(description="🧸" * 2000 + "<"))
+        self.assertIn("🧸" * 2000 + "&lt;\n💰", card)
+
+    def test_short_texts_unchanged(self):
+        self.assertEqual(rendering.truncate("коротко", 7), "коротко")
+        self.assertEqual(rendering.truncate("длинный текст", 8), "длинный…")
+        self.assertEqual(rendering.truncate("🧸🧸", 3), "🧸…")
+        post = rendering.public_post("Санки", "x" * 3000, 900, "mama", "Центр", condition="Б/у", photo_id="p")
+        self.assertTrue(post.endswith("📍 Центр\n📦 Состояние: Б/у"))
+        self.assertLessEqual(rendering.text_length(post), rendering.CAPTION_LIMIT + len("<b></b>"))
+
+    def test_long_title_is_truncated(self):
+        """Если не хватает и пустого описания, сокращается название."""
+        card = rendering.ad_card(make_ad(title="<Санки>" * 300, description="Деревянные", photo="photo-1"))
+        self.assertEqual(rendering.text_length(visible(card)), rendering.CAPTION_LIMIT)
+        self.assertIn("…</b> [Игрушки]\n\n💰 900 руб.", card)
+        self.assertNotIn("Деревянные", card)
+
+    def test_notices_are_escaped(self):
+        self.assertEqual(rendering.expired_notice("a<b & c"), "❌ Ваше объявление «a&lt;b &amp; c» удалено по истечении 7 дней.")
+        self.assertIn("«&lt;i&gt;»", rendering.moderation_notice("<i>", approved=False))
+        alert = rendering.complaint_alert(1, 2, "mama", 42, 43, "спам <script>", "2026-01-01 00:00:00",
+                                          "Санки & <b>", "x" * 5000, 900, "Игрушки")
+        self.assertIn("<b>Санки &amp; &lt;b&gt;</b>", alert)
+        self.assertIn("Причина: спам &lt;script&gt;", alert)
+        self.assertTrue(alert.endswith("x…\n💰 900 руб.\n🏷️ Категория: Игрушки"))
+        self.assertEqual(rendering.text_length(visible(alert)), rendering.MESSAGE_LIMIT)
+
+    def test_stats_line(self):
+        self.assertEqual(rendering.stats_line("Санки <b> & ледянка", 900, "ma<ma"),
+                         "  • Санки &lt;b&gt; &amp; ледянка — 900 руб. (от @ma&lt;ma)")
+        line = rendering.stats_line("Санки " * 100, 900, "mama")
+        self.assertEqual(rendering.text_length(visible(line)), rendering.LINE_LIMIT)
+        self.assertTrue(line.endswith("… — 900 руб. (от @mama)"))
+
+    def test_card_rendered_once_per_record(self):
+        ad = make_ad()
+        self.assertIs(rendering.ad_card(ad), rendering.ad_card(ad))
+        self.assertIsNone(ad.replace(price=1).card)
+
+
+class TestBotCards(unittest.TestCase):
+    """Карточки из кэша объявлений сбрасываются при правке."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        self.original_db_path = bot.DB_PATH
+        bot.DB_PATH = self.db_path
+        bot.init_db()
+
+    def tearDown(self):
+        bot.DB_PATH = self.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def test_edit_rerenders_card(self):
+        ad_id = bot.add_ad_to_db("Санки", "Деревянные", 900, bot.CATEGORIES[0], None, None, 42, "mama")
+        card = bot.format_ad_text(bot.get_all_ads()[0])
+        self.assertIs(bot.format_ad_text(bot.get_ad_by_id(ad_id)), card)
+        bot.update_ad_field(ad_id, 'price', 700)
+        self.assertIn("💰 700 руб.", bot.format_ad_text(bot.get_all_ads()[0]))
+
+
+    def test_stats_entry_points_agree(self):
+        """/stats и кнопка «📊 Статистика» отправляют одну и ту же статистику с экранированными полями."""
+        bot.add_ad_to_db("Санки <b>", "Деревянные", 900, bot.CATEGORIES[0], None, None, 42, "mama")
+        texts = []
+        for handler in (bot.cmd_stats, bot.handle_stats_button):
+            message = MagicMock()
+            message.from_user.id = bot.ADMIN_ID
+            message.answer = AsyncMock()
+            asyncio.run(handler(message, AsyncMock()))
+            texts.append(message.answer.call_args.args[0])
+        self.assertEqual(texts[0], texts[1])
+        self.assertIn("Санки &lt;b&gt; — 900 руб.", texts[0])
+        self.assertIn("🗃 Кэш объявлений", texts[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Тесты планировщика событий (scheduler.py).
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    """Куча сроков с перепланированием и отменой."""
+
+    def setUp(self):
+        self.scheduler = scheduler.Scheduler(clock=lambda: 0)
+
+    def test_pops_due_keys_in_order(self):
+        for key, when in (('c', 30), ('a', 10), ('b', 20)):
+            self.scheduler.schedule(key, when)
+        self.assertEqual(self.scheduler.next_time(), 10)
+        self.assertEqual(self.scheduler.pop_due(20), ['a', 'b'])
+        self.assertEqual(self.scheduler.pop_due(20), [])
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_reschedule_and_cancel(self):
+        self.scheduler.schedule('a', 10)
+        self.scheduler.schedule('b', 15)
+        self.scheduler.schedule('a', 40)
+        self.scheduler.cancel('b')
+        self.assertEqual(self.scheduler.when('a'), 40)
+        self.assertIsNone(self.scheduler.when('b'))
+        # Прежние сроки остались в куче, но не срабатывают
+        self.assertEqual(self.scheduler.next_time(), 40)
+        self.assertEqual(self.scheduler.pop_due(30), [])
+        self.assertEqual(self.scheduler.pop_due(40), ['a'])
+
+
+class TestSchedulerRun(unittest.IsolatedAsyncioTestCase):
+    """run() спит до ближайшего срока и просыпается от более раннего события."""
+
+    async def asyncSetUp(self):
+        self.scheduler = scheduler.Scheduler()
+        self.fired = []
+        self.event = asyncio.Event()
+
+        async def handler(keys):
+            self.fired.append((keys, time.time()))
+            self.event.set()
+
+        self.task = asyncio.create_task(self.scheduler.run(handler))
+        await asyncio.sleep(0)
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+    async def test_fires_on_time(self):
+        due = time.time() + 0.1
+        self.scheduler.schedule('a', due)
+        await asyncio.wait_for(self.event.wait(), 2)
+        keys, fired_at = self.fired[0]
+        self.assertEqual(keys, ['a'])
+        self.assertGreaterEqual(fired_at, due)
+        self.assertLess(fired_at - due, 0.05)
+
+    async def test_earlier_event_from_other_thread_wakes_runner(self):
+        self.scheduler.schedule('late', time.time() + 60)
+        await asyncio.sleep(0.01)
+        thread = threading.Thread(target=self.scheduler.schedule, args=('soon', time.time() + 0.05))
+        thread.start()
+        thread.join()
+        await asyncio.wait_for(self.event.wait(), 2)
+        self.assertEqual(self.fired[0][0], ['soon'])
+
+
+if __name__ == '__main__':
+    unittest.main()
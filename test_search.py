@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Тесты полнотекстового поиска объявлений (search.py, bot.search_ads).
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+import database
+import migrations
+import search
+
+
+def add_ad(title, description="Описание"):
+    return bot.add_ad_to_db(title, description, 1000, bot.CATEGORIES[0], bot.YAKUTSK_DISTRICTS[0], None, 1, "user")
+
+
+class TestStemmer(unittest.TestCase):
+    """Стемминг Snowball для русского языка."""
+
+    def test_word_forms_share_stem(self):
+        for forms in (("коляска", "коляску", "коляски", "колясками"),
+                      ("детская", "детские", "детский"),
+                      ("комбинезон", "комбинезоны", "комбинезона")):
+            self.assertEqual(len({search.stem(word) for word in forms}), 1, forms)
+
+    def test_known_stems(self):
+        cases = {
+            "тепл": "теплая", "куртк": "куртки", "прогулочн": "прогулочная", "красив": "красивейшая",
+            "искусствен": "искусственный", "прода": "продается", "ответствен": "ответственность",
+            "бега": "бегавшись",
+        }
+        for expected, word in cases.items():
+            self.assertEqual(search.stem(word), expected, word)
+
+    def test_terms_normalize_text(self):
+        self.assertEqual(search.terms("Тёплая КУРТКА, 104 см!"), ["тепл", "куртк", "104", "см"])
+
+    def test_edit_distance(self):
+        self.assertEqual(search.edit_distance("каляск", "коляск", 2), 1)
+        self.assertEqual(search.edit_distance("кляоск", "коляск", 2), 2)
+        self.assertEqual(search.edit_distance("санк", "коляск", 1), 2)
+
+
+class TestSearchAds(unittest.TestCase):
+    """Поиск по индексу ads_fts."""
+
+    def setUp(self):
+        self.db_path = tempfile.mktemp(suffix='.db')
+        self.original_db_path = bot.DB_PATH
+        bot.DB_PATH = self.db_path
+        bot.init_db()
+
+    def tearDown(self):
+        bot.DB_PATH = self.original_db_path
+        database.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+
+    def titles(self, keyword, **kwargs):
+        return [ad['title'] for ad in bot.search_ads(keyword, **kwargs)]
+
+    def test_case_insensitive_cyrillic_and_prefix(self):
+        """Регистр кириллицы не важен, слово находится по началу."""
+        add_ad("КОЛЯСКА прогулочная")
+        add_ad("Санки", "детские коляски и санки")
+        add_ad("Ёлочные игрушки")
+        self.assertEqual(set(self.titles("коляс")), {"Санки", "КОЛЯСКА прогулочная"})
+        self.assertEqual(self.titles("елочн"), ["Ёлочные игрушки"])
+
+    def test_word_forms(self):
+        """Любая словоформа находит объявление."""
+        add_ad("Коляска прогулочная")
+        add_ad("Две детские коляски")
+        add_ad("Санки")
+        self.assertEqual(len(self.titles("коляску")), 2)
+        self.assertEqual(self.titles("детскую"), ["Две детские коляски"])
+
+    def test_typos(self):
+        """Слово с опечаткой находит объявления с близкими по написанию словами."""
+        add_ad("Коляска прогулочная")
+        add_ad("Комбинезон зимний")
+        add_ad("Санки")
+        self.assertEqual(self.titles("каляска"), ["Коляска прогулочная"])
+        self.assertEqual(self.titles("колясок"), ["Коляска прогулочная"])
+        self.assertEqual(self.titles("комбинзон"), ["Комбинезон зимний"])
+        self.assertEqual(self.titles("самолет"), [])
+
+    def test_typo_candidates_must_be_in_index(self):
+        """Основы удалённых объявлений не предлагаются как исправление."""
+        ad_id = add_ad("Велосипед")
+        bot.delete_ad_by_id(ad_id)
+        add_ad("Санки")
+        self.assertEqual(self.titles("виласипед"), [])
+
+    def test_query_operators_are_inert(self):
+        add_ad("Коляска")
+        self.assertEqual(self.titles('коляска OR "NEAR('), [])
+        self.assertEqual(self.titles('коляска AND'), [])
+
+    def test_all_words_required(self):
+        add_ad("Коляска зимняя")
+        add_ad("Коляска летняя")
+        self.assertEqual(self.titles("коляска зим"), ["Коляска зимняя"])
+
+    def test_relevance_order(self):
+        """Совпадение в названии весит больше, чем в описании."""
+        for title in ("Санки", "Манеж", "Стульчик", "Ванночка"):
+            add_ad(title)
+        add_ad("Комбинезон зимний", "тёплый, в комплекте куртка и шапка")
+        add_ad("Куртка зимняя", "тёплая, в комплекте комбинезон и шапка")
+        self.assertEqual(self.titles("комбинезон"), ["Комбинезон зимний", "Куртка зимняя"])
+
+    def test_index_follows_updates_and_deletes(self):
+        ad_id = add_ad("Велосипед")
+        bot.update_ad_field(ad_id, 'title', "Самокат")
+        self.assertEqual(self.titles("велосипед"), [])
+        self.assertEqual(self.titles("самокат"), ["Самокат"])
+        bot.delete_ad_by_id(ad_id)
+        self.assertEqual(self.titles("самокат"), [])
+
+    def test_pages_follow_ranking(self):
+        """Страницы по курсору идут в порядке релевантности без повторов и пропусков."""
+        for i in range(12):
+            add_ad(f"Книга {i}", "книга " * (i % 4 + 1))
+        full = [ad['id'] for ad in bot.search_ads("книга")]
+        paged, cursor = [], None
+        while True:
+            page = bot.search_ads("книга", before_id=cursor, limit=5)
+            if not page:
+                break
+            paged.extend(ad['id'] for ad in page)
+            cursor = page[-1]['id']
+        self.assertEqual(paged, full)
+        self.assertEqual(len(full), 12)
+
+    def test_query_without_words_uses_substring(self):
+        add_ad("Распродажа!!!")
+        self.assertEqual(self.titles("!!!"), ["Распродажа!!!"])
+
+    def test_existing_ads_are_indexed_on_migration(self):
+        """Объявления, добавленные до появления индекса, находятся после миграции."""
+        legacy_path = tempfile.mktemp(suffix='.db')
+        self.addCleanup(lambda: [os.unlink(legacy_path + s) for s in ('', '-wal', '-shm') if os.path.exists(legacy_path + s)])
+        with sqlite3.connect(legacy_path) as conn:
+            conn.execute("CREATE TABLE ads (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, description TEXT NOT NULL, "
+                         "price INTEGER NOT NULL, category TEXT NOT NULL, photo_id TEXT, user_id INTEGER NOT NULL, username TEXT)")
+            conn.execute("INSERT INTO ads (title, description, price, category, user_id) VALUES ('Манеж', 'ёмкий', 1, 'c', 1)")
+        migrations.migrate(legacy_path)
+        bot.DB_PATH = legacy_path
+        self.assertEqual(self.titles("емкий"), ["Манеж"])
+
+
+if __name__ == '__main__':
+    unittest.main()
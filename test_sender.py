@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Тесты очереди исходящих запросов (sender.py) и её работы с поддельным Bot API.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import sender
+from fake_telegram import FakeTelegramAPI
+
+
+def retry_after(chat_id, seconds=1):
+    return TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text="x"), message="Flood", retry_after=seconds)
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Ведро токенов со временем, переданным явно."""
+
+    def test_burst_then_rate(self):
+        bucket = sender.TokenBucket(rate=2, capacity=3, now=0)
+        for _ in range(3):
+            self.assertEqual(bucket.wait_time(0), 0)
+            bucket.take(0)
+        self.assertAlmostEqual(bucket.wait_time(0), 0.5)
+        self.assertEqual(bucket.wait_time(0.5), 0)
+        self.assertFalse(bucket.is_full(1))
+        self.assertTrue(bucket.is_full(10))
+
+    def test_pause(self):
+        bucket = sender.TokenBucket(rate=1, capacity=20, now=0)
+        bucket.pause(0, 5)
+        self.assertAlmostEqual(bucket.wait_time(0), 5)
+        self.assertAlmostEqual(bucket.wait_time(4), 1)
+
+    def test_private_chat_burst(self):
+        """В личный чат подряд уходят не больше трёх сообщений, дальше — одно в секунду."""
+        bucket = sender.TokenBucket(*sender.chat_limits(42), now=0)
+        for _ in range(3):
+            self.assertEqual(bucket.wait_time(0), 0)
+            bucket.take(0)
+        self.assertAlmostEqual(bucket.wait_time(0), 1)
+        bucket.take(1)
+        self.assertAlmostEqual(bucket.wait_time(1), 1)
+
+    def test_chat_limits(self):
+        self.assertEqual(sender.chat_limits(42), (sender.CHAT_RATE, sender.CHAT_BURST))
+        self.assertEqual(sender.chat_limits(-100123), (sender.GROUP_RATE, sender.GROUP_BURST))
+        self.assertEqual(sender.chat_limits("@channel"), (sender.GROUP_RATE, sender.GROUP_BURST))
+
+
+class TestSendQueue(unittest.IsolatedAsyncioTestCase):
+    """Порядок, частота, приоритеты и повторы после 429."""
+
+    async def asyncSetUp(self):
+        self.log = []   # (время, chat_id, значение)
+
+    async def asyncTearDown(self):
+        await self.queue.close()
+
+    def make_queue(self, **kwargs):
+        self.queue = sender.SendQueue(**kwargs)
+        return self.queue
+
+    def call(self, chat_id, value):
+        async def request():
+            self.log.append((asyncio.get_running_loop().time(), chat_id, value))
+            return value
+        return request
+
+    async def test_global_rate(self):
+        queue = self.make_queue(rate=50, limits=lambda chat_id: (100, 100))
+        start = asyncio.get_running_loop().time()
+        results = await asyncio.gather(*(queue.submit(self.call(i, i), i) for i in range(26)))
+        self.assertEqual(results, list(range(26)))
+        # Первый запрос сразу, остальные 25 — не чаще 50 в секунду
+        self.assertGreaterEqual(self.log[-1][0] - start, 0.45)
+        self.assertEqual(queue.stats, {'sent': 26, 'retried': 0, 'failed': 0})
+
+    async def test_chat_order_and_limit(self):
+        queue = self.make_queue(rate=1000, limits=lambda chat_id: (20, 2))
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*(queue.submit(self.call(1, i), 1) for i in range(6)),
+                             queue.submit(self.call(2, "other"), 2))
+        chat_log = [entry for entry in self.log if entry[1] == 1]
+        self.assertEqual([value for _, _, value in chat_log], list(range(6)))
+        # Пачка из двух, затем 20 в секунду: 4 запроса ждут 0.2 с
+        self.assertGreaterEqual(chat_log[-1][0] - start, 0.19)
+        # Другой чат не ждёт очереди первого
+        other_time = next(t for t, chat_id, _ in self.log if chat_id == 2)
+        self.assertLess(other_time - start, 0.05)
+
+    async def test_interactive_before_broadcast(self):
+        queue = self.make_queue(rate=20, workers=1, limits=lambda chat_id: (100, 100))
+        with sender.broadcast():
+            mailing = [asyncio.create_task(queue.submit(self.call(i, "broadcast"), i)) for i in range(10)]
+        await asyncio.sleep(0.12)
+        await queue.submit(self.call(100, "reply"), 100)
+        await asyncio.gather(*mailing)
+        values = [value for _, _, value in self.log]
+        # Ответ пользователю обгоняет оставшуюся рассылку
+        self.assertLess(values.index("reply"), 5)
+
+    async def test_retry_after_pauses_only_that_chat(self):
+        queue = self.make_queue(rate=1000, limits=lambda chat_id: (100, 100))
+        attempts = []
+
+        async def flooded():
+            attempts.append(asyncio.get_running_loop().time())
+            if len(attempts) == 1:
+                raise retry_after(1, seconds=1)
+            return "ok"
+
+        start = asyncio.get_running_loop().time()
+        first = asyncio.create_task(queue.submit(flooded, 1))
+        second = asyncio.create_task(queue.submit(self.call(1, "next"), 1))
+        await asyncio.sleep(0.05)
+        await queue.submit(self.call(2, "free"), 2)
+        self.assertLess(asyncio.get_running_loop().time() - start, 0.5)
+        self.assertEqual(await first, "ok")
+        self.assertEqual(await second, "next")
+        self.assertGreaterEqual(attempts[1] - start, 0.95)
+        # Повтор уходит раньше следующего запроса того же чата
+        self.assertLess(attempts[1], self.log[-1][0])
+        self.assertEqual(queue.stats['retried'], 1)
+
+    async def test_retries_exhausted(self):
+        queue = self.make_queue(rate=1000, max_retries=1, limits=lambda chat_id: (1000, 1000))
+
+        async def always_flooded():
+            raise retry_after(1, seconds=0.01)
+
+        with self.assertRaises(TelegramRetryAfter):
+            await queue.submit(always_flooded, 1)
+        self.assertEqual(queue.stats, {'sent': 0, 'retried': 1, 'failed': 1})
+
+    async def test_errors_reach_caller(self):
+        queue = self.make_queue()
+
+        async def broken():
+            raise ValueError("bad request")
+
+        with self.assertRaises(ValueError):
+            await queue.submit(broken, 1)
+        self.assertEqual(await queue.submit(self.call(1, "after"), 1), "after")
+
+
+class TestThrottlingMiddleware(unittest.IsolatedAsyncioTestCase):
+    """Бот aiogram с очередью против поддельного API с лимитами."""
+
+    async def asyncSetUp(self):
+        self.api = FakeTelegramAPI(rate=30, chat_burst=3, chat_interval=0.2, latency=0.01, retry_after=1)
+        await self.api.start()
+        self.bot = self.api.make_bot()
+        self.queue = sender.SendQueue(rate=25)
+        self.bot.session.middleware(sender.ThrottlingMiddleware(self.queue))
+
+    async def asyncTearDown(self):
+        await self.queue.close()
+        await self.bot.session.close()
+        await self.api.stop()
+
+    async def test_broadcast_delivered_without_losses(self):
+        with sender.broadcast():
+            await asyncio.gather(*(self.bot.send_message(chat_id, "Новое объявление")
+                                   for chat_id in range(1, 41)))
+        self.assertEqual(len(self.api.delivered), 40)
+        self.assertEqual(self.api.rejected, 0)
+
+    async def test_flood_is_retried(self):
+        """Пачка в один чат сверх лимита API (очередь с пачкой 20): API отвечает 429, очередь повторяет."""
+        queue = sender.SendQueue(rate=25, limits=lambda chat_id: (sender.CHAT_RATE, 20))
+        self.addAsyncCleanup(queue.close)
+        tg = self.api.make_bot()
+        self.addAsyncCleanup(tg.session.close)
+        tg.session.middleware(sender.ThrottlingMiddleware(queue))
+        await asyncio.gather(*(tg.send_message(7, f"Карточка {i}") for i in range(5)))
+        self.assertEqual(len(self.api.delivered), 5)
+        self.assertGreater(self.api.rejected, 0)
+        self.assertEqual(queue.stats['failed'], 0)
+
+    async def test_private_chat_stays_within_flood_limit(self):
+        """С обычными ограничениями пачка в личный чат не получает 429."""
+        await asyncio.gather(*(self.bot.send_message(7, f"Карточка {i}") for i in range(5)))
+        self.assertEqual(len(self.api.delivered), 5)
+        self.assertEqual(self.api.rejected, 0)
+        self.assertEqual(self.queue.stats['retried'], 0)
+
+    async def test_requests_without_chat_bypass_queue(self):
+        me = await self.bot.get_me()
+        self.assertEqual(me.username, "fake_bot")
+        self.assertEqual(self.queue.stats['sent'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()